@@ -15,7 +15,8 @@ with open(FileToOpen, "rb") as f:
     if chr_ == 0:
         raise SystemExit("ROM has 0 CHR banks (CHR-RAM) — nothing to extract")
 
-    f.seek(16 + prg)  # Skip header + PRG ROM
+    trainer = 512 if h[6] & 0x04 else 0  # Trainer size (flags 6, bit 2)
+    f.seek(16 + trainer + prg)  # Skip header + trainer + PRG ROM
     data = f.read(chr_)  # Read CHR ROM
 
 with open(FileToGen, "wb") as o:
@@ -0,0 +1,541 @@
+# apu_synth.py
+# Usage: python apu_synth.py ../DonkeyKongDisassembly.asm -o wav
+#        python apu_synth.py ../DonkeyKongDisassembly.asm -o wav_new --compare wav
+#        python apu_synth.py DonkeyKong.nes --tune title_theme -o wav
+"""
+Render the game's tunes to WAV files with a model of the 2A03 APU.
+
+Tunes are decoded by sound_data.py into the APU register writes the sound
+engine makes each frame. Those are replayed into a register-level model of
+the pulse, triangle and noise channels (envelopes, sweep units, length and
+linear counters, clocked four times a frame as the engine's write of $C0 to
+$4017 at SoundEngine_FA48 makes the frame counter do), which yields each
+channel's period, duty and volume for every quarter frame. The waveforms
+are then generated for all samples at once with NumPy: sequencer positions
+are cumulative sums of per-sample steps (restarted where the pulse channels'
+$4003/$4007 was written), looked up in the duty, triangle and noise tables,
+mixed with the APU's non-linear mixer, oversampled and averaged down, and
+have their DC offset removed by subtracting a running 50 ms mean.
+
+A source file is rendered for every game version (or those given with
+--version), a .nes dump as it is. Files are written to <out>/<version or ROM
+name>/<tune>.wav; tunes whose register writes are the same in several
+versions are synthesized once. With --compare, every rendered tune is also
+diffed against the WAV of the same name under another directory (e.g. one
+rendered before an edit) and the differences are reported numerically; the
+exit status is 1 if any tune differs.
+"""
+
+import argparse
+import functools
+import pathlib
+import sys
+import time
+import wave
+
+import numpy as np  # pip install numpy
+
+from sound_data import (
+    CPU_CLOCK,
+    FANFARES,
+    MUSIC,
+    VERSION_VALUES,
+    SoundData,
+    distinct_tunes,
+    parse_version,
+    register_writes,
+)
+
+FRAME_CYCLES = 29780.5  # CPU cycles per NTSC frame
+FRAME_RATE = CPU_CLOCK / FRAME_CYCLES
+TICKS = 4  # quarter frames per frame
+SAMPLE_RATE = 44100
+OVERSAMPLE = 4
+TAIL_FRAMES = 30  # rendered after a fanfare ends, for notes to decay
+DC_WINDOW = 0.05  # seconds
+GAIN = 1.6  # mixer output (0 to about 1) to full scale
+
+LENGTHS = (
+    10, 254, 20, 2, 40, 4, 80, 6, 160, 8, 60, 10, 14, 12, 26, 14,
+    12, 16, 24, 18, 48, 20, 96, 22, 192, 24, 72, 26, 16, 28, 32, 30,
+)  # fmt: skip
+DUTY = np.array(
+    [
+        [0, 1, 0, 0, 0, 0, 0, 0],
+        [0, 1, 1, 0, 0, 0, 0, 0],
+        [0, 1, 1, 1, 1, 0, 0, 0],
+        [1, 0, 0, 1, 1, 1, 1, 1],
+    ],
+    dtype=np.float64,
+)
+TRIANGLE = np.concatenate((np.arange(15, -1, -1), np.arange(16))).astype(np.float64)
+NOISE_PERIODS = np.array(
+    [4, 8, 16, 32, 64, 96, 128, 160, 202, 254, 380, 508, 762, 1016, 2034, 4068],
+    dtype=np.float64,
+)
+
+# per-tick arrays recorded by run_apu()
+FIELDS = (
+    "pulse1_period",
+    "pulse1_duty",
+    "pulse1_volume",
+    "pulse1_reset",
+    "pulse2_period",
+    "pulse2_duty",
+    "pulse2_volume",
+    "pulse2_reset",
+    "triangle_period",
+    "triangle_on",
+    "noise_period",
+    "noise_mode",
+    "noise_volume",
+)
+
+
+class _Envelope:
+    def __init__(self):
+        self.start = False
+        self.divider = 0
+        self.decay = 0
+        self.period = 0
+        self.constant = False
+        self.loop = False  # also the length counter halt flag
+
+    def control(self, value):
+        self.loop = bool(value & 0x20)
+        self.constant = bool(value & 0x10)
+        self.period = value & 0x0F
+
+    def clock(self):
+        if self.start:
+            self.start = False
+            self.decay = 15
+            self.divider = self.period
+        elif self.divider:
+            self.divider -= 1
+        else:
+            self.divider = self.period
+            if self.decay:
+                self.decay -= 1
+            elif self.loop:
+                self.decay = 15
+
+    @property
+    def volume(self):
+        return self.period if self.constant else self.decay
+
+
+class _Pulse:
+    def __init__(self, ones_complement):
+        self.ones_complement = ones_complement  # pulse 1 negates period - 1
+        self.envelope = _Envelope()
+        self.duty = 0
+        self.period = 0
+        self.length = 0
+        self.sweep = 0
+        self.sweep_divider = 0
+        self.sweep_reload = False
+        self.reset = False
+
+    def write(self, register, value, enabled):
+        if register == 0:
+            self.duty = value >> 6
+            self.envelope.control(value)
+        elif register == 1:
+            self.sweep = value
+            self.sweep_reload = True
+        elif register == 2:
+            self.period = self.period & 0x700 | value
+        else:
+            self.period = self.period & 0xFF | (value & 7) << 8
+            if enabled:
+                self.length = LENGTHS[value >> 3]
+            self.envelope.start = True
+            self.reset = True
+
+    def _target(self):
+        change = self.period >> (self.sweep & 7)
+        if self.sweep & 0x08:
+            return self.period - change - self.ones_complement
+        return self.period + change
+
+    def _muted(self):
+        return self.period < 8 or self._target() > 0x7FF
+
+    def half(self):
+        if self.length and not self.envelope.loop:
+            self.length -= 1
+        divider = (self.sweep >> 4) & 7
+        if not self.sweep_divider and self.sweep & 0x80 and self.sweep & 7:
+            if not self._muted():
+                self.period = max(self._target(), 0)
+        if not self.sweep_divider or self.sweep_reload:
+            self.sweep_divider = divider
+            self.sweep_reload = False
+        else:
+            self.sweep_divider -= 1
+
+    def volume(self):
+        if not self.length or self._muted():
+            return 0
+        return self.envelope.volume
+
+
+class _Triangle:
+    def __init__(self):
+        self.control = False
+        self.reload_value = 0
+        self.reload = False
+        self.linear = 0
+        self.length = 0
+        self.period = 0
+
+    def write(self, register, value, enabled):
+        if register == 0:
+            self.control = bool(value & 0x80)
+            self.reload_value = value & 0x7F
+        elif register == 2:
+            self.period = self.period & 0x700 | value
+        elif register == 3:
+            self.period = self.period & 0xFF | (value & 7) << 8
+            if enabled:
+                self.length = LENGTHS[value >> 3]
+            self.reload = True
+
+    def quarter(self):
+        if self.reload:
+            self.linear = self.reload_value
+        elif self.linear:
+            self.linear -= 1
+        if not self.control:
+            self.reload = False
+
+    def half(self):
+        if self.length and not self.control:
+            self.length -= 1
+
+    def on(self):
+        # periods below 2 are ultrasonic; treat them as silence
+        return bool(self.linear and self.length and self.period >= 2)
+
+
+class _Noise:
+    def __init__(self):
+        self.envelope = _Envelope()
+        self.mode = 0
+        self.period = 0
+        self.length = 0
+
+    def write(self, register, value, enabled):
+        if register == 0:
+            self.envelope.control(value)
+        elif register == 2:
+            self.mode = value >> 7
+            self.period = value & 0x0F
+        elif register == 3:
+            if enabled:
+                self.length = LENGTHS[value >> 3]
+            self.envelope.start = True
+
+    def half(self):
+        if self.length and not self.envelope.loop:
+            self.length -= 1
+
+    def volume(self):
+        return self.envelope.volume if self.length else 0
+
+
+class APU:
+    """Register-level model of the 2A03 pulse, triangle and noise channels."""
+
+    def __init__(self):
+        self.pulses = (_Pulse(1), _Pulse(0))
+        self.triangle = _Triangle()
+        self.noise = _Noise()
+        self.enabled = 0x0F  # the game enables the channels at reset
+
+    def _channels(self):
+        return self.pulses + (self.triangle, self.noise)
+
+    def write(self, register, value):
+        if register == 0x4015:
+            self.enabled = value & 0x0F
+            for bit, channel in enumerate(self._channels()):
+                if not value >> bit & 1:
+                    channel.length = 0
+        elif 0x4000 <= register < 0x4010:
+            number = (register - 0x4000) >> 2
+            channel = self._channels()[number]
+            channel.write(register & 3, value, self.enabled >> number & 1)
+
+    def quarter(self):
+        self.pulses[0].envelope.clock()
+        self.pulses[1].envelope.clock()
+        self.triangle.quarter()
+        self.noise.envelope.clock()
+
+    def half(self):
+        for channel in self._channels():
+            channel.half()
+
+
+def run_apu(writes, frames):
+    """
+    Replay (frame, register, value) writes into an APU and record the state
+    of every channel for each of frames * TICKS quarter frames, as a dict of
+    FIELDS arrays. Writes happen at the start of their frame, right after the
+    quarter and half frame clock of the engine's $4017 write; the frame
+    counter clocks quarter frames a quarter, half and three quarters of the
+    way through, and a half frame halfway.
+    """
+    apu = APU()
+    count = frames * TICKS
+    record = {name: np.zeros(count, dtype=np.int64) for name in FIELDS}
+    writes = sorted(writes, key=lambda w: w[0])  # stable: keeps order within a frame
+    i = 0
+    for tick in range(count):
+        frame, step = divmod(tick, TICKS)
+        if step == 0:
+            if tick:
+                apu.quarter()
+                apu.half()
+            while i < len(writes) and writes[i][0] <= frame:
+                apu.write(writes[i][1], writes[i][2])
+                i += 1
+        else:
+            apu.quarter()
+            if step == TICKS // 2:
+                apu.half()
+        for number, pulse in enumerate(apu.pulses, 1):
+            name = "pulse{}_".format(number)
+            record[name + "period"][tick] = pulse.period
+            record[name + "duty"][tick] = pulse.duty
+            record[name + "volume"][tick] = pulse.volume()
+            record[name + "reset"][tick] = pulse.reset
+            pulse.reset = False
+        record["triangle_period"][tick] = apu.triangle.period
+        record["triangle_on"][tick] = apu.triangle.on()
+        record["noise_period"][tick] = apu.noise.period
+        record["noise_mode"][tick] = apu.noise.mode
+        record["noise_volume"][tick] = apu.noise.volume()
+    return record
+
+
+@functools.lru_cache(maxsize=None)
+def _noise_sequence(mode):
+    """Output (0 or 1) of the noise LFSR over one period, from its power-on state."""
+    tap = 6 if mode else 1
+    register = 1
+    bits = []
+    while True:
+        bits.append(1 - (register & 1))
+        feedback = (register ^ register >> tap) & 1
+        register = register >> 1 | feedback << 14
+        if register == 1:
+            return np.array(bits, dtype=np.float64)
+
+
+def _positions(step):
+    """Sequencer position before each sample, given the steps taken during each."""
+    return np.cumsum(step) - step
+
+
+def synthesize(record, rate=SAMPLE_RATE, oversample=OVERSAMPLE):
+    """Mono float samples (about -1 to 1) of the channel states run_apu() recorded."""
+    ticks = len(record["pulse1_period"])
+    fine = rate * oversample
+    count = int(ticks / (FRAME_RATE * TICKS) * rate) * oversample
+    tick = np.minimum(
+        (np.arange(count) * (FRAME_RATE * TICKS / fine)).astype(np.int64), ticks - 1
+    )
+
+    # channels that stay silent are skipped
+    pulses = np.zeros(count)
+    for number in (1, 2):
+        name = "pulse{}_".format(number)
+        if not record[name + "volume"].any():
+            continue
+        step = CPU_CLOCK / (2.0 * (record[name + "period"][tick] + 1)) / fine
+        position = _positions(step)
+        # $4003/$4007 restarts the sequencer: measure from the last write
+        starts = np.searchsorted(tick, np.flatnonzero(record[name + "reset"]))
+        starts = starts[starts < count]
+        last = np.zeros(count, dtype=np.int64)
+        last[starts] = starts
+        position -= position[np.maximum.accumulate(last)]
+        shape = DUTY[record[name + "duty"][tick], position.astype(np.int64) & 7]
+        pulses += shape * record[name + "volume"][tick]
+
+    triangle = np.zeros(count)
+    if record["triangle_on"].any():
+        on = record["triangle_on"][tick].astype(bool)
+        step = CPU_CLOCK / (record["triangle_period"][tick] + 1.0) / fine * on
+        triangle = TRIANGLE[_positions(step).astype(np.int64) & 31]
+
+    noise = np.zeros(count)
+    if record["noise_volume"].any():
+        step = CPU_CLOCK / NOISE_PERIODS[record["noise_period"][tick]] / fine
+        position = _positions(step).astype(np.int64)
+        long, short = _noise_sequence(0), _noise_sequence(1)
+        bits = np.where(
+            record["noise_mode"][tick].astype(bool),
+            short[position % len(short)],
+            long[position % len(long)],
+        )
+        noise = bits * record["noise_volume"][tick]
+
+    # non-linear mixer (https://www.nesdev.org/wiki/APU_Mixer)
+    with np.errstate(divide="ignore"):
+        pulse_out = np.where(pulses > 0, 95.88 / (8128.0 / pulses + 100), 0.0)
+        tnd = triangle / 8227.0 + noise / 12241.0
+        tnd_out = np.where(tnd > 0, 159.79 / (1 / tnd + 100), 0.0)
+    mixed = (pulse_out + tnd_out).reshape(-1, oversample).mean(axis=1)
+
+    window = max(int(rate * DC_WINDOW), 1)
+    total = np.concatenate(([0.0], np.cumsum(mixed)))
+    first = np.maximum(np.arange(len(mixed)) + 1 - window, 0)
+    mean = (total[1:] - total[first]) / (np.arange(len(mixed)) + 1 - first)
+    return mixed - mean
+
+
+def render(tune, rate=SAMPLE_RATE, oversample=OVERSAMPLE):
+    """16-bit samples of a decoded tune."""
+    frames = tune.frames + (0 if tune.loops else TAIL_FRAMES)
+    samples = synthesize(run_apu(register_writes(tune), frames), rate, oversample)
+    return np.clip(np.round(samples * GAIN * 32767), -32768, 32767).astype(np.int16)
+
+
+def write_wav(path, samples, rate=SAMPLE_RATE):
+    with wave.open(str(path), "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(rate)
+        f.writeframes(samples.astype("<i2").tobytes())
+
+
+def read_wav(path):
+    with wave.open(str(path), "rb") as f:
+        if f.getnchannels() != 1 or f.getsampwidth() != 2:
+            raise ValueError("{}: not a 16-bit mono WAV".format(path))
+        return np.frombuffer(f.readframes(f.getnframes()), dtype="<i2"), f.getframerate()
+
+
+def difference(new, old, rate=SAMPLE_RATE):
+    """Description of how two sample arrays differ, or None if they are equal."""
+    if len(new) == len(old) and np.array_equal(new, old):
+        return None
+    size = min(len(new), len(old))
+    delta = new[:size].astype(np.int64) - old[:size]
+    changed = np.flatnonzero(delta)
+    text = []
+    if len(changed):
+        text.append(
+            "first at {:.3f}s, max {}, rms {:.1f}".format(
+                changed[0] / rate,
+                int(np.abs(delta).max()),
+                float(np.sqrt(np.mean(delta.astype(np.float64) ** 2))),
+            )
+        )
+    if len(new) != len(old):
+        text.append("length {:.3f}s -> {:.3f}s".format(len(old) / rate, len(new) / rate))
+    return ", ".join(text)
+
+
+def main():
+    ap = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    ap.add_argument("inputs", nargs="+", help="Main assembly file(s) and/or .nes ROMs")
+    ap.add_argument("-o", "--out-dir", default="wav", help="Output directory (default: wav)")
+    ap.add_argument(
+        "--tune",
+        action="append",
+        default=[],
+        help="Tune to render (repeatable, default: all): {}".format(
+            ", ".join(FANFARES + MUSIC)
+        ),
+    )
+    ap.add_argument(
+        "--version",
+        action="append",
+        type=parse_version,
+        default=[],
+        help="Game version of source inputs (repeatable, default: all)",
+    )
+    ap.add_argument("--loops", type=int, default=2, help="Passes of music tunes (default 2)")
+    ap.add_argument("--rate", type=int, default=SAMPLE_RATE, help="Sample rate")
+    ap.add_argument(
+        "--compare", help="Directory of earlier renders to diff against (same layout)"
+    )
+    args = ap.parse_args()
+
+    names = {value: name for name, value in VERSION_VALUES.items()}
+    jobs = []  # (label, input, version)
+    for path in args.inputs:
+        if pathlib.Path(path).suffix.lower() == ".nes":
+            jobs.append((pathlib.Path(path).stem, path, None))
+        else:
+            for version in args.version or sorted(names):
+                jobs.append((names.get(version, str(version)), path, version))
+    labels = [label for label, _, _ in jobs]
+    if len(set(labels)) != len(labels):
+        print("Error: several inputs would be written to the same directory")
+        return 1
+
+    started = time.perf_counter()
+    cache = {}
+    written = rendered = seconds = 0
+    differences = []
+    for label, path, version in jobs:
+        try:
+            data = SoundData.load(path, version)
+            tunes = [data.tune(name, args.loops) for name in args.tune or distinct_tunes(data)]
+        except (OSError, ValueError) as e:  # EvalError, InesError, SoundError
+            print("Error: {}: {}".format(label, e), file=sys.stderr)
+            return 1
+        out_dir = pathlib.Path(args.out_dir) / label
+        out_dir.mkdir(parents=True, exist_ok=True)
+        for tune in tunes:
+            key = (tuple(register_writes(tune)), tune.frames, tune.loops)
+            if key not in cache:
+                cache[key] = render(tune, args.rate)
+                rendered += 1
+            samples = cache[key]
+            written += 1
+            seconds += len(samples) / args.rate
+            write_wav(out_dir / (tune.name + ".wav"), samples, args.rate)
+            if args.compare:
+                old_path = pathlib.Path(args.compare) / label / (tune.name + ".wav")
+                if not old_path.exists():
+                    differences.append((label, tune.name, "not in {}".format(args.compare)))
+                    continue
+                old, rate = read_wav(old_path)
+                change = "sample rate {} -> {}".format(rate, args.rate)
+                if rate == args.rate:
+                    change = difference(samples, old, rate)
+                if change:
+                    differences.append((label, tune.name, change))
+
+    elapsed = time.perf_counter() - started
+    print(
+        "{} tune(s) for {} input(s), {} synthesized: {:.1f}s of audio in {:.2f}s "
+        "({:.0f}x real time)".format(
+            written,
+            len(labels),
+            rendered,
+            seconds,
+            elapsed,
+            seconds / elapsed if elapsed else 0,
+        )
+    )
+    print("Written to {}".format(args.out_dir))
+    if args.compare:
+        for label, name, change in differences:
+            print("  {}/{}: {}".format(label, name, change))
+        print("{} tune(s) differ from {}".format(len(differences), args.compare))
+        return 1 if differences else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,977 @@
+"""
+Evaluate the data subset of ASM6 source to bytes, without running the assembler.
+
+Supported:
+- numbers: $FF, 0FFh, %1010, 1010b, 255 and 'c' character literals
+- symbols, with values supplied by the caller (see collect_constants)
+- ASM6 operators with ASM6 precedence, including unary < (low byte) and
+  > (high byte)
+- data directives: db/byte, dw/word, dl/dh, hex, fill/dsb, dsw
+
+Anything else raises EvalError, so callers can fall back to leaving the
+source as text.
+
+assemble() goes further and lays out a whole program (instructions, org/pad,
+conditionals, macros, includes), so a textual transform of the source can be
+checked byte for byte without asm6 installed.
+"""
+
+import bisect
+import functools
+import pathlib
+import re
+
+import mos6502
+
+
+class EvalError(ValueError):
+    """Raised when an expression or directive cannot be evaluated."""
+
+
+TOKEN_RE = re.compile(
+    r"""\s*(?:
+        (?P<num>\$[0-9A-Fa-f]+|%[01]+|[01]+b\b|[0-9][0-9A-Fa-f]*h\b|[0-9]+\b|'(?:[^'\\]|\\.)')
+      | (?P<sym>[A-Za-z_@.][\w.@]*)
+      | (?P<op><<|>>|<=|>=|==|!=|<>|&&|\|\||[-+*/%&|^~!<>=()$])
+    )""",
+    re.VERBOSE,
+)
+
+# Binary operator precedence (higher binds tighter), as listed in the ASM6 readme
+BINARY_OPS = {
+    "*": 10,
+    "/": 10,
+    "%": 10,
+    "+": 9,
+    "-": 9,
+    "<<": 8,
+    ">>": 8,
+    "<": 7,
+    ">": 7,
+    "<=": 7,
+    ">=": 7,
+    "=": 6,
+    "==": 6,
+    "!=": 6,
+    "<>": 6,
+    "&": 5,
+    "^": 4,
+    "|": 3,
+    "&&": 2,
+    "||": 1,
+}
+UNARY_OPS = {"+", "-", "~", "!", "<", ">"}
+
+
+def _parse_number(text):
+    if text[0] == "$":
+        return int(text[1:], 16)
+    if text[0] == "%":
+        return int(text[1:], 2)
+    if text[0] == "'":
+        body = text[1:-1]
+        return ord(body[-1] if body.startswith("\\") else body)
+    low = text.lower()
+    if low.endswith("h"):
+        return int(text[:-1], 16)
+    if low.endswith("b") and set(low[:-1]) <= {"0", "1"}:
+        return int(text[:-1], 2)
+    return int(text, 10)
+
+
+@functools.lru_cache(maxsize=1 << 16)
+def _tokenize(expr):
+    tokens = []
+    pos = 0
+    expr = expr.rstrip()
+    while pos < len(expr):
+        m = TOKEN_RE.match(expr, pos)
+        if not m or m.end() == pos:
+            raise EvalError("cannot parse expression '{}'".format(expr))
+        if m.group("num"):
+            tokens.append(("num", _parse_number(m.group("num"))))
+        elif m.group("sym"):
+            tokens.append(("sym", m.group("sym")))
+        else:
+            tokens.append(("op", m.group("op")))
+        pos = m.end()
+    return tuple(tokens)
+
+
+def _apply(op, a, b):
+    if op == "*":
+        return a * b
+    if op in ("/", "%"):
+        if b == 0:
+            raise EvalError("division by zero")
+        q = abs(a) // abs(b) * (1 if (a < 0) == (b < 0) else -1)
+        return q if op == "/" else a - q * b
+    if op == "+":
+        return a + b
+    if op == "-":
+        return a - b
+    if op == "<<":
+        return a << b
+    if op == ">>":
+        return a >> b
+    if op == "<":
+        return int(a < b)
+    if op == ">":
+        return int(a > b)
+    if op == "<=":
+        return int(a <= b)
+    if op == ">=":
+        return int(a >= b)
+    if op in ("=", "=="):
+        return int(a == b)
+    if op in ("!=", "<>"):
+        return int(a != b)
+    if op == "&":
+        return a & b
+    if op == "^":
+        return a ^ b
+    if op == "|":
+        return a | b
+    if op == "&&":
+        return int(bool(a) and bool(b))
+    if op == "||":
+        return int(bool(a) or bool(b))
+    raise EvalError("unknown operator '{}'".format(op))
+
+
+class _Parser:
+    def __init__(self, tokens, lookup, pc):
+        self.tokens = tokens
+        self.pos = 0
+        self.lookup = lookup
+        self.pc = pc
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else (None, None)
+
+    def take(self):
+        tok = self.peek()
+        self.pos += 1
+        return tok
+
+    def unary(self):
+        kind, value = self.take()
+        if kind == "num":
+            return value
+        if kind == "sym":
+            return self.lookup(value)
+        if kind == "op":
+            if value == "(":
+                result = self.binary(0)
+                if self.take() != ("op", ")"):
+                    raise EvalError("missing ')'")
+                return result
+            if value == "$":
+                if self.pc is None:
+                    raise EvalError("'$' (current address) is not known here")
+                return self.pc
+            if value in UNARY_OPS:
+                operand = self.unary()
+                if value == "-":
+                    return -operand
+                if value == "~":
+                    return ~operand
+                if value == "!":
+                    return int(not operand)
+                if value == "<":
+                    return operand & 0xFF
+                if value == ">":
+                    return (operand >> 8) & 0xFF
+                return operand
+        raise EvalError("unexpected token '{}'".format(value))
+
+    def binary(self, min_prec):
+        left = self.unary()
+        while True:
+            kind, op = self.peek()
+            if kind != "op" or op not in BINARY_OPS or BINARY_OPS[op] <= min_prec:
+                return left
+            self.take()
+            right = self.binary(BINARY_OPS[op])
+            left = _apply(op, left, right)
+
+
+def evaluate(expr, lookup, pc=None):
+    """
+    Evaluate an ASM6 expression. lookup(name) must return the value of a
+    symbol or raise EvalError; pc is the value of '$', if known.
+    """
+    tokens = _tokenize(expr)
+    if not tokens:
+        raise EvalError("empty expression")
+    parser = _Parser(tokens, lookup, pc)
+    result = parser.binary(0)
+    if parser.pos != len(tokens):
+        raise EvalError("unexpected text in expression '{}'".format(expr))
+    return result
+
+
+def strip_comment(text):
+    """Remove a trailing ;comment, ignoring semicolons inside quotes."""
+    quote = None
+    for i, ch in enumerate(text):
+        if quote:
+            if ch == "\\":
+                continue
+            if ch == quote:
+                quote = None
+        elif ch in "\"'":
+            quote = ch
+        elif ch == ";":
+            return text[:i]
+    return text
+
+
+def split_operands(text):
+    """Split a directive's operand list on commas outside of quotes."""
+    parts = []
+    quote = None
+    start = 0
+    for i, ch in enumerate(text):
+        if quote:
+            if ch == quote:
+                quote = None
+        elif ch in "\"'":
+            quote = ch
+        elif ch == ",":
+            parts.append(text[start:i].strip())
+            start = i + 1
+    parts.append(text[start:].strip())
+    return [p for p in parts if p] if any(parts) else []
+
+
+LINE_RE = re.compile(
+    r"^\s*(?:(?P<label>[A-Za-z_@.][\w.@]*)\s*:\s*)?"
+    r"(?:(?P<assign>[A-Za-z_@][\w.@]*)\s*(?:=|\.?equ\b)\s*(?P<value>.+)"
+    r"|(?P<op>\.?[A-Za-z_]\w*)\b\s*(?P<args>.*))?$",
+    re.IGNORECASE,
+)
+
+
+def parse_line(line):
+    """
+    Split a source line into (label, op, args) or ("=", name, value) parts.
+    Returns a tuple (label, op, args): op is lowercased without a leading dot,
+    "=" for assignments (args is then (name, value)), or None for label-only
+    and blank lines.
+    """
+    m = LINE_RE.match(strip_comment(line).rstrip())
+    if not m:
+        raise EvalError("cannot parse line '{}'".format(line.strip()))
+    label = m.group("label")
+    if m.group("assign"):
+        return label, "=", (m.group("assign"), m.group("value").strip())
+    op = m.group("op")
+    if op is None:
+        return label, None, None
+    return label, op.lower().lstrip("."), m.group("args").strip()
+
+
+DB_OPS = {"db", "byte", "dl", "dh"}
+DW_OPS = {"dw", "word"}
+FILL_OPS = {"fill", "dsb", "dsw"}
+DATA_OPS = DB_OPS | DW_OPS | FILL_OPS | {"hex"}
+
+
+def _is_string(operand):
+    return len(operand) >= 2 and operand[0] == '"' and operand[-1] == '"'
+
+
+def _hex_digits(args):
+    digits = re.sub(r"\s+", "", args)
+    if len(digits) % 2 or not re.match(r"^[0-9A-Fa-f]*$", digits):
+        raise EvalError("bad hex data '{}'".format(args))
+    return digits
+
+
+def data_size(op, args, lookup):
+    """Number of bytes a data directive emits (only fill counts are evaluated)."""
+    if op == "hex":
+        return len(_hex_digits(args)) // 2
+    operands = split_operands(args)
+    if op in DB_OPS:
+        return sum(len(o) - 2 if _is_string(o) else 1 for o in operands)
+    if op in DW_OPS:
+        return 2 * len(operands)
+    if op in FILL_OPS:
+        if not operands:
+            raise EvalError("{} needs a count".format(op))
+        count = evaluate(operands[0], lookup)
+        if count < 0:
+            raise EvalError("negative {} count".format(op))
+        return count * (2 if op == "dsw" else 1)
+    raise EvalError("unsupported directive '{}'".format(op))
+
+
+def data_bytes(op, args, lookup, pc=None, fillvalue=None):
+    """Bytes emitted by a data directive. fillvalue is used by fill without a value."""
+    if op == "hex":
+        return bytes.fromhex(_hex_digits(args))
+
+    operands = split_operands(args)
+    out = bytearray()
+    if op in DB_OPS:
+        for operand in operands:
+            if _is_string(operand):
+                out += operand[1:-1].encode("latin-1")
+                continue
+            value = evaluate(operand, lookup, pc)
+            if op == "dh":
+                value >>= 8
+            elif op != "dl" and not -128 <= value <= 255:
+                raise EvalError("value out of range: {}".format(operand))
+            out.append(value & 0xFF)
+        return bytes(out)
+
+    if op in DW_OPS:
+        for operand in operands:
+            value = evaluate(operand, lookup, pc)
+            if not -32768 <= value <= 65535:
+                raise EvalError("value out of range: {}".format(operand))
+            out += bytes((value & 0xFF, (value >> 8) & 0xFF))
+        return bytes(out)
+
+    if op in FILL_OPS:
+        count = evaluate(operands[0], lookup, pc)
+        if len(operands) > 1:
+            value = evaluate(operands[1], lookup, pc)
+        elif fillvalue is not None:
+            value = fillvalue
+        else:
+            raise EvalError("{} without a value and no known FILLVALUE".format(op))
+        if op == "dsw":
+            return bytes((value & 0xFF, (value >> 8) & 0xFF)) * count
+        return bytes((value & 0xFF,)) * count
+
+    raise EvalError("unsupported directive '{}'".format(op))
+
+
+# Directives that open/close a region whose assignments are not unconditional
+_REGION_OPEN = {"if", "ifdef", "ifndef", "macro", "rept", "enum"}
+_REGION_CLOSE = {"endif", "endm", "endr", "ende"}
+
+
+def collect_constants(lines, constants=None):
+    """
+    Collect the unconditional Name = value constants defined in lines (e.g.
+    Defines.asm plus the main file) and resolve them.
+
+    Assignments inside if/macro/rept/enum regions, and names assigned more
+    than once with different expressions, are left out so nothing depending
+    on them is ever baked in. Returns a dict name -> int, extending constants
+    if given.
+    """
+    exprs = {}
+    excluded = set()
+    depth = 0
+    for line in lines:
+        stripped = line.strip()
+        if not stripped or stripped[0] == ";":
+            continue
+        word = stripped.split(None, 1)[0].lower().lstrip(".")
+        if word in _REGION_OPEN:
+            depth += 1
+            continue
+        if word in _REGION_CLOSE:
+            depth = max(0, depth - 1)
+            continue
+        if "=" not in stripped and "equ" not in stripped.lower():
+            continue
+        try:
+            _, op, args = parse_line(line)
+        except EvalError:
+            continue
+        if op != "=":
+            continue
+        name, value = args
+        if depth:
+            excluded.add(name)
+        elif exprs.get(name, value) != value:
+            excluded.add(name)
+        else:
+            exprs[name] = value
+
+    resolved = dict(constants or {})
+    pending = {n: e for n, e in exprs.items() if n not in excluded}
+    for name in excluded:
+        resolved.pop(name, None)
+
+    def lookup(name):
+        if name in resolved:
+            return resolved[name]
+        raise EvalError("undefined symbol '{}'".format(name))
+
+    # Constants may be defined in terms of later ones: resolve until stable
+    while pending:
+        progress = False
+        for name, expr in list(pending.items()):
+            try:
+                resolved[name] = evaluate(expr, lookup)
+            except EvalError:
+                continue
+            del pending[name]
+            progress = True
+        if not progress:
+            break
+    return resolved
+
+
+def _evaluate_block_at(lines, constants, base, fillvalue):
+    local = {}
+
+    def lookup(name):
+        if name in local:
+            return local[name]
+        if name in constants:
+            return constants[name]
+        raise EvalError("undefined symbol '{}'".format(name))
+
+    # Pass 1: sizes, label offsets and local constants
+    items = []
+    parsed = []
+    offset = 0
+    for line in lines:
+        label, op, args = parse_line(line)
+        if label:
+            local[label] = base + offset
+            items.append((offset, "label", label))
+        if op == "=":
+            local[args[0]] = evaluate(args[1], lookup, base + offset)
+            items.append((offset, "line", strip_comment(line).strip()))
+        elif op is not None:
+            if op not in DATA_OPS:
+                raise EvalError("unsupported directive '{}'".format(op))
+            size = data_size(op, args, lookup)
+            parsed.append((offset, op, args, size))
+            offset += size
+
+    # Pass 2: values, with every label in the block known
+    data = bytearray()
+    for offset, op, args, size in parsed:
+        chunk = data_bytes(op, args, lookup, base + offset, fillvalue)
+        if len(chunk) != size:
+            raise EvalError("size mismatch in '{} {}'".format(op, args))
+        data += chunk
+    return bytes(data), items
+
+
+def evaluate_block(lines, constants, fillvalue=None):
+    """
+    Evaluate a run of data lines (labels, assignments, comments and data
+    directives) to bytes.
+
+    Labels are placed at two different base addresses and the block is only
+    accepted if both produce the same bytes and layout, i.e. its content does
+    not depend on where it ends up in the ROM.
+
+    Returns (data, items) where items is a list of (offset, kind, text):
+    kind "label" for a label name, "line" for an assignment line that must be
+    kept verbatim.
+    """
+    lines = list(lines)
+    first = _evaluate_block_at(lines, constants, 0x1000, fillvalue)
+    second = _evaluate_block_at(lines, constants, 0x2345, fillvalue)
+    if first != second:
+        raise EvalError("block content depends on its address")
+    return first
+
+
+# ---------------------------------------------------------------------------
+# Whole-program assembly
+#
+# assemble() lays out a complete ASM6 program the way the assembler does:
+# instructions are sized and encoded (see mos6502.py), labels get addresses
+# and the source is re-read until every label keeps its value between two
+# passes. It only has to agree with itself, which is enough to check that a
+# purely textual transform (such as split_asm_data.py) kept every byte and
+# every address where it was.
+# ---------------------------------------------------------------------------
+
+MAX_PASSES = 8
+
+_INDEXED_RE = re.compile(r"^(.*?)\s*,\s*([xXyY])$")
+_INDIRECT_X_RE = re.compile(r"^\((.*?)\s*,\s*[xX]\s*\)$")
+_INDIRECT_Y_RE = re.compile(r"^\((.*)\)\s*,\s*[yY]$")
+_CONDITIONALS = {"if", "ifdef", "ifndef", "elseif", "else", "endif"}
+_DIRECTIVES = {
+    "org",
+    "base",
+    "pad",
+    "align",
+    "fillvalue",
+    "incsrc",
+    "include",
+    "incbin",
+    "bin",
+    "enum",
+    "ende",
+    "error",
+    "endm",
+    "endr",
+}
+_LABEL_RE = re.compile(r"^[A-Za-z_@.][\w.@]*$")
+# Directives that do nothing for a byte image
+_IGNORED = {"unstable", "hunstable", "ignorenl", "endinl"}
+
+
+class Program:
+    """
+    Result of assemble().
+
+    image is the output bytes, symbols maps every label and constant to its
+    final value, and spans records where each source line put its bytes:
+    {path: [(line_number, image_offset, address, size), ...]} with 0-based
+    line numbers (bytes from a macro are credited to the line invoking it).
+    missing lists incbin files that were treated as empty (allow_missing),
+    and sources every source file that was read.
+    """
+
+    def __init__(self, image, symbols, spans, missing, sources=()):
+        self.image = image
+        self.symbols = symbols
+        self.spans = spans
+        self.missing = missing
+        self.sources = list(sources)
+        self._ranges = None
+
+    def offset(self, address):
+        """Image offset of the byte assembled at CPU address (None if none was)."""
+        if self._ranges is None:
+            self._ranges = sorted(
+                (addr, offset, size)
+                for spans in self.spans.values()
+                for _, offset, addr, size in spans
+                if addr is not None
+            )
+            self._starts = [r[0] for r in self._ranges]
+        i = bisect.bisect_right(self._starts, address) - 1
+        if i < 0 or address >= self._ranges[i][0] + self._ranges[i][2]:
+            return None
+        addr, offset, _ = self._ranges[i]
+        return offset + address - addr
+
+    def line_bytes(self, path, start=0, end=None):
+        """
+        (address, bytes) emitted by lines start..end-1 of path, where address
+        is that of the first line emitting anything (None if none does).
+        """
+        spans = self.spans.get(str(pathlib.Path(path).resolve()), ())
+        address = None
+        data = bytearray()
+        for line, offset, addr, size in spans:
+            if line < start or (end is not None and line >= end):
+                continue
+            if address is None:
+                address = addr
+            data += self.image[offset : offset + size]
+        return address, bytes(data)
+
+
+class _Pass:
+    """One pass over the source; see assemble()."""
+
+    def __init__(self, base_dir, overrides, previous, files, allow_missing):
+        self.base_dir = base_dir
+        self.overrides = overrides
+        self.previous = previous
+        self.files = files
+        self.allow_missing = allow_missing
+        self.symbols = dict(overrides)
+        self.macros = {}
+        self.expansions = 0
+        self.out = bytearray()
+        self.pc = None
+        self.fill = 0
+        self.enum_saved = None
+        self.scope = ""
+        self.conds = []
+        self.spans = {}
+        self.missing = []
+        self.errors = []
+        self.where = ("", 0)
+
+    # -- symbols -----------------------------------------------------------
+
+    def _key(self, name):
+        return self.scope + name if name[0] == "@" else name
+
+    def lookup(self, name):
+        key = self._key(name)
+        if key in self.symbols:
+            return self.symbols[key]
+        if key in self.previous:
+            return self.previous[key]  # forward reference, value from the last pass
+        raise EvalError("undefined symbol '{}'".format(name))
+
+    def value(self, expr, default=0):
+        """Evaluate expr; errors are recorded (only fatal if they persist)."""
+        try:
+            return evaluate(expr, self.lookup, self.pc)
+        except EvalError as e:
+            self.errors.append((self.where, str(e)))
+            return default
+
+    def define(self, name, value):
+        key = self._key(name)
+        if key in self.overrides:
+            return
+        self.symbols[key] = value
+
+    def label(self, name):
+        if self.pc is None:
+            raise EvalError("label '{}' before any org".format(name))
+        key = self._key(name)
+        if key in self.symbols and self.symbols[key] != self.pc:
+            raise EvalError("label '{}' already defined".format(name))
+        if name[0] != "@":
+            self.scope = name
+            key = name
+        self.symbols[key] = self.pc
+
+    # -- output ------------------------------------------------------------
+
+    def emit(self, data):
+        if not data:
+            return
+        if self.enum_saved is None:
+            path, line = self.where
+            spans = self.spans.setdefault(path, [])
+            spans.append((line, len(self.out), self.pc, len(data)))
+            self.out += data
+        if self.pc is not None:
+            self.pc += len(data)
+
+    def pad_to(self, target, fill):
+        if self.pc is None:
+            self.pc = target
+        elif target < self.pc:
+            raise EvalError("cannot pad backwards to ${:04X}".format(target))
+        else:
+            self.emit(bytes((fill & 0xFF,)) * (target - self.pc))
+
+    # -- source ------------------------------------------------------------
+
+    @property
+    def active(self):
+        return not self.conds or self.conds[-1][1]
+
+    def run_file(self, path):
+        path = pathlib.Path(path).resolve()
+        key = str(path)
+        if key not in self.files:
+            try:
+                text = path.read_text(encoding="utf-8", errors="replace")
+            except OSError as e:
+                raise EvalError("cannot read {}: {}".format(path, e))
+            self.files[key] = text.splitlines()
+        self.run_lines(key, enumerate(self.files[key]))
+
+    def run_lines(self, path, numbered):
+        recording = None  # [kind, header args, body lines, nesting]
+        for number, line in numbered:
+            self.where = (path, number)
+            try:
+                label, op, args = parse_line(line)
+            except EvalError as e:
+                if self.active and recording is None:
+                    raise self._located(e)
+                label, op, args = None, None, None
+
+            if recording is not None:
+                if op in ("macro", "rept"):
+                    recording[3] += 1
+                elif op in ("endm", "endr"):
+                    recording[3] -= 1
+                if recording[3] >= 0:
+                    recording[2].append(line)
+                    continue
+                kind, header, body, _ = recording
+                recording = None
+                try:
+                    if kind == "macro":
+                        self._define_macro(header, body)
+                    else:
+                        count = self.value(header)
+                        for _ in range(max(count, 0)):
+                            self.run_lines(path, ((number, text) for text in body))
+                except EvalError as e:
+                    raise self._located(e)
+                continue
+
+            try:
+                if op in _CONDITIONALS:
+                    self._conditional(op, args)
+                    continue
+                if not self.active:
+                    continue
+                if op in ("macro", "rept"):
+                    recording = [op, args, [], 0]
+                    continue
+                if op is not None and op != "=" and not self._known(op):
+                    # ASM6 also takes an unknown first word as a label without ':'
+                    word, _, rest = strip_comment(line).strip().partition(" ")
+                    if label or not _LABEL_RE.match(word):
+                        raise EvalError(
+                            "unsupported instruction or directive '{}'".format(op)
+                        )
+                    label = word
+                    _, op, args = parse_line(rest)
+                if label:
+                    self.label(label)
+                if op is not None:
+                    self._statement(path, number, op, args)
+            except EvalError as e:
+                raise self._located(e)
+
+        if recording is not None:
+            raise self._located(EvalError("missing end{}".format(recording[0][0])))
+
+    def _located(self, error):
+        path, number = self.where
+        if str(error).startswith(path):
+            return error
+        return EvalError("{}:{}: {}".format(path, number + 1, error))
+
+    def _conditional(self, op, args):
+        if op in ("if", "ifdef", "ifndef"):
+            parent = self.active
+            taken = False
+            if parent:
+                if op == "if":
+                    taken = bool(evaluate(args, self.lookup, self.pc))
+                else:
+                    name = args.split()[0] if args else ""
+                    defined = (
+                        self._key(name) in self.symbols or name.lower() in self.macros
+                    )
+                    taken = defined == (op == "ifdef")
+            self.conds.append([parent, taken, taken])
+            return
+        if not self.conds:
+            raise EvalError("{} without if".format(op))
+        top = self.conds[-1]
+        if op == "elseif":
+            taken = top[0] and not top[2] and bool(evaluate(args, self.lookup, self.pc))
+            top[1] = taken
+            top[2] = top[2] or taken
+        elif op == "else":
+            top[1] = top[0] and not top[2]
+            top[2] = True
+        else:
+            self.conds.pop()
+
+    def _define_macro(self, header, body):
+        parts = header.split(None, 1)
+        if not parts:
+            raise EvalError("macro without a name")
+        params = split_operands(parts[1]) if len(parts) > 1 else []
+        local = []
+        for text in body:
+            try:
+                label = parse_line(text)[0]
+            except EvalError:
+                continue
+            if label and label not in local:
+                local.append(label)
+        self.macros[parts[0].lower()] = (params, local, body)
+
+    def _expand_macro(self, path, number, macro, args):
+        params, local, body = macro
+        self.expansions += 1
+        values = split_operands(args)
+        subst = dict(zip(params, values))
+        for name in params[len(values) :]:
+            subst[name] = "0"
+        # Labels defined inside a macro are local to each expansion
+        for name in local:
+            subst.setdefault(name, "{}.{}".format(name, self.expansions))
+        if subst:
+            pattern = re.compile(
+                r"(?<![\w@.$])({})(?![\w@.])".format(
+                    "|".join(re.escape(n) for n in sorted(subst, key=len, reverse=True))
+                )
+            )
+            body = [pattern.sub(lambda m: subst[m.group(1)], text) for text in body]
+        self.run_lines(path, ((number, text) for text in body))
+
+    def _known(self, op):
+        return (
+            op in mos6502.OPCODES
+            or op in DATA_OPS
+            or op in _DIRECTIVES
+            or op in _IGNORED
+            or op in self.macros
+        )
+
+    def _statement(self, path, number, op, args):
+        if op == "=":
+            name, expr = args
+            self.define(name, self.value(expr, self.previous.get(self._key(name), 0)))
+        elif op in mos6502.OPCODES:
+            self._instruction(op, args)
+        elif op in DATA_OPS:
+            self._data(op, args)
+        elif op == "org":
+            self.pad_to(self.value(args), self.fill)
+        elif op == "base":
+            self.pc = self.value(args)
+        elif op == "pad":
+            operands = split_operands(args)
+            fill = self.value(operands[1]) if len(operands) > 1 else self.fill
+            self.pad_to(self.value(operands[0]), fill)
+        elif op == "align":
+            operands = split_operands(args)
+            fill = self.value(operands[1]) if len(operands) > 1 else self.fill
+            step = self.value(operands[0], 1) or 1
+            if self.pc is not None:
+                self.pad_to(-(-self.pc // step) * step, fill)
+        elif op == "fillvalue":
+            self.fill = self.value(args)
+        elif op in ("incsrc", "include"):
+            self.run_file(self.base_dir / _include_name(args))
+            self.where = (path, number)
+        elif op in ("incbin", "bin"):
+            self._incbin(args)
+        elif op == "enum":
+            self.enum_saved = (self.pc,)
+            self.pc = self.value(args)
+        elif op == "ende":
+            if self.enum_saved is None:
+                raise EvalError("ende without enum")
+            self.pc = self.enum_saved[0]
+            self.enum_saved = None
+        elif op == "error":
+            raise EvalError("error directive: {}".format(args))
+        elif op in ("endm", "endr"):
+            opener = "macro" if op == "endm" else "rept"
+            raise EvalError("{} without {}".format(op, opener))
+        elif op in self.macros:
+            self._expand_macro(path, number, self.macros[op], args)
+
+    def _data(self, op, args):
+        try:
+            chunk = data_bytes(op, args, self.lookup, self.pc, self.fill)
+        except EvalError as e:
+            self.errors.append((self.where, str(e)))
+            chunk = bytes(data_size(op, args, self.lookup))
+        self.emit(chunk)
+
+    def _incbin(self, args):
+        operands = split_operands(args)
+        if not operands:
+            raise EvalError("incbin needs a file name")
+        path = self.base_dir / _include_name(operands[0])
+        try:
+            data = path.read_bytes()
+        except OSError as e:
+            if not self.allow_missing:
+                raise EvalError("cannot read {}: {}".format(path, e))
+            self.missing.append(str(path))
+            return
+        start = self.value(operands[1]) if len(operands) > 1 else 0
+        size = self.value(operands[2]) if len(operands) > 2 else len(data) - start
+        self.emit(data[start : start + size])
+
+    def _instruction(self, mnemonic, args):
+        modes = mos6502.OPCODES[mnemonic]
+        text = args.strip()
+        if not text or (text.lower() == "a" and "acc" in modes):
+            mode = "acc" if "acc" in modes else "imp"
+            if mode not in modes:
+                raise EvalError("{} needs an operand".format(mnemonic))
+            self.emit(bytes((modes[mode],)))
+            return
+
+        if text[0] == "#":
+            mode, expr = "imm", text[1:]
+        elif "rel" in modes:
+            mode, expr = "rel", text
+        elif _INDIRECT_X_RE.match(text):
+            mode, expr = "indx", _INDIRECT_X_RE.match(text).group(1)
+        elif _INDIRECT_Y_RE.match(text):
+            mode, expr = "indy", _INDIRECT_Y_RE.match(text).group(1)
+        elif text[0] == "(" and text[-1] == ")" and "ind" in modes:
+            mode, expr = "ind", text[1:-1]
+        else:
+            m = _INDEXED_RE.match(text)
+            expr, index = (m.group(1), m.group(2).lower()) if m else (text, "")
+            force_abs = expr[:2].lower() == "a:"
+            if force_abs:
+                expr = expr[2:]
+            zp_mode = "zp" + index
+            abs_mode = mos6502.ZP_TO_ABS[zp_mode]
+            try:
+                known = evaluate(expr, self.lookup, self.pc)
+            except EvalError:
+                known = None  # forward reference: absolute until proven otherwise
+            fits_zp = known is not None and 0 <= known <= 0xFF and not force_abs
+            if zp_mode in modes and fits_zp:
+                mode = zp_mode
+            elif abs_mode in modes:
+                mode = abs_mode
+            elif zp_mode in modes:
+                mode = zp_mode
+            else:
+                raise EvalError("{} does not support '{}'".format(mnemonic, text))
+        if mode not in modes:
+            raise EvalError("{} does not support '{}'".format(mnemonic, text))
+
+        value = self.value(expr)
+        size = mos6502.MODE_SIZES[mode]
+        if mode == "rel":
+            if self.pc is not None:
+                value -= self.pc + 2
+            if not -128 <= value <= 127:
+                self.errors.append((self.where, "branch out of range"))
+        elif size == 2 and not -128 <= value <= 0xFF:
+            self.errors.append((self.where, "value out of range: {}".format(expr)))
+        elif size == 3 and not 0 <= value <= 0xFFFF:
+            self.errors.append((self.where, "value out of range: {}".format(expr)))
+        operand = (value & 0xFFFF).to_bytes(2, "little")[: size - 1]
+        self.emit(bytes((modes[mode],)) + operand)
+
+
+def _include_name(operand):
+    operand = operand.strip()
+    if _is_string(operand):
+        return operand[1:-1]
+    return operand.split(",")[0].strip()
+
+
+def assemble(path, overrides=None, allow_missing=False):
+    """
+    Assemble the program whose main file is path, entirely in Python.
+
+    overrides pins symbols (e.g. {"Version": 0}); assignments to them in the
+    source are ignored. Includes are resolved relative to the main file's
+    directory, like split_asm_data.py does. With allow_missing, incbin files
+    that do not exist (e.g. the ripped CHR data) are treated as empty.
+
+    Supports the ASM6 subset this disassembly uses: the 6502 instruction set,
+    db/dw/hex/fill/dsb/incbin, =, labels (including @local ones), org/base/
+    pad/align/fillvalue, enum/ende, if/elseif/else/endif/ifdef/ifndef, macros
+    and rept. Raises EvalError on anything else.
+    """
+    path = pathlib.Path(path).resolve()
+    overrides = dict(overrides or {})
+    files = {}
+    previous = {}
+    for _ in range(MAX_PASSES):
+        state = _Pass(path.parent, overrides, previous, files, allow_missing)
+        state.run_file(path)
+        if state.conds:
+            raise EvalError("{}: missing endif".format(path))
+        if state.symbols == previous:
+            if state.errors:
+                (where, number), message = state.errors[0]
+                raise EvalError("{}:{}: {}".format(where, number + 1, message))
+            return Program(
+                bytes(state.out), state.symbols, state.spans, state.missing, files
+            )
+        previous = state.symbols
+    raise EvalError("label addresses did not settle after {} passes".format(MAX_PASSES))
@@ -0,0 +1,192 @@
+"""
+The sources of a build and the assembler runs that turn them into a ROM,
+shared by split_asm_data.py and the misc/ tools:
+
+- INCLUDE_RE and VERSION_DEFINE_RE, the incsrc/incbin and "Version = ..."
+  lines as the tools read them;
+- include_closure(), every file a main file pulls in (both branches of every
+  conditional), and prepare_version_workspace(), a temp copy of them with the
+  Version define set;
+- find_assembler() and run_assembler(), which records each run in
+  ASSEMBLER_RUNS, so split_asm_data.py --profile counts the runs of every
+  tool it calls into.
+
+include_closure() and prepare_version_workspace() take an optional snapshot
+{path relative to the main file's directory, in posix form: bytes} of files
+as they were before being overwritten, which is read instead of the disk.
+"""
+
+import pathlib
+import re
+import shutil
+import subprocess
+import time
+
+ASSEMBLERS = ("asm6f", "asm6", "asm6f.exe", "asm6.exe")
+ASSEMBLER_DIRS = (".", "tools", "bin", "../tools", "../bin")
+ASSEMBLER_TIMEOUT = 30  # seconds
+
+INCLUDE_RE = re.compile(
+    r'^\s*(?:[A-Za-z_\.][\w\.]*:\s*)?\.?(incsrc|include|incbin|bin)\s+(?:"([^"]+)"|([^\s;,]+))',
+    re.IGNORECASE,
+)
+SOURCE_INCLUDES = ("incsrc", "include")  # the rest of INCLUDE_RE pulls in binary files
+VERSION_DEFINE_RE = re.compile(r"^(\s*Version\s*=\s*)([^;\s]+)(.*)$", re.IGNORECASE)
+SOURCE_SUFFIXES = (".asm", ".s", ".inc", ".i")
+
+
+def find_assembler():
+    """Find asm6f or asm6 assembler in PATH or common locations."""
+    for asm in ASSEMBLERS:
+        if shutil.which(asm):
+            return asm
+    for path in ASSEMBLER_DIRS:
+        for asm in ASSEMBLERS:
+            full_path = pathlib.Path(path) / asm
+            if full_path.exists() and full_path.is_file():
+                return str(full_path)
+    return None
+
+
+# Assembler and evaluator invocations of this process, reported by --profile
+ASSEMBLER_RUNS = []
+
+
+def record_assembler_run(tool, input_file, seconds, ok, version=None, cached=False):
+    ASSEMBLER_RUNS.append(
+        {
+            "tool": pathlib.Path(tool).name,
+            "input": str(input_file),
+            "version": version,
+            "seconds": round(seconds, 6),
+            "ok": ok,
+            "cached": cached,
+        }
+    )
+
+
+def run_assembler(
+    asm_path,
+    input_file,
+    output_file,
+    verbose=False,
+    listing_file=None,
+    version=None,
+    timeout=ASSEMBLER_TIMEOUT,
+):
+    """
+    Run the assembler on the input file (from its directory, so includes
+    resolve), giving up after timeout seconds. If listing_file is given, a
+    listing (-l) is written there as well. The run is recorded in
+    ASSEMBLER_RUNS under version.
+    Returns (success, stdout, stderr)
+    """
+    input_file = pathlib.Path(input_file)
+    cmd = [asm_path, str(input_file), str(output_file)]
+    if listing_file:
+        cmd = [asm_path, "-l", str(input_file), str(output_file), str(listing_file)]
+    if verbose:
+        print("Running: {} (cwd={})".format(" ".join(cmd), input_file.parent))
+    started = time.perf_counter()
+    try:
+        result = subprocess.run(
+            cmd,
+            capture_output=True,
+            text=True,
+            timeout=timeout,
+            cwd=str(input_file.parent),
+        )
+        outcome = result.returncode == 0, result.stdout, result.stderr
+    except subprocess.TimeoutExpired:
+        outcome = False, "", "Assembly process timed out"
+    except Exception as e:
+        outcome = False, "", "Error running assembler: {}".format(e)
+    record_assembler_run(asm_path, input_file, time.perf_counter() - started, outcome[0], version)
+    return outcome
+
+
+def read_source(input_file, rel, snapshot=None):
+    """Bytes of rel (relative to input_file's directory), or None if it is missing."""
+    rel = pathlib.PurePath(rel).as_posix()
+    if snapshot and rel in snapshot:
+        return snapshot[rel]
+    try:
+        return (pathlib.Path(input_file).parent / rel).read_bytes()
+    except OSError:
+        return None
+
+
+def include_closure(input_file, snapshot=None):
+    """
+    Collect the transitive incsrc/include/incbin closure of input_file.
+    Paths are resolved the way the assembler does (relative to the main file's
+    directory). Returns a sorted list of paths relative to that directory,
+    including the main file itself. Missing includes are skipped; the
+    assembler reports those.
+    """
+    input_file = pathlib.Path(input_file)
+    base = input_file.parent
+    seen = set()
+    pending = [pathlib.Path(input_file.name)]
+
+    while pending:
+        rel = pending.pop()
+        if rel in seen:
+            continue
+        if not (snapshot and rel.as_posix() in snapshot) and not (base / rel).is_file():
+            continue
+        seen.add(rel)
+
+        if rel.suffix.lower() not in SOURCE_SUFFIXES:
+            continue
+        data = read_source(input_file, rel, snapshot) or b""
+        for line in data.decode("utf-8", errors="ignore").splitlines():
+            m = INCLUDE_RE.match(line)
+            if m:
+                pending.append(pathlib.Path(m.group(2) or m.group(3)))
+
+    return sorted(seen, key=lambda p: p.as_posix())
+
+
+def inject_version(text, value):
+    """
+    Return text with its top-level Version define set to value.
+    The first "Version = ..." line is rewritten in place (so line numbers do not
+    move); if there is none, a define is prepended.
+    """
+    lines = text.splitlines(True)
+    define = "Version = {}".format(value)
+    for i, line in enumerate(lines):
+        m = VERSION_DEFINE_RE.match(line.rstrip("\r\n"))
+        if m:
+            eol = line[len(line.rstrip("\r\n")) :]
+            lines[i] = m.group(1) + str(value) + m.group(3) + eol
+            return "".join(lines)
+    return define + "\n" + text
+
+
+def prepare_version_workspace(input_file, value, workspace, snapshot=None):
+    """
+    Copy input_file and its include closure into workspace, with the Version
+    define of the main file set to value (unless that is None). The checked-in
+    sources are never touched. Returns the path of the main file inside the
+    workspace.
+    """
+    input_file = pathlib.Path(input_file)
+    workspace = pathlib.Path(workspace)
+    main_rel = pathlib.Path(input_file.name)
+
+    for rel in include_closure(input_file, snapshot):
+        if rel.is_absolute() or ".." in rel.parts:
+            continue  # referenced outside the tree; left for the assembler to resolve
+        target = workspace / rel
+        target.parent.mkdir(parents=True, exist_ok=True)
+        if rel == main_rel and value is not None:
+            text = read_source(input_file, rel, snapshot).decode("utf-8", errors="ignore")
+            target.write_text(inject_version(text, value), encoding="utf-8")
+        elif snapshot and rel.as_posix() in snapshot:
+            target.write_bytes(snapshot[rel.as_posix()])
+        else:
+            shutil.copyfile(str(input_file.parent / rel), str(target))
+
+    return workspace / main_rel
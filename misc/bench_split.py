@@ -0,0 +1,452 @@
+# bench_split.py
+# Usage: python bench_split.py -o bench.json
+#        python bench_split.py --sizes 10k,1M,5M --repeat 3 -o after.json --compare before.json
+"""
+Time the split_asm_data.py pipeline stage by stage on the disassembly and on
+synthetic sources of any size, and keep the results as JSON to compare
+commits.
+
+Stages, in the order split_asm_data.py runs them:
+
+  read         SourceBuffer: map the file and index its lines
+  classify     classify_lines: one regex pass over every line (LineIndex)
+  versioned    mark_versioned_regions (only with --versioned)
+  find_blocks  find_data_blocks
+  coalesce     coalesce_small_blocks
+  block_text   block text, first label, file name and incsrc line per block
+  splice       write_spliced_source into a temp directory
+
+Each stage is timed over --repeat runs (the best is kept), then run once
+more under tracemalloc for the peak of the memory it allocates (mmap'd file
+data is not counted). The reference case is the real DonkeyKongDisassembly.asm;
+the synthetic cases are generated from a model learnt from it: the line
+kinds follow the transition frequencies of the real source (a Markov chain
+over the last few kinds, so tables and code come in runs), each
+line is a real line of that kind, and conditionals are emitted as whole
+If Version ... [else] ... endif regions with the real body lengths. So code,
+labels, db/dw tables, conditionals and comments come in the same
+proportions. The result does not assemble (labels repeat); it is only meant
+to be split. Generated sources are cached in --corpus-dir, keyed on the
+size, the seed and the reference's content.
+
+--compare prints every stage's time against an earlier result file and
+exits with status 1 if one got slower than --threshold times (stages under a
+millisecond are ignored as noise).
+"""
+
+import argparse
+import bisect
+import collections
+import hashlib
+import itertools
+import json
+import pathlib
+import platform
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# split_asm_data.py lives in the repository root, one level up
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+import split_asm_data
+
+REFERENCE = ROOT / "DonkeyKongDisassembly.asm"
+CORPUS_DIR = ROOT / ".bench_corpus"
+DEFAULT_SIZES = "10k,100k,1M"
+STAGES = ("read", "classify", "versioned", "find_blocks", "coalesce", "block_text", "splice")
+NOISE_SECONDS = 0.001
+KIND_NAMES = ("blank", "data", "label", "assign", "directive", "conditional", "code", "versioned")
+# Defined first in every synthetic source, so its conditionals resolve on their own
+PRELUDE = ("JP = 0", "US = 1", "Gamecube = 2", "", "Version = US", "")
+
+OPENERS = ("if", "ifdef", "ifndef")
+ORDER = 4  # line kinds of context the generator's Markov chain remembers
+# Lines the model never reuses: includes (of files the corpus does not have)
+# and the openers/closers of macro and rept blocks, which would not balance
+UNSAMPLED_RE = re.compile(
+    r"^\s*(?:[A-Za-z_.][\w.]*:\s*)?\.?(incsrc|include|incbin|bin|macro|endm|rept|endr)\b",
+    re.IGNORECASE,
+)
+
+Model = collections.namedtuple("Model", "transitions samples conditions regions")
+
+
+class BenchError(ValueError):
+    pass
+
+
+def parse_size(text):
+    """Line count from 10000, 10k or 5M."""
+    text = text.strip().lower()
+    scale = {"k": 1000, "m": 1000000}.get(text[-1:], 1)
+    try:
+        return int(float(text[:-1] if scale > 1 else text) * scale)
+    except ValueError:
+        raise BenchError("bad size '{}' (use e.g. 10000, 10k or 5M)".format(text))
+
+
+def learn(lines):
+    """
+    Model of a source (a list of lines): the next-kind frequencies after
+    every run of ORDER line kinds (and after every single kind, for contexts
+    the source never had) as {context: (next kinds, cumulative counts)}, the
+    lines of each kind, the if lines, and (lines in the if branch, lines in
+    the else branch or None) of every top-level conditional region.
+    """
+    conditional = split_asm_data.KIND_CONDITIONAL
+    samples = collections.defaultdict(list)
+    conditions = []
+    regions = []
+    counts = collections.defaultdict(collections.Counter)
+    depth = 0
+    branch = None
+    context = (split_asm_data.KIND_BLANK,) * ORDER
+    for line in lines:
+        kind = split_asm_data.classify_line(line)[0]
+        if kind == conditional:
+            op = line.split()[0].lower()
+            if op in OPENERS:
+                depth += 1
+                if depth == 1:
+                    conditions.append(line.strip())
+                    branch = [0, None]
+            elif op == "endif" and depth:
+                depth -= 1
+                if not depth:
+                    regions.append(tuple(branch))
+            elif op == "else" and depth == 1:
+                branch[1] = 0
+            if not (depth == 1 and op in OPENERS):
+                continue  # regions are generated whole; only where they start is learnt
+        elif UNSAMPLED_RE.match(line):
+            continue
+        else:
+            samples[kind].append(line)
+            if depth:
+                branch[0 if branch[1] is None else 1] += 1
+        counts[context][kind] += 1
+        counts[context[-1:]][kind] += 1
+        context = context[1:] + (kind,)
+    transitions = {
+        context: (list(c), list(itertools.accumulate(c.values())))
+        for context, c in counts.items()
+    }
+    if not regions:
+        conditions = ["If Version = JP"]
+        regions = [(1, 1)]
+    return Model(transitions, dict(samples), conditions, regions)
+
+
+def generate(model, count, seed=0):
+    """Yield count lines of synthetic source drawn from model."""
+    rng = random.Random(seed)
+    blank = split_asm_data.KIND_BLANK
+    conditional = split_asm_data.KIND_CONDITIONAL
+    context = (blank,) * ORDER
+    for line in PRELUDE:
+        yield line
+    emitted = len(PRELUDE)
+
+    def step(context, allow_conditional=True):
+        table = model.transitions.get(context) or model.transitions.get(
+            context[-1:], model.transitions[(blank,)]
+        )
+        choices, cumulative = table
+        while True:
+            kind = choices[bisect.bisect(cumulative, rng.random() * cumulative[-1])]
+            if allow_conditional or kind != conditional or len(choices) == 1:
+                return kind
+
+    while emitted < count:
+        kind = step(context)
+        context = context[1:] + (kind,)
+        if kind != conditional:
+            yield rng.choice(model.samples[kind])
+            emitted += 1
+            continue
+        then, otherwise = rng.choice(model.regions)
+        body = [rng.choice(model.conditions)]
+        for size, head in ((then, None), (otherwise, "else")):
+            if size is None:
+                continue
+            if head:
+                body.append(head)
+            for _ in range(size):
+                kind = step(context, False)
+                if kind == conditional:
+                    kind = blank
+                context = context[1:] + (kind,)
+                body.append(rng.choice(model.samples[kind]))
+        body.append("endif")
+        for line in body:
+            yield line
+        emitted += len(body)
+
+
+def corpus(size, seed, corpus_dir, model, reference_digest):
+    """Path of the synthetic source of size lines, generated if not cached."""
+    corpus_dir = pathlib.Path(corpus_dir)
+    path = corpus_dir / "synthetic_{}_{}_{}.asm".format(size, seed, reference_digest[:12])
+    if not path.exists():
+        corpus_dir.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(".tmp")
+        with open(str(tmp), "w", encoding="utf-8", newline="\n") as f:
+            for line in generate(model, size, seed):
+                f.write(line)
+                f.write("\n")
+        tmp.replace(path)
+    return path
+
+
+class Pipeline:
+    """One run of the split_asm_data.py stages over a source file."""
+
+    def __init__(self, path, min_lines, workdir):
+        self.path = pathlib.Path(path)
+        self.min_lines = min_lines
+        self.workdir = pathlib.Path(workdir)
+        self.data_dir = self.workdir / "src" / "data"
+        self.out = self.workdir / self.path.name
+        self.source = self.index = self.blocks = self.edits = None
+
+    def read(self):
+        self.source = split_asm_data.SourceBuffer(self.path)
+
+    def classify(self):
+        self.index = split_asm_data.classify_lines(self.source)
+
+    def versioned(self):
+        split_asm_data.mark_versioned_regions(self.index, self.path)
+
+    def find_blocks(self):
+        self.blocks = split_asm_data.find_data_blocks(self.index, self.min_lines)
+
+    def coalesce(self):
+        self.blocks = split_asm_data.coalesce_small_blocks(
+            self.index, self.blocks, max_total=40, gap_limit=3
+        )
+
+    def block_text(self):
+        self.edits = []
+        for start, end in self.blocks:
+            text = "\n".join(self.source[start:end]) + "\n"
+            label = split_asm_data.detect_first_label(self.index, start, end)
+            base = split_asm_data.sanitize_name(label or "block_{}".format(start + 1))
+            suffix = split_asm_data.hash_block(text)
+            fname = "{}_{}_{}.asm".format(base, str(start + 1).zfill(5), suffix)
+            relpath = split_asm_data.route_relpath(self.data_dir, fname)
+            inc_line = split_asm_data.generate_include_line(relpath, base_dir=self.out.parent)
+            self.edits.append((start, end, inc_line))
+
+    def splice(self):
+        tmp, _ = split_asm_data.write_spliced_source(self.source, self.edits, self.out)
+        tmp.unlink()
+
+    def close(self):
+        if self.source is not None:
+            self.source.close()
+
+
+def measure(path, stages, min_lines=6, repeat=1, memory=True):
+    """
+    {"lines", "bytes", "blocks", "kinds", "stages": {stage: {"seconds",
+    "peak_bytes"}}} for the pipeline over path. seconds is the best of repeat
+    runs; peak_bytes (None without memory) is from one more run under
+    tracemalloc.
+    """
+    seconds = {stage: float("inf") for stage in stages}
+    peaks = {stage: None for stage in stages}
+    result = {}
+    with tempfile.TemporaryDirectory(prefix="bench_split_") as workdir:
+        for run in range(repeat + (1 if memory else 0)):
+            traced = run == repeat
+            pipeline = Pipeline(path, min_lines, workdir)
+            try:
+                for stage in stages:
+                    if traced:
+                        tracemalloc.start()
+                    started = time.perf_counter()
+                    getattr(pipeline, stage)()
+                    elapsed = time.perf_counter() - started
+                    if traced:
+                        peaks[stage] = tracemalloc.get_traced_memory()[1]
+                        tracemalloc.stop()
+                    else:
+                        seconds[stage] = min(seconds[stage], elapsed)
+                if not result:
+                    counts = collections.Counter(pipeline.index.kinds)
+                    result = {
+                        "lines": len(pipeline.source),
+                        "bytes": pipeline.source.size,
+                        "blocks": len(pipeline.blocks),
+                        "kinds": {
+                            KIND_NAMES[k]: round(n / max(1, len(pipeline.source)), 4)
+                            for k, n in sorted(counts.items())
+                        },
+                    }
+            finally:
+                if tracemalloc.is_tracing():
+                    tracemalloc.stop()
+                pipeline.close()
+    result["stages"] = {
+        stage: {"seconds": round(seconds[stage], 6), "peak_bytes": peaks[stage]}
+        for stage in stages
+    }
+    return result
+
+
+def git_commit():
+    """HEAD of the repository (with "-dirty" for local changes), or None."""
+    try:
+        head = subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=str(ROOT), capture_output=True, text=True
+        )
+        dirty = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"],
+            cwd=str(ROOT),
+            capture_output=True,
+            text=True,
+        )
+    except OSError:
+        return None
+    if head.returncode:
+        return None
+    return head.stdout.strip() + ("-dirty" if dirty.stdout.strip() else "")
+
+
+def compare(old, new, threshold):
+    """Lines comparing two result dicts, and whether any stage regressed."""
+    lines = ["{:<20} {:<12} {:>10} {:>10} {:>7}".format("Case", "Stage", "Old s", "New s", "Ratio")]
+    regressed = False
+    old_cases = {case["name"]: case for case in old.get("cases", [])}
+    for case in new["cases"]:
+        before = old_cases.get(case["name"])
+        if before is None:
+            continue
+        for stage, timing in case["stages"].items():
+            previous = before["stages"].get(stage)
+            if previous is None:
+                continue
+            a, b = previous["seconds"], timing["seconds"]
+            ratio = b / a if a else float("inf")
+            slower = a >= NOISE_SECONDS and ratio > threshold
+            regressed = regressed or slower
+            lines.append(
+                "{:<20} {:<12} {:>10.4f} {:>10.4f} {:>6.2f}x{}".format(
+                    case["name"], stage, a, b, ratio, "  slower" if slower else ""
+                )
+            )
+    return lines, regressed
+
+
+def main():
+    ap = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    ap.add_argument(
+        "--sizes",
+        default=DEFAULT_SIZES,
+        help="Synthetic source sizes in lines, e.g. 10k,100k,1M,5M "
+        "(default {}; empty for the reference only)".format(DEFAULT_SIZES),
+    )
+    ap.add_argument("--seed", type=int, default=0, help="Generator seed (default 0)")
+    ap.add_argument(
+        "--repeat", type=int, default=3, help="Timed runs per case, the best is kept (default 3)"
+    )
+    ap.add_argument("--min-lines", type=int, default=6, help="As for split_asm_data.py")
+    ap.add_argument(
+        "--versioned", action="store_true", help="Include the versioned stage (--versioned-blocks)"
+    )
+    ap.add_argument("--no-memory", action="store_true", help="Skip the tracemalloc run")
+    ap.add_argument(
+        "--corpus-dir",
+        default=str(CORPUS_DIR),
+        help="Where generated sources are cached (default {})".format(CORPUS_DIR),
+    )
+    ap.add_argument("-o", "--output", help="Write the results to this JSON file")
+    ap.add_argument("--compare", help="Earlier results JSON to compare against")
+    ap.add_argument(
+        "--threshold",
+        type=float,
+        default=1.25,
+        help="With --compare, slowdown ratio counted as a regression (default 1.25)",
+    )
+    args = ap.parse_args()
+
+    try:
+        sizes = [parse_size(s) for s in args.sizes.split(",") if s.strip()]
+        old = None
+        if args.compare:
+            with open(args.compare, encoding="utf-8") as f:
+                old = json.load(f)
+        reference = REFERENCE.read_text(encoding="utf-8", errors="ignore").splitlines()
+    except (OSError, ValueError) as e:  # BenchError, JSONDecodeError
+        print("Error: {}".format(e), file=sys.stderr)
+        return 1
+
+    stages = [s for s in STAGES if args.versioned or s != "versioned"]
+    digest = hashlib.sha256("\n".join(reference).encode("utf-8")).hexdigest()
+    model = learn(reference) if sizes else None
+    cases = [("reference", REFERENCE)]
+    for size in sizes:
+        started = time.perf_counter()
+        path = corpus(size, args.seed, args.corpus_dir, model, digest)
+        elapsed = time.perf_counter() - started
+        if elapsed > 1:
+            print("Generated {} ({:.1f}s)".format(path.name, elapsed))
+        cases.append(("synthetic-{}".format(size), path))
+
+    results = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "seed": args.seed,
+        "repeat": args.repeat,
+        "cases": [],
+    }
+    print("{:<20} {:>9}  ".format("Case", "Lines") + "  ".join("{:>11}".format(s) for s in stages))
+    for name, path in cases:
+        try:
+            case = measure(path, stages, args.min_lines, args.repeat, not args.no_memory)
+        except (OSError, ValueError) as e:  # PreprocessError from the versioned stage
+            print("Error: {}: {}".format(name, e), file=sys.stderr)
+            return 1
+        case["name"] = name
+        results["cases"].append(case)
+        timings = case["stages"]
+        print(
+            "{:<20} {:>9}  ".format(name, case["lines"])
+            + "  ".join("{:>10.4f}s".format(timings[s]["seconds"]) for s in stages)
+        )
+        if not args.no_memory:
+            print(
+                "{:<20} {:>9}  ".format("", "peak")
+                + "  ".join("{:>9.1f}MB".format(timings[s]["peak_bytes"] / 1e6) for s in stages)
+            )
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+            f.write("\n")
+        print("Results written to {}".format(args.output))
+    if old is not None:
+        lines, regressed = compare(old, results, args.threshold)
+        print()
+        for line in lines:
+            print(line)
+        if regressed:
+            print("Slower than {:.2f}x the baseline in at least one stage".format(args.threshold))
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,348 @@
+# chr_codec.py
+# Usage: python chr_codec.py decode DKGFX.bin DKGFX.png [--palette 0F,16,27,30]
+#        python chr_codec.py encode DKGFX.png DKGFX.bin
+"""
+Decode NES 2bpp CHR data to pattern table sheets (PNG) and back.
+
+A tile is 16 bytes: 8 bytes of low bitplane, then 8 bytes of high bitplane,
+one byte per row with the leftmost pixel in bit 7 (see GRAPHICS_WORKFLOW.md).
+Decoding unpacks all planes of a bank at once into a (tiles, 8, 8) array of
+colour indices 0-3; encoding packs them back, so decode + encode gives the
+input bytes back unchanged.
+
+Inputs can be raw CHR blobs (DKGFX.bin) or .nes ROMs, whose CHR ROM is
+memory-mapped in place (no per-tile objects or intermediate copies).
+
+Sheets are written as 8-bit indexed PNGs whose pixel values are the colour
+indices, with the chosen palette attached; edit them in any editor that keeps
+indexed colour. RGB images are accepted too if they only use palette colours.
+"""
+
+import argparse
+import pathlib
+import struct
+import sys
+import zlib
+
+import numpy as np  # pip install numpy
+
+from ines import Ines
+
+TILE_BYTES = 16
+SHEET_COLUMNS = 16  # tiles per sheet row: one 4 KB pattern table is 16x16 tiles
+
+# Common NTSC 2C02 master palette (RGB), indexed by NES colour number $00-$3F
+NES_PALETTE = bytes.fromhex(
+    "7C7C7C 0000FC 0000BC 4428BC 940084 A80020 A81000 881400"
+    "503000 007800 006800 005800 004058 000000 000000 000000"
+    "BCBCBC 0078F8 0058F8 6844FC D800CC E40058 F83800 E45C10"
+    "AC7C00 00B800 00A800 00A844 008888 000000 000000 000000"
+    "F8F8F8 3CBCFC 6888FC 9878F8 F878F8 F85898 F87858 FCA044"
+    "F8B800 B8F818 58D854 58F898 00E8D8 787878 000000 000000"
+    "FCFCFC A4E4FC B8B8F8 D8B8F8 F8B8F8 F8A4C0 F0D0B0 FCE0A8"
+    "F8D878 D8F878 B8F8B8 B8F8D8 00FCFC F8D8F8 000000 000000"
+)
+GRAY_PALETTE = (
+    (0x00, 0x00, 0x00),
+    (0x55, 0x55, 0x55),
+    (0xAA, 0xAA, 0xAA),
+    (0xFF, 0xFF, 0xFF),
+)
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+TILE_COUNT_KEY = "chr-tiles"
+
+
+# ---------------------------------------------------------------------------
+# CHR <-> tiles
+# ---------------------------------------------------------------------------
+
+
+def read_chr(path):
+    """
+    Memory-map the CHR data of path: the CHR ROM of an iNES image, or the
+    whole file otherwise. Returns a read-only uint8 array over the file.
+    """
+    path = pathlib.Path(path)
+    with open(path, "rb") as f:
+        is_rom = f.read(4) == b"NES\x1a"
+    offset, size = 0, path.stat().st_size
+    if is_rom:
+        with Ines.from_file(path, strict=False) as rom:
+            offset, size = rom.chr_offset, len(rom.chr_rom)
+        if not size:
+            raise ValueError("{} has no CHR ROM (CHR-RAM cartridge)".format(path))
+    if not size:
+        return np.zeros(0, dtype=np.uint8)
+    return np.memmap(path, dtype=np.uint8, mode="r", offset=offset, shape=(size,))
+
+
+def decode_tiles(data):
+    """
+    Decode CHR bytes (bytes, memoryview, mmap or uint8 array) to a
+    (tiles, 8, 8) uint8 array of colour indices.
+    """
+    raw = data if isinstance(data, np.ndarray) else np.frombuffer(data, dtype=np.uint8)
+    if raw.size % TILE_BYTES:
+        raise ValueError("CHR data size {} is not a multiple of 16".format(raw.size))
+    # (tile, plane, row) bytes -> (tile, plane, row, column) bits, MSB first
+    bits = np.unpackbits(raw.reshape(-1, 2, 8, 1), axis=3)
+    return bits[:, 0] | (bits[:, 1] << 1)
+
+
+def encode_tiles(tiles):
+    """Encode a (tiles, 8, 8) array of colour indices 0-3 to CHR bytes."""
+    tiles = np.asarray(tiles, dtype=np.uint8)
+    if tiles.ndim != 3 or tiles.shape[1:] != (8, 8):
+        raise ValueError("expected a (tiles, 8, 8) array, got {}".format(tiles.shape))
+    if tiles.size and tiles.max() > 3:
+        raise ValueError("colour index {} does not fit in 2bpp".format(tiles.max()))
+    planes = np.stack((tiles & 1, tiles >> 1), axis=1)
+    return np.packbits(planes, axis=3).tobytes()
+
+
+def tiles_to_sheet(tiles, columns=SHEET_COLUMNS):
+    """Lay tiles out left to right, top to bottom; missing tiles are blank (0)."""
+    rows = -(-len(tiles) // columns)
+    padded = np.zeros((rows * columns, 8, 8), dtype=np.uint8)
+    padded[: len(tiles)] = tiles
+    grid = padded.reshape(rows, columns, 8, 8).transpose(0, 2, 1, 3)
+    return grid.reshape(rows * 8, columns * 8)
+
+
+def sheet_to_tiles(sheet, columns=SHEET_COLUMNS, count=None):
+    """Inverse of tiles_to_sheet; count drops blank padding tiles at the end."""
+    height, width = sheet.shape
+    if height % 8 or width != columns * 8:
+        raise ValueError(
+            "sheet is {}x{}, expected {} pixels wide and a multiple of 8 high".format(
+                width, height, columns * 8
+            )
+        )
+    grid = sheet.reshape(height // 8, 8, columns, 8).transpose(0, 2, 1, 3)
+    tiles = grid.reshape(-1, 8, 8)
+    return tiles[:count] if count is not None else tiles
+
+
+def parse_palette(spec):
+    """
+    Parse --palette: "gray", four NES colour numbers ("0F,16,27,30") or four
+    RGB colours ("#000000,#FF0000,..."). Returns a (4, 3) uint8 array.
+    """
+    if not spec or spec.lower() in ("gray", "grey"):
+        return np.array(GRAY_PALETTE, dtype=np.uint8)
+    colors = []
+    for item in spec.split(","):
+        item = item.strip().lstrip("$")
+        if item.startswith("#") and len(item) == 7:
+            colors.append(tuple(bytes.fromhex(item[1:])))
+        elif len(item) <= 2 and int(item, 16) < 64:
+            n = int(item, 16)
+            colors.append(tuple(NES_PALETTE[n * 3 : n * 3 + 3]))
+        else:
+            raise ValueError("bad palette colour '{}'".format(item))
+    if len(colors) != 4:
+        raise ValueError("a palette needs 4 colours, got {}".format(len(colors)))
+    return np.array(colors, dtype=np.uint8)
+
+
+# ---------------------------------------------------------------------------
+# Minimal PNG I/O (indexed, grayscale and RGB(A), no interlacing)
+# ---------------------------------------------------------------------------
+
+
+def _chunk(kind, data):
+    body = kind + data
+    return struct.pack(">I", len(data)) + body + struct.pack(">I", zlib.crc32(body))
+
+
+def write_png(path, pixels, palette, text=None):
+    """Write a 2-D array of palette indices as an 8-bit indexed PNG."""
+    height, width = pixels.shape
+    rows = np.zeros((height, width + 1), dtype=np.uint8)  # filter byte 0 per row
+    rows[:, 1:] = pixels
+    chunks = [
+        _chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 3, 0, 0, 0)),
+        _chunk(b"PLTE", np.asarray(palette, dtype=np.uint8).tobytes()),
+    ]
+    for key, value in (text or {}).items():
+        body = key.encode("latin-1") + b"\0" + value.encode("latin-1")
+        chunks.append(_chunk(b"tEXt", body))
+    chunks.append(_chunk(b"IDAT", zlib.compress(rows.tobytes(), 9)))
+    chunks.append(_chunk(b"IEND", b""))
+    with open(path, "wb") as f:
+        f.write(PNG_SIGNATURE + b"".join(chunks))
+
+
+def _unfilter(raw, height, stride, bpp):
+    rows = np.frombuffer(raw, dtype=np.uint8)
+    if rows.size != height * (stride + 1):
+        raise ValueError("PNG image data has the wrong size")
+    rows = rows.reshape(height, stride + 1)
+    out = np.zeros((height, stride), dtype=np.uint8)
+    prev = np.zeros(stride, dtype=np.uint8)
+    for y in range(height):
+        kind, line = rows[y, 0], rows[y, 1:]
+        if kind == 0:
+            cur = line.copy()
+        elif kind == 1:  # Sub: running sum per byte position within a pixel
+            cur = line.reshape(-1, bpp).cumsum(axis=0, dtype=np.uint8).reshape(-1)
+        elif kind == 2:  # Up
+            cur = line + prev
+        elif kind in (3, 4):  # Average, Paeth: each byte depends on the previous one
+            cur = bytearray(stride)
+            for i in range(stride):
+                left = cur[i - bpp] if i >= bpp else 0
+                up = int(prev[i])
+                if kind == 3:
+                    predictor = (left + up) >> 1
+                else:
+                    upleft = int(prev[i - bpp]) if i >= bpp else 0
+                    p = left + up - upleft
+                    pa, pb, pc = abs(p - left), abs(p - up), abs(p - upleft)
+                    if pa <= pb and pa <= pc:
+                        predictor = left
+                    else:
+                        predictor = up if pb <= pc else upleft
+                cur[i] = (int(line[i]) + predictor) & 0xFF
+            cur = np.frombuffer(bytes(cur), dtype=np.uint8)
+        else:
+            raise ValueError("unknown PNG filter type {}".format(kind))
+        out[y] = prev = cur
+    return out
+
+
+def read_png(path):
+    """
+    Read a non-interlaced PNG. Returns (pixels, palette, text): pixels is a
+    (height, width) array of indices for indexed/grayscale images or a
+    (height, width, channels) array for RGB(A); palette is an (n, 3) array for
+    indexed images, else None; text holds the tEXt chunks.
+    """
+    data = pathlib.Path(path).read_bytes()
+    if not data.startswith(PNG_SIGNATURE):
+        raise ValueError("{} is not a PNG file".format(path))
+    pos = len(PNG_SIGNATURE)
+    header = palette = None
+    idat = []
+    text = {}
+    while pos + 8 <= len(data):
+        length, kind = struct.unpack(">I4s", data[pos : pos + 8])
+        body = data[pos + 8 : pos + 8 + length]
+        pos += 12 + length
+        if kind == b"IHDR":
+            header = struct.unpack(">IIBBBBB", body)
+        elif kind == b"PLTE":
+            palette = np.frombuffer(body, dtype=np.uint8).reshape(-1, 3)
+        elif kind == b"tEXt":
+            key, _, value = body.partition(b"\0")
+            text[key.decode("latin-1")] = value.decode("latin-1")
+        elif kind == b"IDAT":
+            idat.append(body)
+        elif kind == b"IEND":
+            break
+    if header is None:
+        raise ValueError("{} has no IHDR chunk".format(path))
+
+    width, height, depth, color_type, _, _, interlace = header
+    channels = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}.get(color_type)
+    if channels is None or interlace:
+        raise ValueError(
+            "unsupported PNG (colour type {}, interlace {})".format(color_type, interlace)
+        )
+    if depth != 8 and not (channels == 1 and depth in (1, 2, 4)):
+        raise ValueError("unsupported PNG bit depth {}".format(depth))
+
+    stride = (width * channels * depth + 7) // 8
+    bpp = max(1, channels * depth // 8)
+    rows = _unfilter(zlib.decompress(b"".join(idat)), height, stride, bpp)
+    if depth < 8:
+        bits = np.unpackbits(rows, axis=1).reshape(height, -1, depth)
+        weights = 1 << np.arange(depth - 1, -1, -1, dtype=np.uint8)
+        pixels = (bits * weights).sum(axis=2, dtype=np.uint8)[:, :width]
+    elif channels == 1:
+        pixels = rows
+    else:
+        pixels = rows.reshape(height, width, channels)
+    return pixels, (palette if color_type == 3 else None), text
+
+
+def sheet_indices(pixels, palette):
+    """
+    Colour indices of a sheet read with read_png(). Indexed and grayscale
+    images are used as-is (values must be 0-3); RGB(A) colours are looked up
+    in palette (a (4, 3) array).
+    """
+    if pixels.ndim == 2:
+        if pixels.size and pixels.max() > 3:
+            raise ValueError(
+                "sheet uses colour index {}; only 0-3 exist in 2bpp".format(pixels.max())
+            )
+        return pixels
+    rgb = pixels[..., :3]
+    matches = (rgb[..., None, :] == palette[None, None, :, :]).all(axis=3)
+    if not matches.any(axis=2).all():
+        y, x = np.argwhere(~matches.any(axis=2))[0]
+        raise ValueError("pixel ({}, {}) has a colour outside the palette".format(x, y))
+    return matches.argmax(axis=2).astype(np.uint8)
+
+
+# ---------------------------------------------------------------------------
+# Command line
+# ---------------------------------------------------------------------------
+
+
+def main():
+    ap = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    sub = ap.add_subparsers(dest="command", required=True)
+    dec = sub.add_parser("decode", help="CHR blob or .nes ROM -> PNG sheet")
+    dec.add_argument("input")
+    dec.add_argument("output")
+    enc = sub.add_parser("encode", help="PNG sheet -> CHR blob")
+    enc.add_argument("input")
+    enc.add_argument("output")
+    for p in (dec, enc):
+        p.add_argument(
+            "--palette",
+            default="gray",
+            help='"gray" (default), 4 NES colours like 0F,16,27,30 or 4 #RRGGBB colours',
+        )
+        p.add_argument(
+            "--columns",
+            type=int,
+            default=SHEET_COLUMNS,
+            help="Tiles per sheet row (default 16)",
+        )
+    args = ap.parse_args()
+
+    try:
+        palette = parse_palette(args.palette)
+        if args.command == "decode":
+            tiles = decode_tiles(read_chr(args.input))
+            sheet = tiles_to_sheet(tiles, args.columns)
+            write_png(args.output, sheet, palette, {TILE_COUNT_KEY: str(len(tiles))})
+            print(
+                "Wrote {} ({} tiles, {}x{})".format(
+                    args.output, len(tiles), sheet.shape[1], sheet.shape[0]
+                )
+            )
+        else:
+            pixels, _, text = read_png(args.input)
+            count = int(text[TILE_COUNT_KEY]) if TILE_COUNT_KEY in text else None
+            tiles = sheet_to_tiles(sheet_indices(pixels, palette), args.columns, count)
+            data = encode_tiles(tiles)
+            with open(args.output, "wb") as f:
+                f.write(data)
+            print(
+                "Wrote {} ({} tiles, {} bytes)".format(args.output, len(tiles), len(data))
+            )
+    except (OSError, ValueError) as e:
+        print("Error: {}".format(e), file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
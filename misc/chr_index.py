@@ -0,0 +1,329 @@
+# chr_index.py
+# Usage: python chr_index.py DKGFX_JP.bin DKGFX_US.bin DKGFX_GC.bin [--json report.json]
+#        python chr_index.py DKGFX.bin --query DKGFX.bin:1:$3A
+"""
+Find duplicate and flipped tiles in CHR data.
+
+Every tile is reduced to a canonical key: the smallest of its 16 bytes as
+stored, flipped horizontally, vertically and both ways. Flips are done on
+the packed bytes (a vertical flip reverses the row order of each plane, a
+horizontal flip reverses the bits of every byte), so indexing a whole
+library of CHR banks takes a few vectorized passes and one sort, and tiles
+with the same key form an equivalence class that is found with a single
+dict lookup.
+
+Inputs are CHR blobs (e.g. DKGFX.bin from ExtractGFX.py) or .nes ROMs,
+read through chr_codec.read_chr. Tiles are named file:table:$tile, with a
+table being 256 tiles (4 KB).
+
+The report lists the classes with more than one member and the bytes that
+could be freed by keeping one tile per exact duplicate group, or one per
+class when flipped drawing is available (sprites can be flipped through OAM
+attributes; background tiles cannot).
+"""
+
+import argparse
+import json
+import pathlib
+import sys
+
+import numpy as np  # pip install numpy
+
+from chr_codec import TILE_BYTES, read_chr
+
+TABLE_TILES = 256
+CLASS_TILES_SHOWN = 8  # per class in the printed report (--json has them all)
+FLIPS = ("", "h", "v", "hv")  # transform from a tile to its canonical form
+
+# REVERSE_BITS[b] is b with its bit order reversed (a horizontal flip of one row)
+REVERSE_BITS = np.array(
+    [int("{:08b}".format(b)[::-1], 2) for b in range(256)], dtype=np.uint8
+)
+
+
+def tile_forms(raw):
+    """
+    (tiles, 4, 16) array of each tile's bytes as stored, flipped horizontally,
+    vertically and both ways. raw is a uint8 array of CHR bytes.
+    """
+    tiles = raw.reshape(-1, 2, 8)
+    hflip = REVERSE_BITS[tiles]
+    forms = np.stack((tiles, hflip, tiles[:, :, ::-1], hflip[:, :, ::-1]), axis=1)
+    return forms.reshape(-1, 4, TILE_BYTES)
+
+
+def canonical_keys(raw):
+    """
+    Canonical key of every tile as a (tiles, 2) uint64 array (the 16 bytes
+    read as two big-endian words), plus the index into FLIPS that turns the
+    tile into that form.
+    """
+    words = tile_forms(raw).view(">u8").astype(np.uint64)  # (tiles, 4, 2)
+    hi, lo = words[..., 0], words[..., 1]
+    # smallest (hi, lo) of each tile's 4 forms; lexsort's last key is the primary one
+    flip = np.lexsort((lo, hi), axis=-1)[:, 0]
+    rows = np.arange(len(flip))
+    keys = np.stack((hi[rows, flip], lo[rows, flip]), axis=1)
+    return keys, flip.astype(np.uint8)
+
+
+def _group(keys):
+    """
+    Number the distinct rows of a (n, 2) uint64 array in sorted order.
+    Returns (group of each row, row order sorted by group, start of each group
+    in that order plus a final end offset).
+    """
+    order = np.lexsort((keys[:, 1], keys[:, 0]))
+    ordered = keys[order]
+    new = np.ones(len(order), dtype=bool)
+    new[1:] = (ordered[1:] != ordered[:-1]).any(axis=1)
+    group = np.empty(len(order), dtype=np.int64)
+    group[order] = np.cumsum(new) - 1
+    starts = np.append(np.flatnonzero(new), len(order))
+    return group, order, starts
+
+
+def _distinct_per_source(source, group, nsources):
+    """Number of distinct groups among the tiles of each source."""
+    if not len(source):
+        return np.zeros(nsources, dtype=np.int64)
+    pairs = np.unique(source.astype(np.int64) * (int(group.max()) + 1) + group)
+    return np.bincount(pairs // (int(group.max()) + 1), minlength=nsources)
+
+
+class TileIndex:
+    """
+    Tiles of one or more CHR sources grouped into flip-equivalence classes.
+
+    Per tile (in the order the sources were added): source, tile (number
+    within its source), flip (index into FLIPS), key (canonical form) and
+    klass (class number). exact groups tiles with identical bytes.
+    """
+
+    def __init__(self):
+        self.sources = []
+        self._raw = []
+        self._built = False
+
+    def add(self, name, data):
+        """Add CHR bytes (anything np.frombuffer accepts, or a uint8 array)."""
+        if not isinstance(data, np.ndarray):
+            data = np.frombuffer(data, dtype=np.uint8)
+        raw = data
+        if raw.size % TILE_BYTES:
+            raise ValueError("{}: size {} is not a multiple of 16".format(name, raw.size))
+        self.sources.append(name)
+        self._raw.append(raw)
+        self._built = False
+
+    def add_file(self, path):
+        self.add(pathlib.Path(path).name, read_chr(path))
+
+    def build(self):
+        raw = np.concatenate(self._raw) if self._raw else np.zeros(0, dtype=np.uint8)
+        counts = [r.size // TILE_BYTES for r in self._raw]
+        self.source = np.repeat(np.arange(len(counts)), counts)
+        first = np.repeat(np.cumsum([0] + counts[:-1]), counts).astype(np.int64)
+        self.tile = np.arange(len(self.source)) - first
+        self.key, self.flip = canonical_keys(raw)
+        self.klass, self._order, self._starts = _group(self.key)
+        stored = raw.reshape(-1, 2, 8).view(">u8").reshape(-1, 2).astype(np.uint64)
+        self.exact = _group(stored)[0]
+        self._by_key = None
+        self._built = True
+        return self
+
+    def _ensure_built(self):
+        if not self._built:
+            self.build()
+
+    @property
+    def class_count(self):
+        self._ensure_built()
+        return len(self._starts) - 1
+
+    def members(self, klass):
+        """Tile indices of class klass."""
+        self._ensure_built()
+        return self._order[self._starts[klass] : self._starts[klass + 1]]
+
+    def name(self, i):
+        tile = int(self.tile[i])
+        return "{}:{}:${:02X}".format(
+            self.sources[self.source[i]], tile // TABLE_TILES, tile % TABLE_TILES
+        )
+
+    def lookup(self, tile_bytes):
+        """
+        Tiles equivalent to the given 16 bytes, as (tile index, flip) pairs
+        where flip turns the given tile into that one.
+        """
+        self._ensure_built()
+        if self._by_key is None:
+            # first tile of every class, in class order
+            firsts = self.key[self._order[self._starts[:-1]]].astype(">u8").tobytes()
+            self._by_key = {
+                firsts[k * TILE_BYTES : (k + 1) * TILE_BYTES]: k
+                for k in range(self.class_count)
+            }
+        key, flip = canonical_keys(np.frombuffer(bytes(tile_bytes), dtype=np.uint8))
+        klass = self._by_key.get(key.astype(">u8").tobytes())
+        if klass is None:
+            return []
+        result = []
+        for i in self.members(klass):
+            # query -> canonical -> member: flips are their own inverses and commute
+            result.append((int(i), FLIPS[int(flip[0]) ^ int(self.flip[i])]))
+        return result
+
+    def find(self, ref):
+        """Tile index of a file:table:$tile (or file:$tile) reference."""
+        self._ensure_built()
+        name, _, rest = ref.partition(":")
+        parts = rest.split(":")
+        if name not in self.sources or not 1 <= len(parts) <= 2:
+            raise ValueError("unknown tile reference '{}'".format(ref))
+        tile = int(parts[-1].lstrip("$"), 16)
+        if len(parts) == 2:
+            tile += int(parts[0]) * TABLE_TILES
+        source = self.sources.index(name)
+        hits = np.flatnonzero((self.source == source) & (self.tile == tile))
+        if not len(hits):
+            raise ValueError("no tile {}".format(ref))
+        return int(hits[0])
+
+    def tile_bytes(self, i):
+        start = int(self.tile[i]) * TILE_BYTES
+        return self._raw[self.source[i]][start : start + TILE_BYTES]
+
+    def report(self):
+        """
+        Summary per source and overall, plus the classes with several members.
+        The flip of each tile of a class turns the class's first tile into it.
+        """
+        self._ensure_built()
+        nsources = len(self.sources)
+        tiles = np.bincount(self.source, minlength=nsources)
+        exact = _distinct_per_source(self.source, self.exact, nsources)
+        classes = _distinct_per_source(self.source, self.klass, nsources)
+        rows = [
+            (name, tiles[s], exact[s], classes[s]) for s, name in enumerate(self.sources)
+        ]
+        total_exact = int(self.exact.max()) + 1 if len(self.source) else 0
+        rows.append(("(all)", len(self.source), total_exact, self.class_count))
+        summary = [
+            {
+                "source": name,
+                "tiles": int(n),
+                "unique_exact": int(e),
+                "unique_with_flips": int(c),
+                "freed_bytes_exact": int(n - e) * TILE_BYTES,
+                "freed_bytes_with_flips": int(n - c) * TILE_BYTES,
+            }
+            for name, n, e, c in rows
+        ]
+
+        classes = []
+        sizes = np.diff(self._starts)
+        for klass in np.flatnonzero(sizes > 1):
+            members = self.members(klass)
+            # first -> canonical -> member, as in lookup()
+            first = int(self.flip[members[0]])
+            classes.append(
+                {
+                    "tiles": [
+                        {"tile": self.name(i), "flip": FLIPS[first ^ int(self.flip[i])]}
+                        for i in members
+                    ],
+                    "sources": len(np.unique(self.source[members])),
+                    "exact_groups": len(np.unique(self.exact[members])),
+                }
+            )
+        classes.sort(key=lambda c: -len(c["tiles"]))
+        return {"summary": summary, "classes": classes}
+
+
+def print_report(report, limit):
+    print(
+        "{:<24} {:>6} {:>7} {:>10} {:>12} {:>12}".format(
+            "Source", "Tiles", "Exact", "Flip-aware", "Freed exact", "Freed flips"
+        )
+    )
+    for row in report["summary"]:
+        print(
+            "{:<24} {:>6} {:>7} {:>10} {:>12} {:>12}".format(
+                row["source"][:24],
+                row["tiles"],
+                row["unique_exact"],
+                row["unique_with_flips"],
+                row["freed_bytes_exact"],
+                row["freed_bytes_with_flips"],
+            )
+        )
+    classes = report["classes"]
+    print(
+        "\n{} equivalence class(es) with more than one tile "
+        "(flips relative to the first tile listed)".format(len(classes))
+    )
+    for klass in classes[:limit]:
+        shown = klass["tiles"][:CLASS_TILES_SHOWN]
+        tiles = ", ".join(
+            t["tile"] + (" ({})".format(t["flip"]) if t["flip"] else "") for t in shown
+        )
+        if len(klass["tiles"]) > len(shown):
+            tiles += ", ..."
+        print("  {} tiles: {}".format(len(klass["tiles"]), tiles))
+    if len(classes) > limit:
+        print("  ... and {} more (use --limit or --json)".format(len(classes) - limit))
+
+
+def main():
+    ap = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    ap.add_argument("inputs", nargs="+", help="CHR blobs or .nes ROMs")
+    ap.add_argument(
+        "--query",
+        action="append",
+        default=[],
+        help="List the tiles equivalent to file:table:$tile (repeatable)",
+    )
+    ap.add_argument("--json", help="Write the full report as JSON")
+    ap.add_argument("--limit", type=int, default=20, help="Classes to print (default 20)")
+    args = ap.parse_args()
+
+    index = TileIndex()
+    try:
+        for path in args.inputs:
+            index.add_file(path)
+        index.build()
+    except (OSError, ValueError) as e:
+        print("Error: {}".format(e), file=sys.stderr)
+        return 1
+
+    if args.query:
+        for ref in args.query:
+            try:
+                i = index.find(ref)
+            except ValueError as e:
+                print("Error: {}".format(e), file=sys.stderr)
+                return 1
+            print("{} (flips relative to it):".format(ref))
+            for j, flip in index.lookup(index.tile_bytes(i)):
+                if j != i:
+                    suffix = " ({})".format(flip) if flip else ""
+                    print("  {}{}".format(index.name(j), suffix))
+        return 0
+
+    report = index.report()
+    print_report(report, args.limit)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+        print("Report: {}".format(args.json))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
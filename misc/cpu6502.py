@@ -0,0 +1,320 @@
+"""
+Table-driven 6502 CPU core (official opcodes, no decimal mode, as in the
+NES 2A03).
+
+Every opcode of mos6502.DECODE gets a function, generated once at import
+from a template for its addressing mode and one for its operation, so an
+instruction is a single call through the 256-entry OPS table with no
+decoding at run time:
+
+    cpu = CPU(memory)          # memory: bytearray of (at least) $10000 bytes
+    cpu.reset()                # PC from the reset vector
+    cpu.run(29781)             # execute at least that many cycles
+
+Memory is a flat bytearray. Zero page, the stack and the instruction stream
+are read from it directly; other accesses below $0800 or at $8000 and above
+do the same, and everything in between goes through cpu.read(address) and
+cpu.write(address, value), which a subclass overrides to map RAM mirrors and
+I/O registers (see nes_machine.py). Writes at $8000 and above go through
+cpu.write as well, so ROM stays read-only if the subclass ignores them.
+
+Cycle counts follow mos6502.CYCLES, including the extra cycles of taken
+branches and of indexed reads that cross a page; cpu.cycles is the running
+total (handlers may add to it, e.g. for DMA). Undefined opcodes raise
+CPUError.
+
+Flags are kept apart: c and i and d are 0/1, v is truthy, and N and Z are
+taken from the last result (n holds a value whose bit 7 is N, z a value that
+is 0 when Z is set). cpu.p packs them into the status byte.
+"""
+
+from mos6502 import CYCLES, DECODE, PAGE_CROSS
+
+NMI_VECTOR = 0xFFFA
+RESET_VECTOR = 0xFFFC
+IRQ_VECTOR = 0xFFFE
+INTERRUPT_CYCLES = 7
+MEMORY_SIZE = 0x10000
+RAM_END = 0x0800  # accesses below are plain memory
+ROM_START = 0x8000  # reads from here on are plain memory
+
+
+class CPUError(RuntimeError):
+    pass
+
+
+# code that leaves the effective address in addr (pc is the opcode's address)
+_ADDRESS = {
+    "zp": "addr = mem[pc + 1]",
+    "zpx": "addr = (mem[pc + 1] + cpu.x) & 0xFF",
+    "zpy": "addr = (mem[pc + 1] + cpu.y) & 0xFF",
+    "abs": "addr = mem[pc + 1] | mem[pc + 2] << 8",
+    "absx": "base = mem[pc + 1] | mem[pc + 2] << 8\naddr = (base + cpu.x) & 0xFFFF",
+    "absy": "base = mem[pc + 1] | mem[pc + 2] << 8\naddr = (base + cpu.y) & 0xFFFF",
+    "indx": "z = (mem[pc + 1] + cpu.x) & 0xFF\naddr = mem[z] | mem[(z + 1) & 0xFF] << 8",
+    "indy": (
+        "z = mem[pc + 1]\nbase = mem[z] | mem[(z + 1) & 0xFF] << 8\n"
+        "addr = (base + cpu.y) & 0xFFFF"
+    ),
+}
+_ZERO_PAGE = ("zp", "zpx", "zpy")
+_PLAIN = "addr < {} or addr >= {}".format(RAM_END, ROM_START)
+_READ = "v = mem[addr] if " + _PLAIN + " else cpu.read(addr)"
+_WRITE = "if addr < {}:\n    mem[addr] = v\nelse:\n    cpu.write(addr, v)".format(RAM_END)
+
+_NZ = "cpu.n = cpu.z = "
+_LOADS = {
+    "lda": "cpu.a = " + _NZ + "v",
+    "ldx": "cpu.x = " + _NZ + "v",
+    "ldy": "cpu.y = " + _NZ + "v",
+}
+_ADD = (
+    "a = cpu.a\nr = a + v + cpu.c\ncpu.c = r >> 8\nr &= 0xFF\n"
+    "cpu.v = ~(a ^ v) & (a ^ r) & 0x80\ncpu.a = " + _NZ + "r"
+)
+_READ_OPS = dict(
+    _LOADS,
+    adc=_ADD,
+    sbc="v ^= 0xFF\n" + _ADD,
+    ora="cpu.a = " + _NZ + "cpu.a | v",
+    eor="cpu.a = " + _NZ + "cpu.a ^ v",
+    bit="cpu.z = cpu.a & v\ncpu.n = v\ncpu.v = v & 0x40",
+    **{
+        "and": "cpu.a = " + _NZ + "cpu.a & v",
+        "cmp": "r = cpu.a - v\ncpu.c = int(r >= 0)\n" + _NZ + "r & 0xFF",
+        "cpx": "r = cpu.x - v\ncpu.c = int(r >= 0)\n" + _NZ + "r & 0xFF",
+        "cpy": "r = cpu.y - v\ncpu.c = int(r >= 0)\n" + _NZ + "r & 0xFF",
+    }
+)
+_STORE_OPS = {"sta": "v = cpu.a", "stx": "v = cpu.x", "sty": "v = cpu.y"}
+_RMW_OPS = {
+    "asl": "cpu.c = v >> 7\nv = v << 1 & 0xFF",
+    "lsr": "cpu.c = v & 1\nv >>= 1",
+    "rol": "v = v << 1 | cpu.c\ncpu.c = v >> 8\nv &= 0xFF",
+    "ror": "c = v & 1\nv = v >> 1 | cpu.c << 7\ncpu.c = c",
+    "inc": "v = (v + 1) & 0xFF",
+    "dec": "v = (v - 1) & 0xFF",
+}
+_BRANCHES = {
+    "bpl": "not cpu.n & 0x80",
+    "bmi": "cpu.n & 0x80",
+    "bvc": "not cpu.v",
+    "bvs": "cpu.v",
+    "bcc": "not cpu.c",
+    "bcs": "cpu.c",
+    "bne": "cpu.z",
+    "beq": "not cpu.z",
+}
+_PUSH = "mem[0x100 | cpu.s] = {}\ncpu.s = (cpu.s - 1) & 0xFF"
+_PULL = "cpu.s = (cpu.s + 1) & 0xFF\n{} = mem[0x100 | cpu.s]"
+_IMPLIED = {
+    "nop": "",
+    "clc": "cpu.c = 0",
+    "sec": "cpu.c = 1",
+    "cli": "cpu.i = 0",
+    "sei": "cpu.i = 1",
+    "cld": "cpu.d = 0",
+    "sed": "cpu.d = 1",
+    "clv": "cpu.v = 0",
+    "tax": "cpu.x = " + _NZ + "cpu.a",
+    "tay": "cpu.y = " + _NZ + "cpu.a",
+    "txa": "cpu.a = " + _NZ + "cpu.x",
+    "tya": "cpu.a = " + _NZ + "cpu.y",
+    "tsx": "cpu.x = " + _NZ + "cpu.s",
+    "txs": "cpu.s = cpu.x",
+    "inx": "cpu.x = " + _NZ + "(cpu.x + 1) & 0xFF",
+    "iny": "cpu.y = " + _NZ + "(cpu.y + 1) & 0xFF",
+    "dex": "cpu.x = " + _NZ + "(cpu.x - 1) & 0xFF",
+    "dey": "cpu.y = " + _NZ + "(cpu.y - 1) & 0xFF",
+    "pha": _PUSH.format("cpu.a"),
+    "php": _PUSH.format("cpu.p | 0x10"),
+    "pla": _PULL.format("cpu.a") + "\n" + _NZ + "cpu.a",
+    "plp": _PULL.format("cpu.p"),
+}
+
+
+def _body(opcode):
+    """Statements of the function for one opcode (returning its cycles)."""
+    mnemonic, mode = DECODE[opcode]
+    cycles = CYCLES[opcode]
+    if mnemonic in _BRANCHES:
+        return [
+            "if {}:".format(_BRANCHES[mnemonic]),
+            "    d = mem[pc + 1]",
+            "    target = (pc + 2 + d - (d >> 7 << 8)) & 0xFFFF",
+            "    cpu.pc = target",
+            "    return {} + (((pc + 2) ^ target) > 0xFF)".format(cycles + 1),
+            "cpu.pc = pc + 2",
+            "return {}".format(cycles),
+        ]
+    if mnemonic == "jmp":
+        if mode == "abs":
+            return ["cpu.pc = mem[pc + 1] | mem[pc + 2] << 8", "return 3"]
+        return [  # the pointer's high byte is read from the same page
+            "p = mem[pc + 1] | mem[pc + 2] << 8",
+            "cpu.pc = cpu.read(p) | cpu.read((p & 0xFF00) | ((p + 1) & 0xFF)) << 8",
+            "return {}".format(cycles),
+        ]
+    if mnemonic == "jsr":
+        return [
+            "r = pc + 2",
+            _PUSH.format("r >> 8"),
+            _PUSH.format("r & 0xFF"),
+            "cpu.pc = mem[pc + 1] | mem[pc + 2] << 8",
+            "return {}".format(cycles),
+        ]
+    if mnemonic == "rts":
+        return [
+            _PULL.format("lo"),
+            _PULL.format("hi"),
+            "cpu.pc = (lo | hi << 8) + 1 & 0xFFFF",
+            "return 6",
+        ]
+    if mnemonic == "rti":
+        return [
+            _PULL.format("cpu.p"),
+            _PULL.format("lo"),
+            _PULL.format("hi"),
+            "cpu.pc = lo | hi << 8",
+            "return 6",
+        ]
+    if mnemonic == "brk":
+        return ["cpu.pc = pc + 2", "cpu.interrupt({}, 0x10)".format(IRQ_VECTOR), "return 7"]
+    if mode == "imp":
+        return [_IMPLIED[mnemonic], "cpu.pc = pc + 1", "return {}".format(cycles)]
+    if mode == "acc":
+        return [
+            "v = cpu.a",
+            _RMW_OPS[mnemonic],
+            "cpu.a = " + _NZ + "v",
+            "cpu.pc = pc + 1",
+            "return {}".format(cycles),
+        ]
+
+    size = 2 if mode in _ZERO_PAGE + ("imm", "indx", "indy") else 3
+    lines = []
+    if mode == "imm":
+        lines.append("v = mem[pc + 1]")
+    else:
+        lines.append(_ADDRESS[mode])
+    read = "v = mem[addr]" if mode in _ZERO_PAGE else _READ
+    write = "mem[addr] = v" if mode in _ZERO_PAGE else _WRITE
+    if mnemonic in _READ_OPS:
+        if mode != "imm":
+            lines.append(read)
+        lines.append(_READ_OPS[mnemonic])
+    elif mnemonic in _STORE_OPS:
+        lines += [_STORE_OPS[mnemonic], write]
+    else:
+        lines += [read, _RMW_OPS[mnemonic], _NZ + "v", write]
+    lines.append("cpu.pc = pc + {}".format(size))
+    if opcode in PAGE_CROSS:
+        lines.append("return {} + ((base ^ addr) > 0xFF)".format(cycles))
+    else:
+        lines.append("return {}".format(cycles))
+    return lines
+
+
+def _build():
+    source = []
+    for opcode in sorted(DECODE):
+        source.append("def op_{:02X}(cpu, mem, pc):".format(opcode))
+        for statement in _body(opcode):
+            source += ["    " + line for line in statement.splitlines()]
+    namespace = {}
+    exec(compile("\n".join(source), "<cpu6502 ops>", "exec"), namespace)
+
+    def undefined(cpu, mem, pc):
+        raise CPUError("undefined opcode ${:02X} at ${:04X}".format(mem[pc], pc))
+
+    return tuple(namespace.get("op_{:02X}".format(op), undefined) for op in range(256))
+
+
+# OPS[opcode](cpu, memory, pc) executes one instruction and returns its cycles
+OPS = _build()
+
+
+class CPU:
+    __slots__ = (
+        "mem", "a", "x", "y", "s", "pc", "c", "z", "i", "d", "v", "n", "cycles", "stop"
+    )  # fmt: skip
+
+    def __init__(self, memory):
+        if len(memory) < MEMORY_SIZE:
+            raise ValueError("memory must cover $0000-$FFFF")
+        # two spare bytes: operands fetched at $FFFF must not run off the end
+        memory.extend(bytes(MEMORY_SIZE + 2 - len(memory)))
+        self.mem = memory
+        self.a = self.x = self.y = self.s = 0
+        self.pc = 0
+        self.c = self.v = self.n = self.d = 0
+        self.z = self.i = 1  # Z clear
+        self.cycles = self.stop = 0
+
+    @property
+    def p(self):
+        return (
+            (self.n & 0x80)
+            | (0x40 if self.v else 0)
+            | 0x20
+            | self.d << 3
+            | self.i << 2
+            | (0 if self.z else 0x02)
+            | self.c
+        )
+
+    @p.setter
+    def p(self, value):
+        self.n = value & 0x80
+        self.v = value & 0x40
+        self.d = value >> 3 & 1
+        self.i = value >> 2 & 1
+        self.z = 0 if value & 0x02 else 1
+        self.c = value & 1
+
+    def read(self, address):
+        return self.mem[address]
+
+    def write(self, address, value):
+        if address < ROM_START:
+            self.mem[address] = value
+
+    def vector(self, address):
+        return self.read(address) | self.read(address + 1) << 8
+
+    def reset(self):
+        self.s = (self.s - 3) & 0xFF
+        self.i = 1
+        self.pc = self.vector(RESET_VECTOR)
+        self.cycles += INTERRUPT_CYCLES
+
+    def interrupt(self, vector, brk=0):
+        """Push PC and the status byte (B flag from brk) and jump through vector."""
+        mem = self.mem
+        for value in (self.pc >> 8, self.pc & 0xFF, self.p | brk):
+            mem[0x100 | self.s] = value
+            self.s = (self.s - 1) & 0xFF
+        self.i = 1
+        self.pc = self.vector(vector)
+
+    def nmi(self):
+        self.interrupt(NMI_VECTOR)
+        self.cycles += INTERRUPT_CYCLES
+
+    def step(self):
+        """Execute one instruction; returns its cycles."""
+        cycles = OPS[self.mem[self.pc]](self, self.mem, self.pc)
+        self.cycles += cycles
+        return cycles
+
+    def run(self, cycles):
+        """
+        Execute instructions until at least cycles more cycles have passed, or
+        until a read or write handler sets cpu.stop to 0.
+        """
+        ops = OPS
+        mem = self.mem
+        self.stop = self.cycles + cycles
+        while self.cycles < self.stop:
+            pc = self.pc
+            self.cycles += ops[mem[pc]](self, mem, pc)
@@ -0,0 +1,920 @@
+# cycle_estimate.py
+# Usage: python cycle_estimate.py ../DonkeyKongDisassembly.asm --version us
+#        python cycle_estimate.py ../DonkeyKongDisassembly.asm --routine UpdateScreen_F228 --tree
+#        python cycle_estimate.py DonkeyKong.nes --bound '$F211=32'
+"""
+Estimate worst-case and typical CPU cycles of routines without running them.
+
+Starting from NMI_C85F (the NMI vector) or the routines given with
+--routine, the code is disassembled by following its control flow. Every
+JSR target is a routine; a JMP to one is a tail call. Each routine becomes a
+control-flow graph of basic blocks costed with the cycle counts in
+mos6502.py; a branch whose block fixes the flag it tests (LDA #$00 : BEQ,
+CLC : BCC ...) is followed one way only. Constants are carried through
+registers and zero page/absolute stores and loads, from every path leading
+to the branch within the routine and up to the last call, so a CMP #n or
+LDA var : BNE on a value set by an immediate load is resolved too (the draw
+mode CODE_F082 passes on into SpriteDrawingEngine_F096). The worst case
+pays one cycle for every indexed read that could cross a page (absolute,X/Y
+unless the base address is page aligned, and (indirect),Y) and every branch
+is weighed with its taken cost, one cycle more when it lands on another
+page. A call costs its JSR plus the callee.
+
+Loops are found as natural loops and collapsed innermost first, costing
+(bound - 1) iterations plus the path that leaves the loop. The bound is
+worked out for counter loops: X, Y or a RAM variable set to a constant
+before the loop, stepped in the block that branches back (INX, DEC var,
+LDA var : CLC : ADC #n : STA var ...) and tested there, directly or with
+CPX/CPY/CMP #m, with nothing else in the loop writing it (called routines
+are assumed to leave it alone). Other loops are listed as of unknown bound
+and go around once in the worst and typical cases; --bound sets the bound of
+the loop at a label or address. The worst case is the longest path, the typical
+case the average over both ways of every branch with no page crossings.
+
+Routines are listed with both counts and the worst case as a share of the
+vblank budget (2273 cycles, --budget). The Guessed column is the worst case
+with each loop of unknown bound run --loop-bound times instead, but never
+one inside another (a loop of unknown bound in the body of another, or in a
+routine called from it, then runs once), so the guesses do not multiply; it
+is left blank where it equals the worst case. --tree prints the call tree
+below each root with the worst chain marked. Disassembly is cheap, the
+per-routine analysis is cached in a file next to the input
+(.cycle_cache.json, or --cache), keyed by a hash of the routine's addresses
+and bytes, so after an edit only the routines that changed are analysed
+again.
+"""
+
+import argparse
+import collections
+import hashlib
+import json
+import pathlib
+import sys
+
+from mos6502 import CYCLES, DECODE, MODE_SIZES, PAGE_CROSS
+from nes_machine import VBLANK_CYCLES, Machine, parse_version
+
+CACHE_NAME = ".cycle_cache.json"
+ANALYSIS_VERSION = 2  # bump when cached summaries would change
+DEFAULT_LOOP_BOUND = 16
+NMI_VECTOR = 0xFFFA
+JSR_CYCLES = 6
+
+_X_WRITES = frozenset(("ldx", "tax", "tsx", "inx", "dex"))
+_Y_WRITES = frozenset(("ldy", "tay", "iny", "dey"))
+_A_WRITES = frozenset(("lda", "txa", "tya", "pla", "adc", "sbc", "and", "ora", "eor"))
+_MEMORY_WRITES = frozenset(("sta", "stx", "sty", "inc", "dec", "asl", "lsr", "rol", "ror"))
+_STORED = {"sta": "a", "stx": "x", "sty": "y"}
+_LOADS = frozenset(("lda", "ldx", "ldy"))
+_TRANSFERS = {"tax": "a", "tay": "a", "txa": "x", "tya": "y"}  # -> register copied
+_STEPS = {"inx": 1, "dex": -1, "iny": 1, "dey": -1, "inc": 1, "dec": -1}
+_COMPARES = {"cpx": "x", "cpy": "y"}
+_REGISTER_COMPARES = {"cmp": "a", "cpx": "x", "cpy": "y"}
+
+# branch -> (flag it tests, value it is taken on)
+_BRANCH_FLAGS = {
+    "bcc": ("c", 0),
+    "bcs": ("c", 1),
+    "bne": ("z", 0),
+    "beq": ("z", 1),
+    "bpl": ("n", 0),
+    "bmi": ("n", 1),
+    "bvc": ("v", 0),
+    "bvs": ("v", 1),
+}
+_INVERTED = {"bcc": "bcs", "bcs": "bcc", "bne": "beq", "beq": "bne", "bpl": "bmi", "bmi": "bpl"}
+# instructions that leave a flag alone (among those that can precede a branch)
+_KEEPS = {
+    "nz": frozenset(("sta", "stx", "sty", "pha", "php", "clc", "sec", "cli", "sei", "cld", "sed",
+                     "clv", "nop", "txs")),
+    "c": frozenset(("sta", "stx", "sty", "pha", "php", "cli", "sei", "cld", "sed", "clv", "nop",
+                    "lda", "ldx", "ldy", "tax", "tay", "txa", "tya", "tsx", "txs", "inx", "iny",
+                    "dex", "dey", "inc", "dec", "and", "ora", "eor", "bit")),
+}  # fmt: skip
+
+Instruction = collections.namedtuple("Instruction", "address opcode mnemonic mode operand size")
+
+
+class CycleError(ValueError):
+    pass
+
+
+def decode(mem, address):
+    """The Instruction at address (CPU memory)."""
+    opcode = mem[address]
+    if opcode not in DECODE:
+        raise CycleError("undefined opcode ${:02X} at ${:04X}".format(opcode, address))
+    mnemonic, mode = DECODE[opcode]
+    size = MODE_SIZES[mode]
+    operand = None
+    if mode == "rel":
+        offset = mem[address + 1]
+        operand = (address + 2 + offset - (0x100 if offset & 0x80 else 0)) & 0xFFFF
+    elif size == 2:
+        operand = mem[address + 1]
+    elif size == 3:
+        operand = mem[address + 1] | mem[address + 2] << 8
+    return Instruction(address, opcode, mnemonic, mode, operand, size)
+
+
+def instruction_cycles(ins):
+    """(worst, typical) cycles of an instruction, branches not taken."""
+    worst = CYCLES[ins.opcode]
+    if ins.opcode in PAGE_CROSS and (ins.mode == "indy" or ins.operand & 0xFF):
+        return worst + 1, worst
+    return worst, worst
+
+
+def branch_penalty(ins):
+    """Extra cycles of a taken branch."""
+    return 1 + ((ins.address + 2) >> 8 != ins.operand >> 8)
+
+
+# -- disassembly -----------------------------------------------------------------
+
+
+def _targets(ins):
+    """(control flow successors, called routine or None) of an instruction."""
+    if ins.mnemonic == "jsr":
+        return [ins.address + ins.size], ins.operand
+    if ins.mnemonic in ("rts", "rti", "brk") or ins.mode == "ind":
+        return [], None
+    if ins.mnemonic == "jmp":
+        return [ins.operand], None
+    if ins.mode == "rel":
+        return [ins.address + 2, ins.operand], None
+    return [ins.address + ins.size], None
+
+
+def writes(ins):
+    """The register ("a", "x", "y") or absolute/zero page address ins writes, or None."""
+    if ins.mnemonic in _A_WRITES or ins.mode == "acc":
+        return "a"
+    if ins.mnemonic in _X_WRITES:
+        return "x"
+    if ins.mnemonic in _Y_WRITES:
+        return "y"
+    if ins.mnemonic in _MEMORY_WRITES and ins.mode in ("zp", "abs"):
+        return ins.operand
+    return None
+
+
+def _flags_from(blocks, preds, start, i):
+    """
+    (result, carry) that instruction i of block start sets N and Z from (and C
+    for a compare, else None), if a load, transfer or compare against an
+    immediate whose value is a known constant; else None.
+    """
+    ins = blocks[start][i]
+    compare = _REGISTER_COMPARES.get(ins.mnemonic)
+    if compare and ins.mode == "imm":
+        value = _value(blocks, preds, start, i, compare, through_calls=False)
+        if value is None:
+            return None
+        return (value - ins.operand) & 0xFF, int(value >= ins.operand)
+    if ins.mnemonic in _LOADS and ins.mode == "imm":
+        return ins.operand, None
+    if ins.mnemonic in _LOADS and ins.mode in ("zp", "abs"):
+        where = ins.operand
+    elif ins.mnemonic in _TRANSFERS:
+        where = _TRANSFERS[ins.mnemonic]
+    else:
+        return None
+    value = _value(blocks, preds, start, i, where, through_calls=False)
+    return None if value is None else (value, None)
+
+
+def constant_branch(blocks, preds, start):
+    """The outcome (True: taken) of the final branch of block start if the
+    flag it tests is fixed (LDA #$00 : BEQ, CLC : BCC, a CMP #n of a value set
+    to a constant on every path to it ...), else None."""
+    instructions = blocks[start]
+    flag, taken_on = _BRANCH_FLAGS[instructions[-1].mnemonic]
+    for i in range(len(instructions) - 2, -1, -1):
+        ins = instructions[i]
+        if flag in "nz":
+            if ins.mnemonic in _LOADS or ins.mnemonic in _TRANSFERS or (
+                ins.mnemonic in _REGISTER_COMPARES and ins.mode == "imm"
+            ):
+                flags = _flags_from(blocks, preds, start, i)
+                if flags is None:
+                    return None
+                value = flags[0] == 0 if flag == "z" else flags[0] >> 7
+                return value == taken_on
+            if ins.mnemonic == "ora" and ins.mode == "imm":
+                if ins.operand & (0x80 if flag == "n" else 0xFF):
+                    return taken_on == (flag == "n")  # sets N, clears Z
+                return None
+            if ins.mnemonic not in _KEEPS["nz"]:
+                return None
+        elif flag == "c":
+            if ins.mnemonic in ("clc", "sec"):
+                return (ins.mnemonic == "sec") == taken_on
+            if ins.mnemonic in _REGISTER_COMPARES and ins.mode == "imm":
+                flags = _flags_from(blocks, preds, start, i)
+                return None if flags is None else flags[1] == taken_on
+            if ins.mnemonic not in _KEEPS["c"]:
+                return None
+        else:
+            if ins.mnemonic == "clv":
+                return taken_on == 0
+            if ins.mnemonic in ("adc", "sbc", "bit", "plp", "rti", "jsr"):
+                return None
+    return None
+
+
+def find_entries(mem, roots):
+    """Every routine entry reachable from roots: the roots and all JSR targets."""
+    entries, seen = set(roots), set()
+    todo = list(roots)
+    while todo:
+        address = todo.pop()
+        if address in seen or address < 0x8000:
+            continue
+        seen.add(address)
+        try:
+            ins = decode(mem, address)
+        except CycleError:
+            continue
+        following, callee = _targets(ins)
+        if callee is not None:
+            entries.add(callee)
+            todo.append(callee)
+        todo.extend(following)
+    return entries
+
+
+def build_routine(mem, entry, entries):
+    """
+    Disassemble the routine at entry into basic blocks.
+
+    Returns (blocks, succs, notes): blocks maps a block's first address to its
+    Instructions, succs to [(successor, extra cycles of going there)] within
+    the routine (branches whose outcome the block fixes have one successor),
+    and notes lists what could not be followed.
+    """
+    forced = {}  # branch address -> only successor
+    while True:
+        code, leaders, notes = {}, {entry}, []
+        todo = [entry]
+        while todo:
+            address = todo.pop()
+            if address in code:
+                continue
+            try:
+                ins = decode(mem, address)
+            except CycleError as e:
+                notes.append(str(e))
+                continue
+            code[address] = ins
+            following, _ = _targets(ins)
+            if ins.mode == "ind":
+                notes.append("indirect jump at ${:04X}".format(address))
+            if ins.mnemonic == "jmp" and ins.mode == "abs" and ins.operand in entries:
+                if ins.operand != entry:
+                    continue  # tail call
+            if address in forced:
+                following = [forced[address]]
+            if ins.mode == "rel" or ins.mnemonic == "jmp":
+                leaders.update(following)
+            todo.extend(following)
+
+        blocks, start, end = {}, None, None
+        for address in sorted(code):
+            ins = code[address]
+            if address in leaders or start is None or address != end:
+                start = address
+                blocks[start] = []
+            blocks[start].append(ins)
+            end = address + ins.size
+            if ins.mode == "rel" or ins.mnemonic in ("jmp", "rts", "rti", "brk"):
+                start = None
+
+        succs = _successors(blocks, forced, entry, entries)
+        preds = _predecessors(succs)
+        found = False
+        for start, instructions in blocks.items():
+            last = instructions[-1]
+            if last.mode == "rel" and last.address not in forced:
+                taken = constant_branch(blocks, preds, start)
+                if taken is not None:
+                    forced[last.address] = last.operand if taken else last.address + 2
+                    found = True
+        if not found:
+            return blocks, succs, notes
+
+
+def _successors(blocks, forced, entry, entries):
+    """{block: [(successor, extra cycles of going there)]} within the routine."""
+    succs = {}
+    for start, instructions in blocks.items():
+        last = instructions[-1]
+        end = last.address + last.size
+        succs[start] = []
+        if last.mnemonic == "jmp" and last.mode == "abs":
+            if last.operand not in entries or last.operand == entry:
+                succs[start].append((last.operand, 0))
+        elif last.mode == "rel":
+            if forced.get(last.address, end) == end:
+                succs[start].append((end, 0))
+            if forced.get(last.address, last.operand) == last.operand:
+                succs[start].append((last.operand, branch_penalty(last)))
+        elif last.mnemonic not in ("rts", "rti", "brk") and end in blocks:
+            succs[start].append((end, 0))
+    return succs
+
+
+def _predecessors(succs):
+    """{block: [blocks leading to it]}, in address order."""
+    preds = collections.defaultdict(list)
+    for start in sorted(succs):
+        for target, _ in succs[start]:
+            preds[target].append(start)
+    return preds
+
+
+def summarize(blocks, succs, entry, entries):
+    """
+    The cacheable analysis of a routine: per block its own (worst, typical)
+    cycles, the routines it calls and its successors with the extra cycles
+    of getting there, plus the loops with their detected bounds.
+    """
+    summary = {"blocks": {}, "loops": []}
+    for start, instructions in blocks.items():
+        worst = typical = 0
+        calls = []
+        for ins in instructions:
+            w, t = instruction_cycles(ins)
+            worst += w
+            typical += t
+            if ins.mnemonic == "jsr":
+                calls.append(ins.operand)
+        last = instructions[-1]
+        if last.mnemonic == "jmp" and last.mode == "abs":
+            if last.operand in entries and last.operand != entry:
+                calls.append(last.operand)
+        summary["blocks"][start] = (worst, typical, calls, succs[start])
+    preds = _predecessors(succs)
+    for header, body, latches in find_loops(succs, entry):
+        bound, how = loop_bound(blocks, preds, header, body, latches)
+        summary["loops"].append((header, sorted(body), bound, how))
+    return summary
+
+
+def find_loops(succs, entry):
+    """[(header, body, latches)] of the natural loops, innermost first."""
+    preds = collections.defaultdict(set)
+    for start, following in succs.items():
+        for target, _ in following:
+            preds[target].add(start)
+    back = collections.defaultdict(set)  # header -> latches
+    state = {entry: 1}  # 1 on the DFS stack, 2 done
+    stack = [(entry, iter(succs[entry]))]
+    while stack:
+        node, following = stack[-1]
+        for target, _ in following:
+            if state.get(target) == 1:
+                back[target].add(node)
+            elif target not in state and target in succs:
+                state[target] = 1
+                stack.append((target, iter(succs[target])))
+                break
+        else:
+            state[node] = 2
+            stack.pop()
+    loops = []
+    for header, latches in back.items():
+        body, todo = {header}, list(latches)
+        while todo:
+            node = todo.pop()
+            if node not in body:
+                body.add(node)
+                todo.extend(preds[node])
+        loops.append((header, body, latches))
+    return sorted(loops, key=lambda loop: len(loop[1]))
+
+
+def _value(blocks, preds, start, index, where, through_calls=True, depth=8, seen=None):
+    """
+    Constant held by a register or address before instruction index of block
+    start, the same on every path leading there (up to depth blocks back), or
+    None. Calls are assumed to leave it alone unless through_calls is False.
+    """
+    seen = set() if seen is None else seen
+    instructions = blocks[start]
+    for i in range(index - 1, -1, -1):
+        ins = instructions[i]
+        if ins.mnemonic == "jsr" and not through_calls:
+            return None
+        if writes(ins) != where:
+            continue
+        if ins.mnemonic in _LOADS and ins.mode == "imm":
+            return ins.operand
+        if ins.mnemonic in _LOADS and ins.mode in ("zp", "abs"):
+            source = ins.operand
+        else:
+            source = _STORED.get(ins.mnemonic) or _TRANSFERS.get(ins.mnemonic)
+        if source is None:
+            return None
+        return _value(blocks, preds, start, i, source, through_calls, depth, seen)
+    if index == len(instructions):
+        seen.add(start)  # whole block read: a path around back to it adds nothing
+    if depth == 0 or not preds[start]:
+        return None
+    values = set()
+    for pred in preds[start]:
+        if pred not in seen:
+            values.add(
+                _value(
+                    blocks, preds, pred, len(blocks[pred]), where, through_calls, depth - 1, seen
+                )
+            )
+        if None in values or len(values) > 1:
+            return None
+    return values.pop() if values else None
+
+
+def _step(instructions, i, where):
+    """Amount the instruction at i adds to where (a counter), or None."""
+    ins = instructions[i]
+    if ins.mnemonic in _STEPS:
+        return _STEPS[ins.mnemonic]
+    if ins.mnemonic == "sta" and i >= 3:
+        before = instructions[i - 3 : i]
+        names = [b.mnemonic for b in before]
+        load = [b for b in before if b.mnemonic == "lda"]
+        add = before[-1]
+        if load and load[0].operand == where and load[0].mode == ins.mode and add.mode == "imm":
+            if add.mnemonic == "adc" and "clc" in names:
+                return add.operand
+            if add.mnemonic == "sbc" and "sec" in names:
+                return -add.operand
+    return None
+
+
+def loop_bound(blocks, preds, header, body, latches):
+    """(header executions, description) of a counter loop, or (None, reason)."""
+    if len(latches) != 1:
+        return None, "several ways back"
+    latch = next(iter(latches))
+    test = blocks[latch]
+    branch = test[-1]
+    name = branch.mnemonic
+    if branch.mnemonic == "jmp" and len(test) == 1 and len(preds[latch]) == 1:
+        # BEQ out : JMP back, as the JP version likes to do
+        test = blocks[preds[latch][0]]
+        branch = test[-1]
+        if branch.mode != "rel" or branch.mnemonic not in _INVERTED:
+            return None, "not a counted loop"
+        name = _INVERTED[branch.mnemonic]
+    elif branch.mode != "rel" or branch.operand != header:
+        return None, "not a counted loop"
+    if len(test) < 2:
+        return None, "not a counted loop"
+
+    flags = test[-2]
+    compare = None
+    if flags.mnemonic in _STEPS and writes(flags) is not None:
+        where = writes(flags)
+    elif flags.mnemonic in _COMPARES and flags.mode == "imm":
+        where, compare = _COMPARES[flags.mnemonic], flags.operand
+    elif flags.mnemonic == "cmp" and flags.mode == "imm" and len(test) >= 3:
+        source = test[-3]
+        if source.mnemonic not in ("sta", "lda") or source.mode not in ("zp", "abs"):
+            return None, "not a counted loop"
+        where, compare = source.operand, flags.operand
+    else:
+        return None, "not a counted loop"
+    what = where.upper() if isinstance(where, str) else "${:02X}".format(where)
+
+    step = 0
+    for start in body:
+        instructions = blocks[start]
+        for i, ins in enumerate(instructions):
+            if writes(ins) != where:
+                continue
+            amount = _step(instructions, i, where) if instructions is test else None
+            if amount is None:
+                return None, "{} changed in the loop".format(what)
+            step += amount
+    if step == 0:
+        return None, "{} not stepped".format(what)
+
+    values = set()
+    for start in preds[header]:
+        if start not in body:
+            values.add(_value(blocks, preds, start, len(blocks[start]), where))
+    if len(values) != 1 or None in values:
+        return None, "{} not set to a constant".format(what)
+    init = values.pop()
+
+    size = abs(step)
+    distance = ((compare or 0) - init) * (1 if step > 0 else -1) % 256
+    count = None
+    if name == "bne":
+        if distance % size == 0:
+            count = (distance or 256) // size
+    elif compare is None and name == "bpl" and step < 0 and init < 0x80:
+        count = init // size + 1
+    elif compare is not None and name in ("bcc", "bmi") and step > 0 and init < compare:
+        if compare < 0x80 or name == "bcc":
+            count = -(-(compare - init) // size)
+    elif compare is not None and name == "bcs" and step < 0 and init >= compare:
+        count = (init - compare) // size + 1
+    if count is None:
+        return None, "unknown exit condition"
+    return count, "{}={:02X}, step {:+d}".format(what, init, step)
+
+
+def routine_hash(blocks):
+    """Hash of a routine's instruction addresses and bytes."""
+    digest = hashlib.sha1(str(ANALYSIS_VERSION).encode("ascii"))
+    for start in sorted(blocks):
+        for ins in blocks[start]:
+            digest.update(ins.address.to_bytes(2, "little") + bytes([ins.opcode]))
+            if ins.operand is not None:
+                digest.update(ins.operand.to_bytes(2, "little"))
+    return digest.hexdigest()
+
+
+# -- evaluation --------------------------------------------------------------------
+
+
+def _mean(values):
+    return sum(values) / len(values)
+
+
+def evaluate(summary, entry, totals, typical, bounds, default_bound):
+    """
+    Cycles of one call of the routine, given totals of the routines it calls,
+    as (known, guessed). known goes around every loop without a known bound
+    once; guessed runs it default_bound times, but only with nothing guessed
+    inside it (its body, and the routines called from it, costed as in
+    known), so guesses never multiply.
+    """
+    combine = _mean if typical else max
+    cost, succs = {}, {}
+    for start, (worst, average, calls, following) in summary["blocks"].items():
+        own = average if typical else worst
+        cost[start] = [
+            own + sum(JSR_CYCLES + totals.get(callee, (0, 0))[k] for callee in calls)
+            for k in (0, 1)
+        ]
+        succs[start] = list(following)
+    rep = {}
+
+    def find(node):
+        while node in rep:
+            node = rep[node]
+        return node
+
+    for header, body, bound, _ in summary["loops"]:
+        bound = bounds.get(header, bound)
+        body = {find(node) for node in body}
+
+        def path(node, to_header, k, memo, active):
+            if node in memo:
+                return memo[node]
+            active.add(node)
+            options = []
+            for target, extra in succs[node]:
+                target = find(target)
+                if target == header:
+                    if to_header:
+                        options.append(extra)
+                elif target not in body:
+                    if not to_header:
+                        options.append(extra)
+                elif target not in active:
+                    value = path(target, to_header, k, memo, active)
+                    if value is not None:
+                        options.append(extra + value)
+            if not succs[node] and not to_header:
+                options.append(0)
+            active.discard(node)
+            memo[node] = cost[node][k] + combine(options) if options else None
+            return memo[node]
+
+        once, leave = [], []
+        for k in (0, 1):
+            once.append(path(header, True, k, {}, set()))
+            value = path(header, False, k, {}, set())
+            leave.append(value if value is not None else once[k])
+        if once[0] is None:
+            continue
+        exits = {
+            find(target)
+            for node in body
+            for target, _ in succs[node]
+            if find(target) not in body
+        }
+        if bound is not None:
+            cost[header] = [(bound - 1) * once[k] + leave[k] for k in (0, 1)]
+        else:
+            guessed = (default_bound - 1) * once[0] + leave[0]
+            cost[header] = [once[0] + leave[0], max(guessed, once[1] + leave[1])]
+        succs[header] = [(target, 0) for target in sorted(exits)]
+        for node in body:
+            if node != header:
+                rep[node] = header
+
+    def total(node, k, memo, active):
+        if node in memo:
+            return memo[node]
+        active.add(node)
+        options = [
+            extra + total(find(target), k, memo, active)
+            for target, extra in succs[node]
+            if find(target) not in active and find(target) != node
+        ]
+        active.discard(node)
+        memo[node] = cost[node][k] + (combine(options) if options else 0)
+        return memo[node]
+
+    return tuple(total(find(entry), k, {}, set()) for k in (0, 1))
+
+
+class Analysis:
+    """Routines reachable from roots in CPU memory, analysed with an optional cache."""
+
+    def __init__(self, mem, roots, cache=None):
+        self.mem = mem
+        self.roots = roots
+        self.entries = find_entries(mem, roots)
+        self.cache = cache if cache is not None else {}
+        self.summaries, self.notes, self.hashes = {}, {}, {}
+        self.hits = self.misses = 0
+        todo = list(roots)
+        while todo:
+            entry = todo.pop(0)
+            if entry in self.summaries:
+                continue
+            blocks, succs, self.notes[entry] = build_routine(mem, entry, self.entries)
+            key = self.hashes[entry] = routine_hash(blocks)
+            if key in self.cache:
+                self.hits += 1
+            else:
+                self.misses += 1
+                self.cache[key] = _to_json(summarize(blocks, succs, entry, self.entries))
+            self.summaries[entry] = _from_json(self.cache[key])
+            todo.extend(self.callees(entry))
+
+    def callees(self, entry):
+        """Routines called by entry, in address order of the first call."""
+        found = []
+        for start in sorted(self.summaries[entry]["blocks"]):
+            for callee in self.summaries[entry]["blocks"][start][2]:
+                if callee not in found:
+                    found.append(callee)
+        return found
+
+    def totals(self, typical, bounds=None, default_bound=DEFAULT_LOOP_BOUND):
+        """
+        {entry: (known, guessed)} cycles of every routine (see evaluate());
+        recursive calls count as free.
+        """
+        totals, active = {}, set()
+
+        def visit(entry):
+            if entry in totals or entry in active:
+                return
+            active.add(entry)
+            for callee in self.callees(entry):
+                visit(callee)
+            active.discard(entry)
+            totals[entry] = evaluate(
+                self.summaries[entry], entry, totals, typical, bounds or {}, default_bound
+            )
+
+        for entry in self.summaries:
+            visit(entry)
+        return totals
+
+    def assumed(self, entry, bounds):
+        """Headers of the routine's loops whose bound is not known."""
+        return [
+            header
+            for header, _, bound, _ in self.summaries[entry]["loops"]
+            if bound is None and header not in bounds
+        ]
+
+
+def _to_json(summary):
+    return {
+        "blocks": [[start, *value] for start, value in summary["blocks"].items()],
+        "loops": summary["loops"],
+    }
+
+
+def _from_json(data):
+    return {
+        "blocks": {
+            start: (worst, typical, list(calls), [tuple(s) for s in succs])
+            for start, worst, typical, calls, succs in data["blocks"]
+        },
+        "loops": [tuple(loop) for loop in data["loops"]],
+    }
+
+
+def load_cache(path):
+    try:
+        data = json.loads(pathlib.Path(path).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+    return data.get("routines", {}) if data.get("version") == ANALYSIS_VERSION else {}
+
+
+def save_cache(path, cache):
+    data = {"version": ANALYSIS_VERSION, "routines": cache}
+    try:
+        pathlib.Path(path).write_text(json.dumps(data), encoding="utf-8")
+    except OSError as e:
+        print("Warning: could not write {}: {}".format(path, e))
+
+
+# -- command line ------------------------------------------------------------------
+
+
+def label_names(symbols):
+    """CPU address -> label for ROM addresses, preferring names ending in it."""
+    names = {}
+    for name, value in sorted(symbols.items()):
+        if not isinstance(value, int) or not 0x8000 <= value <= 0xFFFF:
+            continue
+        if value not in names or (
+            name.upper().endswith("_{:04X}".format(value))
+            and not names[value].upper().endswith("_{:04X}".format(value))
+        ):
+            names[value] = name
+    return names
+
+
+def parse_bound(text):
+    where, _, count = text.partition("=")
+    try:
+        if not where or int(count) < 1:
+            raise ValueError
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            "expected label=count or $address=count, not '{}'".format(text)
+        ) from None
+    return where, int(count)
+
+
+def worst_chain(analysis, root, worst):
+    """The routines from root down through the most expensive callee of each."""
+    chain = [root]
+    while analysis.callees(chain[-1]):
+        callee = max(analysis.callees(chain[-1]), key=worst.get)
+        if callee in chain:
+            break
+        chain.append(callee)
+    return chain
+
+
+def print_tree(analysis, entry, worst, typical, name, width, budget, depth, chain, prefix=""):
+    print(
+        "{}{}{:<{}} {:>8} {:>8.0f}{}".format(
+            prefix,
+            "*" if entry in chain else " ",
+            name(entry),
+            width - len(prefix),
+            worst[entry],
+            typical[entry],
+            "  over budget" if worst[entry] > budget else "",
+        )
+    )
+    if depth == 0:
+        return
+    on_chain = chain[1:] if chain and chain[0] == entry else []
+    for callee in analysis.callees(entry):
+        print_tree(
+            analysis,
+            callee,
+            worst,
+            typical,
+            name,
+            width,
+            budget,
+            depth - 1,
+            on_chain if on_chain and on_chain[0] == callee else [],
+            prefix + "  ",
+        )
+
+
+def main():
+    ap = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    ap.add_argument("input", help="Main assembly file or .nes ROM")
+    ap.add_argument(
+        "--version", type=parse_version, help="Game version: jp, us, gamecube or 0-2"
+    )
+    ap.add_argument(
+        "--routine",
+        action="append",
+        default=[],
+        help="Routine to start from, label or address (repeatable, default: the NMI vector)",
+    )
+    ap.add_argument(
+        "--budget", type=int, default=VBLANK_CYCLES, help="Cycle budget (default: vblank)"
+    )
+    ap.add_argument(
+        "--loop-bound",
+        type=int,
+        default=DEFAULT_LOOP_BOUND,
+        help="Iterations of loops without a known bound in the Guessed column "
+        "(default {})".format(
+            DEFAULT_LOOP_BOUND
+        ),
+    )
+    ap.add_argument(
+        "--bound",
+        action="append",
+        type=parse_bound,
+        default=[],
+        help="Iterations of the loop starting at a label or address: where=count",
+    )
+    ap.add_argument("--tree", action="store_true", help="Print the call tree of each root")
+    ap.add_argument("--depth", type=int, default=4, help="Depth of --tree (default 4)")
+    ap.add_argument("--cache", help="Cache file (default: {} next to the input)".format(CACHE_NAME))
+    ap.add_argument("--no-cache", action="store_true", help="Do not read or write the cache")
+    args = ap.parse_args()
+
+    try:
+        machine = Machine.load(args.input, args.version)
+        roots = [machine.address(where) for where in args.routine]
+        bounds = {machine.address(where): count for where, count in args.bound}
+    except (OSError, ValueError) as e:  # EvalError, InesError
+        print("Error: {}".format(e), file=sys.stderr)
+        return 1
+    if not roots:
+        roots = [machine.peek(NMI_VECTOR) | machine.peek(NMI_VECTOR + 1) << 8]
+
+    cache_path = pathlib.Path(args.cache or pathlib.Path(args.input).parent / CACHE_NAME)
+    cache = {} if args.no_cache else load_cache(cache_path)
+    analysis = Analysis(machine.mem, roots, cache)
+    if not args.no_cache and analysis.misses:
+        save_cache(cache_path, cache)
+
+    labels = label_names(machine.symbols)
+
+    def name(entry):
+        return labels.get(entry, "${:04X}".format(entry))
+
+    totals = analysis.totals(False, bounds, args.loop_bound)
+    worst = {entry: known for entry, (known, _) in totals.items()}
+    guessed = {entry: value for entry, (_, value) in totals.items()}
+    typical = {entry: known for entry, (known, _) in analysis.totals(True, bounds).items()}
+
+    width = max([len(name(entry)) for entry in analysis.summaries] + [26])
+    print(
+        "{:<{}} {:>5} {:>8} {:>8} {:>7} {:>8}  {}".format(
+            "Routine", width, "Addr", "Worst", "Typical", "Budget", "Guessed", "Notes"
+        )
+    )
+    for entry in sorted(analysis.summaries, key=lambda e: (-worst[e], e)):
+        notes = list(analysis.notes[entry])
+        assumed = analysis.assumed(entry, bounds)
+        if assumed:
+            notes.insert(
+                0,
+                "{} loop(s) of unknown bound: {}".format(
+                    len(assumed), " ".join(name(h) for h in assumed)
+                ),
+            )
+        worst_share = worst[entry] / args.budget
+        print(
+            "{:<{}} {:5} {:>8} {:>8.0f} {:>7.0%} {:>8}  {}".format(
+                name(entry),
+                width,
+                "${:04X}".format(entry),
+                worst[entry],
+                typical[entry],
+                worst_share,
+                guessed[entry] if guessed[entry] != worst[entry] else "",
+                "; ".join(notes),
+            )
+        )
+
+    for root in roots:
+        chain = worst_chain(analysis, root, worst)
+        print()
+        print("Worst call chain: {}".format(" > ".join(name(entry) for entry in chain)))
+        if args.tree:
+            title = "Call tree (* on the chain)"
+            print("{:<{}} {:>8} {:>8}".format(title, width + 1, "Worst", "Typical"))
+            print_tree(
+                analysis, root, worst, typical, name, width, args.budget, args.depth, chain
+            )
+    print()
+    print(
+        "{} routine(s), {} analysed, {} from cache; budget {} cycles".format(
+            len(analysis.summaries), analysis.misses, analysis.hits, args.budget
+        )
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
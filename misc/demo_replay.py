@@ -0,0 +1,407 @@
+# demo_replay.py
+# Usage: python demo_replay.py ../DonkeyKongDisassembly.asm -o traces --ignore '$0100-$01FF'
+#        python demo_replay.py ../DonkeyKongDisassembly.asm --version us --movie run.txt \
+#            --press 60:start:2 --at 200
+#        python demo_replay.py --diff old/us.trace traces/us.trace
+"""
+Replay controller input movies headless and trace RAM/OAM hashes per frame.
+
+A movie is a list of (input, frames) entries in the format of the attract
+mode's DemoInputData_C014/DemoTimingData_C028 tables: an input byte laid out
+like the game's joypad byte (Input_A = $80 ... Input_Right = $01, with $05
+being Demo_JumpCommand, played as A) and a timing. The demo spends one frame
+fetching an entry and then applies it for timing frames, so each entry holds
+its input for timing + 1 frames of the controller stream. By default the
+movie is the one in the ROM being run; --movie reads one from a text file,
+one entry per line (--print-movie writes the ROM's in that format):
+
+    right 219           ; Input_Right for $DB frames
+    jump  1             ; or $05, Demo_JumpCommand
+    up+a  $20           ; buttons joined with +, or a byte like $88
+
+The movie starts at frame --at (Start can be pressed before that with
+--press frame:button[:frames], e.g. to leave the title screen) and every
+input is run with nes_machine.Machine in lockstep: a source file once per
+game version (or those given with --version), a .nes dump as it is. Every
+--interval frames the frame number, the buttons held and 64-bit BLAKE2b
+hashes of RAM and OAM are written to <out>/<version or ROM name>.trace, one
+line each. The first divergence of each input from the first one is found
+as it happens, on any frame, and reported with the RAM addresses involved.
+--diff compares two trace files, e.g. written before and after an edit, and
+prints the first sample where they differ; the exit status is 1 if they do.
+"""
+
+import argparse
+import collections
+import hashlib
+import json
+import pathlib
+import sys
+import time
+
+from nes_machine import RAM_SIZE, VERSION_VALUES, Machine, parse_press, parse_version
+
+DEMO_INPUT = 0xC014  # DemoInputData_C014, at this address in every version
+DEMO_TIMING = 0xC028  # DemoTimingData_C028
+DEMO_JUMP = 0x05  # Demo_JumpCommand
+HASH_SIZE = 8
+SHOW_ADDRESSES = 16
+
+# bits of the game's joypad byte (Input_A etc. in Defines.asm)
+INPUTS = {
+    "a": 0x80,
+    "b": 0x40,
+    "select": 0x20,
+    "start": 0x10,
+    "up": 0x08,
+    "down": 0x04,
+    "left": 0x02,
+    "right": 0x01,
+}
+INPUT_ALIASES = {"jump": DEMO_JUMP, "none": 0x00, "-": 0x00}
+
+Sample = collections.namedtuple("Sample", "frame buttons ram oam")
+
+
+class ReplayError(ValueError):
+    pass
+
+
+# -- movies --------------------------------------------------------------------
+
+
+def demo_movie(machine):
+    """The attract mode's (input, timing) entries from the ROM loaded in machine."""
+    inputs = machine.symbols.get("DemoInputData_C014", DEMO_INPUT)
+    timings = machine.symbols.get("DemoTimingData_C028", DEMO_TIMING)
+    count = timings - inputs
+    return list(zip(machine.peek(inputs, count), machine.peek(timings, count)))
+
+
+def _number(text):
+    return int(text[1:], 16) if text.startswith("$") else int(text, 0)
+
+
+def parse_input(text):
+    """'right', 'up+a', 'jump', '$05' ... -> input byte."""
+    text = text.lower()
+    if text in INPUT_ALIASES:
+        return INPUT_ALIASES[text]
+    if text[0].isdigit() or text[0] == "$":
+        value = _number(text)
+        if not 0 <= value <= 0xFF:
+            raise ValueError
+        return value
+    value = 0
+    for name in text.split("+"):
+        value |= INPUTS[name]
+    return value
+
+
+def read_movie(path):
+    """(input, timing) entries of a movie file."""
+    movie = []
+    with open(path) as f:
+        for number, line in enumerate(f, 1):
+            fields = line.split(";")[0].split()
+            if not fields:
+                continue
+            try:
+                if len(fields) != 2:
+                    raise ValueError
+                movie.append((parse_input(fields[0]), _number(fields[1])))
+            except (KeyError, ValueError):
+                raise ReplayError(
+                    "{}:{}: expected 'input frames', not '{}'".format(path, number, line.strip())
+                ) from None
+    return movie
+
+
+def format_input(value):
+    if value == DEMO_JUMP:
+        return "jump"
+    names = [name for name, bit in INPUTS.items() if value & bit]
+    return "+".join(names) if names else "none"
+
+
+def format_movie(movie):
+    return "".join(
+        "{:<12}{:<5}; ${:02X} ${:02X}\n".format(format_input(value), timing, value, timing)
+        for value, timing in movie
+    )
+
+
+def controller_stream(movie):
+    """Per-frame joypad bytes (game layout) a movie holds."""
+    stream = []
+    for value, timing in movie:
+        stream += [INPUTS["a"] if value == DEMO_JUMP else value] * (timing + 1)
+    return stream
+
+
+def joypad(value):
+    """Game joypad byte -> the order the buttons are shifted in (nes_machine.BUTTONS)."""
+    return int("{:08b}".format(value)[::-1], 2)
+
+
+# -- traces --------------------------------------------------------------------
+
+
+def _hash(data):
+    return hashlib.blake2b(bytes(data), digest_size=HASH_SIZE).hexdigest()
+
+
+def ram(machine, ignore=()):
+    """The machine's RAM with the (first, last) address ranges in ignore zeroed."""
+    data = bytearray(machine.mem[:RAM_SIZE])
+    for first, last in ignore:
+        data[first : last + 1] = bytes(last + 1 - first)
+    return data
+
+
+def sample(machine, buttons, ignore=()):
+    return Sample(machine.frames, buttons, _hash(ram(machine, ignore)), _hash(machine.ppu.oam))
+
+
+def write_trace(path, header, samples):
+    with open(path, "w") as f:
+        f.write("# {}\n".format(json.dumps(header)))
+        for s in samples:
+            f.write("{} {:02X} {} {}\n".format(s.frame, s.buttons, s.ram, s.oam))
+
+
+def read_trace(path):
+    """(header dict, samples) of a trace file."""
+    header, samples = {}, []
+    with open(path) as f:
+        for number, line in enumerate(f, 1):
+            try:
+                if line.startswith("#"):
+                    header = json.loads(line[1:])
+                    continue
+                frame, buttons, ram_hash, oam_hash = line.split()
+                samples.append(Sample(int(frame), int(buttons, 16), ram_hash, oam_hash))
+            except ValueError:
+                raise ReplayError("{}:{}: not a trace line".format(path, number)) from None
+    return header, samples
+
+
+def first_divergence(old, new):
+    """(last equal sample, old sample, new sample) at the first frame both
+    traces sampled with different contents, or None."""
+    by_frame = {s.frame: s for s in new}
+    last = None
+    for s in old:
+        other = by_frame.get(s.frame)
+        if other is None:
+            continue
+        if s != other:
+            return last, s, other
+        last = s
+    return None
+
+
+def describe(old, new):
+    names = {"buttons": "input", "ram": "RAM", "oam": "OAM"}
+    return ", ".join(
+        text for name, text in names.items() if getattr(old, name) != getattr(new, name)
+    )
+
+
+def parse_range(text):
+    """'$0100-$01FF' or '$0100' -> (first, last) RAM address."""
+    first, _, last = text.partition("-")
+    try:
+        first, last = _number(first), _number(last or first)
+        if not 0 <= first <= last < RAM_SIZE:
+            raise ValueError
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            "expected a RAM address or range like $0100-$01FF, not '{}'".format(text)
+        ) from None
+    return first, last
+
+
+# -- command line --------------------------------------------------------------
+
+
+def diff(old_path, new_path):
+    try:
+        (old_header, old), (new_header, new) = read_trace(old_path), read_trace(new_path)
+    except (OSError, ValueError) as e:
+        print("Error: {}".format(e), file=sys.stderr)
+        return 1
+    for key in ("interval", "at", "ignore"):
+        if old_header.get(key) != new_header.get(key):
+            print("Warning: traces differ in {}".format(key))
+    found = first_divergence(old, new)
+    common = len({s.frame for s in old} & {s.frame for s in new})
+    if found is None:
+        print("{} common sample(s), no divergence".format(common))
+        if len(old) != len(new):
+            print("({} has {} samples, {} has {})".format(old_path, len(old), new_path, len(new)))
+        return 0
+    last, a, b = found
+    print(
+        "First divergence at frame {} ({}), after frame {}".format(
+            a.frame, describe(a, b), last.frame if last else "-"
+        )
+    )
+    print("  {}: {:02X} {} {}".format(old_path, a.buttons, a.ram, a.oam))
+    print("  {}: {:02X} {} {}".format(new_path, b.buttons, b.ram, b.oam))
+    return 1
+
+
+def main():
+    ap = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    ap.add_argument("inputs", nargs="*", help="Main assembly file(s) and/or .nes ROMs")
+    ap.add_argument("-o", "--out-dir", help="Directory to write <label>.trace files to")
+    ap.add_argument(
+        "--version",
+        action="append",
+        type=parse_version,
+        default=[],
+        help="Game version of source inputs (repeatable, default: all)",
+    )
+    ap.add_argument("--movie", help="Movie file to replay (default: the ROM's demo tables)")
+    ap.add_argument("--at", type=int, default=0, help="Frame the movie starts on (default 0)")
+    ap.add_argument(
+        "--press",
+        action="append",
+        type=parse_press,
+        default=[],
+        help="Also hold buttons: frame:button+button[:frames] (repeatable)",
+    )
+    ap.add_argument("--frames", type=int, help="Frames to run (default: to the movie's end)")
+    ap.add_argument("--interval", type=int, default=1, help="Frames per trace sample (default 1)")
+    ap.add_argument(
+        "--ignore",
+        action="append",
+        type=parse_range,
+        default=[],
+        help="RAM range left out of hashes and comparisons, e.g. the stack $0100-$01FF",
+    )
+    ap.add_argument("--print-movie", action="store_true", help="Print the movie and exit")
+    ap.add_argument("--diff", nargs=2, metavar=("OLD", "NEW"), help="Compare two trace files")
+    args = ap.parse_args()
+
+    if args.diff:
+        return diff(*args.diff)
+    if not args.inputs:
+        ap.error("an input or --diff is required")
+    if args.interval < 1:
+        ap.error("--interval must be at least 1")
+
+    names = {value: name for name, value in VERSION_VALUES.items()}
+    jobs = []  # (label, input, version)
+    for path in args.inputs:
+        if pathlib.Path(path).suffix.lower() == ".nes":
+            jobs.append((pathlib.Path(path).stem, path, None))
+        else:
+            for version in args.version or sorted(names):
+                jobs.append((names.get(version, str(version)), path, version))
+    labels = [label for label, _, _ in jobs]
+    if len(set(labels)) != len(labels):
+        print("Error: several inputs would be written to the same trace")
+        return 1
+
+    machines, streams = [], []
+    try:
+        movie = read_movie(args.movie) if args.movie else None
+        for label, path, version in jobs:
+            machines.append(Machine.load(path, version))
+            streams.append(controller_stream(movie or demo_movie(machines[-1])))
+            if args.print_movie:
+                print("; {}".format(label))
+                print(format_movie(movie or demo_movie(machines[-1])))
+    except (OSError, ValueError) as e:  # EvalError, InesError, ReplayError
+        print("Error: {}".format(e), file=sys.stderr)
+        return 1
+    if args.print_movie:
+        return 0
+
+    frames = args.frames if args.frames is not None else args.at + max(map(len, streams))
+    held = []
+    for stream in streams:
+        buttons = [0] * frames
+        for frame, value in enumerate(stream[: max(frames - args.at, 0)], args.at):
+            buttons[frame] = value
+        for first, count, value in args.press:
+            for frame in range(first, min(first + count, frames)):
+                buttons[frame] |= joypad(value)
+        held.append(buttons)
+
+    started = time.perf_counter()
+    traces = [[] for _ in jobs]
+    diverged = {}  # job index -> frame
+    try:
+        for frame in range(frames):
+            for machine, buttons in zip(machines, held):
+                machine.frame(joypad(buttons[frame]))
+            if (frame + 1) % args.interval == 0:
+                for trace, machine, buttons in zip(traces, machines, held):
+                    trace.append(sample(machine, buttons[frame], args.ignore))
+            reference = machines[0]
+            expected = ram(reference, args.ignore)
+            for i, machine in enumerate(machines[1:], 1):
+                if i in diverged:
+                    continue
+                actual = ram(machine, args.ignore)
+                if actual == expected:
+                    if machine.ppu.oam == reference.ppu.oam and held[i][frame] == held[0][frame]:
+                        continue
+                diverged[i] = frame + 1
+                addresses = [a for a in range(RAM_SIZE) if actual[a] != expected[a]]
+                print(
+                    "{} diverges from {} at frame {}: {} RAM byte(s), {} OAM byte(s){}".format(
+                        labels[i],
+                        labels[0],
+                        frame + 1,
+                        len(addresses),
+                        sum(a != b for a, b in zip(machine.ppu.oam, reference.ppu.oam)),
+                        ", input {:02X}/{:02X}".format(held[i][frame], held[0][frame])
+                        if held[i][frame] != held[0][frame]
+                        else "",
+                    )
+                )
+                for a in addresses[:SHOW_ADDRESSES]:
+                    print("  ${:04X}: {:02X} {:02X}".format(a, reference.mem[a], machine.mem[a]))
+                if len(addresses) > SHOW_ADDRESSES:
+                    print("  ...")
+    except RuntimeError as e:  # CPUError
+        print("Error: frame {}: {}".format(frame, e), file=sys.stderr)
+        return 1
+    elapsed = time.perf_counter() - started
+
+    if args.out_dir:
+        out_dir = pathlib.Path(args.out_dir)
+        out_dir.mkdir(parents=True, exist_ok=True)
+        for (label, path, version), trace in zip(jobs, traces):
+            header = {
+                "label": label,
+                "input": path,
+                "version": version,
+                "movie": args.movie,
+                "at": args.at,
+                "interval": args.interval,
+                "ignore": args.ignore,
+            }
+            write_trace(out_dir / (label + ".trace"), header, trace)
+    print(
+        "{} frames x {} input(s) in {:.2f}s, {} sample(s) each{}".format(
+            frames,
+            len(jobs),
+            elapsed,
+            len(traces[0]),
+            ", written to {}".format(args.out_dir) if args.out_dir else "",
+        )
+    )
+    if len(jobs) > 1 and len(diverged) < len(jobs) - 1:
+        print("{} input(s) never diverge from {}".format(len(jobs) - 1 - len(diverged), labels[0]))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
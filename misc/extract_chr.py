@@ -11,7 +11,8 @@ with open(sys.argv[1], "rb") as f:
     chr_ = h[5] * 8192
     if chr_ == 0:
         raise SystemExit("ROM has 0 CHR banks (CHR-RAM) — nothing to extract")
-    f.seek(16 + prg)
+    trainer = 512 if h[6] & 0x04 else 0  # optional trainer precedes PRG
+    f.seek(16 + trainer + prg)
     data = f.read(chr_)
 
 with open(sys.argv[2], "wb") as o:
@@ -0,0 +1,205 @@
+# extract_chr_batch.py
+# Usage: python extract_chr_batch.py roms/ "dumps/**/*.nes" -o chr --report chr/report.json
+"""
+Extract the CHR ROM of many iNES dumps at once.
+
+Inputs are .nes files, directories (searched recursively) or glob patterns.
+Each ROM is mmap'd and parsed with ines.py (trainer and PlayChoice-10 data
+are skipped correctly) in a process pool. CHR payloads are written to the
+output directory as chr_<sha1>.bin, so dumps that share graphics (e.g. the
+JP, US and Gamecube releases) produce a single file. A JSON report lists
+every ROM, its header fields and the file(s) holding its CHR data.
+"""
+
+import argparse
+import concurrent.futures
+import glob
+import hashlib
+import json
+import os
+import pathlib
+import sys
+import tempfile
+import time
+
+from ines import CHR_BANK_SIZE, Ines
+
+
+def find_roms(inputs):
+    """Expand files, directories and glob patterns to a sorted list of .nes paths."""
+    found = set()
+    for item in inputs:
+        path = pathlib.Path(item)
+        if path.is_dir():
+            candidates = path.rglob("*")
+        elif path.is_file():
+            candidates = [path]
+        else:
+            candidates = (pathlib.Path(p) for p in glob.glob(item, recursive=True))
+        for candidate in candidates:
+            if candidate.suffix.lower() == ".nes" and candidate.is_file():
+                found.add(str(candidate))
+    return sorted(found)
+
+
+def write_once(path, data):
+    """
+    Write data to path unless it already exists (possibly being written by
+    another worker at the same moment). Returns True if this call wrote it.
+    """
+    if path.exists():
+        return False
+    fd, tmp = tempfile.mkstemp(dir=str(path.parent), prefix=".chr_", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        try:
+            os.link(tmp, str(path))  # fails if another worker got there first
+        except FileExistsError:
+            return False
+        except OSError:
+            os.replace(tmp, str(path))  # no hard links here; same content anyway
+            tmp = None
+        return True
+    finally:
+        if tmp is not None and os.path.exists(tmp):
+            os.unlink(tmp)
+
+
+def extract_one(job):
+    """
+    Process-pool worker: extract the CHR data of one ROM.
+    job is (rom_path, out_dir, per_bank). Returns the ROM's report entry.
+    """
+    rom_path, out_dir, per_bank = job
+    entry = {"path": rom_path}
+    try:
+        with Ines.from_file(rom_path, strict=False) as rom:
+            header = rom.header
+            entry.update(
+                mapper=header.mapper,
+                prg_banks=header.len_prg_rom,
+                chr_banks=header.len_chr_rom,
+                trainer=rom.trainer is not None,
+                playchoice10=rom.playchoice10 is not None,
+            )
+            chr_rom = rom.chr_rom
+            if not len(chr_rom):
+                entry["status"] = "no-chr"  # CHR-RAM cartridge
+                return entry
+
+            step = CHR_BANK_SIZE if per_bank else len(chr_rom)
+            outputs = []
+            for start in range(0, len(chr_rom), step):
+                with chr_rom[start : start + step] as piece:
+                    digest = hashlib.sha1(piece).hexdigest()
+                    name = "chr_{}.bin".format(digest)
+                    written = write_once(pathlib.Path(out_dir) / name, piece)
+                outputs.append(
+                    {"sha1": digest, "file": name, "size": step, "written": written}
+                )
+            entry["chr"] = outputs
+            entry["status"] = "ok"
+    except (OSError, ValueError) as e:  # ines.InesError is a ValueError
+        entry["status"] = "error"
+        entry["error"] = str(e)
+    return entry
+
+
+def build_report(entries, seconds):
+    """Group the per-ROM entries by CHR payload and add summary counts."""
+    payloads = {}
+    for entry in entries:
+        for out in entry.get("chr", ()):
+            payload = payloads.setdefault(
+                out["sha1"], {"file": out["file"], "size": out["size"], "roms": []}
+            )
+            payload["roms"].append(entry["path"])
+
+    statuses = [e["status"] for e in entries]
+    pieces = sum(len(e.get("chr", ())) for e in entries)
+    return {
+        "summary": {
+            "roms": len(entries),
+            "extracted": statuses.count("ok"),
+            "no_chr": statuses.count("no-chr"),
+            "errors": statuses.count("error"),
+            "chr_files": len(payloads),
+            "duplicates": pieces - len(payloads),
+            "seconds": round(seconds, 3),
+        },
+        "payloads": payloads,
+        "roms": entries,
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    ap.add_argument("inputs", nargs="+", help=".nes files, directories or glob patterns")
+    ap.add_argument("-o", "--out-dir", default="chr", help="Output directory (default: chr)")
+    ap.add_argument(
+        "--report", help="JSON report path (default: <out-dir>/report.json)"
+    )
+    ap.add_argument(
+        "--banks",
+        action="store_true",
+        help="Write (and deduplicate) each 8 KB CHR bank separately",
+    )
+    ap.add_argument(
+        "--jobs", "-j", type=int, default=None, help="Worker processes (default: CPU count)"
+    )
+    ap.add_argument("--verbose", "-v", action="store_true", help="List every ROM")
+    args = ap.parse_args()
+
+    roms = find_roms(args.inputs)
+    if not roms:
+        print("No .nes files found")
+        return 1
+
+    out_dir = pathlib.Path(args.out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    report_path = pathlib.Path(args.report) if args.report else out_dir / "report.json"
+
+    started = time.perf_counter()
+    jobs = [(rom, str(out_dir), args.banks) for rom in roms]
+    if len(jobs) == 1 or args.jobs == 1:
+        entries = [extract_one(job) for job in jobs]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs) as pool:
+            chunksize = max(1, len(jobs) // (4 * (args.jobs or os.cpu_count() or 1)))
+            entries = list(pool.map(extract_one, jobs, chunksize=chunksize))
+    report = build_report(entries, time.perf_counter() - started)
+
+    if args.verbose:
+        for entry in entries:
+            if entry["status"] == "ok":
+                files = ", ".join(o["file"][:20] for o in entry["chr"])
+                print("{}: {}".format(entry["path"], files))
+            else:
+                print("{}: {}".format(entry["path"], entry.get("error", entry["status"])))
+
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+        f.write("\n")
+
+    summary = report["summary"]
+    print(
+        "{} ROM(s): {} extracted to {} unique CHR file(s) ({} duplicates), "
+        "{} without CHR ROM, {} error(s) in {:.2f}s".format(
+            summary["roms"],
+            summary["extracted"],
+            summary["chr_files"],
+            summary["duplicates"],
+            summary["no_chr"],
+            summary["errors"],
+            summary["seconds"],
+        )
+    )
+    print("Report: {}".format(report_path))
+    return 1 if summary["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
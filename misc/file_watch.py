@@ -0,0 +1,197 @@
+"""
+Wait for a set of files to change: inotify on Linux, stat polling elsewhere.
+
+    watcher = open_watcher(paths)
+    while True:
+        changed = watcher.wait()        # set of the paths that changed
+        ...
+        watcher.watch(new_paths)        # the set may change between waits
+
+inotify is reached through ctypes (no extra package). The directories of
+the files are watched rather than the files, so a file that does not exist
+yet, or that an editor saves by writing a new file and renaming it over the
+old one, is still seen. When inotify is unavailable (not Linux, or out of
+watches) the files are stat()ed every poll interval instead.
+
+Both watchers debounce: once something changed they keep collecting events
+until none arrived for the debounce interval, so one save (or a script
+rewriting a dozen data files) is reported as one change.
+"""
+
+import ctypes
+import ctypes.util
+import os
+import pathlib
+import select
+import struct
+import sys
+import time
+
+DEBOUNCE = 0.1
+POLL_INTERVAL = 0.25
+
+# <sys/inotify.h>
+IN_MODIFY = 0x002
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_FROM = 0x040
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+EVENT = struct.Struct("iIII")  # wd, mask, cookie, len (then len bytes of name)
+
+
+class PollingWatcher:
+    """Compares the stat() of every watched file each poll interval."""
+
+    method = "polling"
+
+    def __init__(self, paths=(), debounce=DEBOUNCE, interval=POLL_INTERVAL):
+        self.debounce = debounce
+        self.interval = interval
+        self.stats = {}
+        self.watch(paths)
+
+    @staticmethod
+    def _stat(path):
+        try:
+            st = os.stat(str(path))
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size, st.st_ino
+
+    def watch(self, paths):
+        """Watch exactly paths from now on."""
+        paths = {pathlib.Path(p).resolve() for p in paths}
+        self.stats = {p: self.stats[p] if p in self.stats else self._stat(p) for p in paths}
+
+    def _changed(self):
+        changed = set()
+        for path, old in self.stats.items():
+            new = self._stat(path)
+            if new != old:
+                self.stats[path] = new
+                changed.add(path)
+        return changed
+
+    def wait(self, timeout=None):
+        """The set of watched paths that changed, or an empty set after timeout seconds."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            changed = self._changed()
+            if changed:
+                break
+            if deadline is not None and time.monotonic() >= deadline:
+                return set()
+            time.sleep(self.interval)
+        while True:
+            time.sleep(max(self.debounce, self.interval))
+            more = self._changed()
+            if not more:
+                return changed
+            changed |= more
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher:
+    """Watches the directories of the files through inotify."""
+
+    method = "inotify"
+
+    def __init__(self, paths=(), debounce=DEBOUNCE):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or None, use_errno=True)
+        for name in ("inotify_init1", "inotify_add_watch", "inotify_rm_watch"):
+            if not hasattr(libc, name):
+                raise OSError("no inotify in the C library")
+        self.libc = libc
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.debounce = debounce
+        self.paths = set()
+        self.dirs = {}  # directory -> watch descriptor
+        self.wds = {}  # watch descriptor -> directory
+        try:
+            self.watch(paths)
+        except OSError:
+            self.close()
+            raise
+
+    def watch(self, paths):
+        """Watch exactly paths from now on."""
+        self.paths = {pathlib.Path(p).resolve() for p in paths}
+        dirs = {p.parent for p in self.paths}
+        for directory in dirs - set(self.dirs):
+            if not directory.is_dir():
+                continue  # not there yet; its parent's events will not name the file either
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(str(directory)), WATCH_MASK)
+            if wd < 0:
+                errno = ctypes.get_errno()
+                raise OSError(errno, "cannot watch {}: {}".format(directory, os.strerror(errno)))
+            self.dirs[directory] = wd
+            self.wds[wd] = directory
+        for directory in set(self.dirs) - dirs:
+            wd = self.dirs.pop(directory)
+            del self.wds[wd]
+            self.libc.inotify_rm_watch(self.fd, wd)
+
+    def _read(self, timeout):
+        """Paths named by the events that arrive within timeout seconds (None: block)."""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return set()
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return set()
+        changed = set()
+        pos = 0
+        while pos < len(data):
+            wd, mask, _, length = EVENT.unpack_from(data, pos)
+            name = data[pos + EVENT.size : pos + EVENT.size + length].rstrip(b"\0")
+            pos += EVENT.size + length
+            if mask & IN_Q_OVERFLOW:
+                changed |= self.paths  # events were lost: assume everything changed
+            elif mask & IN_IGNORED:
+                directory = self.wds.pop(wd, None)
+                self.dirs.pop(directory, None)
+            elif wd in self.wds and name:
+                path = self.wds[wd] / os.fsdecode(name)
+                if path in self.paths:
+                    changed.add(path)
+        return changed
+
+    def wait(self, timeout=None):
+        """The set of watched paths that changed, or an empty set after timeout seconds."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            changed = self._read(remaining)
+            if changed:
+                break
+            if deadline is not None and time.monotonic() >= deadline:
+                return set()
+        while True:
+            more = self._read(self.debounce)
+            if not more:
+                return changed
+            changed |= more
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+def open_watcher(paths=(), debounce=DEBOUNCE, poll=False):
+    """An InotifyWatcher for paths where inotify works (unless poll), else a PollingWatcher."""
+    if not poll and sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(paths, debounce)
+        except OSError:
+            pass
+    return PollingWatcher(paths, debounce)
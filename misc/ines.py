@@ -1,127 +1,206 @@
-# This is a generated file! Please edit source .ksy file and use kaitai-struct-compiler to rebuild
-# type: ignore
+"""
+iNES ROM image parser (https://www.nesdev.org/wiki/INES).
 
-import kaitaistruct
-from kaitaistruct import KaitaiStruct, KaitaiStream, BytesIO
+Replaces the Kaitai Struct generated parser and keeps its field names
+(rom.header.mapper, rom.header.f6.trainer, rom.prg_rom, rom.chr_rom,
+rom.playchoice10, rom.title, ...), without needing the kaitaistruct runtime.
+
+The 16-byte header is decoded with a single struct unpack and the flag bytes
+are only picked apart when a field is read. trainer, prg_rom, chr_rom and the
+PlayChoice-10 areas are memoryview slices of the input, so nothing is copied
+until the caller does so (bytes(rom.chr_rom), f.write(rom.chr_rom), ...).
+
+    rom = Ines.from_bytes(data)
+    with Ines.from_file("DonkeyKong.nes") as rom:   # mmap'd, read-only
+        chr_data = bytes(rom.chr_rom)
+
+Absent optional parts (trainer, playchoice10, title) are None.
+"""
+
+import mmap
+import struct
 from enum import IntEnum
 
+HEADER = struct.Struct("<4s7B5s")
+MAGIC = b"NES\x1a"
+TRAINER_SIZE = 512
+PRG_BANK_SIZE = 16384
+CHR_BANK_SIZE = 8192
+PC10_INST_ROM_SIZE = 8192
+PC10_PROM_SIZE = 16
 
-if getattr(kaitaistruct, 'API_VERSION', (0, 9)) < (0, 11):
-    raise Exception("Incompatible Kaitai Struct Python API: 0.11 or later is required, but you have %s" % (kaitaistruct.__version__))
 
-class Ines(KaitaiStruct):
+class InesError(ValueError):
+    """Raised for data that is not a (complete) iNES image."""
+
+
+class Ines:
     """
     .. seealso::
        Source - https://www.nesdev.org/wiki/INES
     """
-    def __init__(self, _io, _parent=None, _root=None):
-        super(Ines, self).__init__(_io)
-        self._parent = _parent
-        self._root = _root or self
-        self._read()
-
-    def _read(self):
-        self._raw_header = self._io.read_bytes(16)
-        _io__raw_header = KaitaiStream(BytesIO(self._raw_header))
-        self.header = Ines.Header(_io__raw_header, self, self._root)
-        if self.header.f6.trainer:
-            pass
-            self.trainer = self._io.read_bytes(512)
 
-        self.prg_rom = self._io.read_bytes(self.header.len_prg_rom * 16384)
-        self.chr_rom = self._io.read_bytes(self.header.len_chr_rom * 8192)
-        if self.header.f7.playchoice10:
-            pass
-            self.playchoice10 = Ines.Playchoice10(self._io, self, self._root)
-
-        if (not (self._io.is_eof())):
-            pass
-            self.title = (self._io.read_bytes_full()).decode(u"ASCII")
-
-
-
-    def _fetch_instances(self):
-        pass
-        self.header._fetch_instances()
+    __slots__ = (
+        "_buf",
+        "_mmap",
+        "header",
+        "trainer",
+        "prg_rom",
+        "chr_rom",
+        "playchoice10",
+        "prg_offset",
+        "chr_offset",
+        "_end",
+    )
+
+    def __init__(self, data, strict=True):
+        """
+        Parse data (bytes, bytearray, mmap or anything exposing the buffer
+        protocol). With strict=False, non-zero reserved header bytes (e.g.
+        "DiskDude!" signatures) are accepted instead of raising InesError.
+        """
+        self._mmap = None
+        self._buf = memoryview(data).cast("B")
+        self.trainer = self.prg_rom = self.chr_rom = self.playchoice10 = None
+        try:
+            self._parse(strict)
+        except Exception:
+            self._release()  # so that an mmap under a bad file can be closed
+            raise
+
+    def _parse(self, strict):
+        self.header = Ines.Header(self._buf, strict)
+
+        pos = HEADER.size
         if self.header.f6.trainer:
-            pass
+            self.trainer = self._take(pos, TRAINER_SIZE, "trainer")
+            pos += TRAINER_SIZE
+
+        self.prg_offset = pos
+        size = self.header.len_prg_rom * PRG_BANK_SIZE
+        self.prg_rom = self._take(pos, size, "PRG ROM")
+        pos += size
+        self.chr_offset = pos
+        size = self.header.len_chr_rom * CHR_BANK_SIZE
+        self.chr_rom = self._take(pos, size, "CHR ROM")
+        pos += size
 
         if self.header.f7.playchoice10:
-            pass
-            self.playchoice10._fetch_instances()
-
-        if (not (self._io.is_eof())):
-            pass
-
-
-    class Header(KaitaiStruct):
-        def __init__(self, _io, _parent=None, _root=None):
-            super(Ines.Header, self).__init__(_io)
-            self._parent = _parent
-            self._root = _root
-            self._read()
-
-        def _read(self):
-            self.magic = self._io.read_bytes(4)
-            if not self.magic == b"\x4E\x45\x53\x1A":
-                raise kaitaistruct.ValidationNotEqualError(b"\x4E\x45\x53\x1A", self.magic, self._io, u"/types/header/seq/0")
-            self.len_prg_rom = self._io.read_u1()
-            self.len_chr_rom = self._io.read_u1()
-            self._raw_f6 = self._io.read_bytes(1)
-            _io__raw_f6 = KaitaiStream(BytesIO(self._raw_f6))
-            self.f6 = Ines.Header.F6(_io__raw_f6, self, self._root)
-            self._raw_f7 = self._io.read_bytes(1)
-            _io__raw_f7 = KaitaiStream(BytesIO(self._raw_f7))
-            self.f7 = Ines.Header.F7(_io__raw_f7, self, self._root)
-            self.len_prg_ram = self._io.read_u1()
-            self._raw_f9 = self._io.read_bytes(1)
-            _io__raw_f9 = KaitaiStream(BytesIO(self._raw_f9))
-            self.f9 = Ines.Header.F9(_io__raw_f9, self, self._root)
-            self._raw_f10 = self._io.read_bytes(1)
-            _io__raw_f10 = KaitaiStream(BytesIO(self._raw_f10))
-            self.f10 = Ines.Header.F10(_io__raw_f10, self, self._root)
-            self.reserved = self._io.read_bytes(5)
-            if not self.reserved == b"\x00\x00\x00\x00\x00":
-                raise kaitaistruct.ValidationNotEqualError(b"\x00\x00\x00\x00\x00", self.reserved, self._io, u"/types/header/seq/8")
-
-
-        def _fetch_instances(self):
-            pass
-            self.f6._fetch_instances()
-            self.f7._fetch_instances()
-            self.f9._fetch_instances()
-            self.f10._fetch_instances()
-
-        class F10(KaitaiStruct):
+            size = PC10_INST_ROM_SIZE + 2 * PC10_PROM_SIZE
+            view = self._take(pos, size, "PlayChoice-10 data")
+            self.playchoice10 = Ines.Playchoice10(view)
+            view.release()
+            pos += size
+        self._end = pos
+
+    def _take(self, pos, size, what):
+        if pos + size > len(self._buf):
+            raise InesError(
+                "truncated {}: need {} bytes at offset {}, file has {}".format(
+                    what, size, pos, len(self._buf)
+                )
+            )
+        return self._buf[pos : pos + size]
+
+    @classmethod
+    def from_bytes(cls, data, strict=True):
+        return cls(data, strict)
+
+    @classmethod
+    def from_file(cls, path, strict=True):
+        """Parse a ROM file through a read-only mmap; close() releases it."""
+        with open(path, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            rom = cls(mapped, strict)
+        except Exception:
+            mapped.close()
+            raise
+        rom._mmap = mapped
+        return rom
+
+    @property
+    def title(self):
+        """Trailing title block (NES 2.0-era dumps), or None."""
+        if self._end >= len(self._buf):
+            return None
+        return bytes(self._buf[self._end :]).decode("ascii", "replace")
+
+    def _release(self):
+        for view in (self.trainer, self.prg_rom, self.chr_rom):
+            if view is not None:
+                view.release()
+        if self.playchoice10 is not None:
+            self.playchoice10.release()
+        self._buf.release()
+
+    def close(self):
+        """
+        Release the buffer (and the mmap of from_file). Slices handed out
+        (prg_rom, chr_rom, ...) must not be used afterwards; slices the caller
+        took of them stay valid and keep the mmap open until they are gone.
+        """
+        self._release()
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                pass  # still exported to the caller's slices; closed when they are freed
+            self._mmap = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    class Header:
+        __slots__ = (
+            "magic",
+            "len_prg_rom",
+            "len_chr_rom",
+            "f6",
+            "f7",
+            "len_prg_ram",
+            "f9",
+            "f10",
+            "reserved",
+        )
+
+        def __init__(self, buf, strict=True):
+            if len(buf) < HEADER.size:
+                raise InesError("truncated header: {} bytes".format(len(buf)))
+            (
+                self.magic,
+                self.len_prg_rom,
+                self.len_chr_rom,
+                f6,
+                f7,
+                self.len_prg_ram,
+                f9,
+                f10,
+                self.reserved,
+            ) = HEADER.unpack_from(buf)
+            if self.magic != MAGIC:
+                raise InesError("not an iNES image (magic {!r})".format(self.magic))
+            if strict and self.reserved != b"\x00" * 5:
+                raise InesError(
+                    "reserved header bytes are not zero: {!r}".format(self.reserved)
+                )
+            self.f6 = Ines.Header.F6(f6)
+            self.f7 = Ines.Header.F7(f7)
+            self.f9 = Ines.Header.F9(f9)
+            self.f10 = Ines.Header.F10(f10)
+
+        @property
+        def mapper(self):
             """
             .. seealso::
-               Source - https://www.nesdev.org/wiki/INES#Flags_10
+               Source - https://www.nesdev.org/wiki/Mapper
             """
+            return self.f6.lower_mapper | self.f7.upper_mapper << 4
 
-            class TvSystem(IntEnum):
-                ntsc = 0
-                dual1 = 1
-                pal = 2
-                dual2 = 3
-            def __init__(self, _io, _parent=None, _root=None):
-                super(Ines.Header.F10, self).__init__(_io)
-                self._parent = _parent
-                self._root = _root
-                self._read()
-
-            def _read(self):
-                self.reserved1 = self._io.read_bits_int_be(2)
-                self.bus_conflict = self._io.read_bits_int_be(1) != 0
-                self.prg_ram = self._io.read_bits_int_be(1) != 0
-                self.reserved2 = self._io.read_bits_int_be(2)
-                self.tv_system = KaitaiStream.resolve_enum(Ines.Header.F10.TvSystem, self._io.read_bits_int_be(2))
-
-
-            def _fetch_instances(self):
-                pass
-
-
-        class F6(KaitaiStruct):
+        class F6:
             """
             .. seealso::
                Source - https://www.nesdev.org/wiki/INES#Flags_6
@@ -130,47 +209,35 @@ class Ines(KaitaiStruct):
             class Mirroring(IntEnum):
                 horizontal = 0
                 vertical = 1
-            def __init__(self, _io, _parent=None, _root=None):
-                super(Ines.Header.F6, self).__init__(_io)
-                self._parent = _parent
-                self._root = _root
-                self._read()
-
-            def _read(self):
-                self.lower_mapper = self._io.read_bits_int_be(4)
-                self.four_screen = self._io.read_bits_int_be(1) != 0
-                self.trainer = self._io.read_bits_int_be(1) != 0
-                self.has_battery_ram = self._io.read_bits_int_be(1) != 0
-                self.mirroring = KaitaiStream.resolve_enum(Ines.Header.F6.Mirroring, self._io.read_bits_int_be(1))
 
+            __slots__ = ("raw",)
 
-            def _fetch_instances(self):
-                pass
+            def __init__(self, raw):
+                self.raw = raw
 
+            lower_mapper = property(lambda self: self.raw >> 4)
+            four_screen = property(lambda self: bool(self.raw & 0x08))
+            trainer = property(lambda self: bool(self.raw & 0x04))
+            has_battery_ram = property(lambda self: bool(self.raw & 0x02))
+            mirroring = property(lambda self: Ines.Header.F6.Mirroring(self.raw & 0x01))
 
-        class F7(KaitaiStruct):
+        class F7:
             """
             .. seealso::
                Source - https://www.nesdev.org/wiki/INES#Flags_7
             """
-            def __init__(self, _io, _parent=None, _root=None):
-                super(Ines.Header.F7, self).__init__(_io)
-                self._parent = _parent
-                self._root = _root
-                self._read()
-
-            def _read(self):
-                self.upper_mapper = self._io.read_bits_int_be(4)
-                self.format = self._io.read_bits_int_be(2)
-                self.playchoice10 = self._io.read_bits_int_be(1) != 0
-                self.vs_unisystem = self._io.read_bits_int_be(1) != 0
 
+            __slots__ = ("raw",)
 
-            def _fetch_instances(self):
-                pass
+            def __init__(self, raw):
+                self.raw = raw
 
+            upper_mapper = property(lambda self: self.raw >> 4)
+            format = property(lambda self: (self.raw >> 2) & 0x03)
+            playchoice10 = property(lambda self: bool(self.raw & 0x02))
+            vs_unisystem = property(lambda self: bool(self.raw & 0x01))
 
-        class F9(KaitaiStruct):
+        class F9:
             """
             .. seealso::
                Source - https://www.nesdev.org/wiki/INES#Flags_9
@@ -179,69 +246,58 @@ class Ines(KaitaiStruct):
             class TvSystem(IntEnum):
                 ntsc = 0
                 pal = 1
-            def __init__(self, _io, _parent=None, _root=None):
-                super(Ines.Header.F9, self).__init__(_io)
-                self._parent = _parent
-                self._root = _root
-                self._read()
 
-            def _read(self):
-                self.reserved = self._io.read_bits_int_be(7)
-                self.tv_system = KaitaiStream.resolve_enum(Ines.Header.F9.TvSystem, self._io.read_bits_int_be(1))
+            __slots__ = ("raw",)
 
+            def __init__(self, raw):
+                self.raw = raw
 
-            def _fetch_instances(self):
-                pass
+            reserved = property(lambda self: self.raw >> 1)
+            tv_system = property(lambda self: Ines.Header.F9.TvSystem(self.raw & 0x01))
 
-
-        @property
-        def mapper(self):
+        class F10:
             """
             .. seealso::
-               Source - https://www.nesdev.org/wiki/Mapper
+               Source - https://www.nesdev.org/wiki/INES#Flags_10
             """
-            if hasattr(self, '_m_mapper'):
-                return self._m_mapper
 
-            self._m_mapper = self.f6.lower_mapper | self.f7.upper_mapper << 4
-            return getattr(self, '_m_mapper', None)
+            class TvSystem(IntEnum):
+                ntsc = 0
+                dual1 = 1
+                pal = 2
+                dual2 = 3
+
+            __slots__ = ("raw",)
+
+            def __init__(self, raw):
+                self.raw = raw
 
+            reserved1 = property(lambda self: self.raw >> 6)
+            bus_conflict = property(lambda self: bool(self.raw & 0x20))
+            prg_ram = property(lambda self: bool(self.raw & 0x10))
+            reserved2 = property(lambda self: (self.raw >> 2) & 0x03)
+            tv_system = property(lambda self: Ines.Header.F10.TvSystem(self.raw & 0x03))
 
-    class Playchoice10(KaitaiStruct):
+    class Playchoice10:
         """
         .. seealso::
            Source - https://www.nesdev.org/wiki/PC10_ROM-Images
         """
-        def __init__(self, _io, _parent=None, _root=None):
-            super(Ines.Playchoice10, self).__init__(_io)
-            self._parent = _parent
-            self._root = _root
-            self._read()
-
-        def _read(self):
-            self.inst_rom = self._io.read_bytes(8192)
-            self.prom = Ines.Playchoice10.Prom(self._io, self, self._root)
-
-
-        def _fetch_instances(self):
-            pass
-            self.prom._fetch_instances()
-
-        class Prom(KaitaiStruct):
-            def __init__(self, _io, _parent=None, _root=None):
-                super(Ines.Playchoice10.Prom, self).__init__(_io)
-                self._parent = _parent
-                self._root = _root
-                self._read()
-
-            def _read(self):
-                self.data = self._io.read_bytes(16)
-                self.counter_out = self._io.read_bytes(16)
-
 
-            def _fetch_instances(self):
-                pass
+        __slots__ = ("inst_rom", "prom")
 
+        def __init__(self, view):
+            self.inst_rom = view[:PC10_INST_ROM_SIZE]
+            self.prom = Ines.Playchoice10.Prom(view[PC10_INST_ROM_SIZE:])
 
+        def release(self):
+            self.inst_rom.release()
+            self.prom.data.release()
+            self.prom.counter_out.release()
 
+        class Prom:
+            __slots__ = ("data", "counter_out")
 
+            def __init__(self, view):
+                self.data = view[:PC10_PROM_SIZE]
+                self.counter_out = view[PC10_PROM_SIZE : 2 * PC10_PROM_SIZE]
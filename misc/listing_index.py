@@ -0,0 +1,598 @@
+# listing_index.py
+# Usage: python listing_index.py ../DonkeyKongDisassembly.asm '$FB75' NMI_C85F
+#        python listing_index.py ../DonkeyKongDisassembly.asm DonkeyKongDisassembly.asm:2900 --version jp
+#        python listing_index.py ../DonkeyKongDisassembly.asm --offset 0x0413
+"""
+Map ROM addresses to source lines and labels to addresses, from an index
+kept next to the main file (.listing_index.db, an SQLite database).
+
+The index is built once per game version from an asm6f/asm6 listing (-l):
+every listing line is lined up with the source line it came from by walking
+the main file and its incsrc includes in assembly order (lines of a macro
+expansion count for the line invoking the macro), so each byte of the ROM
+gets its CPU address, image offset, file, line and the label it falls under.
+Without an assembler, asm6_eval.py lays the program out instead. The index
+also keeps the assembled image and a hash of every file in the include
+closure, and is only rebuilt when one of them changes (or with --rebuild).
+A SourceIndex opened with a snapshot of files that were overwritten since
+(see asm_build.py) indexes and checks them as they were.
+
+Queries are CPU addresses ($C85F, 0xC85F), image offsets (with --offset),
+labels (NMI_C85F) or file:line (the first byte at or after that line). From
+Python:
+
+    with SourceIndex("DonkeyKongDisassembly.asm") as index:
+        index.ensure(version=0)
+        index.locate(0xC85F, version=0)  # Location(address, offset, ...)
+        index.address_of("NMI_C85F", version=0)
+"""
+
+import argparse
+import collections
+import hashlib
+import json
+import pathlib
+import re
+import sqlite3
+import sys
+import tempfile
+import time
+
+import asm6_eval
+from asm_build import (
+    INCLUDE_RE,
+    SOURCE_INCLUDES,
+    find_assembler,
+    include_closure,
+    prepare_version_workspace,
+    read_source,
+    record_assembler_run,
+    run_assembler,
+)
+from nes_machine import parse_version
+
+INDEX_NAME = ".listing_index.db"
+SCHEMA_VERSION = 1  # bump when the tables change
+LISTMAX = 8  # bytes asm6 shows per listing line before cutting it short
+MATCH_WINDOW = 2000  # source lines searched ahead for an unexpected listing line
+LISTING_TIMEOUT = 60  # seconds per assembler run
+
+LISTING_RE = re.compile(r"^([0-9A-Fa-f]{5})\s?((?:[0-9A-F]{2}\s)*)(\.*)(.*)$")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS builds (
+    version TEXT PRIMARY KEY, method TEXT, sources TEXT, image BLOB
+);
+CREATE TABLE IF NOT EXISTS files (id INTEGER PRIMARY KEY, path TEXT UNIQUE);
+CREATE TABLE IF NOT EXISTS lines (
+    version TEXT, address INTEGER, offset INTEGER, size INTEGER,
+    file INTEGER, line INTEGER, label TEXT
+);
+CREATE INDEX IF NOT EXISTS lines_address ON lines (version, address);
+CREATE INDEX IF NOT EXISTS lines_offset ON lines (version, offset);
+CREATE INDEX IF NOT EXISTS lines_source ON lines (version, file, line);
+CREATE TABLE IF NOT EXISTS labels (
+    version TEXT, name TEXT, address INTEGER, file INTEGER, line INTEGER,
+    PRIMARY KEY (version, name)
+);
+"""
+
+# address is the CPU address (None for bytes outside any org, like the iNES
+# header), offset the position in the image; path is relative to the main
+# file's directory and line is 1-based
+Location = collections.namedtuple("Location", "address offset size path line label")
+Label = collections.namedtuple("Label", "name address path line")
+
+
+class ListingError(ValueError):
+    pass
+
+
+def version_key(version):
+    return "default" if version is None else str(version)
+
+
+
+def source_closure(main_file, snapshot=None):
+    """
+    [(relative path, sha256)] of main_file and everything it includes
+    (incsrc and incbin, both branches of every conditional), sorted by path.
+    Missing files are left out; the assembler reports those.
+    """
+    return [
+        (rel.as_posix(), hashlib.sha256(read_source(main_file, rel, snapshot)).hexdigest())
+        for rel in include_closure(main_file, snapshot)
+    ]
+
+
+def source_lines(main_file, snapshot=None):
+    """
+    Yield (relative path, 0-based line, text) for the main file with every
+    incsrc expanded in place, the order the assembler reads them in.
+    """
+    main_file = pathlib.Path(main_file)
+
+    def walk(rel, depth):
+        data = read_source(main_file, rel, snapshot) if depth <= 32 else None
+        if data is None:
+            return
+        for number, line in enumerate(data.decode("utf-8", errors="replace").splitlines()):
+            yield rel, number, line
+            m = INCLUDE_RE.match(line)
+            if m and m.group(1).lower() in SOURCE_INCLUDES:
+                yield from walk(pathlib.Path(m.group(2) or m.group(3)).as_posix(), depth + 1)
+
+    yield from walk(main_file.name, 0)
+
+
+def _label(text):
+    """Global label defined on a source line, or None."""
+    try:
+        label, _, _ = asm6_eval.parse_line(text)
+    except asm6_eval.EvalError:
+        return None
+    if not label or label[0] in "@+-.":
+        return None
+    return label
+
+
+def _normalized(text):
+    return " ".join(text.split())
+
+
+def parse_listing(text):
+    """
+    Yield (address or None, [bytes], cut short, source text) per listing line.
+    asm6 prints a line as a 5 digit address, up to LISTMAX bytes (followed by
+    dots when there were more) and the source text.
+    """
+    for line in text.splitlines():
+        m = LISTING_RE.match(line)
+        if not m:
+            yield None, [], False, line
+            continue
+        data = [int(b, 16) for b in m.group(2).split()]
+        yield int(m.group(1), 16), data, bool(m.group(3)) or len(data) > LISTMAX, m.group(4)
+
+
+def records_from_listing(listing, image, main_file, snapshot=None):
+    """
+    Line up an assembler listing with the source and return (lines, labels):
+    lines are (address, offset, size, path, line, label) for every source line
+    that emitted bytes, labels (name, address, path, line). Raises ListingError
+    if the listing does not describe image.
+    """
+    stream = list(source_lines(main_file, snapshot))
+    texts = [_normalized(text) for _, _, text in stream]
+    expansions = set()
+    body = None
+    for text in texts:
+        word = text.split(" ", 1)[0].lower().lstrip(".")
+        if word in ("macro", "rept"):
+            body = []
+        elif word in ("endm", "endr"):
+            expansions.update(body or ())
+            body = None
+        elif body is not None and text:
+            body.append(text)
+
+    items = []  # [address, data, cut short, stream index]
+    cursor = 0
+    last = None
+    for address, data, cut, text in parse_listing(listing):
+        text = _normalized(text)
+        owner = None
+        if cursor < len(texts) and texts[cursor] == text:
+            owner = cursor
+        elif text and text not in expansions:
+            end = min(cursor + MATCH_WINDOW, len(texts))
+            owner = next((j for j in range(cursor, end) if texts[j] == text), None)
+        if owner is not None:
+            cursor = owner + 1
+            last = owner
+        else:
+            owner = last
+        items.append([address, data, cut, owner])
+
+    lines = []
+    labels = []
+    offset = 0
+    label = None
+    seen = set()
+    for i, (address, data, cut, owner) in enumerate(items):
+        if owner is None:
+            continue
+        rel, number, text = stream[owner]
+        if owner not in seen:
+            seen.add(owner)
+            name = _label(text)
+            if name and address is not None:
+                label = name
+                labels.append((name, address, rel, number + 1))
+        if address is None or not data:
+            continue
+        size = len(data)
+        if cut:
+            later = next((e[0] for e in items[i + 1 :] if e[0] is not None and e[1]), None)
+            if later is not None and later > address:
+                size = later - address
+        if image[offset : offset + len(data[:LISTMAX])] != bytes(data[:LISTMAX]):
+            raise ListingError(
+                "listing line {}:{} does not match the image at offset {}".format(
+                    rel, number + 1, offset
+                )
+            )
+        lines.append((address, offset, size, rel, number + 1, label))
+        offset += size
+    if not lines:
+        raise ListingError("no bytes found in the listing")
+    return lines, labels
+
+
+def records_from_program(program, main_file, snapshot=None):
+    """(lines, labels) like records_from_listing(), from an asm6_eval.Program."""
+    base = pathlib.Path(main_file).resolve().parent
+    spans = {}
+    for path, entries in program.spans.items():
+        rel = pathlib.Path(path).relative_to(base).as_posix()
+        for number, offset, address, size in entries:
+            spans.setdefault((rel, number), []).append((offset, address, size))
+
+    lines = []
+    labels = []
+    label = None
+    for rel, number, text in source_lines(main_file, snapshot):
+        name = _label(text)
+        if name and name in program.symbols:
+            label = name
+            labels.append((name, program.symbols[name], rel, number + 1))
+        for offset, address, size in spans.pop((rel, number), ()):
+            if size:
+                lines.append((address, offset, size, rel, number + 1, label))
+    return lines, labels
+
+
+def run_listing(assembler, main_file, version=None, snapshot=None):
+    """
+    Assemble main_file with a listing, with its Version define set to version
+    (in a temp copy of the include closure, also used for a snapshot) unless
+    that is None. Returns (listing text, image bytes).
+    """
+    main_file = pathlib.Path(main_file).resolve()
+    with tempfile.TemporaryDirectory(prefix="listing_index_") as tmp:
+        tmp = pathlib.Path(tmp)
+        source = main_file
+        if version is not None or snapshot:
+            source = prepare_version_workspace(main_file, version, tmp, snapshot)
+        output = tmp / "output.nes"
+        listing = tmp / "output.lst"
+        success, stdout, stderr = run_assembler(
+            assembler,
+            source,
+            output,
+            listing_file=listing,
+            version=version,
+            timeout=LISTING_TIMEOUT,
+        )
+        if not success or not listing.exists():
+            raise ListingError("{} failed: {}".format(assembler, (stderr or stdout).strip()))
+        return (
+            listing.read_text(encoding="utf-8", errors="replace"),
+            output.read_bytes(),
+        )
+
+
+class SourceIndex:
+    """
+    The address <-> source line index of one main file. version is the value
+    of the Version define (0-2) or None for the one in the source.
+    """
+
+    def __init__(self, main_file, path=None, snapshot=None):
+        self.main_file = pathlib.Path(main_file).resolve()
+        self.snapshot = snapshot or {}
+        self.path = pathlib.Path(path) if path else self.main_file.parent / INDEX_NAME
+        self.db = sqlite3.connect(str(self.path))
+        self.db.executescript(SCHEMA)
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'schema'").fetchone()
+        if row is None or row[0] != str(SCHEMA_VERSION):
+            with self.db:
+                for table in ("builds", "files", "lines", "labels"):
+                    self.db.execute("DELETE FROM {}".format(table))
+                self.db.execute(
+                    "INSERT OR REPLACE INTO meta VALUES ('schema', ?)", (str(SCHEMA_VERSION),)
+                )
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def method(self, version=None):
+        """How the version was indexed ("asm6f", "asm6" or "eval"), None if it was not."""
+        row = self.db.execute(
+            "SELECT method FROM builds WHERE version = ?", (version_key(version),)
+        ).fetchone()
+        return row[0] if row else None
+
+    def fresh(self, version=None, method=None):
+        """True if the version is indexed (by method, if given) from the current sources."""
+        row = self.db.execute(
+            "SELECT method, sources FROM builds WHERE version = ?", (version_key(version),)
+        ).fetchone()
+        if row is None or (method and row[0] != method):
+            return False
+        for rel, digest in json.loads(row[1]):
+            data = read_source(self.main_file, rel, self.snapshot)
+            if data is None or hashlib.sha256(data).hexdigest() != digest:
+                return False
+        return True
+
+    def ensure(self, version=None, assembler=None, program=None, listing=None):
+        """
+        Build the version's index unless it is fresh. Returns True if it was
+        (re)built. See build() for assembler, program and listing; an index
+        built some other way than asked for is not fresh, unless neither
+        assembler nor program is given.
+        """
+        wanted = pathlib.Path(assembler).stem if assembler else None
+        if program is not None and not assembler:
+            wanted = "eval"
+        if self.fresh(version, wanted):
+            return False
+        self.build(version, assembler, program, listing)
+        return True
+
+    def build(self, version=None, assembler=None, program=None, listing=None):
+        """
+        Index the version from the listing of assembler, or from program (an
+        asm6_eval.Program of that version) or a fresh asm6_eval run if no
+        assembler is given. listing, if given, is the (listing text, image) of
+        an earlier run of assembler on the version (e.g. from a cache), so it
+        is not run again. A listing that cannot be lined up with the source
+        falls back to asm6_eval for the lines, keeping the assembled image.
+        Returns the method recorded.
+        """
+        sources = source_closure(self.main_file, self.snapshot)
+        lines = None
+        if assembler:
+            listing, image = listing or run_listing(
+                assembler, self.main_file, version, self.snapshot
+            )
+            method = pathlib.Path(assembler).stem
+            try:
+                lines, labels = records_from_listing(listing, image, self.main_file, self.snapshot)
+            except ListingError:
+                program = None
+        else:
+            method = "eval"
+        if lines is None:
+            if program is None:
+                program, lines, labels = self._evaluate(version)
+            else:
+                lines, labels = records_from_program(program, self.main_file, self.snapshot)
+            if not assembler:
+                image = program.image
+
+        key = version_key(version)
+        with self.db:
+            for table in ("builds", "lines", "labels"):
+                self.db.execute("DELETE FROM {} WHERE version = ?".format(table), (key,))
+            self.db.execute(
+                "INSERT INTO builds VALUES (?, ?, ?, ?)",
+                (key, method, json.dumps(sources), image),
+            )
+            files = {}
+            for rel in sorted({r[3] for r in lines} | {r[2] for r in labels}):
+                self.db.execute("INSERT OR IGNORE INTO files (path) VALUES (?)", (rel,))
+                files[rel] = self.db.execute(
+                    "SELECT id FROM files WHERE path = ?", (rel,)
+                ).fetchone()[0]
+            self.db.executemany(
+                "INSERT INTO lines VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    (key, address, offset, size, files[rel], line, label)
+                    for address, offset, size, rel, line, label in lines
+                ),
+            )
+            self.db.executemany(
+                "INSERT OR REPLACE INTO labels VALUES (?, ?, ?, ?, ?)",
+                (
+                    (key, name, address, files[rel], line)
+                    for name, address, rel, line in labels
+                ),
+            )
+        return method
+
+    def _evaluate(self, version):
+        """(program, lines, labels) of the version laid out by asm6_eval."""
+        overrides = {"Version": version} if version is not None else None
+        with tempfile.TemporaryDirectory(prefix="listing_index_") as tmp:
+            main = self.main_file
+            if self.snapshot:
+                main = prepare_version_workspace(main, None, tmp, self.snapshot)
+            started = time.perf_counter()
+            program = asm6_eval.assemble(main, overrides, allow_missing=True)
+            record_assembler_run("asm6_eval", main, time.perf_counter() - started, True, version)
+            return (program,) + records_from_program(program, main)
+
+    def _location(self, where, args):
+        row = self.db.execute(
+            "SELECT address, offset, size, path, line, label FROM lines"
+            " JOIN files ON files.id = lines.file WHERE " + where,
+            args,
+        ).fetchone()
+        return Location(*row) if row else None
+
+    def locate(self, address, version=None):
+        """Location of the line that assembled the byte at a CPU address, or None."""
+        found = self._location(
+            "version = ? AND address <= ? ORDER BY address DESC, offset DESC LIMIT 1",
+            (version_key(version), address),
+        )
+        if found is None or address >= found.address + found.size:
+            return None
+        return found
+
+    def locate_offset(self, offset, version=None):
+        """Location of the line that assembled the byte at an image offset, or None."""
+        found = self._location(
+            "version = ? AND offset <= ? ORDER BY offset DESC LIMIT 1",
+            (version_key(version), offset),
+        )
+        if found is None or offset >= found.offset + found.size:
+            return None
+        return found
+
+    def locate_line(self, path, line, version=None):
+        """Location of the first bytes assembled at or after path:line, or None."""
+        return self._location(
+            "version = ? AND path = ? AND line >= ? ORDER BY line, offset LIMIT 1",
+            (version_key(version), pathlib.Path(path).as_posix(), line),
+        )
+
+    def label(self, name, version=None):
+        """Label record of name, or None."""
+        row = self.db.execute(
+            "SELECT name, address, path, line FROM labels"
+            " JOIN files ON files.id = labels.file WHERE version = ? AND name = ?",
+            (version_key(version), name),
+        ).fetchone()
+        return Label(*row) if row else None
+
+    def address_of(self, name, version=None):
+        """Address of the label name, or None."""
+        found = self.label(name, version)
+        return found.address if found else None
+
+    def image(self, version=None):
+        """The image the version was indexed from, or None."""
+        row = self.db.execute(
+            "SELECT image FROM builds WHERE version = ?", (version_key(version),)
+        ).fetchone()
+        return bytes(row[0]) if row else None
+
+    def counts(self, version=None):
+        """(lines, labels) indexed for the version."""
+        key = version_key(version)
+        return tuple(
+            self.db.execute(
+                "SELECT COUNT(*) FROM {} WHERE version = ?".format(table), (key,)
+            ).fetchone()[0]
+            for table in ("lines", "labels")
+        )
+
+
+def describe(location):
+    """Short text for a Location: file:line (label)."""
+    text = "{}:{}".format(location.path, location.line)
+    if location.label:
+        text += " ({})".format(location.label)
+    return text
+
+
+def _number(text):
+    if text.startswith("$"):
+        return int(text[1:], 16)
+    return int(text, 0)
+
+
+def query(index, text, version=None, offsets=False):
+    """Answer one CLI query: (a line of text, True if it was found)."""
+    path, colon, line = text.rpartition(":")
+    if colon and line.isdigit():
+        found = index.locate_line(path, int(line), version)
+        if found is None:
+            return "{}: no bytes assembled at or after this line".format(text), False
+        return (
+            "{}: {} at offset ${:04X}".format(
+                text,
+                "${:04X}".format(found.address) if found.address is not None else "-",
+                found.offset,
+            ),
+            True,
+        )
+    try:
+        number = _number(text)
+    except ValueError:
+        found = index.label(text, version)
+        if found is None:
+            return "{}: no such label".format(text), False
+        return (
+            "{} = ${:04X}  {}:{}".format(found.name, found.address, found.path, found.line),
+            True,
+        )
+    if offsets:
+        found = index.locate_offset(number, version)
+        where = "offset ${:04X}".format(number)
+    else:
+        found = index.locate(number, version)
+        where = "${:04X}".format(number)
+    if found is None:
+        return "{}: not assembled from any source line".format(where), False
+    if offsets and found.address is not None:
+        where += " (${:04X})".format(found.address + number - found.offset)
+    return "{}  {}".format(where, describe(found)), True
+
+
+def main():
+    ap = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    ap.add_argument("input", help="Main assembly file")
+    ap.add_argument("queries", nargs="*", help="$address, label or file:line")
+    ap.add_argument(
+        "--version", type=parse_version, help="Game version: jp, us, gamecube or 0-2"
+    )
+    ap.add_argument(
+        "--offset", action="store_true", help="Numbers are image offsets, not CPU addresses"
+    )
+    ap.add_argument(
+        "--assembler", help="asm6f/asm6 to take the listing from (default: found on PATH)"
+    )
+    ap.add_argument(
+        "--eval", action="store_true", help="Index with asm6_eval.py even if an assembler is found"
+    )
+    ap.add_argument("--index", help="Index file (default: {} next to the input)".format(INDEX_NAME))
+    ap.add_argument("--rebuild", action="store_true", help="Rebuild even if the index is fresh")
+    args = ap.parse_intermixed_args()
+
+    assembler = None if args.eval else args.assembler or find_assembler()
+    try:
+        with SourceIndex(args.input, args.index) as index:
+            if args.rebuild:
+                index.build(args.version, assembler)
+                rebuilt = True
+            else:
+                rebuilt = index.ensure(args.version, assembler)
+            if rebuilt or not args.queries:
+                lines, labels = index.counts(args.version)
+                print(
+                    "{} {}: {} lines, {} labels ({}{})".format(
+                        "Indexed" if rebuilt else "Index of",
+                        pathlib.Path(args.input).name,
+                        lines,
+                        labels,
+                        index.method(args.version),
+                        ", version {}".format(args.version) if args.version is not None else "",
+                    ),
+                    file=sys.stderr if args.queries else sys.stdout,
+                )
+            failed = False
+            for text in args.queries:
+                line, found = query(index, text, args.version, args.offset)
+                print(line)
+                failed = failed or not found
+    except (OSError, ValueError, sqlite3.Error) as e:  # EvalError, ListingError
+        print("Error: {}".format(e), file=sys.stderr)
+        return 1
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
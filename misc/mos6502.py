@@ -0,0 +1,168 @@
+"""
+6502 instruction set tables (official opcodes only, as used by the NES 2A03).
+
+OPCODES maps a mnemonic to {addressing mode: opcode byte}; DECODE is the
+reverse map opcode -> (mnemonic, mode). Addressing modes:
+
+  imp  implied             RTS
+  acc  accumulator         ASL A
+  imm  immediate           LDA #$10
+  zp   zero page           LDA $10
+  zpx  zero page,X         LDA $10,X
+  zpy  zero page,Y         LDX $10,Y
+  abs  absolute            LDA $1234
+  absx absolute,X          LDA $1234,X
+  absy absolute,Y          LDA $1234,Y
+  ind  indirect            JMP ($1234)
+  indx (indirect,X)        LDA ($10,X)
+  indy (indirect),Y        LDA ($10),Y
+  rel  relative            BNE label
+
+CYCLES maps an opcode to its base cycle count; reads through an index that
+crosses a page boundary (opcodes in PAGE_CROSS) take one cycle more, and a
+taken branch one more (two if it lands on another page).
+"""
+
+MODE_SIZES = {
+    "imp": 1,
+    "acc": 1,
+    "imm": 2,
+    "zp": 2,
+    "zpx": 2,
+    "zpy": 2,
+    "abs": 3,
+    "absx": 3,
+    "absy": 3,
+    "ind": 3,
+    "indx": 2,
+    "indy": 2,
+    "rel": 2,
+}
+
+# Zero page mode -> the absolute mode with the same indexing
+ZP_TO_ABS = {"zp": "abs", "zpx": "absx", "zpy": "absy"}
+
+_ALU = ("imm", "zp", "zpx", "abs", "absx", "absy", "indx", "indy")
+_SHIFT = ("acc", "zp", "zpx", "abs", "absx")
+
+
+def _modes(names, opcodes):
+    return dict(zip(names, opcodes))
+
+
+OPCODES = {
+    "adc": _modes(_ALU, (0x69, 0x65, 0x75, 0x6D, 0x7D, 0x79, 0x61, 0x71)),
+    "and": _modes(_ALU, (0x29, 0x25, 0x35, 0x2D, 0x3D, 0x39, 0x21, 0x31)),
+    "asl": _modes(_SHIFT, (0x0A, 0x06, 0x16, 0x0E, 0x1E)),
+    "bcc": {"rel": 0x90},
+    "bcs": {"rel": 0xB0},
+    "beq": {"rel": 0xF0},
+    "bit": {"zp": 0x24, "abs": 0x2C},
+    "bmi": {"rel": 0x30},
+    "bne": {"rel": 0xD0},
+    "bpl": {"rel": 0x10},
+    "brk": {"imp": 0x00},
+    "bvc": {"rel": 0x50},
+    "bvs": {"rel": 0x70},
+    "clc": {"imp": 0x18},
+    "cld": {"imp": 0xD8},
+    "cli": {"imp": 0x58},
+    "clv": {"imp": 0xB8},
+    "cmp": _modes(_ALU, (0xC9, 0xC5, 0xD5, 0xCD, 0xDD, 0xD9, 0xC1, 0xD1)),
+    "cpx": {"imm": 0xE0, "zp": 0xE4, "abs": 0xEC},
+    "cpy": {"imm": 0xC0, "zp": 0xC4, "abs": 0xCC},
+    "dec": {"zp": 0xC6, "zpx": 0xD6, "abs": 0xCE, "absx": 0xDE},
+    "dex": {"imp": 0xCA},
+    "dey": {"imp": 0x88},
+    "eor": _modes(_ALU, (0x49, 0x45, 0x55, 0x4D, 0x5D, 0x59, 0x41, 0x51)),
+    "inc": {"zp": 0xE6, "zpx": 0xF6, "abs": 0xEE, "absx": 0xFE},
+    "inx": {"imp": 0xE8},
+    "iny": {"imp": 0xC8},
+    "jmp": {"abs": 0x4C, "ind": 0x6C},
+    "jsr": {"abs": 0x20},
+    "lda": _modes(_ALU, (0xA9, 0xA5, 0xB5, 0xAD, 0xBD, 0xB9, 0xA1, 0xB1)),
+    "ldx": {"imm": 0xA2, "zp": 0xA6, "zpy": 0xB6, "abs": 0xAE, "absy": 0xBE},
+    "ldy": {"imm": 0xA0, "zp": 0xA4, "zpx": 0xB4, "abs": 0xAC, "absx": 0xBC},
+    "lsr": _modes(_SHIFT, (0x4A, 0x46, 0x56, 0x4E, 0x5E)),
+    "nop": {"imp": 0xEA},
+    "ora": _modes(_ALU, (0x09, 0x05, 0x15, 0x0D, 0x1D, 0x19, 0x01, 0x11)),
+    "pha": {"imp": 0x48},
+    "php": {"imp": 0x08},
+    "pla": {"imp": 0x68},
+    "plp": {"imp": 0x28},
+    "rol": _modes(_SHIFT, (0x2A, 0x26, 0x36, 0x2E, 0x3E)),
+    "ror": _modes(_SHIFT, (0x6A, 0x66, 0x76, 0x6E, 0x7E)),
+    "rti": {"imp": 0x40},
+    "rts": {"imp": 0x60},
+    "sbc": _modes(_ALU, (0xE9, 0xE5, 0xF5, 0xED, 0xFD, 0xF9, 0xE1, 0xF1)),
+    "sec": {"imp": 0x38},
+    "sed": {"imp": 0xF8},
+    "sei": {"imp": 0x78},
+    "sta": _modes(_ALU[1:], (0x85, 0x95, 0x8D, 0x9D, 0x99, 0x81, 0x91)),
+    "stx": {"zp": 0x86, "zpy": 0x96, "abs": 0x8E},
+    "sty": {"zp": 0x84, "zpx": 0x94, "abs": 0x8C},
+    "tax": {"imp": 0xAA},
+    "tay": {"imp": 0xA8},
+    "tsx": {"imp": 0xBA},
+    "txa": {"imp": 0x8A},
+    "txs": {"imp": 0x9A},
+    "tya": {"imp": 0x98},
+}
+
+DECODE = {
+    opcode: (mnemonic, mode)
+    for mnemonic, modes in OPCODES.items()
+    for mode, opcode in modes.items()
+}
+
+BRANCHES = frozenset(m for m, modes in OPCODES.items() if "rel" in modes)
+
+_READS = frozenset(
+    ("adc", "and", "bit", "cmp", "cpx", "cpy", "eor", "lda", "ldx", "ldy", "ora", "sbc")
+)
+_STORES = frozenset(("sta", "stx", "sty"))
+_RMW = frozenset(("asl", "dec", "inc", "lsr", "rol", "ror"))
+_READ_CYCLES = {
+    "imm": 2,
+    "zp": 3,
+    "zpx": 4,
+    "zpy": 4,
+    "abs": 4,
+    "absx": 4,
+    "absy": 4,
+    "indx": 6,
+    "indy": 5,
+}
+_STORE_CYCLES = dict(_READ_CYCLES, absx=5, absy=5, indy=6)
+_RMW_CYCLES = {"acc": 2, "zp": 5, "zpx": 6, "abs": 6, "absx": 7}
+_OTHER_CYCLES = {
+    "brk": 7,
+    "jsr": 6,
+    "rti": 6,
+    "rts": 6,
+    "pha": 3,
+    "php": 3,
+    "pla": 4,
+    "plp": 4,
+}
+
+
+def _cycles(mnemonic, mode):
+    if mnemonic in _READS:
+        return _READ_CYCLES[mode]
+    if mnemonic in _STORES:
+        return _STORE_CYCLES[mode]
+    if mnemonic in _RMW:
+        return _RMW_CYCLES[mode]
+    if mnemonic == "jmp":
+        return 3 if mode == "abs" else 5
+    return _OTHER_CYCLES.get(mnemonic, 2)  # other implied ops, branches not taken
+
+
+CYCLES = {opcode: _cycles(mnemonic, mode) for opcode, (mnemonic, mode) in DECODE.items()}
+
+PAGE_CROSS = frozenset(
+    opcode
+    for opcode, (mnemonic, mode) in DECODE.items()
+    if mnemonic in _READS and mode in ("absx", "absy", "indy")
+)
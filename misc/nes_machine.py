@@ -0,0 +1,394 @@
+# nes_machine.py
+# Usage: python nes_machine.py ../DonkeyKongDisassembly.asm --frames 600 --show RNG_Value
+#        python nes_machine.py DonkeyKong.nes --frames 3600 --show '$21:3' --press 200:start
+"""
+Run a ROM headless: cpu6502.CPU on an NROM memory map with PPU and APU
+register stubs, stepped one video frame at a time.
+
+    machine = Machine.load("../DonkeyKongDisassembly.asm", version=1)
+    machine.run_frames(120)                    # boot to the title screen
+    machine.frame(BUTTONS["start"])            # one frame with Start held
+    machine.peek("ScoreDisplay_Top", 3)        # RAM by symbol (source builds)
+
+A frame starts with vblank: the PPU status flag is set and NMI_C85F runs if
+NMI is enabled in $2000, then the CPU runs until the next frame, 29780.5
+cycles later (an NTSC frame); the flag is cleared VBLANK_CYCLES into the
+frame or when $2002 is read. Enabling NMI while the flag is set fires an NMI
+after the current instruction, as on hardware. Nothing is rendered, but the
+stubs keep the state code can observe or tests may want to check: VRAM
+(nametables with the cartridge's mirroring, palette RAM) written through
+$2006/$2007, OAM (OAMDMA at $4014 costs its 513 cycles), the last value
+written to every APU register and, optionally, a log of APU writes for
+apu_synth.run_apu(). Controllers are read from $4016/$4017 through the usual
+shift registers; the buttons are passed to frame().
+
+Source files are assembled with asm6_eval (no CHR data needed); .nes files
+are loaded as they are. On the command line, --press holds buttons from a
+frame on (frame:button+button[:frames]) and --show prints RAM after the run.
+"""
+
+import argparse
+import hashlib
+import pathlib
+import sys
+import time
+
+import asm6_eval
+from cpu6502 import CPU, ROM_START
+from ines import CHR_BANK_SIZE, HEADER, PRG_BANK_SIZE, TRAINER_SIZE, Ines
+
+FRAME_CYCLES = 29780.5  # CPU cycles per NTSC frame
+VBLANK_CYCLES = 2273  # 20 scanlines of 341 PPU dots, 3 dots per CPU cycle
+DMA_CYCLES = 513  # plus one when it starts on an odd cycle
+RAM_SIZE = 0x0800
+PPU_END = 0x4000
+OAM_DMA = 0x4014
+APU_STATUS = 0x4015
+JOYPAD1 = 0x4016
+JOYPAD2 = 0x4017
+IO_END = 0x4018
+
+# bit of each button in the byte frame() takes (the order they are read in)
+BUTTONS = {
+    "a": 0x01,
+    "b": 0x02,
+    "select": 0x04,
+    "start": 0x08,
+    "up": 0x10,
+    "down": 0x20,
+    "left": 0x40,
+    "right": 0x80,
+}
+
+VERSION_VALUES = {"jp": 0, "us": 1, "gamecube": 2}
+
+
+class PPU:
+    """PPU registers ($2000-$2007) without rendering."""
+
+    def __init__(self, chr_data, vertical_mirroring):
+        self.chr = bytearray(chr_data) or bytearray(CHR_BANK_SIZE)
+        self.writable_chr = not chr_data  # CHR RAM cartridge
+        self.nametables = bytearray(0x800)
+        self.palette = bytearray(32)
+        self.oam = bytearray(256)
+        self.vertical = vertical_mirroring
+        self.ctrl = self.mask = self.status = self.oam_address = 0
+        self.address = 0
+        self.scroll = [0, 0]
+        self.latch = 0  # the $2005/$2006 write toggle
+        self.buffer = 0  # $2007 read buffer
+
+    def _nametable(self, address):
+        table = (address >> 10) & 3
+        table = table & 1 if self.vertical else table >> 1
+        return table << 10 | address & 0x3FF
+
+    def _palette(self, address):
+        address &= 0x1F
+        return address & 0x0F if address & 0x13 == 0x10 else address
+
+    def vram_read(self, address):
+        address &= 0x3FFF
+        if address < 0x2000:
+            return self.chr[address % len(self.chr)]
+        if address < 0x3F00:
+            return self.nametables[self._nametable(address)]
+        return self.palette[self._palette(address)]
+
+    def vram_write(self, address, value):
+        address &= 0x3FFF
+        if address < 0x2000:
+            if self.writable_chr:
+                self.chr[address] = value
+        elif address < 0x3F00:
+            self.nametables[self._nametable(address)] = value
+        else:
+            self.palette[self._palette(address)] = value
+
+    def read(self, register):
+        if register == 2:
+            value = self.status
+            self.status &= 0x7F
+            self.latch = 0
+            return value
+        if register == 4:
+            return self.oam[self.oam_address]
+        if register == 7:
+            address = self.address & 0x3FFF
+            value = self.buffer
+            self.buffer = self.vram_read(address)
+            if address >= 0x3F00:
+                value = self.buffer
+                self.buffer = self.vram_read(address - 0x1000)
+            self._step()
+            return value
+        return 0
+
+    def write(self, register, value):
+        if register == 0:
+            self.ctrl = value
+        elif register == 1:
+            self.mask = value
+        elif register == 3:
+            self.oam_address = value
+        elif register == 4:
+            self.oam[self.oam_address] = value
+            self.oam_address = (self.oam_address + 1) & 0xFF
+        elif register == 5:
+            self.scroll[self.latch] = value
+            self.latch ^= 1
+        elif register == 6:
+            if self.latch:
+                self.address = self.address & 0x3F00 | value
+            else:
+                self.address = (value & 0x3F) << 8 | self.address & 0xFF
+            self.latch ^= 1
+        elif register == 7:
+            self.vram_write(self.address, value)
+            self._step()
+
+    def _step(self):
+        self.address = (self.address + (32 if self.ctrl & 0x04 else 1)) & 0x3FFF
+
+    def nametable(self, table):
+        """The 1 KB of nametable (and attribute) memory shown at $2000 + table * $400."""
+        start = self._nametable(0x2000 + table * 0x400)
+        return bytes(self.nametables[start : start + 0x400])
+
+
+class Machine(CPU):
+    """NROM console: 2 KB RAM (mirrored to $1FFF), PPU and APU stubs, two controllers."""
+
+    __slots__ = (
+        "ppu",
+        "apu",
+        "apu_log",
+        "symbols",
+        "frames",
+        "buttons",
+        "_shift",
+        "_strobe",
+        "_nmi_pending",
+    )
+
+    def __init__(self, prg, chr_data=b"", vertical_mirroring=False, symbols=None):
+        memory = bytearray(0x10000)
+        if not prg or len(prg) > 0x8000:
+            raise ValueError("PRG ROM of {} bytes is not NROM".format(len(prg)))
+        for address in range(ROM_START, 0x10000, len(prg)):
+            memory[address : address + len(prg)] = prg
+        super().__init__(memory)
+        self.ppu = PPU(chr_data, vertical_mirroring)
+        self.apu = bytearray(IO_END - 0x4000)  # last value written to each register
+        self.apu_log = None  # a list to record (frame, register, value) APU writes
+        self.symbols = symbols or {}
+        self.frames = 0
+        self.buttons = [0, 0]
+        self._shift = [0, 0]
+        self._strobe = 0
+        self._nmi_pending = False
+        self.reset()
+
+    @classmethod
+    def from_ines(cls, data, symbols=None):
+        """Machine for an iNES image; a missing CHR ROM (e.g. no DKGFX.bin) is left blank."""
+        data = bytes(data)
+        if len(data) >= HEADER.size:
+            header = HEADER.unpack_from(data)
+            size = HEADER.size + header[1] * PRG_BANK_SIZE + header[2] * CHR_BANK_SIZE
+            size += TRAINER_SIZE if header[3] & 0x04 else 0
+            data += bytes(max(size - len(data), 0))
+        with Ines.from_bytes(data, strict=False) as rom:
+            if rom.header.mapper:
+                raise ValueError("mapper {} is not supported".format(rom.header.mapper))
+            vertical = rom.header.f6.mirroring == 1
+            return cls(bytes(rom.prg_rom), bytes(rom.chr_rom), vertical, symbols)
+
+    @classmethod
+    def load(cls, path, version=None):
+        """Machine for a .nes file, or for a source file assembled with asm6_eval."""
+        if pathlib.Path(path).suffix.lower() == ".nes":
+            return cls.from_ines(pathlib.Path(path).read_bytes())
+        overrides = {"Version": version} if version is not None else {}
+        program = asm6_eval.assemble(path, overrides, allow_missing=True)
+        return cls.from_ines(program.image, program.symbols)
+
+    # -- memory map ----------------------------------------------------------
+
+    def read(self, address):
+        if address < 0x2000:
+            return self.mem[address & 0x7FF]
+        if address < PPU_END:
+            return self.ppu.read(address & 7)
+        if address == JOYPAD1 or address == JOYPAD2:
+            port = address - JOYPAD1
+            if self._strobe:
+                return 0x40 | self.buttons[port] & 1
+            value = self._shift[port] & 1
+            self._shift[port] = self._shift[port] >> 1 | 0x80  # 1s after 8 reads
+            return 0x40 | value
+        if address < IO_END:
+            return 0  # APU status: no length counters are modelled
+        return self.mem[address]
+
+    def write(self, address, value):
+        if address < 0x2000:
+            self.mem[address & 0x7FF] = value
+        elif address < PPU_END:
+            register = address & 7
+            if register == 0 and value & ~self.ppu.ctrl & 0x80 and self.ppu.status & 0x80:
+                self._nmi_pending = True
+                self.stop = 0  # leave run() after this instruction
+            self.ppu.write(register, value)
+        elif address == OAM_DMA:
+            page = value << 8
+            self.ppu.oam[:] = bytes(self.read(page + i) for i in range(256))
+            self.cycles += DMA_CYCLES + (self.cycles & 1)
+        elif address == JOYPAD1:
+            self._strobe = value & 1
+            if self._strobe:
+                self._shift = list(self.buttons)
+        elif address < IO_END:
+            self.apu[address - 0x4000] = value
+            if self.apu_log is not None:
+                self.apu_log.append((self.frames, address, value))
+
+    # -- frames ----------------------------------------------------------------
+
+    def _run_to(self, target):
+        while self.cycles < target:
+            self.run(target - self.cycles)
+            if self._nmi_pending:
+                self._nmi_pending = False
+                self.nmi()
+
+    def frame(self, buttons=0, buttons2=0):
+        """Run one frame with the given controller buttons (see BUTTONS) held."""
+        self.buttons = [buttons, buttons2]
+        start = int(self.frames * FRAME_CYCLES)
+        self.ppu.status |= 0x80
+        if self.ppu.ctrl & 0x80:
+            self.nmi()
+        self._run_to(start + VBLANK_CYCLES)
+        self.ppu.status &= 0x1F
+        self.frames += 1
+        self._run_to(int(self.frames * FRAME_CYCLES))
+
+    def run_frames(self, count, buttons=0, buttons2=0):
+        for _ in range(count):
+            self.frame(buttons, buttons2)
+
+    # -- inspection ----------------------------------------------------------
+
+    def address(self, name):
+        """CPU address of a symbol, or of a number like $21 or 0x21."""
+        if name in self.symbols:
+            return self.symbols[name]
+        try:
+            return asm6_eval.evaluate(name, self.symbols.__getitem__)
+        except (asm6_eval.EvalError, KeyError):
+            raise ValueError("unknown symbol '{}'".format(name)) from None
+
+    def peek(self, where, size=None):
+        """The byte (or size bytes) at an address or symbol, without side effects."""
+        address = self.address(where) if isinstance(where, str) else where
+        if size is not None:
+            return bytes(self.peek(address + i) for i in range(size))
+        return self.mem[address & 0x7FF if address < 0x2000 else address & 0xFFFF]
+
+    def ram_hash(self):
+        """SHA-1 of the 2 KB of RAM (hex)."""
+        return hashlib.sha1(bytes(self.mem[:RAM_SIZE])).hexdigest()
+
+
+def parse_version(text):
+    if text.isdigit():
+        return int(text)
+    if text.lower() not in VERSION_VALUES:
+        raise argparse.ArgumentTypeError("unknown version '{}'".format(text))
+    return VERSION_VALUES[text.lower()]
+
+
+def parse_press(text):
+    """frame:button+button[:frames] -> (first frame, frames, buttons byte)."""
+    parts = text.split(":")
+    try:
+        if len(parts) not in (2, 3):
+            raise ValueError
+        buttons = 0
+        for name in parts[1].lower().split("+"):
+            buttons |= BUTTONS[name]
+        return int(parts[0]), int(parts[2]) if len(parts) == 3 else 1, buttons
+    except (KeyError, ValueError):
+        raise argparse.ArgumentTypeError(
+            "expected frame:button[+button][:frames], not '{}'".format(text)
+        ) from None
+
+
+def main():
+    ap = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    ap.add_argument("input", help="Main assembly file or .nes ROM")
+    ap.add_argument(
+        "--version", type=parse_version, help="Game version: jp, us, gamecube or 0-2"
+    )
+    ap.add_argument("--frames", type=int, default=600, help="Frames to run (default 600)")
+    ap.add_argument(
+        "--press",
+        action="append",
+        type=parse_press,
+        default=[],
+        help="Hold player 1 buttons: frame:button+button[:frames] (repeatable)",
+    )
+    ap.add_argument(
+        "--show",
+        action="append",
+        default=[],
+        help="Print RAM at a symbol or address after the run, e.g. RNG_Value or '$21:3'",
+    )
+    args = ap.parse_args()
+
+    try:
+        machine = Machine.load(args.input, args.version)
+    except (OSError, ValueError) as e:  # EvalError, InesError
+        print("Error: {}".format(e), file=sys.stderr)
+        return 1
+
+    held = [0] * args.frames
+    for first, count, buttons in args.press:
+        for frame in range(first, min(first + count, args.frames)):
+            held[frame] |= buttons
+
+    started = time.perf_counter()
+    try:
+        for buttons in held:
+            machine.frame(buttons)
+    except RuntimeError as e:  # CPUError
+        print("Error: frame {}: {}".format(machine.frames, e), file=sys.stderr)
+        return 1
+    elapsed = time.perf_counter() - started
+
+    print(
+        "{} frames, {} cycles in {:.2f}s ({:.0f} frames/s)".format(
+            machine.frames,
+            machine.cycles,
+            elapsed,
+            machine.frames / elapsed if elapsed else 0,
+        )
+    )
+    print("RAM SHA-1: {}".format(machine.ram_hash()))
+    for item in args.show:
+        name, _, size = item.partition(":")
+        try:
+            data = machine.peek(name, int(size or 1))
+        except ValueError as e:
+            print("Error: {}".format(e), file=sys.stderr)
+            return 1
+        print("{}: {}".format(item, " ".join("{:02X}".format(b) for b in data)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,428 @@
+# rom_catalog.py
+# Usage: python rom_catalog.py --scan /path/to/roms
+#        python rom_catalog.py --known-from-source ../DonkeyKongDisassembly.asm
+#        python rom_catalog.py --known "Donkey Kong (US)=dumps/us.nes"
+#        python rom_catalog.py --mapper 0 --prg-kb 16 --chr-kb 8 --known-good
+"""
+Catalog of a library of iNES ROMs, to find the Donkey Kong dumps (JP/PRG0,
+US/PRG1, the Gamecube extraction) among thousands of .nes files without
+opening each one with the extract scripts.
+
+--scan walks the given directories for .nes files. Of each file only the
+16-byte header is parsed (ines.Ines.Header); PRG and CHR ROM are then
+streamed in chunks through CRC32 and SHA1, on a pool of threads (hashlib
+and zlib release the GIL while hashing). Results are kept in a SQLite
+catalog (.rom_catalog.db in the current directory, or --catalog) keyed by
+path with the file's size and mtime, so a re-scan only reads the files that
+are new or changed, and forgets the ones that are gone. Files that are not
+iNES images are recorded too (with the reason), so they are not re-read.
+
+Known-good hashes are kept in the same catalog:
+  --known-from-source MAIN.asm  the PRG ROM of every game version, laid out
+                                from the disassembly by asm6_eval.py (the
+                                CHR data is not part of the repo)
+  --known NAME=ROM              PRG, CHR and whole-ROM hashes of a verified dump
+
+Queries (combined with AND): --mapper, --prg-kb, --chr-kb, --mirroring,
+--hash (CRC32 or SHA1 of the PRG, the CHR or the whole ROM), --known-good (PRG or
+whole ROM matches a known entry). Each match is printed with its header
+fields, PRG CRC32 and the known entry it matches.
+"""
+
+import argparse
+import collections
+import concurrent.futures
+import hashlib
+import os
+import pathlib
+import sqlite3
+import sys
+import time
+import zlib
+
+from ines import CHR_BANK_SIZE, HEADER, PRG_BANK_SIZE, TRAINER_SIZE, Ines, InesError
+from nes_machine import VERSION_VALUES
+
+CATALOG_NAME = ".rom_catalog.db"
+SCHEMA_VERSION = 1  # bump when the tables change
+CHUNK = 1 << 20  # bytes hashed at once
+BATCH = 500  # rows written per transaction while scanning
+MIRRORING = ("horizontal", "vertical", "four-screen")
+ROM_SUFFIXES = (".nes",)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS roms (
+    path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, error TEXT,
+    mapper INTEGER, nes2 INTEGER, prg_size INTEGER, chr_size INTEGER,
+    mirroring TEXT, battery INTEGER, trainer INTEGER,
+    prg_crc32 TEXT, prg_sha1 TEXT, chr_crc32 TEXT, chr_sha1 TEXT, rom_sha1 TEXT
+);
+CREATE INDEX IF NOT EXISTS roms_prg_sha1 ON roms (prg_sha1);
+CREATE INDEX IF NOT EXISTS roms_rom_sha1 ON roms (rom_sha1);
+CREATE TABLE IF NOT EXISTS known (
+    name TEXT PRIMARY KEY, prg_sha1 TEXT, chr_sha1 TEXT, rom_sha1 TEXT, source TEXT
+);
+"""
+
+ROM_FIELDS = (
+    "mapper nes2 prg_size chr_size mirroring battery trainer "
+    "prg_crc32 prg_sha1 chr_crc32 chr_sha1 rom_sha1"
+)
+RomInfo = collections.namedtuple("RomInfo", ROM_FIELDS)
+
+
+def _hash_range(f, size, *digests):
+    """Feed size bytes of f to every digest; returns the CRC32 of them too."""
+    crc = 0
+    while size > 0:
+        chunk = f.read(min(CHUNK, size))
+        if not chunk:
+            raise InesError("truncated image: {} bytes missing".format(size))
+        crc = zlib.crc32(chunk, crc)
+        for digest in digests:
+            digest.update(chunk)
+        size -= len(chunk)
+    return "{:08x}".format(crc)
+
+
+def read_rom_info(path):
+    """RomInfo of an iNES file, from its header and a streamed pass over PRG and CHR."""
+    with open(str(path), "rb") as f:
+        header = Ines.Header(f.read(HEADER.size), strict=False)
+        if header.f6.trainer:
+            f.seek(TRAINER_SIZE, os.SEEK_CUR)
+        prg_size = header.len_prg_rom * PRG_BANK_SIZE
+        chr_size = header.len_chr_rom * CHR_BANK_SIZE
+        rom = hashlib.sha1()
+        prg = hashlib.sha1()
+        prg_crc = _hash_range(f, prg_size, prg, rom)
+        chr_ = hashlib.sha1()
+        chr_crc = _hash_range(f, chr_size, chr_, rom)
+    if header.f6.four_screen:
+        mirroring = "four-screen"
+    else:
+        mirroring = header.f6.mirroring.name
+    return RomInfo(
+        header.mapper,
+        header.f7.format == 2,
+        prg_size,
+        chr_size,
+        mirroring,
+        header.f6.has_battery_ram,
+        header.f6.trainer,
+        prg_crc,
+        prg.hexdigest(),
+        chr_crc if chr_size else None,
+        chr_.hexdigest() if chr_size else None,
+        rom.hexdigest(),
+    )
+
+
+def _scan_job(item):
+    path, size, mtime_ns = item
+    try:
+        return path, size, mtime_ns, read_rom_info(path), None
+    except (OSError, InesError) as e:
+        return path, size, mtime_ns, None, str(e)
+
+
+def find_roms(roots):
+    """{absolute path: (size, mtime_ns)} of the .nes files under roots (files or directories)."""
+    found = {}
+    pending = [pathlib.Path(root).resolve() for root in roots]
+    while pending:
+        path = pending.pop()
+        if path.is_file():
+            st = path.stat()
+            found[str(path)] = (st.st_size, st.st_mtime_ns)
+            continue
+        try:
+            entries = list(os.scandir(str(path)))
+        except OSError as e:
+            print("Warning: cannot list {}: {}".format(path, e), file=sys.stderr)
+            continue
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                pending.append(pathlib.Path(entry.path))
+            elif entry.name.lower().endswith(ROM_SUFFIXES) and entry.is_file():
+                st = entry.stat()
+                found[entry.path] = (st.st_size, st.st_mtime_ns)
+    return found
+
+
+class Catalog:
+    """The SQLite catalog of scanned ROMs and known-good hashes."""
+
+    def __init__(self, path=None):
+        self.path = pathlib.Path(path or CATALOG_NAME)
+        self.db = sqlite3.connect(str(self.path))
+        self.db.executescript(SCHEMA)
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'schema'").fetchone()
+        if row is None or row[0] != str(SCHEMA_VERSION):
+            with self.db:
+                self.db.execute("DELETE FROM roms")
+                self.db.execute(
+                    "INSERT OR REPLACE INTO meta VALUES ('schema', ?)", (str(SCHEMA_VERSION),)
+                )
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def scan(self, roots, jobs=None):
+        """
+        Bring the catalog up to date with the .nes files under roots: files
+        whose size or mtime changed (or that are new) are read, entries of
+        files under roots that are gone are dropped. Returns a Counter of
+        new, changed, unchanged, removed and error (files found that are
+        not valid iNES images, read now or before).
+        """
+        found = find_roms(roots)
+        prefixes = [str(pathlib.Path(root).resolve()) for root in roots]
+        stats = collections.Counter()
+        stored = {}
+        failed = set()
+        rows = self.db.execute("SELECT path, size, mtime_ns, error FROM roms")
+        for path, size, mtime_ns, error in rows:
+            if any(path == p or path.startswith(p.rstrip(os.sep) + os.sep) for p in prefixes):
+                stored[path] = (size, mtime_ns)
+                if error:
+                    failed.add(path)
+        gone = [path for path in stored if path not in found]
+        todo = []
+        for path, key in found.items():
+            if stored.get(path) == key:
+                stats["unchanged"] += 1
+                stats["error"] += path in failed
+            else:
+                stats["changed" if path in stored else "new"] += 1
+                todo.append((path, key[0], key[1]))
+
+        with self.db:
+            self.db.executemany("DELETE FROM roms WHERE path = ?", [(p,) for p in gone])
+        stats["removed"] = len(gone)
+
+        rows = []
+        with concurrent.futures.ThreadPoolExecutor(jobs) as pool:
+            for path, size, mtime_ns, info, error in pool.map(_scan_job, todo):
+                if error:
+                    stats["error"] += 1
+                    info = RomInfo(*([None] * len(RomInfo._fields)))
+                rows.append((path, size, mtime_ns, error) + tuple(info))
+                if len(rows) >= BATCH:
+                    self._store(rows)
+                    rows = []
+        self._store(rows)
+        return stats
+
+    def _store(self, rows):
+        with self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO roms VALUES ({})".format(", ".join("?" * 16)), rows
+            )
+
+    def add_known(self, name, prg_sha1, chr_sha1=None, rom_sha1=None, source=None):
+        with self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO known VALUES (?, ?, ?, ?, ?)",
+                (name, prg_sha1, chr_sha1, rom_sha1, source),
+            )
+
+    def known(self):
+        return self.db.execute("SELECT name, prg_sha1, chr_sha1, rom_sha1, source FROM known")
+
+    def query(
+        self,
+        mapper=None,
+        prg_kb=None,
+        chr_kb=None,
+        mirroring=None,
+        digest=None,
+        known_good=False,
+        errors=False,
+    ):
+        """
+        Rows (path, mapper, prg_size, chr_size, mirroring, battery, prg_crc32,
+        known name or None, error) of the catalogued files matching every
+        given criterion, by path. digest is a CRC32 or SHA1 (hex) of the PRG
+        or CHR ROM. errors selects the files that are not valid iNES images
+        instead.
+        """
+        where = []
+        params = []
+        for column, value in (("mapper", mapper), ("mirroring", mirroring)):
+            if value is not None:
+                where.append("r.{} = ?".format(column))
+                params.append(value)
+        for column, kb in (("prg_size", prg_kb), ("chr_size", chr_kb)):
+            if kb is not None:
+                where.append("r.{} = ?".format(column))
+                params.append(kb * 1024)
+        if digest is not None:
+            digest = digest.lower()
+            where.append("? IN (r.prg_crc32, r.prg_sha1, r.chr_crc32, r.chr_sha1, r.rom_sha1)")
+            params.append(digest)
+        if known_good:
+            where.append("k.name IS NOT NULL")
+        where.append("r.error IS NOT NULL" if errors else "r.error IS NULL")
+        sql = (
+            "SELECT r.path, r.mapper, r.prg_size, r.chr_size, r.mirroring, r.battery, "
+            "r.prg_crc32, k.name, r.error FROM roms r "
+            "LEFT JOIN known k ON k.rom_sha1 = r.rom_sha1 "
+            "OR (k.prg_sha1 = r.prg_sha1 AND (k.chr_sha1 IS NULL OR k.chr_sha1 = r.chr_sha1)) "
+            "WHERE {} GROUP BY r.path ORDER BY r.path"
+        ).format(" AND ".join(where))
+        return self.db.execute(sql, params).fetchall()
+
+    def count(self):
+        return self.db.execute("SELECT COUNT(*) FROM roms").fetchone()[0]
+
+
+def known_from_source(main_file):
+    """
+    [(name, PRG SHA1)] of every game version of the disassembly, assembled
+    in-process by asm6_eval.py (header and PRG ROM; the CHR data is not in
+    the repo).
+    """
+    import asm6_eval
+
+    entries = []
+    for version, value in sorted(VERSION_VALUES.items(), key=lambda item: item[1]):
+        program = asm6_eval.assemble(main_file, {"Version": value}, allow_missing=True)
+        image = bytes(program.image)
+        header = Ines.Header(image, strict=False)
+        prg = image[HEADER.size : HEADER.size + header.len_prg_rom * PRG_BANK_SIZE]
+        entries.append(
+            (
+                "{} ({})".format(pathlib.Path(main_file).stem, version),
+                hashlib.sha1(prg).hexdigest(),
+            )
+        )
+    return entries
+
+
+def parse_known(text):
+    """NAME=ROM of --known."""
+    name, sep, path = text.partition("=")
+    if not sep or not name or not path:
+        raise argparse.ArgumentTypeError("expected NAME=ROM, not '{}'".format(text))
+    return name, path
+
+
+def main():
+    ap = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    ap.add_argument(
+        "--catalog",
+        help="Catalog database (default {} in the current directory)".format(CATALOG_NAME),
+    )
+    ap.add_argument("--scan", nargs="+", metavar="DIR", help="Directories (or files) to scan")
+    ap.add_argument("--jobs", type=int, help="Files hashed at once (default: Python's pool size)")
+    ap.add_argument(
+        "--known-from-source",
+        metavar="MAIN",
+        help="Record the PRG hashes of every version of this disassembly as known good",
+    )
+    ap.add_argument(
+        "--known",
+        action="append",
+        type=parse_known,
+        default=[],
+        metavar="NAME=ROM",
+        help="Record the hashes of a verified dump as known good (repeatable)",
+    )
+    ap.add_argument("--list-known", action="store_true", help="List the known-good entries")
+    ap.add_argument("--mapper", type=int, help="Only ROMs with this iNES mapper number")
+    ap.add_argument("--prg-kb", type=int, help="Only ROMs with this much PRG ROM (KB)")
+    ap.add_argument(
+        "--chr-kb", type=int, help="Only ROMs with this much CHR ROM (KB, 0 for CHR RAM)"
+    )
+    ap.add_argument("--mirroring", choices=MIRRORING, help="Only ROMs with this mirroring")
+    ap.add_argument("--hash", help="Only ROMs whose PRG, CHR or whole ROM has this CRC32/SHA1")
+    ap.add_argument(
+        "--known-good", action="store_true", help="Only ROMs matching a known-good entry"
+    )
+    ap.add_argument(
+        "--errors", action="store_true", help="List the files that are not valid iNES images"
+    )
+    args = ap.parse_args()
+
+    filters = (args.mapper, args.prg_kb, args.chr_kb, args.mirroring, args.hash)
+    querying = args.errors or args.known_good or any(f is not None for f in filters)
+
+    try:
+        with Catalog(args.catalog) as catalog:
+            if args.known_from_source:
+                for name, prg_sha1 in known_from_source(args.known_from_source):
+                    catalog.add_known(name, prg_sha1, source=args.known_from_source)
+                    print("Known: {} PRG {}".format(name, prg_sha1))
+            for name, path in args.known:
+                info = read_rom_info(path)
+                catalog.add_known(name, info.prg_sha1, info.chr_sha1, info.rom_sha1, path)
+                print("Known: {} PRG {} ROM {}".format(name, info.prg_sha1, info.rom_sha1))
+            if args.list_known:
+                for name, prg_sha1, chr_sha1, rom_sha1, source in catalog.known():
+                    print(
+                        "{}\tPRG {}\tCHR {}\tROM {}\t{}".format(
+                            name, prg_sha1, chr_sha1 or "-", rom_sha1 or "-", source or ""
+                        )
+                    )
+
+            if args.scan:
+                started = time.perf_counter()
+                stats = catalog.scan(args.scan, args.jobs)
+                print(
+                    "Scanned {} file(s) in {:.1f}s: {} new, {} changed, {} unchanged, "
+                    "{} removed; {} not valid iNES images".format(
+                        sum(stats[k] for k in ("new", "changed", "unchanged")),
+                        time.perf_counter() - started,
+                        stats["new"],
+                        stats["changed"],
+                        stats["unchanged"],
+                        stats["removed"],
+                        stats["error"],
+                    )
+                )
+
+            if querying:
+                rows = catalog.query(
+                    args.mapper,
+                    args.prg_kb,
+                    args.chr_kb,
+                    args.mirroring,
+                    args.hash,
+                    args.known_good,
+                    args.errors,
+                )
+                for path, mapper, prg, chr_, mirroring, battery, crc, known, error in rows:
+                    if error:
+                        print("{}\t{}".format(path, error))
+                        continue
+                    print(
+                        "{}\tmapper {}\tPRG {}K\tCHR {}K\t{}{}\tPRG CRC32 {}{}".format(
+                            path,
+                            mapper,
+                            prg // 1024,
+                            chr_ // 1024,
+                            mirroring,
+                            ", battery" if battery else "",
+                            crc,
+                            "\t" + known if known else "",
+                        )
+                    )
+                print("{} of {} catalogued file(s) match".format(len(rows), catalog.count()))
+    except (OSError, ValueError, sqlite3.Error) as e:  # InesError, EvalError
+        print("Error: {}".format(e), file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
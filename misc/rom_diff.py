@@ -0,0 +1,267 @@
+# rom_diff.py
+# Usage: python rom_diff.py reference/us.nes build/us.nes --source ../DonkeyKongDisassembly.asm
+#        python rom_diff.py reference/ builds/ --source ../DonkeyKongDisassembly.asm --limit 5
+"""
+List the byte runs where two iNES ROMs differ, located in the ROM layout and
+in the source.
+
+Both files are mmap'd and compared as NumPy arrays, so a run list costs one
+vectorized comparison whatever the ROM size. Each run is placed with the
+iNES header of the new ROM: header, trainer, PRG ROM (16 KB bank and CPU
+address; one or two banks are mapped like NROM, the last bank of a larger
+ROM at $C000 and the others at $8000) or CHR ROM (8 KB bank and pattern
+table address). Runs crossing a region or bank boundary are split there.
+
+With --source, every PRG run is annotated with the label and source line
+that assembled its first byte, from the listing_index.py index of that main
+file (built from an asm6f listing, and only rebuilt when the sources
+changed). The version indexed is --version, or the one the ROM is named
+after (jp.nes, us.nes, gamecube.nes), or else the source's own.
+
+Directories are compared file by file: every .nes file under OLD is paired
+with the file at the same relative path under NEW, so the builds of each
+commit can be checked against a set of reference dumps in one run. The exit
+status is 0 if every pair is identical and 1 otherwise.
+"""
+
+import argparse
+import collections
+import concurrent.futures
+import mmap
+import os
+import pathlib
+import sqlite3
+import sys
+
+import numpy as np  # pip install numpy
+
+from ines import CHR_BANK_SIZE, HEADER, PRG_BANK_SIZE, TRAINER_SIZE, Ines
+from nes_machine import VERSION_VALUES, parse_version
+
+# region is "header", "trainer", "PRG", "CHR" or "extra" (PlayChoice-10 data,
+# title, or the tail of the longer file); bank and address are None where
+# they do not apply
+Run = collections.namedtuple("Run", "offset size region bank address")
+Layout = collections.namedtuple("Layout", "prg_offset prg_size chr_offset chr_size")
+
+
+class DiffError(ValueError):
+    pass
+
+
+def layout(data):
+    """PRG/CHR placement from the iNES header of data (the rest need not be there)."""
+    header = Ines.Header(data, strict=False)
+    prg_offset = HEADER.size + (TRAINER_SIZE if header.f6.trainer else 0)
+    prg_size = header.len_prg_rom * PRG_BANK_SIZE
+    return Layout(
+        prg_offset, prg_size, prg_offset + prg_size, header.len_chr_rom * CHR_BANK_SIZE
+    )
+
+
+def _regions(rom):
+    """(start, end, region, bank size) in file order."""
+    regions = [(0, HEADER.size, "header", 0)]
+    if rom.prg_offset > HEADER.size:
+        regions.append((HEADER.size, rom.prg_offset, "trainer", 0))
+    regions.append((rom.prg_offset, rom.chr_offset, "PRG", PRG_BANK_SIZE))
+    end = rom.chr_offset + rom.chr_size
+    regions.append((rom.chr_offset, end, "CHR", CHR_BANK_SIZE))
+    return regions, end
+
+
+def cpu_address(rom, bank, within):
+    """CPU address of byte within PRG bank (NROM mapping for up to 32 KB)."""
+    banks = rom.prg_size // PRG_BANK_SIZE
+    if banks <= 2:
+        return 0x10000 - rom.prg_size + bank * PRG_BANK_SIZE + within
+    return (0xC000 if bank == banks - 1 else 0x8000) + within
+
+
+def byte_runs(old, new):
+    """
+    (starts, ends) of the runs of differing bytes in the common length of
+    old and new, as NumPy arrays of offsets.
+    """
+    size = min(len(old), len(new))
+    a = np.frombuffer(old, np.uint8, size)
+    b = np.frombuffer(new, np.uint8, size)
+    changed = np.empty(size + 2, np.int8)
+    changed[0] = changed[-1] = 0
+    np.not_equal(a, b, out=changed[1:-1], casting="unsafe")
+    edges = np.flatnonzero(np.diff(changed))
+    return edges[0::2], edges[1::2]
+
+
+def diff(old, new):
+    """
+    Runs where new differs from old (both bytes-like), split at region and
+    bank boundaries of new's layout. Extra bytes of the longer one are a
+    final "extra" run.
+    """
+    rom = layout(new)
+    regions, end = _regions(rom)
+    starts, ends = byte_runs(old, new)
+    if len(old) != len(new):
+        starts = np.append(starts, min(len(old), len(new)))
+        ends = np.append(ends, max(len(old), len(new)))
+
+    cuts = [r[0] for r in regions] + [end]
+    for start, stop, _, bank_size in regions:
+        if bank_size:
+            cuts.extend(range(start + bank_size, stop, bank_size))
+    cuts = np.unique(cuts)
+    # split every run at the cuts inside it
+    inside = np.searchsorted(cuts, starts, "right"), np.searchsorted(cuts, ends, "left")
+    if np.any(inside[1] > inside[0]):
+        bounds = [
+            np.concatenate(([s], cuts[i:j], [e]))
+            for s, e, i, j in zip(starts, ends, *inside)
+        ]
+        starts = np.concatenate([b[:-1] for b in bounds])
+        ends = np.concatenate([b[1:] for b in bounds])
+
+    runs = []
+    for start, stop in zip(starts.tolist(), ends.tolist()):
+        for first, last, region, bank_size in regions:
+            if first <= start < last:
+                break
+        else:
+            runs.append(Run(start, stop - start, "extra", None, None))
+            continue
+        bank = address = None
+        if bank_size:
+            bank, within = divmod(start - first, bank_size)
+            if region == "PRG":
+                address = cpu_address(rom, bank, within)
+            else:
+                address = within
+        runs.append(Run(start, stop - start, region, bank, address))
+    return runs
+
+
+def diff_files(old_path, new_path):
+    """diff() of two ROM files, read through mmap."""
+    maps = []
+    for path in (old_path, new_path):
+        with open(path, "rb") as f:
+            if not os.fstat(f.fileno()).st_size:  # mmap cannot map empty files
+                raise DiffError("{} is empty".format(path))
+            maps.append(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+    old, new = maps
+    try:
+        return diff(old, new)
+    finally:
+        old.close()
+        new.close()
+
+
+def pair_roms(old, new):
+    """[(label, old path, new path)] for two files, or two directories of .nes files."""
+    old, new = pathlib.Path(old), pathlib.Path(new)
+    if old.is_dir() != new.is_dir():
+        raise DiffError("compare two files or two directories")
+    if not old.is_dir():
+        return [(new.name, old, new)]
+    pairs = []
+    for path in sorted(old.rglob("*")):
+        if path.suffix.lower() != ".nes" or not path.is_file():
+            continue
+        rel = path.relative_to(old)
+        if (new / rel).is_file():
+            pairs.append((rel.as_posix(), path, new / rel))
+        else:
+            print("Warning: {} has no counterpart in {}".format(rel.as_posix(), new))
+    return pairs
+
+
+def rom_version(path, version):
+    """Version to index for a ROM: the one given, or the one it is named after."""
+    if version is not None:
+        return version
+    return VERSION_VALUES.get(pathlib.Path(path).stem.lower())
+
+
+def describe_run(run, index=None, version=None):
+    """One line for a run, annotated from a listing_index.SourceIndex if given."""
+    span = "${:05X}".format(run.offset)
+    if run.size > 1:
+        span += "-${:05X}".format(run.offset + run.size - 1)
+    if run.region == "PRG":
+        where = "PRG {} ${:04X}".format(run.bank, run.address)
+    elif run.region == "CHR":
+        where = "CHR {} ${:04X}".format(run.bank, run.address)
+    else:
+        where = run.region
+    text = "  {:<16} {:<15} {:>6} byte(s)".format(span, where, run.size)
+    if index is not None and run.region == "PRG":
+        location = index.locate_offset(run.offset, version)
+        if location is not None:
+            text += "  {}:{}".format(location.path, location.line)
+            if location.label:
+                text += " ({})".format(location.label)
+    return text
+
+
+def main():
+    ap = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    ap.add_argument("old", help="Reference ROM, or directory of them")
+    ap.add_argument("new", help="ROM to check, or directory of them")
+    ap.add_argument("--source", help="Main assembly file to annotate PRG runs from")
+    ap.add_argument(
+        "--version", type=parse_version, help="Game version of the ROMs: jp, us, gamecube or 0-2"
+    )
+    ap.add_argument("--assembler", help="asm6f/asm6 for the listing (default: found on PATH)")
+    ap.add_argument(
+        "--limit", type=int, default=20, help="Runs listed per ROM, 0 for all (default 20)"
+    )
+    ap.add_argument("--jobs", type=int, help="ROM pairs compared at once (default: CPUs)")
+    args = ap.parse_args()
+
+    try:
+        pairs = pair_roms(args.old, args.new)
+        with concurrent.futures.ThreadPoolExecutor(args.jobs) as pool:
+            results = list(pool.map(lambda p: diff_files(p[1], p[2]), pairs))
+    except (OSError, ValueError) as e:  # DiffError, InesError
+        print("Error: {}".format(e), file=sys.stderr)
+        return 1
+
+    index = None
+    if args.source and any(results):
+        import listing_index
+        from asm_build import find_assembler
+
+        assembler = args.assembler or find_assembler()
+        try:
+            index = listing_index.SourceIndex(args.source)
+            for version in {rom_version(p[2], args.version) for p, r in zip(pairs, results) if r}:
+                index.ensure(version, assembler)
+        except (OSError, ValueError, sqlite3.Error) as e:  # EvalError, ListingError
+            print("Warning: no source annotations ({})".format(e), file=sys.stderr)
+            index = None
+
+    differing = 0
+    for (label, _, new_path), runs in zip(pairs, results):
+        if not runs:
+            print("{}: identical".format(label))
+            continue
+        differing += 1
+        print(
+            "{}: {} run(s), {} byte(s) differ".format(
+                label, len(runs), sum(run.size for run in runs)
+            )
+        )
+        version = rom_version(new_path, args.version)
+        for run in runs[: args.limit or None]:
+            print(describe_run(run, index, version))
+        if args.limit and len(runs) > args.limit:
+            print("  ... {} more".format(len(runs) - args.limit))
+    if len(pairs) > 1:
+        print("{} of {} ROM(s) differ".format(differing, len(pairs)))
+    return 1 if differing else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,412 @@
+# sound_data.py
+# Usage: python sound_data.py ../DonkeyKongDisassembly.asm
+#        python sound_data.py ../DonkeyKongDisassembly.asm --tune title_theme --version jp
+#        python sound_data.py DonkeyKong.nes --tune 25m
+"""
+Decode the music and fanfare data of the sound engine into note events.
+
+Fanfares (Sound_Fanfare) start from a header in FanfareHeaders_FE59: a note
+length offset into ChannelLengthLookup_FB4C, a data pointer and the offsets
+of the triangle and square 1 tracks within that data (0: channel unused).
+Square 2 plays the data from its start, except for the game start fanfare
+and the second part of the death sound, which play square 1 from there
+instead. A fanfare ends when a square track reaches a 0 byte.
+
+- square 1: a byte with bit 7 set picks a new note length (bits 0-2), any
+  other byte is an index into ChannelFrequencyLookup_FB00 (0 high byte: rest)
+- square 2 and triangle: bits 1-5 are the frequency index, bits 6, 7 and 0
+  the note length (AlternateLengthHandler_FAC4)
+
+Music (Sound_Music) only uses the triangle: MusicDataOffsets_FFCD points
+every tune into MusicData_FFD4, where each byte is a note as above, with its
+length from DATA_FB62 instead, and a 0 byte loops the tune.
+
+The decoder steps the engine's own per-frame logic (HandleSound_Music_FD0B,
+HandleSound_Fanfare_FD58 and what they call), so every note comes with the
+frame it starts on, how many frames it lasts and the value written to the
+channel's control register ($4000/$4004: duty and volume, $4008: linear
+counter). register_writes() turns a tune back into the APU register writes
+of each frame, which is what apu_synth.py renders.
+
+Tables are read from the source through asm6_eval.assemble (pick the game
+version with --version) or from an iNES dump; the engine sits at $FA48 in
+every version, so a dump is read at the same addresses.
+"""
+
+import argparse
+import collections
+import math
+import pathlib
+import sys
+
+import asm6_eval
+from ines import Ines
+
+# symbol, and the address used for ROM dumps
+TABLES = {
+    "frequencies": ("ChannelFrequencyLookup_FB00", 0xFB00),
+    "lengths": ("ChannelLengthLookup_FB4C", 0xFB4C),
+    "music_lengths": ("DATA_FB62", 0xFB62),
+    "fanfares": ("FanfareHeaders_FE59", 0xFE59),
+    "music_offsets": ("MusicDataOffsets_FFCD", 0xFFCD),
+    "music": ("MusicData_FFD4", 0xFFD4),
+}
+
+# tunes by bit number of Sound_Fanfare (dead is the second part of
+# Sound_Effect2_PlayerDead) and of Sound_Music
+FANFARES = (
+    "game_start",
+    "phase_complete",
+    "kong_defeated",
+    "phase_start",
+    "kong_falling",
+    "score",
+    "pause",
+    "title_theme",
+    "dead",
+)
+MUSIC = (
+    "music_01",  # same data as 25m
+    "25m",
+    "music_04",
+    "music_08",
+    "100m",
+    "hurry_up",
+    "hammer",
+    "music_80",  # no entry of its own, reads the first byte of MusicData_FFD4
+)
+
+CHANNELS = ("square1", "square2", "triangle")
+REGISTERS = {"square1": 0x4000, "square2": 0x4004, "triangle": 0x4008}
+
+PRG_START = 0x8000
+LENGTH_LOAD = 0x08  # ORed into the high period byte: length counter index 1
+SWEEP_OFF = 0x7F
+SQUARE_MUTED = 0x10  # constant volume 0
+SQUARE1_SILENCED = 0x90  # MuteSquare1_FAE0
+GAME_START_SQUARE = 0x9F  # 50% duty, constant volume 15
+SQUARE1_WITH_TRIANGLE = 0x06  # 12.5% duty, decaying
+SQUARE1_SOLO = 0x86  # 50% duty, decaying
+SQUARE2_VOLUMES = ((0x18, 0x89), (0x10, 0x86), (0x00, 0x84))  # by note length
+MUSIC_TRIANGLE = 0x10  # linear counter of music notes
+TRIANGLE_HELD = 0xFF  # game start fanfare: no linear counter
+TRIANGLE_MAX = 0x38
+FREQUENCY_MASK = 0x3E
+LENGTH_FLAG = 0x80
+END = 0
+MAX_FRAMES = 60 * 60  # give up on a fanfare that has not ended after a minute
+
+VERSION_VALUES = {"jp": 0, "us": 1, "gamecube": 2}
+CPU_CLOCK = 1789773  # NTSC
+NOTE_NAMES = ("C", "C#", "D", "D#", "E", "F", "F#", "G", "G#", "A", "A#", "B")
+
+
+class SoundError(ValueError):
+    pass
+
+
+# index is into ChannelFrequencyLookup_FB00, period is the timer value
+# written (None for a rest: no frequency is written), control the value
+# written to the channel's first register
+Note = collections.namedtuple("Note", "frame channel length index period control")
+
+# frames is the length of the tune: the frame a fanfare ends on (when the
+# engine silences the channels), or one pass of a looping music tune
+Tune = collections.namedtuple("Tune", "name frames notes loops")
+
+
+def cpu_memory(program):
+    """$0000-$FFFF as a bytearray, with the bytes program assembled at their addresses."""
+    memory = bytearray(0x10000)
+    for spans in program.spans.values():
+        for _, offset, address, size in spans:
+            if address is not None and address + size <= len(memory):
+                memory[address : address + size] = program.image[offset : offset + size]
+    return memory
+
+
+def rom_memory(path):
+    """$0000-$FFFF as a bytearray, with the PRG ROM of an iNES dump mapped (and mirrored) from $8000."""
+    memory = bytearray(0x10000)
+    with Ines.from_file(path, strict=False) as rom:
+        prg = bytes(rom.prg_rom)
+    if not prg:
+        raise SoundError("{}: no PRG ROM".format(path))
+    for address in range(PRG_START, len(memory), len(prg)):
+        memory[address : address + len(prg)] = prg[: len(memory) - address]
+    return memory
+
+
+def _length_index(value):
+    """AlternateLengthHandler_FAC4: bits 6, 7 and 0 of value as a number 0-7."""
+    return (value & 1) << 2 | (value >> 7) << 1 | (value >> 6) & 1
+
+
+def note_name(period, triangle=False):
+    """Nearest note (e.g. "A4") to a timer period, or "" if it is out of range."""
+    if period is None or period < 8:
+        return ""
+    hertz = CPU_CLOCK / ((32 if triangle else 16) * (period + 1))
+    key = int(round(12 * math.log2(hertz / 440.0))) + 57
+    if key < 0:
+        return ""
+    return "{}{}".format(NOTE_NAMES[key % 12], key // 12)
+
+
+class SoundData:
+    """Sound tables of one program, read from a $0000-$FFFF memory image."""
+
+    def __init__(self, memory, addresses):
+        self.memory = memory
+        self.addresses = addresses
+
+    @classmethod
+    def from_source(cls, path, version=None):
+        overrides = {"Version": version} if version is not None else {}
+        program = asm6_eval.assemble(path, overrides, allow_missing=True)
+        addresses = {}
+        for table, (symbol, _) in TABLES.items():
+            if symbol not in program.symbols:
+                raise SoundError("{} is not defined".format(symbol))
+            addresses[table] = program.symbols[symbol]
+        return cls(cpu_memory(program), addresses)
+
+    @classmethod
+    def from_rom(cls, path):
+        addresses = {table: address for table, (_, address) in TABLES.items()}
+        return cls(rom_memory(path), addresses)
+
+    @classmethod
+    def load(cls, path, version=None):
+        """from_rom for .nes files, from_source for anything else."""
+        if pathlib.Path(path).suffix.lower() == ".nes":
+            return cls.from_rom(path)
+        return cls.from_source(path, version)
+
+    def byte(self, table, index):
+        return self.memory[(self.addresses[table] + index) & 0xFFFF]
+
+    def _data(self, pointer, index):
+        """(pointer),Y"""
+        return self.memory[(pointer + (index & 0xFF)) & 0xFFFF]
+
+    def period(self, index):
+        """Timer period of a ChannelFrequencyLookup_FB00 index (None: rest)."""
+        low = self.byte("frequencies", index + 1)
+        if not low:
+            return None
+        return (self.byte("frequencies", index) & 7) << 8 | low
+
+    def tune(self, name, loops=1):
+        """Decode a tune of FANFARES or MUSIC (music is repeated loops times)."""
+        if name in FANFARES:
+            return self.fanfare(FANFARES.index(name))
+        if name in MUSIC:
+            return self.music(MUSIC.index(name), loops)
+        raise SoundError("unknown tune '{}'".format(name))
+
+    def fanfare(self, number):
+        """Decode fanfare number (0-8, see FANFARES)."""
+        header = self.addresses["fanfares"] + self.byte("fanfares", number)
+        length_offset = self.memory[header]
+        pointer = self.memory[header + 1] | self.memory[header + 2] << 8
+        triangle = self.memory[header + 3]
+        square1 = self.memory[header + 4]
+        # game start and dead leave Sound_CurrentFanfareID at 0: square 1
+        # plays the data from its start, and there is no square 2
+        primary = number in (0, len(FANFARES) - 1)
+        if primary:
+            square1 = 0
+        square2 = 0
+        timers = dict.fromkeys(CHANNELS, 1)
+        saved = 0  # Sound_SquareNoteLengthSaved is not set up by the engine
+        notes = []
+
+        def lengths(value):
+            index = (_length_index(value) + length_offset) & 0xFF
+            return self.byte("lengths", index)
+
+        def play(frame, channel, length, index, control):
+            period = self.period(index)
+            notes.append(Note(frame, channel, length, index, period, control))
+
+        for frame in range(MAX_FRAMES):
+            if primary or square1:
+                timers["square1"] -= 1
+                if not timers["square1"] & 0xFF:
+                    value = self._data(pointer, square1)
+                    square1 += 1
+                    if value == END:
+                        break
+                    if value & LENGTH_FLAG:
+                        saved = self.byte("lengths", ((value & 7) + length_offset) & 0xFF)
+                        value = self._data(pointer, square1)
+                        square1 += 1
+                    if self.period(value) is None:
+                        control = SQUARE_MUTED
+                    elif primary:
+                        control = GAME_START_SQUARE
+                    elif triangle:
+                        control = SQUARE1_WITH_TRIANGLE
+                    else:
+                        control = SQUARE1_SOLO
+                    play(frame, "square1", saved or 256, value, control)
+                    timers["square1"] = saved
+            if not primary:
+                timers["square2"] -= 1
+                if not timers["square2"] & 0xFF:
+                    value = self._data(pointer, square2)
+                    square2 += 1
+                    if value == END:
+                        break
+                    length = lengths(value)
+                    index = value & FREQUENCY_MASK
+                    control = SQUARE_MUTED
+                    if self.period(index) is not None:
+                        control = next(v for limit, v in SQUARE2_VOLUMES if length >= limit)
+                    play(frame, "square2", length or 256, index, control)
+                    timers["square2"] = length
+            if triangle:
+                timers["triangle"] -= 1
+                if not timers["triangle"] & 0xFF:
+                    value = self._data(pointer, triangle)
+                    triangle += 1
+                    length = lengths(value)
+                    control = min(((length - 2) & 0xFF) << 2 & 0xFF, TRIANGLE_MAX)
+                    if primary:
+                        control = TRIANGLE_HELD
+                    play(frame, "triangle", length or 256, value & FREQUENCY_MASK, control)
+                    timers["triangle"] = length
+        else:
+            raise SoundError(
+                "{} has not ended after {} frames".format(FANFARES[number], MAX_FRAMES)
+            )
+        return Tune(FANFARES[number], frame, _clip(notes, frame), 0)
+
+    def music(self, number, loops=1):
+        """Decode music number (0-7, see MUSIC), repeated loops times."""
+        start = self.byte("music_offsets", number)
+        pointer = self.addresses["music"]
+        notes = []
+        frame = 0
+        for _ in range(max(loops, 1)):
+            offset = start
+            first = frame
+            while True:
+                value = self._data(pointer, offset & 0xFF)
+                offset += 1
+                if value == END:
+                    break
+                if offset - start > 0x100:
+                    raise SoundError("{} does not end".format(MUSIC[number]))
+                length = self.byte("music_lengths", _length_index(value))
+                index = value & FREQUENCY_MASK
+                notes.append(
+                    Note(frame, "triangle", length, index, self.period(index), MUSIC_TRIANGLE)
+                )
+                frame += length or 256
+            if frame == first:
+                raise SoundError("{} has no notes".format(MUSIC[number]))
+        return Tune(MUSIC[number], frame, notes, max(loops, 1))
+
+
+def _clip(notes, end):
+    """Shorten notes still playing at the end of a fanfare."""
+    return [n._replace(length=min(n.length, end - n.frame)) for n in notes]
+
+
+def register_writes(tune):
+    """
+    APU register writes of a tune as (frame, register, value), in the order
+    the engine makes them within a frame.
+    """
+    writes = []
+    for note in sorted(tune.notes, key=lambda n: (n.frame, CHANNELS.index(n.channel))):
+        base = REGISTERS[note.channel]
+        writes.append((note.frame, base, note.control))
+        if note.channel != "triangle":
+            writes.append((note.frame, base + 1, SWEEP_OFF))
+        if note.period is not None:
+            writes.append((note.frame, base + 2, note.period & 0xFF))
+            writes.append((note.frame, base + 3, note.period >> 8 | LENGTH_LOAD))
+    if not tune.loops:
+        # EndFanfare_FDE9
+        writes.append((tune.frames, REGISTERS["square1"], SQUARE1_SILENCED))
+        writes.append((tune.frames, REGISTERS["triangle"], 0))
+        writes.append((tune.frames, REGISTERS["square2"], SQUARE_MUTED))
+    return writes
+
+
+def distinct_tunes(data):
+    """
+    Names of all fanfares and of the music tunes, leaving out music bits that
+    play the same data as a named tune (or an earlier unnamed one).
+    """
+    names = list(FANFARES)
+    seen = set()
+    # the names the game uses (Sound_Music_*) first
+    for name in sorted(MUSIC, key=lambda name: name.startswith("music_")):
+        offset = data.byte("music_offsets", MUSIC.index(name))
+        if offset not in seen:
+            seen.add(offset)
+            names.append(name)
+    return names
+
+
+def print_tune(tune):
+    kind = "{} loop(s)".format(tune.loops) if tune.loops else "fanfare"
+    print("{}: {} frames ({})".format(tune.name, tune.frames, kind))
+    for channel in CHANNELS:
+        notes = [n for n in tune.notes if n.channel == channel]
+        if not notes:
+            continue
+        print("  {}:".format(channel))
+        for note in notes:
+            name = note_name(note.period, channel == "triangle") or "rest"
+            period = "${:03X}".format(note.period) if note.period is not None else "-"
+            print(
+                "    {:5d} +{:<3d} {:<4} {:>4}  index ${:02X}  control ${:02X}".format(
+                    note.frame, note.length, name, period, note.index, note.control
+                )
+            )
+
+
+def parse_version(text):
+    if text.isdigit():
+        return int(text)
+    if text.lower() not in VERSION_VALUES:
+        raise argparse.ArgumentTypeError("unknown version '{}'".format(text))
+    return VERSION_VALUES[text.lower()]
+
+
+def main():
+    ap = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    ap.add_argument("input", help="Main assembly file or .nes ROM")
+    ap.add_argument(
+        "--tune",
+        action="append",
+        default=[],
+        help="Tune to decode (repeatable, default: all): {}".format(
+            ", ".join(FANFARES + MUSIC)
+        ),
+    )
+    ap.add_argument(
+        "--version", type=parse_version, help="Game version: jp, us, gamecube or 0-2"
+    )
+    ap.add_argument("--loops", type=int, default=1, help="Passes of music tunes (default 1)")
+    args = ap.parse_args()
+
+    try:
+        data = SoundData.load(args.input, args.version)
+        for name in args.tune or distinct_tunes(data):
+            print_tune(data.tune(name, args.loops))
+    except (OSError, ValueError) as e:  # EvalError, InesError, SoundError
+        print("Error: {}".format(e), file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
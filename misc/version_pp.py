@@ -0,0 +1,389 @@
+# version_pp.py
+# Usage: python version_pp.py ../DonkeyKongDisassembly.asm -o flat
+#        python version_pp.py ../DonkeyKongDisassembly.asm --line DonkeyKongDisassembly.asm:2010
+"""
+Resolve the Version conditionals of the disassembly without assembling it.
+
+The main file is read once per game version with its includes inlined, the
+Version define pinned (jp, us, gamecube or 0-2) and every if/elseif/else/
+endif, ifdef and ifndef decided on the spot: "Name = value" constants are
+evaluated as they are met, so conditions on Version, MAPPER and the like are
+resolved, while one that needs a label (anything only the assembler knows)
+is an error. Macros (the JPRemap.asm ones) and rept blocks are expanded,
+with labels defined in a macro renamed per expansion like asm6_eval.py does.
+
+The result is a flat stream of the lines that version assembles, with no
+conditionals, macro definitions or incsrc lines left, each mapped back to
+the file and line it came from (and, for macro lines, to the line that
+invoked the macro). -o writes <version>.asm and <version>.map (flat line,
+source line, invoking line) per version; --line shows which versions keep a
+source line and where it lands.
+"""
+
+import argparse
+import collections
+import pathlib
+import re
+import sys
+
+from asm6_eval import EvalError, evaluate, parse_line, split_operands
+from asm_build import INCLUDE_RE, SOURCE_INCLUDES, VERSION_DEFINE_RE
+from nes_machine import VERSION_VALUES, parse_version
+
+CONDITIONALS = frozenset(("if", "ifdef", "ifndef", "elseif", "else", "endif"))
+MAX_DEPTH = 32
+
+# path is relative to the main file's directory and line 0-based; macro is
+# the (path, line) of the invocation for lines expanded from a macro or rept
+FlatLine = collections.namedtuple("FlatLine", "path line text macro")
+# a conditional in one file: line numbers of its if, of each elseif/else and
+# of its endif
+Region = collections.namedtuple("Region", "start branches end")
+
+
+class PreprocessError(ValueError):
+    pass
+
+
+def conditional_regions(lines):
+    """
+    Match the if/elseif/else/endif lines of one file (a list of line texts).
+    Returns a list of Region sorted by start; raises PreprocessError if they
+    do not balance.
+    """
+    regions = []
+    stack = []
+    for number, line in enumerate(lines):
+        try:
+            _, op, _ = parse_line(line)
+        except EvalError:
+            continue
+        if op in ("if", "ifdef", "ifndef"):
+            stack.append((number, []))
+        elif op in ("elseif", "else", "endif"):
+            if not stack:
+                raise PreprocessError("line {}: {} without if".format(number + 1, op))
+            if op == "endif":
+                start, branches = stack.pop()
+                regions.append(Region(start, tuple(branches), number))
+            else:
+                stack[-1][1].append(number)
+    if stack:
+        raise PreprocessError("line {}: if without endif".format(stack[-1][0] + 1))
+    return sorted(regions)
+
+
+class Flattened:
+    """The lines one version assembles (see flatten())."""
+
+    def __init__(self, version, lines, skipped=None):
+        self.version = version
+        self.lines = lines
+        self._active = None
+        self._skipped = skipped or {}
+
+    def __len__(self):
+        return len(self.lines)
+
+    def text(self):
+        return "".join(line.text + "\n" for line in self.lines)
+
+    def origin(self, index):
+        """(path, 0-based line) flat line index came from."""
+        line = self.lines[index]
+        return line.path, line.line
+
+    def active(self, path):
+        """0-based lines of path that are part of the stream (not through a macro)."""
+        if self._active is None:
+            self._active = {}
+            for line in self.lines:
+                if line.macro is None:
+                    self._active.setdefault(line.path, set()).add(line.line)
+        return self._active.get(pathlib.PurePath(path).as_posix(), set())
+
+    def skipped(self, path):
+        """0-based lines of path inside a conditional branch this version does not take."""
+        return self._skipped.get(pathlib.PurePath(path).as_posix(), set())
+
+    def files(self):
+        """Paths (relative to the main file) of the source files in the stream."""
+        return {line.path for line in self.lines}
+
+    def position(self, path, line):
+        """Flat index of path:line (0-based), or None if this version drops it."""
+        path = pathlib.PurePath(path).as_posix()
+        for i, flat in enumerate(self.lines):
+            if flat.path == path and flat.line == line and flat.macro is None:
+                return i
+        return None
+
+
+class _Flattener:
+    def __init__(self, base, version, read=None):
+        self.base = base
+        self.version = version
+        self.read = read
+        self.skipped = {}
+        self.constants = {}
+        self.labels = set()
+        self.macros = {}
+        self.expansions = 0
+        self.out = []
+
+    def lookup(self, name):
+        if name in self.constants:
+            return self.constants[name]
+        raise EvalError("'{}' is not a constant".format(name))
+
+    def run_file(self, rel, depth=0):
+        if depth > MAX_DEPTH:
+            raise PreprocessError("{}: includes nested too deeply".format(rel))
+        path = self.base / rel
+        text = self.read(rel) if self.read else None
+        if text is None:
+            try:
+                text = path.read_text(encoding="utf-8", errors="replace")
+            except OSError as e:
+                raise PreprocessError("cannot read {}: {}".format(path, e))
+        self.run_lines(((rel, n, line) for n, line in enumerate(text.splitlines())), None, depth)
+
+    def run_lines(self, numbered, macro, depth):
+        conds = []  # [parent active, this branch taken, some branch taken]
+        recording = None  # [kind, header, body, nesting, where]
+        for rel, number, line in numbered:
+            where = "{}:{}".format(rel, number + 1)
+            try:
+                label, op, args = parse_line(line)
+            except EvalError:
+                label, op, args = None, None, None
+            active = not conds or conds[-1][1]
+
+            if recording is not None:
+                if op in ("macro", "rept"):
+                    recording[3] += 1
+                elif op in ("endm", "endr"):
+                    recording[3] -= 1
+                if recording[3] >= 0:
+                    recording[2].append((rel, number, line))
+                    continue
+                self._close(recording, macro, depth)
+                recording = None
+                continue
+
+            if op in CONDITIONALS:
+                self._conditional(conds, op, args, where)
+                continue
+            if not active:
+                if macro is None:
+                    self.skipped.setdefault(rel, set()).add(number)
+                continue
+            if op in ("macro", "rept"):
+                recording = [op, args, [], 0, (rel, number)]
+                continue
+
+            m = INCLUDE_RE.match(line)
+            if m and m.group(1).lower() in SOURCE_INCLUDES and macro is None:
+                self.run_file(pathlib.Path(m.group(2) or m.group(3)).as_posix(), depth + 1)
+                continue
+            if op is not None and op != "=" and op in self.macros:
+                if label:
+                    self.labels.add(label)
+                    self.out.append(FlatLine(rel, number, label + ":", macro))
+                self._expand(self.macros[op], args, macro or (rel, number), depth)
+                continue
+
+            if label:
+                self.labels.add(label)
+            if op == "=":
+                name, value = args
+                if name == "Version" and self.version is not None:
+                    line = VERSION_DEFINE_RE.sub(
+                        lambda m: m.group(1) + str(self.version) + m.group(3), line
+                    )
+                    self.constants[name] = self.version
+                else:
+                    try:
+                        self.constants[name] = evaluate(value, self.lookup)
+                    except EvalError:
+                        self.constants.pop(name, None)  # depends on labels
+            self.out.append(FlatLine(rel, number, line, macro))
+
+        if recording is not None:
+            raise PreprocessError("{}:{}: missing end{}".format(*recording[4], recording[0][0]))
+        if conds:
+            raise PreprocessError("missing endif")
+
+    def _conditional(self, conds, op, args, where):
+        try:
+            if op in ("if", "ifdef", "ifndef"):
+                parent = not conds or conds[-1][1]
+                taken = False
+                if parent:
+                    if op == "if":
+                        taken = bool(evaluate(args, self.lookup))
+                    else:
+                        name = args.split()[0] if args else ""
+                        defined = (
+                            name in self.constants
+                            or name in self.labels
+                            or name.lower() in self.macros
+                        )
+                        taken = defined == (op == "ifdef")
+                conds.append([parent, taken, taken])
+                return
+            if not conds:
+                raise PreprocessError("{}: {} without if".format(where, op))
+            top = conds[-1]
+            if op == "elseif":
+                taken = top[0] and not top[2] and bool(evaluate(args, self.lookup))
+                top[1] = taken
+                top[2] = top[2] or taken
+            elif op == "else":
+                top[1] = top[0] and not top[2]
+                top[2] = True
+            else:
+                conds.pop()
+        except EvalError as e:
+            raise PreprocessError(
+                "{}: cannot resolve '{} {}' without assembling ({})".format(where, op, args, e)
+            )
+
+    def _close(self, recording, macro, depth):
+        kind, header, body, _, (rel, number) = recording
+        if kind == "rept":
+            invocation = macro or (rel, number)
+            try:
+                count = evaluate(header, self.lookup)
+            except EvalError as e:
+                raise PreprocessError("{}:{}: rept count: {}".format(rel, number + 1, e))
+            for _ in range(max(count, 0)):
+                self.run_lines(iter(body), invocation, depth)
+            return
+        parts = header.split(None, 1)
+        if not parts:
+            raise PreprocessError("{}:{}: macro without a name".format(rel, number + 1))
+        params = split_operands(parts[1]) if len(parts) > 1 else []
+        local = []
+        for _, _, text in body:
+            try:
+                label = parse_line(text)[0]
+            except EvalError:
+                continue
+            if label and label not in local:
+                local.append(label)
+        self.macros[parts[0].lower()] = (params, local, body)
+
+    def _expand(self, macro, args, invocation, depth):
+        params, local, body = macro
+        self.expansions += 1
+        values = split_operands(args)
+        subst = dict(zip(params, values))
+        for name in params[len(values) :]:
+            subst[name] = "0"
+        # Labels defined inside a macro are local to each expansion
+        for name in local:
+            subst.setdefault(name, "{}.{}".format(name, self.expansions))
+        if subst:
+            pattern = re.compile(
+                r"(?<![\w@.$])({})(?![\w@.])".format(
+                    "|".join(re.escape(n) for n in sorted(subst, key=len, reverse=True))
+                )
+            )
+            body = [
+                (rel, number, pattern.sub(lambda m: subst[m.group(1)], text))
+                for rel, number, text in body
+            ]
+        self.run_lines(iter(body), invocation, depth)
+
+
+def flatten(main_file, version=None, read=None):
+    """
+    The Flattened stream of main_file for a Version value (None keeps the
+    source's own define). Raises PreprocessError for conditions that cannot
+    be resolved without assembling, unbalanced conditionals and unreadable
+    includes. read(rel), if given, supplies the text of a file (its path
+    relative to the main file's directory, in posix form) instead of the
+    disk, or None to read it from disk.
+    """
+    main_file = pathlib.Path(main_file).resolve()
+    state = _Flattener(main_file.parent, version, read)
+    state.run_file(main_file.name)
+    return Flattened(version, state.out, state.skipped)
+
+
+def version_name(version):
+    names = {value: name for name, value in VERSION_VALUES.items()}
+    return names.get(version, "default" if version is None else str(version))
+
+
+def write_flattened(flat, out_dir):
+    """Write <version>.asm and <version>.map to out_dir; returns the .asm path."""
+    out_dir = pathlib.Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    name = version_name(flat.version)
+    source = out_dir / "{}.asm".format(name)
+    source.write_text(flat.text(), encoding="utf-8")
+    with open(out_dir / "{}.map".format(name), "w", encoding="utf-8") as f:
+        for i, line in enumerate(flat.lines, 1):
+            f.write("{}\t{}:{}".format(i, line.path, line.line + 1))
+            if line.macro:
+                f.write("\t{}:{}".format(line.macro[0], line.macro[1] + 1))
+            f.write("\n")
+    return source
+
+
+def main():
+    ap = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    ap.add_argument("input", help="Main assembly file")
+    ap.add_argument(
+        "--version",
+        action="append",
+        type=parse_version,
+        default=[],
+        help="Game version: jp, us, gamecube or 0-2 (repeatable, default: all)",
+    )
+    ap.add_argument("-o", "--out-dir", help="Directory to write <version>.asm/.map to")
+    ap.add_argument(
+        "--line",
+        action="append",
+        default=[],
+        help="file:line to look up in every version's stream (repeatable)",
+    )
+    args = ap.parse_args()
+
+    versions = args.version or sorted(VERSION_VALUES.values())
+    lookups = []
+    for text in args.line:
+        path, _, number = text.rpartition(":")
+        if not path or not number.isdigit():
+            print("Error: expected file:line, not '{}'".format(text), file=sys.stderr)
+            return 1
+        lookups.append((text, path, int(number) - 1))
+
+    for version in versions:
+        try:
+            flat = flatten(args.input, version)
+        except PreprocessError as e:
+            print("Error: {}".format(e), file=sys.stderr)
+            return 1
+        name = version_name(version)
+        expanded = sum(1 for line in flat.lines if line.macro)
+        if args.out_dir:
+            path = write_flattened(flat, args.out_dir)
+            print("{}: {} lines ({} from macros) -> {}".format(name, len(flat), expanded, path))
+        elif not lookups:
+            print("{}: {} lines ({} from macros)".format(name, len(flat), expanded))
+        for text, path, number in lookups:
+            index = flat.position(path, number)
+            if index is None:
+                print("{}: {} is not assembled".format(name, text))
+            else:
+                print("{}: {} is flat line {}".format(name, text, index + 1))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,630 @@
+# vram_pack.py
+# Usage: python vram_pack.py ../out.asm
+#        python vram_pack.py ../out.asm --layout 25m --base clear --write
+"""
+Re-encode screen layouts as the shortest equivalent VRAM write streams.
+
+A layout stream (see vram_stream.py) only matters for the memory it leaves
+behind. This tool works out that target state, i.e. the final value of every
+nametable, attribute and palette cell the stream writes, and encodes it again
+in the game's own format:
+
+- Horizontal entries are chosen by dynamic programming over the cells in
+  address order: each cell either starts a literal entry (3 + count bytes)
+  or a repeat entry (4 bytes) of any length the count byte allows, or is
+  skipped if it need not be written. The result is the smallest possible
+  stream made of horizontal entries, with upload time as the tie-breaker.
+- Vertical entries (down a column) are then tried one at a time, in order of
+  how many cells they cover, and kept whenever they make the whole stream
+  smaller.
+
+Every entry writes cells their final value, so entries can come in any
+order. With --base clear the layout is assumed to be drawn on the blank
+screen CODE_F1B4 leaves behind (true for the stage designs and the title
+screen): cells that end up blank need not be written, and blank cells may be
+written again to join two entries. Otherwise (the default, and always for
+the HUD, which is drawn over a stage) exactly the cells the original stream
+writes are written.
+
+Each result is checked by decoding it and replaying it next to the original
+on the screen(s) it may be drawn on. The report lists bytes and estimated
+upload cycles (UpdateScreen_F228) before and after; --write replaces the
+layout's source lines with the new stream. Lines that hold anything besides
+the stream's data (labels, conditionals, comments) are left alone, and a
+write is undone unless every Version (JP, US, Gamecube) still leaves the same
+PPU memory for every layout.
+"""
+
+import argparse
+import pathlib
+import sys
+
+import numpy as np  # pip install numpy
+
+import asm6_eval
+from vram_stream import (
+    ENTRY_CYCLES,
+    LITERAL_BYTE_CYCLES,
+    NAMETABLE_SIZE,
+    REPEAT_BYTE_CYCLES,
+    REPEAT_ENTRY_CYCLES,
+    SCREEN_COLUMNS,
+    SCREEN_ROWS,
+    VERTICAL_SAVED_CYCLES,
+    VRAM_COUNT_MASK,
+    LAYOUTS,
+    VERSION_VALUES,
+    LayoutSource,
+    PPUMemory,
+    StreamError,
+    decode_stream,
+    encode_stream,
+    make_write,
+    upload_cycles,
+)
+
+# Bytes always come first; cycles only break ties between equally short streams
+BYTE_WEIGHT = 1 << 20
+MAX_COUNT = VRAM_COUNT_MASK  # 1-63 bytes per entry, or 256 with a count of 0
+BASES = ("none", "clear")
+BLANK_TABLE = 0x2000  # the nametable CODE_F1B4 clears
+PALETTE_MIRRORS = (0x3F10, 0x3F14, 0x3F18, 0x3F1C)
+PATCH_GAP = 3  # see _patches
+BYTES_PER_LINE = 16  # payload bytes per db line in --write output
+
+
+def _lengths(available):
+    """Entry lengths that fit in available consecutive cells."""
+    lengths = range(1, min(MAX_COUNT, available) + 1)
+    return list(lengths) + [0x100] if available >= 0x100 else lengths
+
+
+def _entry_cost(count, repeat, vertical=False):
+    if repeat:
+        size, cycles = 4, REPEAT_ENTRY_CYCLES + REPEAT_BYTE_CYCLES * count
+    else:
+        size, cycles = 3 + count, ENTRY_CYCLES + LITERAL_BYTE_CYCLES * count
+    if vertical:
+        cycles -= VERTICAL_SAVED_CYCLES
+    return size * BYTE_WEIGHT + cycles
+
+
+def screen_target(writes, base="none"):
+    """
+    What an equivalent stream must do, as (cells, required): cells maps every
+    address that may be written to the value it must be written with, and
+    required is the set of addresses that have to be written.
+    """
+    ppu = PPUMemory()
+    final = {}
+    for entry in writes:
+        addresses = ppu.canonical(entry.addresses()).tolist()
+        final.update(zip(addresses, entry.values))
+
+    cells = {}
+    required = set(final)
+    if base == "clear":
+        ppu.clear()
+        blank = ppu.nametables[0].tolist()
+        cells.update((BLANK_TABLE + i, value) for i, value in enumerate(blank))
+        required = {
+            address
+            for address, value in final.items()
+            if not 0 <= address - BLANK_TABLE < NAMETABLE_SIZE
+            or blank[address - BLANK_TABLE] != value
+        }
+    cells.update(final)
+    for mirror in PALETTE_MIRRORS:
+        if mirror - 0x10 in final:
+            cells[mirror] = final[mirror - 0x10]  # writing there sets the mirrored cell
+    return cells, required
+
+
+def _wrong(values, start, end, fill, skip, fixed):
+    """Indices in start..end-1 a repeat entry of fill leaves to be patched."""
+    return [
+        j
+        for j in range(start, end)
+        if j not in skip and (values[j] != fill or j in fixed)
+    ]
+
+
+def _patches(wrong, values):
+    """
+    Group wrong cell indices into patch entries (first, last, uniform). Right
+    cells in between two wrong ones are taken along when at most PATCH_GAP
+    apart, which is never larger and never slower than another entry.
+    """
+    patches = []
+    for j in wrong:
+        if patches and j - patches[-1][1] - 1 <= PATCH_GAP:
+            first, last, uniform = patches[-1]
+            uniform = uniform and last == j - 1 and values[j] == values[last]
+            patches[-1] = (first, j, uniform)
+        else:
+            patches.append((j, j, True))
+    return patches
+
+
+def _grow(patch, j, values, closed, patch_cost):
+    """Add wrong cell j to the open patch (see _patches) or start a new one."""
+    if patch and j - patch[1] - 1 <= PATCH_GAP:
+        first, last, uniform = patch
+        uniform = uniform and last == j - 1 and values[j] == values[last]
+        return closed, (first, j, uniform)
+    if patch:
+        closed += patch_cost(*patch)
+    return closed, (j, j, True)
+
+
+def pack_horizontal(cells, required, later=frozenset(), fixed=frozenset()):
+    """
+    Cheapest horizontal entries writing every required address, using only
+    the addresses in cells. Addresses in later get their final value from
+    entries sent afterwards; addresses in fixed must be written after every
+    fill (see below). Returns (cost, fills, writes): fills are repeat entries
+    that leave some cells wrong and go first, writes only write final values.
+
+    Going through the cells in address order, each one is skipped (if it need
+    not be written), starts a literal entry, or starts a repeat entry of its
+    own value that may run over cells needing other values, which are then
+    patched by later entries.
+    """
+    addresses = sorted(cells)
+    count = len(addresses)
+    values = [cells[a] for a in addresses]
+    must = [a in required for a in addresses]
+    skip = {i for i, a in enumerate(addresses) if a in later}
+    forced = {i for i, a in enumerate(addresses) if a in fixed}
+    run = [1] * count  # consecutive addresses from here
+    for i in range(count - 2, -1, -1):
+        if addresses[i + 1] == addresses[i] + 1:
+            run[i] = run[i + 1] + 1
+
+    literal = [_entry_cost(n, False) for n in range(0x101)]
+    repeat = [_entry_cost(n, True) for n in range(0x101)]
+    uniform_patch = [min(a, b) for a, b in zip(literal, repeat)]
+
+    def patch_cost(first, last, uniform):
+        return (uniform_patch if uniform else literal)[last - first + 1]
+
+    best = [0] * (count + 1)
+    choice = [None] * count
+    next_required = {}  # value -> index of the nearest required cell holding it
+    for i in range(count - 1, -1, -1):
+        fill = values[i]
+        reach = min(MAX_COUNT, run[i])
+        if must[i]:
+            cost = float("inf")
+            next_required[fill] = i
+        else:
+            # Starting a literal entry here is never better than starting it
+            # one cell later, and a repeat entry only helps if it reaches a
+            # required cell of the same value
+            cost = best[i + 1]
+            if next_required.get(fill, count) >= i + reach:
+                best[i] = cost
+                continue
+        pick = None
+        if must[i]:
+            for n in _lengths(run[i]):
+                c = literal[n] + best[i + n]
+                if c < cost:
+                    cost, pick = c, (n, False)
+
+        # repeat entries: while every cell holds fill the entry writes final
+        # values only; past that it is sent first and what it leaves wrong
+        # is patched afterwards (as in _patches), with the patch cost kept up
+        # to date while the entry grows
+        floor = min(best[i + 1 : i + reach + 1])  # no suffix is cheaper
+        plain = True
+        closed = 0
+        patch = None
+        for n in range(1, reach + 1):
+            j = i + n - 1
+            if plain and values[j] != fill:
+                plain = False
+                for k in range(i, j):  # cells already passed that now need a patch
+                    if k in forced and k not in skip:
+                        closed, patch = _grow(patch, k, values, closed, patch_cost)
+            if j not in skip and (values[j] != fill or (j in forced and not plain)):
+                closed, patch = _grow(patch, j, values, closed, patch_cost)
+            c = repeat[n] + closed
+            if c + floor >= cost:
+                break  # closed patches only add up from here
+            c += best[i + n]
+            if patch:
+                c += patch_cost(*patch)
+            if c < cost:
+                cost, pick = c, (n, True)
+        best[i] = cost
+        choice[i] = pick
+
+    fills = []
+    writes = []
+    i = 0
+    while i < count:
+        if choice[i] is None:
+            i += 1
+            continue
+        n, is_repeat = choice[i]
+        if not is_repeat:
+            writes.append(make_write(addresses[i], values[i : i + n]))
+            i += n
+            continue
+        entry = make_write(addresses[i], [values[i]] * n, repeat=True)
+        if all(v == values[i] for v in values[i : i + n]):
+            writes.append(entry)
+            i += n
+            continue
+        fills.append(entry)
+        patches = _patches(_wrong(values, i, i + n, values[i], skip, forced), values)
+        for first, last, uniform in patches:
+            size = last - first + 1
+            as_repeat = uniform and repeat[size] < literal[size]
+            patch = values[first : last + 1]
+            writes.append(make_write(addresses[first], patch, repeat=as_repeat))
+        i += n
+    return best[0], fills, writes
+
+
+def vertical_candidates(cells, required):
+    """
+    Vertical entries worth trying, from every run of writable cells in a
+    nametable column: the run as one literal entry, and for each value, one
+    repeat entry of it from its first to its last required cell (the cells
+    in between that need another value are patched afterwards). Entries
+    must cover at least two required cells.
+
+    Returns (bytes per required cell, entry, right addresses, wrong
+    addresses) tuples, cheapest first.
+    """
+    candidates = []
+    tables = sorted({a & ~(NAMETABLE_SIZE - 1) for a in required if a < 0x3F00})
+    for table in tables:
+        for column in range(SCREEN_COLUMNS):
+            runs = []
+            current = []
+            for row in range(SCREEN_ROWS + 1):
+                address = table + column + SCREEN_COLUMNS * row
+                if row < SCREEN_ROWS and address in cells:
+                    current.append(address)
+                elif current:
+                    runs.append(current)
+                    current = []
+            for run in runs:
+                hits = [k for k, a in enumerate(run) if a in required]
+                if len(hits) >= 2:
+                    span = run[hits[0] : hits[-1] + 1]
+                    entry = make_write(span[0], [cells[a] for a in span], vertical=True)
+                    candidates.append((entry.size / len(hits), entry, set(span), set()))
+                for value in {cells[run[k]] for k in hits}:
+                    same = [k for k in hits if cells[run[k]] == value]
+                    if len(same) < 2:
+                        continue
+                    span = run[same[0] : same[-1] + 1]
+                    entry = make_write(span[0], [value] * len(span), True, True)
+                    right = {a for a in span if cells[a] == value}
+                    candidates.append(
+                        (entry.size / len(same), entry, right, set(span) - right)
+                    )
+    candidates.sort(key=lambda c: (c[0], -len(c[2])))
+    return candidates
+
+
+def _layers(cells, required, chosen):
+    """
+    Cost and entries of a stream using the vertical entries chosen (as
+    (entry, right addresses, wrong addresses) tuples) plus the horizontal
+    entries still needed, or None if two chosen entries conflict.
+    """
+    cost = 0
+    remaining = set(required)
+    later = set()  # right after the vertical entries
+    fixed = set()  # left wrong by a vertical repeat entry: horizontal ones fix them
+    filled = set()  # cells under vertical entries that leave some wrong
+    column_fills = []
+    finals = []
+    for entry, right, wrong in chosen:
+        if wrong:
+            if (right | wrong) & filled:
+                return None  # overlapping column fills would need an order
+            filled |= right | wrong
+            column_fills.append(entry)
+        else:
+            finals.append(entry)
+        need = wrong - later
+        remaining = (remaining - right) | need
+        later |= right
+        fixed |= need
+        cost += _entry_cost(entry.count, entry.repeat, vertical=True)
+    horizontal_cost, fills, horizontal = pack_horizontal(cells, remaining, later, fixed)
+
+    def order(entry):
+        return entry.address, entry.vertical
+
+    writes = (
+        sorted(fills, key=order)
+        + sorted(column_fills, key=order)
+        + sorted(horizontal + finals, key=order)
+    )
+    return cost + horizontal_cost, writes, remaining
+
+
+def _candidate(entry, cells):
+    """(entry, right addresses, wrong addresses) for a vertical entry."""
+    addresses = PPUMemory().canonical(entry.addresses()).tolist()
+    right = {a for a, v in zip(addresses, entry.values) if cells.get(a) == v}
+    return entry, right, set(addresses) - right
+
+
+def pack(cells, required, vertical=True, hints=()):
+    """
+    Shortest stream found for a target (see screen_target). Returns the
+    entries in the order they have to be sent.
+
+    Without vertical entries this is pack_horizontal, which is optimal.
+    Vertical entries are then chosen greedily, starting from the hints (e.g.
+    those of the original stream) if they help: the hints and the
+    vertical_candidates are tried one at a time and kept when the horizontal
+    entries still needed around them make the stream smaller, after which
+    each kept one is dropped again if that helps.
+    Order: horizontal repeat entries that leave cells wrong, vertical ones
+    that do, then all entries writing final values.
+    """
+    chosen = []
+    cost, writes, remaining = _layers(cells, required, chosen)
+    if not vertical:
+        return writes
+    tries = [_candidate(entry, cells) for entry in hints if entry.vertical]
+    # vertical entries often only pay off together (e.g. a block of tiles
+    # drawn column by column), so the hints are first tried all at once
+    seeded = _layers(cells, required, tries)
+    if seeded is not None and seeded[0] < cost:
+        chosen = list(tries)
+        cost, writes, remaining = seeded
+    tries += [c[1:] for c in vertical_candidates(cells, required)]
+    for candidate in tries:
+        if not candidate[1] & remaining:
+            continue
+        trial = _layers(cells, required, chosen + [candidate])
+        if trial is not None and trial[0] < cost:
+            chosen.append(candidate)
+            cost, writes, remaining = trial
+    for candidate in list(chosen):
+        rest = [c for c in chosen if c is not candidate]
+        trial = _layers(cells, required, rest)
+        if trial is not None and trial[0] < cost:
+            chosen = rest
+            cost, writes, remaining = trial
+    return writes
+
+
+def _test_screens(base):
+    """PPU states a layout may be drawn on, for checking an encoding."""
+    blank = PPUMemory()
+    blank.clear()
+    if base == "clear":
+        return [blank]
+    noisy = PPUMemory()
+    noisy.nametables[:] = np.arange(noisy.nametables.size).reshape(2, -1) * 7 % 251
+    noisy.palette[:] = np.arange(32) * 5 % 64
+    return [blank, noisy]
+
+
+def equivalent(original, packed, base="none"):
+    """True if both streams leave the same PPU memory on every test screen."""
+    for screen in _test_screens(base):
+        a, b = PPUMemory(), PPUMemory()
+        for ppu in (a, b):
+            ppu.nametables[:] = screen.nametables
+            ppu.palette[:] = screen.palette
+        a.apply(original)
+        b.apply(packed)
+        if not (
+            np.array_equal(a.nametables, b.nametables)
+            and np.array_equal(a.palette, b.palette)
+        ):
+            return False
+    return True
+
+
+def stream_source(writes):
+    """The stream as db lines in the style of src/data/layouts/."""
+    lines = []
+    for entry in writes:
+        flags = ""
+        if entry.repeat:
+            flags += "|VRAMWriteCommand_Repeat"
+        if entry.vertical:
+            flags += "|VRAMWriteCommand_DrawVert"
+        lines.append("db ${:02X},${:02X}".format(entry.address >> 8, entry.address & 0xFF))
+        lines.append("db ${:02X}{}".format(entry.count & VRAM_COUNT_MASK, flags))
+        for start in range(0, len(entry.data), BYTES_PER_LINE):
+            chunk = entry.data[start : start + BYTES_PER_LINE]
+            lines.append("db " + ",".join("${:02X}".format(b) for b in chunk))
+        lines.append("")
+    lines.append("db VRAMWriteCommand_Stop")
+    return "\n".join(lines) + "\n"
+
+
+def stream_lines(source, name, size):
+    """
+    (path, first, last): the 0-based source lines holding exactly the stream
+    of layout name (size bytes), or None if they also hold anything else:
+    other data, labels, conditional or other directives, or comments (which
+    would be lost).
+    """
+    start = source.program.offset(source.pointer(name))
+    for path, spans in source.program.spans.items():
+        inside = [span for span in spans if start <= span[1] < start + size]
+        if not inside or inside[0][1] != start:
+            continue
+        first, last = inside[0][0], inside[-1][0]
+        contiguous = all(a[1] + a[3] == b[1] for a, b in zip(inside, inside[1:]))
+        others = [span for span in spans if first <= span[0] <= last and span not in inside]
+        if not contiguous or others or sum(span[3] for span in inside) != size:
+            return None
+        lines = pathlib.Path(path).read_text(encoding="utf-8").splitlines()
+        for line in lines[first : last + 1]:
+            label, op, _ = asm6_eval.parse_line(line)
+            if label or op not in asm6_eval.DATA_OPS | {None}:
+                return None
+            if asm6_eval.strip_comment(line) != line:
+                return None
+        return pathlib.Path(path), first, last
+    return None
+
+
+def changed_versions(sources, originals):
+    """
+    Re-assemble the source of each Version and return the names of those in
+    which a layout of originals {value: {name: (writes, base)}} no longer
+    leaves the same PPU memory.
+    """
+    names = {value: name for name, value in VERSION_VALUES.items()}
+    changed = []
+    for value, source in sources.items():
+        try:
+            source.assemble()
+            same = all(
+                equivalent(writes, source.layout(name), base)
+                for name, (writes, base) in originals[value].items()
+            )
+        except (asm6_eval.EvalError, StreamError):
+            same = False
+        if not same:
+            changed.append(names[value])
+    return changed
+
+
+def replace_lines(path, first, last, text):
+    """Replace lines first..last of path with text, keeping its line endings."""
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        data = f.read()
+    newline = "\r\n" if "\r\n" in data else "\n"
+    lines = data.splitlines()
+    lines[first : last + 1] = text.splitlines()
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        f.write(newline.join(lines) + newline)
+
+
+def main():
+    ap = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    ap.add_argument("source", help="Main assembly file (e.g. out.asm)")
+    ap.add_argument(
+        "--layout",
+        action="append",
+        choices=LAYOUTS,
+        help="Layout to pack (repeatable, default: all)",
+    )
+    ap.add_argument(
+        "--base",
+        choices=BASES,
+        default="none",
+        help="Screen the layouts are drawn on: clear (blank screen, not used for "
+        "the HUD) or none (write exactly the original cells, default)",
+    )
+    ap.add_argument(
+        "--no-vertical", action="store_true", help="Only use horizontal entries"
+    )
+    ap.add_argument(
+        "--write",
+        action="store_true",
+        help="Replace the source lines of each layout with the packed stream",
+    )
+    args = ap.parse_args()
+
+    try:
+        source = LayoutSource(args.source)
+    except (OSError, asm6_eval.EvalError) as e:
+        print("Error: {}".format(e), file=sys.stderr)
+        return 1
+
+    # the 50M slot points at the title screen
+    names = args.layout or [name for name in LAYOUTS if name != "50m"]
+    # --write checks every Version still draws every layout the same
+    versions, originals = {}, {}
+    if args.write:
+        try:
+            for value in VERSION_VALUES.values():
+                versions[value] = LayoutSource(args.source, value)
+                originals[value] = {
+                    name: (versions[value].layout(name), "none" if name == "hud" else args.base)
+                    for name in names
+                }
+        except (OSError, asm6_eval.EvalError, StreamError) as e:
+            print("Error: {}".format(e), file=sys.stderr)
+            return 1
+    seen = set()
+    print(
+        "{:<6} {:>7} {:>7} {:>6} {:>8} {:>8} {:>7}".format(
+            "Layout", "Bytes", "Packed", "Saved", "Cycles", "Packed", "Saved"
+        )
+    )
+    total_saved = 0
+    failed = False
+    for name in names:
+        try:
+            address = source.pointer(name)
+            if address in seen:
+                continue
+            seen.add(address)
+            original = source.layout(name)
+        except StreamError as e:
+            print("Error: {}: {}".format(name, e), file=sys.stderr)
+            return 1
+        base = "none" if name == "hud" else args.base
+        cells, required = screen_target(original, base)
+        packed = pack(cells, required, not args.no_vertical, hints=original)
+
+        data = encode_stream(packed)
+        if not equivalent(original, decode_stream(data)[0], base):
+            print("Error: {}: packed stream does not match".format(name), file=sys.stderr)
+            failed = True
+            continue
+
+        size = sum(w.size for w in original) + 1
+        cycles = upload_cycles(original)
+        packed_cycles = upload_cycles(packed)
+        if (len(data), packed_cycles) >= (size, cycles):
+            packed, data, packed_cycles = original, encode_stream(original), cycles
+        total_saved += size - len(data)
+        print(
+            "{:<6} {:>7} {:>7} {:>6} {:>8} {:>8} {:>7}".format(
+                name,
+                size,
+                len(data),
+                size - len(data),
+                cycles,
+                packed_cycles,
+                cycles - packed_cycles,
+            )
+        )
+        if args.write and packed is not original:
+            where = stream_lines(source, name, size)
+            if where is None:
+                print(
+                    "  not written: its source lines also hold other data, labels, "
+                    "directives or comments"
+                )
+                continue
+            path, first, last = where
+            backup = path.read_bytes()
+            replace_lines(path, first, last, stream_source(packed))
+            changed = changed_versions(versions, originals)
+            if changed:
+                path.write_bytes(backup)
+                changed_versions(versions, originals)
+                print("  not written: it would change the {} build".format(", ".join(changed)))
+            else:
+                print("  wrote {} lines {}-{}".format(path, first + 1, last + 1))
+            source.assemble()  # later layouts may have moved
+    print("Total bytes saved: {}".format(total_saved))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,536 @@
+# vram_stream.py
+# Usage: python vram_stream.py ../DonkeyKongDisassembly.asm --chr ../DKGFX.bin -o previews
+#        python vram_stream.py ../DonkeyKongDisassembly.asm --dump 75m
+#        python vram_stream.py ../out.asm --chr ../DKGFX.bin -o previews --watch
+"""
+Decode the VRAM write streams used for screen layouts and render previews.
+
+The layouts behind ScreenLayoutData_C4A7 (stage designs, the title screen
+and the HUD) are drawn by UpdateScreen_F228 from a stream of entries:
+
+    hi, lo   PPU address
+    count    bit 7 (VRAMWriteCommand_DrawVert): step 32, i.e. down a column
+             bit 6 (VRAMWriteCommand_Repeat): a single value byte follows
+             and is written count times; otherwise count bytes follow
+             bits 0-5: count (0 means 256)
+    ...      payload
+
+ended by a 0 byte (VRAMWriteCommand_Stop) where an address would be. The
+same entries fill the nametable, the attribute table and palette RAM.
+
+Streams are read from the source through asm6_eval.assemble (no assembler
+needed), replayed into a model of PPU memory on top of the blank screen left
+by CODE_F1B4, and drawn with the background pattern table of the CHR data.
+A phase preview is its stage layout plus the HUD. Frames are arrays of NES
+colour numbers and are written as indexed PNGs with the NES palette.
+
+PreviewRenderer keeps every tile pre-coloured with each background palette
+and remembers what it drew, so drawing an edited layout only copies the
+nametable cells whose tile or palette changed. With --watch, edits to data
+files that were split out of the main source (src/data/...) are patched into
+the assembled image without re-assembling, so previews follow edits within
+milliseconds.
+"""
+
+import argparse
+import collections
+import pathlib
+import sys
+import time
+
+import numpy as np  # pip install numpy
+
+import asm6_eval
+from chr_codec import NES_PALETTE, decode_tiles, read_chr, write_png
+
+# Count byte flags (VRAMWriteCommand_* in Defines.asm)
+VRAM_STOP = 0x00
+VRAM_DRAW_VERT = 0x80
+VRAM_REPEAT = 0x40
+VRAM_COUNT_MASK = 0x3F
+
+NAMETABLE_SIZE = 0x400
+ATTRIBUTE_OFFSET = 0x3C0
+PALETTE_BASE = 0x3F00
+SCREEN_ROWS, SCREEN_COLUMNS = 30, 32
+TILE_EMPTY = 0x24  # Tile_Empty, what CODE_F1B4 fills the screen with
+BG_TABLE = 1  # SetInitRegsAndClearScreen_C7E7 writes $10 to PPUCTRL: BG tiles at $1000
+TABLE_TILES = 256
+
+LAYOUT_TABLE = "ScreenLayoutData_C4A7"
+# Entries of ScreenLayoutData_C4A7 in order (the 50M slot points at the title screen)
+LAYOUTS = ("25m", "50m", "75m", "100m", "title", "hud")
+# Preview name -> layouts drawn, in order, on a blank screen
+PREVIEWS = {
+    "25m": ("25m", "hud"),
+    "75m": ("75m", "hud"),
+    "100m": ("100m", "hud"),
+    "title": ("title",),
+}
+VERSION_VALUES = {"jp": 0, "us": 1, "gamecube": 2}
+WATCH_INTERVAL = 0.2  # seconds between checks for edited files
+
+# CPU cycles UpdateScreen_F228 spends, counted from UpdateScreenLoop_F1EC
+# (ignoring the extra cycle when LDA ($00),Y crosses a page)
+ENTRY_CYCLES = 89  # address, count byte, loop exit and pointer update
+REPEAT_ENTRY_CYCLES = 92  # same, plus reading the value byte
+LITERAL_BYTE_CYCLES = 18
+REPEAT_BYTE_CYCLES = 17
+VERTICAL_SAVED_CYCLES = 1  # BCS taken instead of falling through to AND
+STOP_CYCLES = 13
+
+# Bit position of each cell's palette within its attribute byte
+_ATTRIBUTE_SHIFTS = (
+    (np.arange(SCREEN_ROWS)[:, None] >> 1 & 1) * 4
+    + (np.arange(SCREEN_COLUMNS)[None, :] >> 1 & 1) * 2
+).astype(np.uint8)
+
+
+class StreamError(ValueError):
+    """Raised for a VRAM write stream that runs past the end of its data."""
+
+
+class VRAMWrite(
+    collections.namedtuple("VRAMWrite", "offset address vertical repeat count data")
+):
+    """
+    One stream entry: offset of its first byte in the buffer it was decoded
+    from, PPU address, vertical (step 32) and repeat flags, number of bytes
+    written and the payload as stored (a single byte for a repeated entry).
+    """
+
+    __slots__ = ()
+
+    @property
+    def size(self):
+        """Bytes the entry takes up in the stream."""
+        return 3 + len(self.data)
+
+    @property
+    def values(self):
+        """The bytes written to VRAM, in order."""
+        return self.data * self.count if self.repeat else self.data
+
+    def addresses(self):
+        """PPU addresses written, in order (the address wraps at $4000)."""
+        step = 32 if self.vertical else 1
+        return (self.address + step * np.arange(self.count)) & 0x3FFF
+
+    @property
+    def cycles(self):
+        """Estimated CPU cycles UpdateScreen_F228 takes to upload the entry."""
+        if self.repeat:
+            cycles = REPEAT_ENTRY_CYCLES + REPEAT_BYTE_CYCLES * self.count
+        else:
+            cycles = ENTRY_CYCLES + LITERAL_BYTE_CYCLES * self.count
+        return cycles - VERTICAL_SAVED_CYCLES if self.vertical else cycles
+
+    def encode(self):
+        control = self.count & VRAM_COUNT_MASK
+        if self.vertical:
+            control |= VRAM_DRAW_VERT
+        if self.repeat:
+            control |= VRAM_REPEAT
+        return bytes((self.address >> 8, self.address & 0xFF, control)) + self.data
+
+
+def make_write(address, values, vertical=False, repeat=False):
+    """A VRAMWrite (without stream offset) writing values from address."""
+    count = len(values)
+    if not (1 <= count < 0x40 or count == 0x100):
+        raise StreamError("an entry writes 1-63 or 256 bytes, not {}".format(count))
+    data = bytes(values[:1]) if repeat else bytes(values)
+    return VRAMWrite(None, address, vertical, repeat, count, data)
+
+
+def encode_stream(writes):
+    """Stream bytes for writes, including the stop byte."""
+    return b"".join(entry.encode() for entry in writes) + bytes((VRAM_STOP,))
+
+
+def upload_cycles(writes):
+    """Estimated CPU cycles UpdateScreen_F228 takes for a whole stream."""
+    return sum(entry.cycles for entry in writes) + STOP_CYCLES
+
+
+def decode_stream(data, offset=0):
+    """
+    Decode the stream starting at data[offset] (bytes, bytearray or
+    memoryview). Returns (entries, offset just past the stop byte).
+    """
+    writes = []
+    pos = offset
+    end = len(data)
+    while True:
+        if pos >= end:
+            raise StreamError("stream at offset {} has no stop byte".format(offset))
+        if data[pos] == VRAM_STOP:
+            return writes, pos + 1
+        if pos + 3 > end:
+            raise StreamError("truncated entry at offset {}".format(pos))
+        control = data[pos + 2]
+        count = (control & VRAM_COUNT_MASK) or 0x100
+        repeat = bool(control & VRAM_REPEAT)
+        size = 1 if repeat else count
+        if pos + 3 + size > end:
+            raise StreamError("truncated entry at offset {}".format(pos))
+        writes.append(
+            VRAMWrite(
+                pos,
+                (data[pos] << 8 | data[pos + 1]) & 0x3FFF,
+                bool(control & VRAM_DRAW_VERT),
+                repeat,
+                count,
+                bytes(data[pos + 3 : pos + 3 + size]),
+            )
+        )
+        pos += 3 + size
+
+
+class PPUMemory:
+    """
+    The parts of PPU memory a layout can write: two nametables (with their
+    attribute tables) and palette RAM. Writes to pattern memory are ignored
+    (the cartridge has CHR ROM there).
+    """
+
+    def __init__(self, mirroring="horizontal"):
+        self.nametables = np.zeros((2, NAMETABLE_SIZE), dtype=np.uint8)
+        self.palette = np.zeros(32, dtype=np.uint8)
+        # horizontal mirroring: $2000 = $2400 and $2800 = $2C00
+        self._table_bit = 11 if mirroring == "horizontal" else 10
+
+    def clear(self):
+        """Blank the first nametable the way CODE_F1B4 does."""
+        self.nametables[0, :ATTRIBUTE_OFFSET] = TILE_EMPTY
+        self.nametables[0, ATTRIBUTE_OFFSET:] = 0
+
+    def canonical(self, addresses):
+        """
+        Map PPU addresses to the one address of the same memory cell: the
+        nametable at $2000 or its horizontal/vertical neighbour, and
+        $3F00-$3F1F for palette RAM. Pattern memory is left alone.
+        """
+        addresses = np.asarray(addresses) & 0x3FFF
+        table = addresses >> self._table_bit & 1
+        names = 0x2000 | table << self._table_bit | addresses & (NAMETABLE_SIZE - 1)
+        index = addresses & 0x1F
+        colors = PALETTE_BASE | np.where(index & 0x13 == 0x10, index & 0x0F, index)
+        return np.where(
+            addresses >= PALETTE_BASE,
+            colors,
+            np.where(addresses >= 0x2000, names, addresses),
+        )
+
+    def write(self, addresses, values):
+        """Write values (uint8 array) to PPU addresses (int array), in order."""
+        names = (addresses >= 0x2000) & (addresses < PALETTE_BASE)
+        if names.any():
+            address = addresses[names]
+            table = address >> self._table_bit & 1
+            self.nametables[table, address & (NAMETABLE_SIZE - 1)] = values[names]
+        colors = addresses >= PALETTE_BASE
+        if colors.any():
+            index = addresses[colors] & 0x1F
+            # $3F10/$3F14/$3F18/$3F1C are mirrors of $3F00/$3F04/$3F08/$3F0C
+            index = np.where(index & 0x13 == 0x10, index & 0x0F, index)
+            self.palette[index] = values[colors]
+
+    def apply(self, writes):
+        for entry in writes:
+            self.write(entry.addresses(), np.frombuffer(entry.values, dtype=np.uint8))
+
+    def screen(self, table=0):
+        """(30, 32) tile numbers and (8, 8) attribute bytes of a nametable."""
+        data = self.nametables[table]
+        tiles = data[:ATTRIBUTE_OFFSET].reshape(SCREEN_ROWS, SCREEN_COLUMNS)
+        return tiles, data[ATTRIBUTE_OFFSET:].reshape(8, 8)
+
+    def background_colors(self):
+        """(4, 4) NES colour numbers of the background palettes."""
+        colors = self.palette[:16].reshape(4, 4).copy()
+        colors[:, 0] = self.palette[0]  # colour 0 is the shared backdrop
+        return colors & 0x3F
+
+
+def cell_palettes(attributes):
+    """Background palette (0-3) of every cell from (8, 8) attribute bytes."""
+    expanded = attributes.repeat(4, axis=0).repeat(4, axis=1)[:SCREEN_ROWS]
+    return expanded >> _ATTRIBUTE_SHIFTS & 3
+
+
+class PreviewRenderer:
+    """
+    Draws nametables into a 240x256 frame of NES colour numbers.
+
+    The atlas holds every tile drawn with each of the four background
+    palettes and is only rebuilt when a palette changes; render() copies the
+    cells whose tile or palette differs from the previous call, so redrawn
+    tells how many cells that was.
+    """
+
+    def __init__(self, tiles):
+        self.tiles = np.asarray(tiles, dtype=np.uint8)
+        self.frame = np.zeros((SCREEN_ROWS * 8, SCREEN_COLUMNS * 8), dtype=np.uint8)
+        # (row, column, y, x) view of the frame
+        self._cells = self.frame.reshape(SCREEN_ROWS, 8, SCREEN_COLUMNS, 8).swapaxes(1, 2)
+        self.redrawn = 0
+        self.reset()
+
+    def reset(self):
+        """Forget what was drawn, so the next render() draws every cell."""
+        self._atlas = self._colors = self._names = self._palettes = None
+
+    def render(self, ppu, table=0):
+        names, attributes = ppu.screen(table)
+        palettes = cell_palettes(attributes)
+        colors = ppu.background_colors()
+
+        if self._atlas is None:
+            dirty = np.ones(names.shape, dtype=bool)
+        else:
+            recolored = (colors != self._colors).any(axis=1)
+            dirty = (names != self._names) | (palettes != self._palettes)
+            dirty |= recolored[palettes]
+        if self._atlas is None or not np.array_equal(colors, self._colors):
+            self._atlas = colors[:, self.tiles]  # (palette, tile, y, x)
+
+        rows, columns = np.nonzero(dirty)
+        if len(rows):
+            self._cells[rows, columns] = self._atlas[
+                palettes[rows, columns], names[rows, columns]
+            ]
+        self.redrawn = len(rows)
+        self._colors = colors
+        self._names = names.copy()
+        self._palettes = palettes
+        return self.frame
+
+
+def save_png(path, frame):
+    write_png(path, frame, np.frombuffer(NES_PALETTE, dtype=np.uint8).reshape(-1, 3))
+
+
+class LayoutSource:
+    """
+    Layout streams of an assembled program. reload() takes an edited source
+    file into account, re-assembling only when the edit could have moved
+    anything.
+    """
+
+    def __init__(self, main_file, version=None):
+        self.main_file = pathlib.Path(main_file).resolve()
+        self.overrides = {"Version": version} if version is not None else {}
+        self.assemble()
+
+    def assemble(self):
+        self.program = asm6_eval.assemble(
+            self.main_file, self.overrides, allow_missing=True
+        )
+        self.image = bytearray(self.program.image)
+
+    def _read_word(self, address):
+        offset = self.program.offset(address)
+        if offset is None:
+            raise StreamError("nothing assembled at ${:04X}".format(address))
+        return self.image[offset] | self.image[offset + 1] << 8
+
+    def pointer(self, name):
+        """CPU address of layout name (see LAYOUTS)."""
+        if LAYOUT_TABLE not in self.program.symbols:
+            raise StreamError("{} is not defined".format(LAYOUT_TABLE))
+        return self._read_word(self.program.symbols[LAYOUT_TABLE] + 2 * LAYOUTS.index(name))
+
+    def layout(self, name):
+        """Decoded entries of layout name; offsets are image offsets."""
+        address = self.pointer(name)
+        offset = self.program.offset(address)
+        if offset is None:
+            raise StreamError("nothing assembled at ${:04X}".format(address))
+        return decode_stream(self.image, offset)[0]
+
+    def reload(self, path):
+        """
+        Take an edit of path into account. A file of data lines whose size
+        did not change is re-evaluated and patched into the image ("patched");
+        anything else is re-assembled ("assembled").
+        """
+        key = str(pathlib.Path(path).resolve())
+        spans = self.program.spans.get(key)
+        try:
+            if not spans:
+                raise asm6_eval.EvalError("no data from {}".format(key))
+            lines = pathlib.Path(key).read_text(encoding="utf-8").splitlines()
+            data, items = asm6_eval.evaluate_block(lines, self.program.symbols)
+            start = spans[0][1]
+            size = sum(span[3] for span in spans)
+            in_place = all(a[1] + a[3] == b[1] for a, b in zip(spans, spans[1:]))
+            if not in_place or len(data) != size or any(k == "line" for _, k, _ in items):
+                raise asm6_eval.EvalError("{} changed layout".format(key))
+        except (OSError, asm6_eval.EvalError):
+            self.assemble()
+            return "assembled"
+        self.image[start : start + size] = data
+        return "patched"
+
+
+def background_tiles(chr_path, table=BG_TABLE):
+    tiles = decode_tiles(read_chr(chr_path))
+    tiles = tiles[table * TABLE_TILES : (table + 1) * TABLE_TILES]
+    if len(tiles) < TABLE_TILES:
+        raise ValueError("{} has no pattern table {}".format(chr_path, table))
+    return tiles
+
+
+def compose(source, preview):
+    """PPU memory after drawing a preview's layouts on a blank screen."""
+    ppu = PPUMemory()
+    ppu.clear()
+    for name in PREVIEWS[preview]:
+        ppu.apply(source.layout(name))
+    return ppu
+
+
+def dump_layout(source, name):
+    address = source.pointer(name)
+    writes = source.layout(name)
+    print("{} (${:04X}):".format(name, address))
+    base = source.program.offset(address)
+    for entry in writes:
+        kind = ("vert " if entry.vertical else "") + ("repeat" if entry.repeat else "")
+        print(
+            "  +{:04X} ${:04X} x{:<3} {:<12} {}".format(
+                entry.offset - base,
+                entry.address,
+                entry.count,
+                kind.strip(),
+                " ".join("{:02X}".format(b) for b in entry.data),
+            )
+        )
+    end = writes[-1].offset + writes[-1].size if writes else base
+    print("  +{:04X} stop ({} entries, {} bytes)".format(end - base, len(writes), end - base + 1))
+
+
+def render_all(source, renderers, out_dir):
+    """Render every preview; returns {preview: cells redrawn}."""
+    redrawn = {}
+    for preview, renderer in renderers.items():
+        frame = renderer.render(compose(source, preview))
+        redrawn[preview] = renderer.redrawn
+        if out_dir is not None and renderer.redrawn:
+            save_png(out_dir / "{}.png".format(preview), frame)
+    return redrawn
+
+
+def watch(source, renderers, out_dir):
+    def mtimes():
+        found = {}
+        for path in source.program.sources:
+            try:
+                found[path] = pathlib.Path(path).stat().st_mtime_ns
+            except OSError:
+                found[path] = None
+        return found
+
+    seen = mtimes()
+    print("Watching {} file(s), Ctrl+C to stop".format(len(seen)))
+    try:
+        while True:
+            time.sleep(WATCH_INTERVAL)
+            now = mtimes()
+            changed = [path for path in now if now[path] != seen.get(path)]
+            if not changed:
+                continue
+            started = time.perf_counter()
+            try:
+                how = [source.reload(path) for path in changed][-1]
+                redrawn = render_all(source, renderers, out_dir)
+            except (asm6_eval.EvalError, StreamError) as e:
+                print("Error: {}".format(e))
+            else:
+                print(
+                    "{}: {}, cells redrawn {} in {:.1f} ms".format(
+                        ", ".join(pathlib.Path(p).name for p in changed),
+                        how,
+                        ", ".join("{} {}".format(k, v) for k, v in redrawn.items()),
+                        (time.perf_counter() - started) * 1000,
+                    )
+                )
+            seen = mtimes()
+    except KeyboardInterrupt:
+        pass
+
+
+def parse_version(text):
+    if text.isdigit():
+        return int(text)
+    if text.lower() not in VERSION_VALUES:
+        raise argparse.ArgumentTypeError("unknown version '{}'".format(text))
+    return VERSION_VALUES[text.lower()]
+
+
+def main():
+    ap = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    ap.add_argument("source", help="Main assembly file (e.g. DonkeyKongDisassembly.asm)")
+    ap.add_argument("--chr", help="CHR data or .nes ROM (default: DKGFX.bin next to source)")
+    ap.add_argument(
+        "--version", type=parse_version, help="JP, US or Gamecube (default: as in source)"
+    )
+    ap.add_argument("-o", "--out-dir", help="Write <preview>.png files here")
+    ap.add_argument(
+        "--preview",
+        action="append",
+        choices=sorted(PREVIEWS),
+        help="Preview to render (repeatable, default: all)",
+    )
+    ap.add_argument(
+        "--dump", action="append", choices=LAYOUTS, help="List the entries of a layout"
+    )
+    ap.add_argument(
+        "--watch", action="store_true", help="Re-render whenever a source file changes"
+    )
+    args = ap.parse_args()
+
+    try:
+        source = LayoutSource(args.source, args.version)
+        for name in args.dump or ():
+            dump_layout(source, name)
+    except (OSError, asm6_eval.EvalError, StreamError) as e:
+        print("Error: {}".format(e), file=sys.stderr)
+        return 1
+    if args.dump and not (args.out_dir or args.watch):
+        return 0
+
+    chr_path = pathlib.Path(args.chr or source.main_file.parent / "DKGFX.bin")
+    try:
+        tiles = background_tiles(chr_path)
+    except (OSError, ValueError) as e:
+        print("Error: {} (use --chr)".format(e), file=sys.stderr)
+        return 1
+
+    out_dir = pathlib.Path(args.out_dir) if args.out_dir else None
+    if out_dir is not None:
+        out_dir.mkdir(parents=True, exist_ok=True)
+    renderers = {p: PreviewRenderer(tiles) for p in args.preview or PREVIEWS}
+    started = time.perf_counter()
+    try:
+        render_all(source, renderers, out_dir)
+    except StreamError as e:
+        print("Error: {}".format(e), file=sys.stderr)
+        return 1
+    print(
+        "Rendered {} preview(s){} in {:.1f} ms".format(
+            len(renderers),
+            " to {}".format(out_dir) if out_dir else "",
+            (time.perf_counter() - started) * 1000,
+        )
+    )
+    if args.watch:
+        watch(source, renderers, out_dir)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
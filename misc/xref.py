@@ -0,0 +1,341 @@
+# xref.py
+# Usage: python xref.py ../DonkeyKongDisassembly.asm --calls GetBitIndex_FA86
+#        python xref.py ../DonkeyKongDisassembly.asm --reads Hammer_AnimationFrameCounter --writes Hammer_AnimationFrameCounter
+#        python xref.py ../DonkeyKongDisassembly.asm --dead
+"""
+Cross-reference index of the labels and symbols of the disassembly.
+
+Every file of the incsrc closure (DonkeyKongDisassembly.asm, Defines.asm,
+the src/data includes, ...) is scanned line by line, both sides of every
+conditional, for definitions (labels, and "Name = value" symbols such as the
+RAM addresses in Defines.asm) and references, each with the global label
+it appears under:
+
+  call    JSR target
+  jump    JMP target (JMP (pointer) reads the pointer instead)
+  branch  branch target
+  table   db/dw operand (jump and pointer tables, offset tables)
+  read    operand of LDA, CMP, BIT, ... and of JMP (pointer)
+  write   operand of STA/STX/STY
+  modify  operand of INC/DEC/ASL/LSR/ROL/ROR
+  imm     immediate operand (LDA #<Table ...)
+  use     anything else (assignments, conditionals, macro arguments)
+
+The index is kept in .xref.db (SQLite) next to the main file. Each file's
+entries are stored with its hash, so after an edit only the files that
+changed are scanned again. Queries: --calls (call, jump, branch, table),
+--reads (read, modify), --writes (write, modify), a bare name for every
+reference, and --dead for the labels nothing refers to outside their own
+routine (split by whether the line above can fall into them) and the
+symbols that are never used.
+"""
+
+import argparse
+import pathlib
+import re
+import sqlite3
+import sys
+
+from asm6_eval import EvalError, parse_line
+from listing_index import source_closure
+from mos6502 import BRANCHES, OPCODES
+
+INDEX_NAME = ".xref.db"
+SCHEMA_VERSION = 1  # bump when the tables or the scan change
+
+SOURCE_SUFFIXES = (".asm", ".s", ".inc", ".i")
+TABLE_OPS = frozenset(("db", "byte", "dw", "word", "dl", "dh"))
+SKIPPED_OPS = frozenset(("incsrc", "include", "incbin", "bin", "error"))
+TRANSFERS = frozenset(("rts", "rti", "jmp"))
+READS = frozenset(
+    ("adc", "and", "bit", "cmp", "cpx", "cpy", "eor", "lda", "ldx", "ldy", "ora", "sbc")
+)
+WRITES = frozenset(("sta", "stx", "sty"))
+MODIFIES = frozenset(("asl", "dec", "inc", "lsr", "rol", "ror"))
+
+CALL_KINDS = ("call", "jump", "branch", "table")
+READ_KINDS = ("read", "modify")
+WRITE_KINDS = ("write", "modify")
+
+NAME_RE = re.compile(r"(?<![\w$%@.])[A-Za-z_][\w.]*")
+STRING_RE = re.compile(r"\"[^\"]*\"|'[^']*'")
+INDEX_SUFFIX_RE = re.compile(r"\s*,\s*[xXyY]\s*\)?\s*$")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, digest TEXT);
+CREATE TABLE IF NOT EXISTS defs (
+    path TEXT, line INTEGER, name TEXT, kind TEXT, value TEXT, prev TEXT, next TEXT
+);
+CREATE TABLE IF NOT EXISTS refs (
+    path TEXT, line INTEGER, name TEXT, kind TEXT, op TEXT, routine TEXT
+);
+CREATE INDEX IF NOT EXISTS defs_name ON defs (name);
+CREATE INDEX IF NOT EXISTS refs_name ON refs (name, kind);
+CREATE INDEX IF NOT EXISTS defs_path ON defs (path);
+CREATE INDEX IF NOT EXISTS refs_path ON refs (path);
+"""
+
+
+def operand_names(args):
+    """Symbol names in an operand or expression (strings and registers left out)."""
+    text = STRING_RE.sub(" ", args)
+    text = INDEX_SUFFIX_RE.sub(")" if text.rstrip().endswith(")") else "", text)
+    if text.strip().upper() == "A":  # ASL A
+        return []
+    return NAME_RE.findall(text)
+
+
+def instruction_kind(mnemonic, args):
+    if args.startswith("#"):
+        return "imm"
+    if mnemonic == "jsr":
+        return "call"
+    if mnemonic == "jmp":
+        return "read" if args.startswith("(") else "jump"
+    if mnemonic in BRANCHES:
+        return "branch"
+    if mnemonic in WRITES:
+        return "write"
+    if mnemonic in MODIFIES:
+        return "modify"
+    if mnemonic in READS:
+        return "read"
+    return "use"
+
+
+def scan(lines):
+    """
+    Definitions and references of one file's lines.
+    Returns (defs, refs): defs are (line, name, "label" or "symbol", value,
+    previous statement, next statement), refs (line, name, kind, op, routine),
+    with 1-based lines. Labels and symbols inside macro bodies are not
+    definitions; references there are credited to the macro.
+    """
+    defs = []
+    refs = []
+    routine = None
+    macro = None
+    prev = None
+    waiting = []  # labels whose next statement is still to come
+    for number, line in enumerate(lines, 1):
+        try:
+            label, op, args = parse_line(line)
+        except EvalError:
+            continue
+        if label and macro is None and label[0] not in "@+-.":
+            routine = label
+            definition = [number, label, "label", None, prev, None]
+            defs.append(definition)
+            waiting.append(definition)
+        if op is None:
+            continue
+
+        if op == "macro":
+            words = args.replace(",", " ").split()
+            macro = words[0] if words else None
+            continue
+        if op == "endm":
+            macro = None
+            continue
+        owner = macro or routine
+        if op == "=":
+            name, value = args
+            if macro is None:
+                defs.append([number, name, "symbol", value.strip(), None, None])
+            refs.extend((number, n, "use", "=", owner) for n in operand_names(value))
+            continue
+        if op in SKIPPED_OPS:
+            continue
+
+        if op in OPCODES:
+            kind = instruction_kind(op, args)
+        elif op in TABLE_OPS:
+            kind = "table"
+        else:
+            kind = "use"
+        refs.extend((number, n, kind, op, owner) for n in operand_names(args))
+        if macro is None and op not in ("if", "ifdef", "ifndef", "elseif", "else", "endif"):
+            for definition in waiting:
+                definition[5] = op
+            waiting = []
+            prev = op
+    return [tuple(d) for d in defs], refs
+
+
+class XrefIndex:
+    """Definitions and references of every file in a main file's incsrc closure."""
+
+    def __init__(self, main_file, path=None):
+        self.main_file = pathlib.Path(main_file).resolve()
+        self.path = pathlib.Path(path) if path else self.main_file.parent / INDEX_NAME
+        self.db = sqlite3.connect(str(self.path))
+        self.db.executescript(SCHEMA)
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'schema'").fetchone()
+        if row is None or row[0] != str(SCHEMA_VERSION):
+            with self.db:
+                for table in ("files", "defs", "refs"):
+                    self.db.execute("DELETE FROM {}".format(table))
+                self.db.execute(
+                    "INSERT OR REPLACE INTO meta VALUES ('schema', ?)", (str(SCHEMA_VERSION),)
+                )
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def update(self):
+        """
+        Scan the files of the closure that are new or changed since the last
+        update and drop the ones no longer included.
+        Returns (files scanned, files in the closure).
+        """
+        closure = {
+            rel: digest
+            for rel, digest in source_closure(self.main_file)
+            if pathlib.PurePosixPath(rel).suffix.lower() in SOURCE_SUFFIXES
+        }
+        known = dict(self.db.execute("SELECT path, digest FROM files"))
+        changed = [rel for rel, digest in closure.items() if known.get(rel) != digest]
+        with self.db:
+            for rel in changed + [rel for rel in known if rel not in closure]:
+                for table in ("files", "defs", "refs"):
+                    self.db.execute("DELETE FROM {} WHERE path = ?".format(table), (rel,))
+            for rel in changed:
+                path = self.main_file.parent / rel
+                defs, refs = scan(path.read_text(encoding="utf-8", errors="replace").splitlines())
+                self.db.executemany(
+                    "INSERT INTO defs VALUES (?, ?, ?, ?, ?, ?, ?)", ((rel,) + d for d in defs)
+                )
+                self.db.executemany(
+                    "INSERT INTO refs VALUES (?, ?, ?, ?, ?, ?)", ((rel,) + r for r in refs)
+                )
+                self.db.execute("INSERT INTO files VALUES (?, ?)", (rel, closure[rel]))
+        return len(changed), len(closure)
+
+    def definitions(self, name):
+        """[(path, line, kind, value)] where name is defined."""
+        return self.db.execute(
+            "SELECT path, line, kind, value FROM defs WHERE name = ? ORDER BY path, line",
+            (name,),
+        ).fetchall()
+
+    def references(self, name, kinds=None):
+        """[(path, line, kind, op, routine)] referring to name, optionally of some kinds."""
+        query = "SELECT path, line, kind, op, routine FROM refs WHERE name = ?"
+        args = [name]
+        if kinds:
+            query += " AND kind IN ({})".format(", ".join("?" * len(kinds)))
+            args.extend(kinds)
+        return self.db.execute(query + " ORDER BY path, line", args).fetchall()
+
+    def callers(self, name):
+        return self.references(name, CALL_KINDS)
+
+    def readers(self, name):
+        return self.references(name, READ_KINDS)
+
+    def writers(self, name):
+        return self.references(name, WRITE_KINDS)
+
+    def dead_labels(self):
+        """
+        [(path, line, name, reason)] for labels referred to nowhere but from
+        their own routine. reason is "data" when a data directive follows the
+        label, "unreachable" when the statement above is RTS/RTI/JMP and
+        "fall-through" otherwise.
+        """
+        rows = self.db.execute(
+            "SELECT path, line, name, prev, next FROM defs WHERE kind = 'label'"
+            " AND NOT EXISTS (SELECT 1 FROM refs"
+            " WHERE refs.name = defs.name AND refs.routine IS NOT defs.name)"
+            " ORDER BY path, line"
+        ).fetchall()
+        dead = []
+        for path, line, name, prev, following in rows:
+            if following in TABLE_OPS or following in ("hex", "incbin", "bin"):
+                reason = "data"
+            elif prev in TRANSFERS:
+                reason = "unreachable"
+            else:
+                reason = "fall-through"
+            dead.append((path, line, name, reason))
+        return dead
+
+    def unused_symbols(self):
+        """[(path, line, name, value)] for symbols nothing refers to."""
+        return self.db.execute(
+            "SELECT path, line, name, value FROM defs WHERE kind = 'symbol'"
+            " AND NOT EXISTS (SELECT 1 FROM refs WHERE refs.name = defs.name)"
+            " ORDER BY path, line"
+        ).fetchall()
+
+
+def print_references(title, rows):
+    print("{} ({}):".format(title, len(rows)))
+    for path, line, kind, op, routine in rows:
+        where = "{}:{}".format(path, line)
+        print("  {:<36} {:<32} {:<5} {}".format(where, routine or "-", op, kind))
+
+
+def main():
+    ap = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    ap.add_argument("input", help="Main assembly file")
+    ap.add_argument("names", nargs="*", help="Label or symbol to list every reference of")
+    ap.add_argument("--calls", action="append", default=[], help="Who calls/jumps to a label")
+    ap.add_argument("--reads", action="append", default=[], help="Who reads a symbol or table")
+    ap.add_argument("--writes", action="append", default=[], help="Who writes a symbol")
+    ap.add_argument("--dead", action="store_true", help="Report unreferenced labels and symbols")
+    ap.add_argument("--index", help="Index file (default: {} next to the input)".format(INDEX_NAME))
+    args = ap.parse_args()
+
+    try:
+        with XrefIndex(args.input, args.index) as index:
+            scanned, total = index.update()
+            if scanned:
+                print("Scanned {} of {} file(s)".format(scanned, total), file=sys.stderr)
+
+            queries = [(name, "References to", index.references) for name in args.names]
+            queries += [(name, "Callers of", index.callers) for name in args.calls]
+            queries += [(name, "Readers of", index.readers) for name in args.reads]
+            queries += [(name, "Writers of", index.writers) for name in args.writes]
+            for name, title, lookup in queries:
+                found = index.definitions(name)
+                if not found:
+                    print("Warning: {} is not defined anywhere".format(name))
+                for path, line, kind, value in found:
+                    print(
+                        "{} {} at {}:{}{}".format(
+                            kind.capitalize(),
+                            name,
+                            path,
+                            line,
+                            " = {}".format(value) if value is not None else "",
+                        )
+                    )
+                print_references("{} {}".format(title, name), lookup(name))
+
+            if args.dead:
+                dead = index.dead_labels()
+                print("Unreferenced labels ({}):".format(len(dead)))
+                for path, line, name, reason in dead:
+                    print("  {:<36} {:<40} {}".format("{}:{}".format(path, line), name, reason))
+                unused = index.unused_symbols()
+                print("Unused symbols ({}):".format(len(unused)))
+                for path, line, name, value in unused:
+                    print("  {:<36} {:<40} {}".format("{}:{}".format(path, line), name, value))
+    except (OSError, sqlite3.Error) as e:
+        print("Error: {}".format(e), file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
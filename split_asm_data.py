@@ -3,13 +3,25 @@
 Split asm6/asm6f source into include files with build verification:
 - Finds contiguous "data blocks" (db/dw/hex/fill/incbin lines, comments, and label-only lines).
 - Moves each block to src/data/<name>.asm and replaces it with incsrc in the main file.
+  With --emit binary, blocks are assembled to src/data/<name>.bin and the .asm keeps
+  only their labels around incbin ranges (see misc/asm6_eval.py).
 - Verifies the build works before and after splitting to ensure no regressions.
 - By default, only splits blocks >= min_lines (to avoid churning tiny tables).
+- Records extracted blocks in <data-dir>/split_manifest.json; re-runs only write,
+  rename or delete the data files that actually changed.
+- With --versioned-blocks, a block may contain whole If Version ... endif regions
+  that hold only data; misc/version_pp.py resolves them for every version.
 - Handles ASM6-specific syntax and directives properly.
+- With --profile, writes a JSON report of where a run spends its time and memory
+  (per phase of main(), per assembler run) for dashboards and regression checks.
 
 Usage:
   python split_asm_data.py DonkeyKongDisassembly.asm out/DonkeyKongDisassembly.split.asm --data-dir src/data --min-lines 6 --dry-run
   python split_asm_data.py DonkeyKongDisassembly.asm DonkeyKongDisassembly.asm --data-dir src/data --verify
+  python split_asm_data.py DonkeyKongDisassembly.asm DonkeyKongDisassembly.asm --data-dir src/data --versions JP,US,Gamecube
+  python split_asm_data.py DonkeyKongDisassembly.asm DonkeyKongDisassembly.asm --data-dir src/data --eval-verify
+  python split_asm_data.py DonkeyKongDisassembly.asm --watch
+  python split_asm_data.py DonkeyKongDisassembly.asm out.asm --verify --profile split_profile.json --cprofile split
 
 Requirements:
   Python 3.6.8 or later (uses pathlib, subprocess features, and f-strings in some error messages)
@@ -17,18 +29,41 @@ Requirements:
 Safeguards:
 - Verifies original file assembles successfully before splitting
 - Verifies split result assembles to identical binary
+- Without an assembler (or with --eval-verify), assembles both in-process with
+  misc/asm6_eval.py and also checks each block's bytes and address
+- Caches assembler results on disk, keyed on the incsrc/incbin closure, the
+  Version define and the assembler binary (--cache-dir/--no-cache)
+- With --versions, verifies every listed game version concurrently, each in an
+  isolated temp copy with the Version define injected
+- On a mismatch, lists the differing byte runs with the source line each
+  came from (misc/rom_diff.py, misc/listing_index.py)
+- With --watch, keeps the sources, their line classification and each version's
+  include graph in memory, and re-verifies only the versions an edit can affect
+  (inotify through misc/file_watch.py, or stat polling)
 - The transform is textual: assembled bytes should be identical
 - Preserves ASM6-specific syntax and formatting
 """
 
 import argparse
+import array
+import concurrent.futures
 import hashlib
+import itertools
+import json
+import mmap
+import os
 import pathlib
 import re
 import shutil
-import subprocess
 import sys
 import tempfile
+import time
+import tracemalloc
+
+# Helper modules shared with the other tools (asm6_eval, ...) live in misc/
+TOOLS_DIR = pathlib.Path(__file__).resolve().parent / "misc"
+if str(TOOLS_DIR) not in sys.path:
+    sys.path.insert(0, str(TOOLS_DIR))
 
 # Check Python version
 if sys.version_info < (3, 6, 8):
@@ -41,6 +76,18 @@ if sys.version_info < (3, 6, 8):
     print("Please upgrade your Python installation or use a newer version")
     sys.exit(1)
 
+# Source closure, Version injection and assembler runs, shared with misc/
+from asm_build import (
+    ASSEMBLER_RUNS,
+    INCLUDE_RE,
+    VERSION_DEFINE_RE,
+    find_assembler,
+    include_closure,
+    prepare_version_workspace,
+    record_assembler_run,
+    run_assembler,
+)
+
 # ASM6-specific data tokens (case-insensitive)
 DATA_TOKENS = {
     "db",
@@ -155,54 +202,6 @@ _OK = "✓" if _supports_unicode() else "OK"
 _FAIL = "✗" if _supports_unicode() else "FAIL"
 
 
-def find_assembler():
-    """Find asm6f or asm6 assembler in PATH or common locations."""
-    assemblers = ["asm6f", "asm6", "asm6f.exe", "asm6.exe"]
-
-    # Check PATH first
-    for asm in assemblers:
-        if shutil.which(asm):
-            return asm
-
-    # Check common local paths
-    local_paths = [".", "tools", "bin", "../tools", "../bin"]
-    for path in local_paths:
-        for asm in assemblers:
-            full_path = pathlib.Path(path) / asm
-            if full_path.exists() and full_path.is_file():
-                return str(full_path)
-
-    return None
-
-
-def run_assembler(asm_path, input_file, output_file, verbose=False):
-    """
-    Run the assembler on the input file.
-    Returns (success, stdout, stderr)
-    """
-    try:
-        cmd = [asm_path, str(input_file), str(output_file)]
-        if verbose:
-            print("Running: {} (cwd={})".format(" ".join(cmd), input_file.parent))
-
-        result = subprocess.run(
-            cmd,
-            capture_output=True,
-            text=True,
-            timeout=30,  # 30 second timeout
-            cwd=str(
-                pathlib.Path(input_file).parent
-            ),  # <— NEW: resolve includes correctly
-        )
-
-        return result.returncode == 0, result.stdout, result.stderr
-
-    except subprocess.TimeoutExpired:
-        return False, "", "Assembly process timed out"
-    except Exception as e:
-        return False, "", "Error running assembler: {}".format(e)
-
-
 def get_file_hash(filepath):
     """Get SHA256 hash of a file."""
     if not filepath.exists():
@@ -215,23 +214,41 @@ def get_file_hash(filepath):
     return sha256_hash.hexdigest()
 
 
-def verify_assembly(asm_path, input_file, description, verbose=False):
+def verify_assembly(asm_path, input_file, description, verbose=False, cache=None):
     """
     Verify that an assembly file can be assembled successfully.
+    With an AssemblyCache, a previous result for the same include closure,
+    Version and assembler is reused instead of running the assembler.
     Returns (success, output_hash) where output_hash is None if assembly failed.
     """
+    key = None
+    if cache is not None:
+        key = assembly_cache_key(asm_path, input_file)
+        entry = cache.get(key)
+        if entry:
+            print("Verifying {}... {} (cached)".format(description, _OK))
+            record_assembler_run(asm_path, input_file, 0.0, True, cached=True)
+            return True, entry["rom_hash"]
+
     temp_output = tempfile.NamedTemporaryFile(suffix=".nes", delete=False)
     temp_output_path = pathlib.Path(temp_output.name)
     temp_output.close()
+    temp_listing_path = temp_output_path.with_suffix(".lst")
 
     try:
         print("Verifying {}...".format(description), end="")
         success, stdout, stderr = run_assembler(
-            asm_path, input_file, temp_output_path, verbose
+            asm_path,
+            input_file,
+            temp_output_path,
+            verbose,
+            listing_file=temp_listing_path if cache is not None else None,
         )
 
         if success:
             output_hash = get_file_hash(temp_output_path)
+            if cache is not None:
+                cache.put(key, output_hash, temp_listing_path, temp_output_path)
             print(f" {_OK}")
             if verbose and stdout:
                 print("  Assembler output: {}".format(stdout))
@@ -246,9 +263,535 @@ def verify_assembly(asm_path, input_file, description, verbose=False):
             return False, None
 
     finally:
-        # Clean up temp file
+        # Clean up temp files
         if temp_output_path.exists():
             temp_output_path.unlink()
+        if temp_listing_path.exists():
+            temp_listing_path.unlink()
+
+
+# Game versions selectable through the Version define (see Defines.asm)
+VERSION_VALUES = {"jp": 0, "us": 1, "gamecube": 2}
+VERSION_NAMES = ("JP", "US", "Gamecube")
+
+
+def parse_versions(spec):
+    """
+    Parse a --versions argument such as "JP,US,Gamecube" or "0,1,2".
+    Returns a list of (name, value) tuples; raises ValueError on unknown names.
+    """
+    versions = []
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        if item.isdigit() and int(item) < len(VERSION_NAMES):
+            value = int(item)
+        elif item.lower() in VERSION_VALUES:
+            value = VERSION_VALUES[item.lower()]
+        else:
+            raise ValueError(
+                "Unknown version '{}' (use {} or 0-{})".format(
+                    item, ", ".join(VERSION_NAMES), len(VERSION_NAMES) - 1
+                )
+            )
+        name = VERSION_NAMES[value]
+        if name not in [n for n, _ in versions]:
+            versions.append((name, value))
+    return versions
+
+
+def _assemble_version_job(job):
+    """
+    Process-pool worker: assemble one version in a private temp workspace.
+    job is (asm_path, input_file, name, value, cache_spec) where cache_spec is
+    (root, max_bytes) of an AssemblyCache or None.
+    Returns (name, success, output_hash, error_text, cache_hit, seconds).
+    """
+    asm_path, input_file, name, value, cache_spec = job
+
+    cache = key = None
+    if cache_spec:
+        cache = AssemblyCache(*cache_spec)
+        key = assembly_cache_key(asm_path, input_file, value)
+        entry = cache.get(key)
+        if entry:
+            return name, True, entry["rom_hash"], "", True, 0.0
+
+    with tempfile.TemporaryDirectory(prefix="split_asm_{}_".format(name)) as tmp:
+        main_copy = prepare_version_workspace(input_file, value, tmp)
+        output = pathlib.Path(tmp) / "output.nes"
+        listing = pathlib.Path(tmp) / "output.lst" if cache else None
+        started = time.perf_counter()
+        success, stdout, stderr = run_assembler(
+            asm_path, main_copy, output, listing_file=listing
+        )
+        seconds = time.perf_counter() - started
+        if not success:
+            return name, False, None, (stderr or stdout).strip(), False, seconds
+        output_hash = get_file_hash(output)
+        if cache:
+            cache.put(key, output_hash, listing, output)
+        return name, True, output_hash, "", False, seconds
+
+
+def verify_versions(
+    asm_path, input_file, versions, description, verbose=False, cache=None
+):
+    """
+    Assemble input_file once per (name, value) in versions, concurrently.
+    Versions found in the AssemblyCache (if given) are not assembled again.
+    Returns (all_succeeded, {name: output_hash or None}).
+    """
+    input_file = pathlib.Path(input_file).resolve()
+    # Keep bare command names (found on PATH) as-is; make local paths absolute
+    if pathlib.Path(asm_path).exists():
+        asm_path = str(pathlib.Path(asm_path).resolve())
+
+    print(
+        "Verifying {} ({})...".format(description, ", ".join(n for n, _ in versions)),
+        end="",
+    )
+    sys.stdout.flush()
+
+    cache_spec = (str(cache.root.resolve()), cache.max_bytes) if cache else None
+    jobs = [
+        (asm_path, str(input_file), name, value, cache_spec) for name, value in versions
+    ]
+    with concurrent.futures.ProcessPoolExecutor(max_workers=len(jobs)) as pool:
+        results = list(pool.map(_assemble_version_job, jobs))
+
+    hashes = {}
+    failures = []
+    cached = []
+    for name, success, output_hash, error, hit, seconds in results:
+        hashes[name] = output_hash
+        record_assembler_run(asm_path, input_file, seconds, success, name, hit)
+        if cache:
+            cache.record(hit)
+        if hit:
+            cached.append(name)
+        if not success:
+            failures.append((name, error))
+
+    if cached and not failures:
+        print(" {} (cached: {})".format(_OK, ", ".join(cached)))
+    else:
+        print(" {}".format(_FAIL if failures else _OK))
+    for name, error in failures:
+        print("  Assembly failed for {} ({})".format(description, name))
+        if error:
+            print("  Error: {}".format(error))
+    if verbose:
+        for name, output_hash in hashes.items():
+            print("  {}: {}".format(name, output_hash or "-"))
+
+    return not failures, hashes
+
+
+def print_version_table(versions, before, after):
+    """Print a per-version before/after hash table. Returns True if all match."""
+    all_match = True
+    print("{:<10} {:<18} {:<18} {}".format("Version", "Original", "Split", "Result"))
+    for name, _ in versions:
+        old = before.get(name)
+        new = after.get(name)
+        match = bool(old) and old == new
+        all_match = all_match and match
+        print(
+            "{:<10} {:<18} {:<18} {}".format(
+                name,
+                old[:16] if old else "-",
+                new[:16] if new else "-",
+                _OK if match else _FAIL,
+            )
+        )
+    return all_match
+
+
+def evaluate_versions(input_file, versions, description, verbose=False):
+    """
+    In-process counterpart of verify_versions(), for when no assembler is
+    available: lay out input_file with asm6_eval.assemble() once per (name,
+    value) in versions, or once with the source's own Version define if
+    versions is None (the result is then keyed None). Missing incbin files
+    (the CHR data is not part of the repo) are evaluated as empty.
+    Returns (all_succeeded, {name: asm6_eval.Program or None}).
+    """
+    import asm6_eval
+
+    runs = versions or [(None, None)]
+    names = " ({})".format(", ".join(n for n, _ in versions)) if versions else ""
+    print("Evaluating {}{}...".format(description, names), end="")
+    sys.stdout.flush()
+
+    programs = {}
+    failures = []
+    for name, value in runs:
+        overrides = {"Version": value} if value is not None else None
+        started = time.perf_counter()
+        try:
+            programs[name] = asm6_eval.assemble(input_file, overrides, allow_missing=True)
+        except asm6_eval.EvalError as e:
+            programs[name] = None
+            failures.append((name, str(e)))
+        record_assembler_run(
+            "asm6_eval", input_file, time.perf_counter() - started, programs[name] is not None, name
+        )
+
+    print(" {}".format(_FAIL if failures else _OK))
+    for name, error in failures:
+        print(
+            "  Evaluation failed for {}{}".format(
+                description, " ({})".format(name) if name else ""
+            )
+        )
+        print("  Error: {}".format(error))
+    if verbose:
+        missing = sorted({m for p in programs.values() if p for m in p.missing})
+        for path in missing:
+            print("  Note: {} not found, evaluated as empty".format(path))
+
+    return not failures, programs
+
+
+def program_hashes(programs):
+    """SHA256 of each evaluated image, keyed like the programs."""
+    return {
+        name: hashlib.sha256(p.image).hexdigest() if p else None
+        for name, p in programs.items()
+    }
+
+
+def _first_difference(old, new):
+    for i, (a, b) in enumerate(zip(old, new)):
+        if a != b:
+            return i
+    return min(len(old), len(new))
+
+
+def compare_evaluated_blocks(before, after, src, extracted):
+    """
+    Check that every extracted block (start, end, data_path) emits the same
+    bytes at the same address from its data file as lines start..end-1 of src
+    did before the split, in every evaluated version.
+    Prints one line per mismatch; returns True if all blocks match.
+    """
+    all_match = True
+    for name, old in before.items():
+        new = after.get(name)
+        if not old or not new:
+            continue
+        tag = " ({})".format(name) if name else ""
+        for start, end, path in extracted:
+            old_addr, old_data = old.line_bytes(src, start, end)
+            new_addr, new_data = new.line_bytes(path)
+            if old_data != new_data:
+                offset = _first_difference(old_data, new_data)
+                detail = "bytes differ from offset {} ({} -> {} bytes)".format(
+                    offset, len(old_data), len(new_data)
+                )
+            elif old_addr != new_addr:
+                detail = "moved from ${:04X} to ${:04X}".format(old_addr, new_addr)
+            else:
+                continue
+            all_match = False
+            print(
+                "  {} {}{}, lines {}-{}: {}".format(
+                    _FAIL, pathlib.Path(path).name, tag, start + 1, end, detail
+                )
+            )
+    return all_match
+
+
+def assemble_image(asm_path, input_file, value=None):
+    """
+    Assemble input_file, with its Version define set to value unless that is
+    None, and return the output bytes (None if assembly failed).
+    """
+    with tempfile.TemporaryDirectory(prefix="split_asm_") as tmp:
+        if value is not None:
+            input_file = prepare_version_workspace(input_file, value, tmp)
+        output = pathlib.Path(tmp) / "output.nes"
+        success, _, _ = run_assembler(asm_path, input_file, output, version=value)
+        return output.read_bytes() if success and output.exists() else None
+
+
+class DeferredSourceIndex:
+    """
+    The misc/listing_index.py index of the original sources, so a mismatch
+    can be traced back to a source line. Nothing is built up front: get()
+    brings one version's index up to date when a mismatch asks for it, from
+    the listing the AssemblyCache kept of the original's verification, the
+    program evaluated by --eval-verify, or as a last resort a listing run.
+    Files the split (or an edit under --watch) overwrites are read from the
+    snapshot keep() takes of them beforehand.
+    """
+
+    def __init__(self, input_file, asm_path=None, programs=None, cache=None, verbose=False):
+        self.input_file = pathlib.Path(input_file).resolve()
+        self.asm_path = asm_path
+        self.programs = programs or {}
+        self.cache = cache
+        self.verbose = verbose
+        self.snapshot = {}
+        self.index = None
+        self.unavailable = False
+        # What the cache keys of the original are made of, taken before anything changes
+        self.digest = self.define = None
+        if cache and asm_path:
+            self.digest = closure_digest(self.input_file)
+            self.define = read_version_define(self.input_file)
+
+    def keep(self, paths):
+        """Snapshot the current contents of paths, about to be overwritten or deleted."""
+        base = self.input_file.parent
+        for path in paths:
+            rel = pathlib.Path(os.path.relpath(str(pathlib.Path(path).resolve()), str(base)))
+            if ".." in rel.parts or rel.as_posix() in self.snapshot:
+                continue
+            try:
+                self.snapshot[rel.as_posix()] = (base / rel).read_bytes()
+            except OSError:
+                pass
+
+    def get(self, name, value):
+        """
+        The SourceIndex with version value (of --versions name) indexed, or
+        None if it cannot be built (verification does not depend on it).
+        """
+        import listing_index
+
+        if self.unavailable:
+            return None
+        try:
+            if self.index is None:
+                self.index = listing_index.SourceIndex(self.input_file, snapshot=self.snapshot)
+            listing = None
+            if self.digest:
+                version = self.define if value is None else value
+                key = assembly_cache_key(self.asm_path, self.input_file, version, self.digest)
+                listing = self.cache.listing(key)
+            if self.index.ensure(value, self.asm_path, self.programs.get(name), listing):
+                if self.verbose:
+                    print("  Indexed source lines{}".format(" ({})".format(name) if name else ""))
+        except Exception as e:
+            print("  Note: source line index unavailable ({})".format(e))
+            self.unavailable = True
+            return None
+        return self.index
+
+
+def describe_differences(index, value, image, limit=5):
+    """
+    The byte runs where image differs from the original image in the source
+    line index (see misc/rom_diff.py), each with the source line it came
+    from, as lines of text (none if they are identical).
+    """
+    import rom_diff
+
+    old = index.image(value)
+    if old is None or image is None:
+        return []
+    runs = rom_diff.diff(old, image)
+    if not runs:
+        return []
+    lines = ["{} run(s), {} byte(s) differ:".format(len(runs), sum(r.size for r in runs))]
+    lines.extend(rom_diff.describe_run(run, index, value) for run in runs[:limit])
+    if len(runs) > limit:
+        lines.append("  ... {} more".format(len(runs) - limit))
+    return lines
+
+
+# On-disk cache of assembler results (see AssemblyCache)
+CACHE_DIR_NAME = ".split_asm_cache"
+CACHE_DEFAULT_MAX_MB = 64
+
+_ASSEMBLER_HASHES = {}
+
+
+def assembler_hash(asm_path):
+    """SHA256 of the assembler binary (looked up through PATH), memoized."""
+    resolved = shutil.which(asm_path) or asm_path
+    if resolved not in _ASSEMBLER_HASHES:
+        _ASSEMBLER_HASHES[resolved] = get_file_hash(pathlib.Path(resolved)) or resolved
+    return _ASSEMBLER_HASHES[resolved]
+
+
+def closure_digest(input_file):
+    """SHA256 over the relative paths and contents of input_file's include closure."""
+    input_file = pathlib.Path(input_file)
+    digest = hashlib.sha256()
+    for rel in include_closure(input_file):
+        digest.update(rel.as_posix().encode("utf-8") + b"\0")
+        digest.update(get_file_hash(input_file.parent / rel).encode("ascii") + b"\n")
+    return digest.hexdigest()
+
+
+def read_version_define(input_file):
+    """Return the value of the main file's Version define, or None if it has none."""
+    with open(input_file, encoding="utf-8", errors="ignore") as f:
+        for line in f:
+            m = VERSION_DEFINE_RE.match(line)
+            if m:
+                return m.group(2)
+    return None
+
+
+def assembly_cache_key(asm_path, input_file, version=None, digest=None):
+    """
+    Cache key for assembling input_file: the include closure digest (computed
+    unless given), the Version value (read from the main file unless given)
+    and the assembler hash.
+    """
+    if version is None:
+        version = read_version_define(input_file)
+    version = str(version)
+    version = str(VERSION_VALUES.get(version.lower(), version))
+
+    key = hashlib.sha256()
+    key.update((digest or closure_digest(input_file)).encode("ascii") + b"\0")
+    key.update(version.encode("utf-8") + b"\0")
+    key.update(assembler_hash(asm_path).encode("utf-8"))
+    return key.hexdigest()
+
+
+class AssemblyCache:
+    """
+    Size-bounded on-disk LRU cache of assembler results.
+
+    Each entry is <key>.json (output ROM hash) plus <key>.lst and <key>.nes
+    (the assembler listing and the ROM, which the source line index is built
+    from). An entry's mtime records its last use; the least recently used
+    entries are evicted once the cache grows past max_bytes. Writes go through
+    a temp file and os.replace, so parallel workers can share one cache.
+    """
+
+    def __init__(self, root, max_bytes=CACHE_DEFAULT_MAX_MB * 1024 * 1024):
+        self.root = pathlib.Path(root)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    def _paths(self, key):
+        return tuple(self.root / (key + suffix) for suffix in (".json", ".lst", ".nes"))
+
+    def get(self, key):
+        """Return the cached entry dict for key (and mark it used), or None."""
+        paths = self._paths(key)
+        try:
+            entry = json.loads(paths[0].read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+
+        for path in paths:
+            try:
+                os.utime(str(path))
+            except OSError:
+                pass
+        self.hits += 1
+        return entry
+
+    def listing(self, key):
+        """
+        The (listing text, ROM bytes) stored for key, or None if the entry has
+        no listing (e.g. it was written before listings were kept).
+        """
+        _, listing_path, rom_path = self._paths(key)
+        try:
+            listing = listing_path.read_text(encoding="utf-8", errors="replace")
+            return listing, rom_path.read_bytes()
+        except OSError:
+            return None
+
+    def rom(self, key):
+        """The ROM bytes stored for key, or None."""
+        try:
+            return self._paths(key)[2].read_bytes()
+        except OSError:
+            return None
+
+    def record(self, hit):
+        """Count a lookup that was performed elsewhere (e.g. in a worker process)."""
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+    def _write_atomic(self, path, data):
+        fd, tmp = tempfile.mkstemp(dir=str(self.root), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, str(path))
+        except BaseException:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+
+    def put(self, key, rom_hash, listing_file=None, rom_file=None):
+        """
+        Store a result; listing_file and the rom_file it describes (if both
+        exist) are copied into the cache.
+        """
+        try:
+            self.root.mkdir(parents=True, exist_ok=True)
+            meta_path, listing_path, rom_path = self._paths(key)
+            if (
+                listing_file
+                and rom_file
+                and pathlib.Path(listing_file).exists()
+                and pathlib.Path(rom_file).exists()
+            ):
+                self._write_atomic(rom_path, pathlib.Path(rom_file).read_bytes())
+                self._write_atomic(listing_path, pathlib.Path(listing_file).read_bytes())
+            entry = {"rom_hash": rom_hash, "created": time.time()}
+            self._write_atomic(meta_path, json.dumps(entry).encode("utf-8"))
+            self.evict()
+        except OSError as e:
+            # A broken cache must never fail a verification run
+            print("  Warning: could not write assembly cache: {}".format(e))
+
+    def _entries(self):
+        """Return [(mtime, size, key)] for every entry in the cache."""
+        entries = []
+        for meta_path in self.root.glob("*.json"):
+            key = meta_path.stem
+            size = 0
+            try:
+                for path in self._paths(key):
+                    if path.exists():
+                        size += path.stat().st_size
+                entries.append((meta_path.stat().st_mtime, size, key))
+            except OSError:
+                continue
+        return entries
+
+    def evict(self):
+        """Drop least recently used entries until the cache fits in max_bytes."""
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in entries:
+            if total <= self.max_bytes:
+                break
+            for path in self._paths(key):
+                try:
+                    path.unlink()
+                except OSError:
+                    pass
+            total -= size
+
+    def stats_line(self):
+        entries = self._entries() if self.root.exists() else []
+        return "Assembly cache: {} hit(s), {} miss(es); {} entr{}, {:.1f} KB in {}".format(
+            self.hits,
+            self.misses,
+            len(entries),
+            "y" if len(entries) == 1 else "ies",
+            sum(size for _, size, _ in entries) / 1024.0,
+            self.root,
+        )
 
 
 def is_data_line(line):
@@ -342,31 +885,320 @@ def sanitize_name(s):
     return s or "block"
 
 
-def detect_first_label(lines, start, end):
+class SourceBuffer:
+    """
+    Read-only, memory-mapped view of a source file, indexed by line.
+
+    offsets[i] is the byte offset where line i starts; offsets[len(self)] is
+    the end of the file. Lines are split on LF (a trailing CR is dropped) and
+    decoded from UTF-8 on access, so the file is never held in memory as one
+    big string or as a list of lines.
+    """
+
+    CHUNK_BYTES = 1 << 22  # bytes scanned at once while indexing lines
+    CHUNK_LINES = 4096  # lines decoded at once while iterating
+
+    def __init__(self, path):
+        self.path = pathlib.Path(path)
+        self._file = open(str(self.path), "rb")
+        self.size = os.fstat(self._file.fileno()).st_size
+        if self.size:
+            self.data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self.data = b""  # empty files cannot be mapped
+
+        # Line starts, found chunk by chunk: the offset after each newline is the
+        # running sum of (part length + 1) over the chunk's newline-split parts
+        offsets = array.array("Q", [0])
+        for base in range(0, self.size, self.CHUNK_BYTES):
+            parts = self.data[base : base + self.CHUNK_BYTES].split(b"\n")
+            del parts[-1]  # bytes after the chunk's last newline
+            ends = itertools.accumulate(
+                itertools.chain((base,), map((1).__add__, map(len, parts)))
+            )
+            next(ends)
+            offsets.extend(ends)
+        if offsets[-1] < self.size:
+            offsets.append(self.size)  # last line has no newline
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def raw_line(self, i):
+        """Bytes of line i without its line terminator."""
+        line = self.data[self.offsets[i] : self.offsets[i + 1]]
+        if line.endswith(b"\n"):
+            line = line[:-1]
+        if line.endswith(b"\r"):
+            line = line[:-1]
+        return line
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[k] for k in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("line index out of range")
+        return self.raw_line(i).decode("utf-8", errors="ignore")
+
+    def __iter__(self):
+        # Decode a few thousand lines at a time rather than line by line
+        offsets = self.offsets
+        n = len(self)
+        for i in range(0, n, self.CHUNK_LINES):
+            j = min(n, i + self.CHUNK_LINES)
+            text = self.data[offsets[i] : offsets[j]].decode("utf-8", errors="ignore")
+            parts = text.replace("\r\n", "\n").split("\n")[: j - i]
+            if j == n and not text.endswith("\n") and parts[-1].endswith("\r"):
+                parts[-1] = parts[-1][:-1]
+            for line in parts:
+                yield line
+
+    def newline(self):
+        """Line terminator used by the file (CRLF if its first line uses one)."""
+        if len(self) and self.data[self.offsets[1] - 2 : self.offsets[1]] == b"\r\n":
+            return b"\r\n"
+        return b"\n"
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.data = b""
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def write_spliced_source(source, edits, out):
+    """
+    Stream source into a temp file next to out, replacing each (start, end,
+    include_line) range of lines in edits with include_line. Everything else is
+    copied as unchanged byte ranges straight from the mapped file.
+    Returns (temp_path, sha256 hexdigest of the written bytes); the caller moves
+    the temp file into place.
+    """
+    out = pathlib.Path(out)
+    newline = source.newline()
+    offsets = source.offsets
+    digest = hashlib.sha256()
+
+    fd, tmp = tempfile.mkstemp(dir=str(out.parent), prefix=out.name + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+
+            def emit(chunk):
+                digest.update(chunk)
+                f.write(chunk)
+
+            pos = 0
+            for start, end, inc_line in edits:
+                emit(source.data[pos : offsets[start]])
+                emit(inc_line.encode("utf-8") + newline)
+                pos = offsets[end]
+            emit(source.data[pos : source.size])
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+    # mkstemp creates the file private; give it the permissions out would get
+    if out.exists():
+        shutil.copymode(str(out), tmp)
+    else:
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(tmp, 0o666 & ~umask)
+
+    return pathlib.Path(tmp), digest.hexdigest()
+
+
+# Line kinds produced by classify_lines(). Every line of the source is
+# classified exactly once; block discovery and validation read these codes
+# instead of re-running the regexes above.
+KIND_BLANK = 0  # comment or blank line
+KIND_DATA = 1  # db/dw/hex/fill/incbin/... (optionally labelled)
+KIND_LABEL = 2  # label-only line
+KIND_ASSIGN = 3  # Name = value
+KIND_DIRECTIVE = 4  # org/base/macro/... (breaks a data block)
+KIND_CONDITIONAL = 5  # if/else/endif (breaks a data block)
+KIND_CODE = 6  # anything else (instructions, macro calls)
+KIND_VERSIONED = 7  # if/else/endif of a data-only conditional (--versioned-blocks)
+
+# Kinds that may appear inside a data block
+BLOCK_KINDS = frozenset((KIND_BLANK, KIND_DATA, KIND_LABEL, KIND_ASSIGN, KIND_VERSIONED))
+# Kinds that hard-stop a data block
+BREAK_KINDS = frozenset((KIND_DIRECTIVE, KIND_CONDITIONAL))
+
+
+def classify_line(line):
+    """
+    Classify a single source line.
+    Returns (kind, label) where label is the label defined on the line
+    (label-only or labelled data line, without the trailing colon) or None.
+    """
+    stripped = line.strip()
+    if not stripped or stripped[0] == ";":
+        return KIND_BLANK, None
+
+    # Cheap prefilters on the first word keep most code lines down to a
+    # single regex match; the regexes still have the final say.
+    first = stripped.split(None, 1)[0].lower()
+    if first[:2] in ("if", "el", "en") and CONDITIONAL_RE.match(line):
+        return KIND_CONDITIONAL, None
+
+    # Same rule as is_assembler_directive(): skip a leading "label:" part
+    if ":" in first:
+        first = first.split(":", 1)[1]
+    if first in ASM_DIR_CMDS:
+        return KIND_DIRECTIVE, None
+
+    if ":" in stripped:
+        m = LABEL_ONLY_RE.match(line)
+        if m:
+            return KIND_LABEL, m.group(1).rstrip(":")
+
+    m = DATA_LINE_RE.match(line)
+    if m and m.group(2) and m.group(2).lower() in DATA_TOKENS:
+        return KIND_DATA, m.group(1).rstrip(":") if m.group(1) else None
+
+    if "=" in stripped and ASSIGNMENT_RE.match(line):
+        return KIND_ASSIGN, None
+
+    return KIND_CODE, None
+
+
+class LineIndex:
+    """
+    One-pass classification of a list of source lines.
+
+    kinds[i]        - KIND_* code of line i (compact byte array)
+    labels.get(i)   - label defined on line i, or None (sparse dict)
+    next_sig[i]     - index of the first non-blank/non-comment line after i,
+                      or len(lines) if there is none
+    regions.get(i)  - (if line, endif line) of a KIND_VERSIONED line i
+
+    lines may be a list of strings or a SourceBuffer; it is only iterated once
+    and kept by reference, never copied.
+    """
+
+    __slots__ = ("lines", "kinds", "labels", "next_sig", "regions")
+
+    def __init__(self, lines):
+        self.lines = lines
+        n = len(lines)
+        self.kinds = array.array("B", bytes(n))
+        self.labels = {}
+        self.regions = {}
+        self.next_sig = array.array("I", [n]) * n
+
+        kinds = self.kinds
+        labels = self.labels
+        for i, line in enumerate(lines):
+            kind, label = classify_line(line)
+            kinds[i] = kind
+            if label:
+                labels[i] = label
+
+        # Backward sweep: next significant line after each index
+        next_sig = self.next_sig
+        nxt = n
+        for i in range(n - 1, -1, -1):
+            next_sig[i] = nxt
+            if kinds[i] != KIND_BLANK:
+                nxt = i
+
+    def __len__(self):
+        return len(self.lines)
+
+
+def classify_lines(lines):
+    """Build a LineIndex for lines (returned as-is if already classified)."""
+    if isinstance(lines, LineIndex):
+        return lines
+    return LineIndex(lines)
+
+
+def mark_versioned_regions(index, input_file):
+    """
+    Reclassify the if/elseif/else/endif lines of input_file (classified in
+    index) as KIND_VERSIONED where the whole conditional may sit inside a data
+    block: every branch holds only block lines, and every game version's
+    conditions resolve without assembling (misc/version_pp.py).
+    Returns the flattened streams {version name: version_pp.Flattened}; raises
+    version_pp.PreprocessError if a version cannot be flattened.
+    """
+    import version_pp
+
+    flats = {
+        name: version_pp.flatten(input_file, value)
+        for value, name in enumerate(VERSION_NAMES)
+    }
+    kinds = index.kinds
+    # Innermost first, so a nested data-only conditional counts as block lines
+    regions = version_pp.conditional_regions(index.lines)
+    for region in sorted(regions, key=lambda r: r.end - r.start):
+        directives = (region.start,) + region.branches + (region.end,)
+        body = (k for k in range(region.start + 1, region.end) if k not in directives)
+        if all(kinds[k] in BLOCK_KINDS for k in body):
+            for k in directives:
+                kinds[k] = KIND_VERSIONED
+                index.regions[k] = (region.start, region.end)
+    return flats
+
+
+def version_line_counts(flats, path, start, end):
+    """{version name: lines of start..end-1 in path that version assembles}."""
+    block = set(range(start, end))
+    return {name: len(flat.active(path) & block) for name, flat in flats.items()}
+
+
+def balance_block(index, start, end):
+    """
+    Shrink block start..end-1 until every KIND_VERSIONED conditional in it is
+    complete: a block that starts inside a branch stops at that branch's end,
+    one that would end inside a conditional stops before its if.
+    """
+    index = classify_lines(index)
+    kinds = index.kinds
+    changed = True
+    while changed:
+        changed = False
+        for k in range(start, end):
+            region = index.regions.get(k)
+            if region and (region[0] < start or region[1] >= end):
+                end = k if region[0] < start else region[0]
+                changed = True
+                break
+        while end > start and (
+            kinds[end - 1] == KIND_BLANK or kinds[end - 1] == KIND_LABEL
+        ):
+            end -= 1
+    return end
+
+
+def detect_first_label(index, start, end):
     """Extract the first meaningful label from a block."""
-    # Check the start line for labels
-    m = LABEL_ONLY_RE.match(lines[start])
-    if m:
-        return m.group(1).rstrip(":")
+    index = classify_lines(index)
+    kinds, labels = index.kinds, index.labels
 
-    m = DATA_LINE_RE.match(lines[start])
-    if m and m.group(1):
-        return m.group(1).rstrip(":")
+    # Check the start line for labels
+    if start in labels:
+        return labels[start]
 
     # Look backward for nearby labels (within 3 lines)
     for k in range(max(0, start - 3), start):
-        mm = LABEL_ONLY_RE.match(lines[k])
-        if mm:
-            return mm.group(1).rstrip(":")
+        if kinds[k] == KIND_LABEL:
+            return labels[k]
 
     # Look forward in the block for the first label
     for k in range(start, min(end, start + 5)):
-        mm = LABEL_ONLY_RE.match(lines[k])
-        if mm:
-            return mm.group(1).rstrip(":")
-        mm = DATA_LINE_RE.match(lines[k])
-        if mm and mm.group(1):
-            return mm.group(1).rstrip(":")
+        if k in labels:
+            return labels[k]
 
     return None
 
@@ -376,122 +1208,110 @@ def hash_block(text):
     return hashlib.sha1(text.encode("utf-8", errors="ignore")).hexdigest()[:8]
 
 
-def count_actual_data_lines(lines, start, end):
+def count_actual_data_lines(index, start, end):
     """Count actual data lines (excluding comments and blanks)."""
+    kinds = classify_lines(index).kinds
     count = 0
     for i in range(start, end):
-        if is_data_line(lines[i]) or is_label_only(lines[i]):
+        if kinds[i] == KIND_DATA or kinds[i] == KIND_LABEL:
             count += 1
     return count
 
 
-def validate_block(lines, start, end):
+def validate_block(index, start, end):
     """Validate that block is suitable for extraction."""
-    # Must contain at least one actual data line
-    has_data = False
-    for i in range(start, end):
-        if is_data_line(lines[i]):
-            has_data = True
-            break
+    kinds = classify_lines(index).kinds
 
-    if not has_data:
+    # Must contain at least one actual data line
+    if KIND_DATA not in kinds[start:end]:
         return False
 
-    # Check for problematic constructs
-    for i in range(start, end):
-        line = lines[i].strip()
-        if line and not (is_block_line(lines[i]) or should_break_block(lines[i])):
-            # Unknown line type - be conservative
-            return False
+    # Check for problematic constructs: unknown line type - be conservative
+    if KIND_CODE in kinds[start:end]:
+        return False
 
     return True
 
 
-# Drop-in patch snippets for split_asm_data.py
-# Fix: avoid capturing trailing label-only lines (e.g., CODE_FB75:) at the end of data blocks,
-# while still allowing labels *inside* a data block when they are immediately followed by data.
-
-# --- Add these helpers near the other predicate helpers ---
-
-
-def next_significant_index(lines: list[str], idx: int) -> int:
+def next_significant_index(index, idx):
     """Return index of next non-blank/non-comment line after idx, or len(lines) if none."""
-    n = len(lines)
-    k = idx + 1
-    while k < n and is_comment_or_blank(lines[k]):
-        k += 1
-    return k
+    return classify_lines(index).next_sig[idx]
 
 
-def next_significant_is_data(lines: list[str], idx: int) -> bool:
+def next_significant_is_data(index, idx):
     """Return True if the next significant line after idx looks like data/assignment."""
-    k = next_significant_index(lines, idx)
-    if k >= len(lines):
+    index = classify_lines(index)
+    k = index.next_sig[idx]
+    if k >= len(index):
         return False
-    return is_data_line(lines[k]) or is_assignment(lines[k])
-
+    return index.kinds[k] == KIND_DATA or index.kinds[k] == KIND_ASSIGN
 
-# --- Replace your find_data_blocks(...) with the version below ---
 
-
-def find_data_blocks(lines, min_lines):
+def find_data_blocks(index, min_lines):
     """Find all suitable data blocks in the source.
 
+    Accepts either a list of lines or a LineIndex; the scan itself only reads
+    the precomputed line kinds, so it is linear in the number of lines.
+
     Heuristics:
     - Start a block only at a data line (db/dw/hex/fill/incbin/etc.).
     - Permit label-only lines *inside* the block only when they are immediately followed by data.
       If a label-only line is followed by non-data (typically code), treat it as the start of the next section
       and do not include it in the data block.
     - Trim any trailing label-only or comment lines that accidentally slip through, as an extra safeguard.
+    - Conditionals marked by mark_versioned_regions() may sit inside a block, but only whole
+      (see balance_block()).
     """
-    i, n = 0, len(lines)
+    index = classify_lines(index)
+    kinds = index.kinds
+    next_sig = index.next_sig
+    i, n = 0, len(index)
     blocks = []
 
     while i < n:
-        line = lines[i]
-
-        if is_data_line(line):
+        if kinds[i] == KIND_DATA:
             start = i
             j = i
 
             while j < n:
-                cur = lines[j]
-
-                # Hard break on assembler directives / conditionals
-                if should_break_block(cur):
-                    break
+                kind = kinds[j]
 
                 # Allow block-compatible lines, with special rules for label-only lines
-                if is_label_only(cur):
+                if kind == KIND_LABEL:
                     # Keep label only if followed by data/assignment; otherwise it's the start of next section
-                    if next_significant_is_data(lines, j):
+                    k = next_sig[j]
+                    if k < n and (
+                        kinds[k] == KIND_DATA
+                        or kinds[k] == KIND_ASSIGN
+                        or kinds[k] == KIND_VERSIONED
+                    ):
                         j += 1
                         continue
-                    else:
-                        break  # do not consume this label; let the next pass handle it
+                    break  # do not consume this label; let the next pass handle it
 
-                if is_block_line(cur):
+                if kind in BLOCK_KINDS:
                     j += 1
                     continue
 
-                # Unknown line type: stop block
+                # Assembler directives / conditionals / unknown line type: stop block
                 break
 
             end = j
 
             # Trim trailing label-only or comment/blank lines from the block, if any
             while end > start and (
-                is_comment_or_blank(lines[end - 1]) or is_label_only(lines[end - 1])
+                kinds[end - 1] == KIND_BLANK or kinds[end - 1] == KIND_LABEL
             ):
                 end -= 1
 
-            block_len = end - start
-            actual_data_lines = count_actual_data_lines(lines, start, end)
+            if index.regions:
+                end = balance_block(index, start, end)
 
+            block_len = end - start
             if (
                 block_len >= min_lines
-                and actual_data_lines >= max(1, min_lines // 2)
-                and validate_block(lines, start, end)
+                and count_actual_data_lines(index, start, end) >= max(1, min_lines // 2)
+                and validate_block(index, start, end)
             ):
                 blocks.append((start, end))
 
@@ -505,8 +1325,10 @@ def find_data_blocks(lines, min_lines):
 from pathlib import Path
 
 
-def generate_include_line(target_path: Path, base_dir: Path) -> str:
-    """Generate ASM6-compatible incsrc line using a path *relative to base_dir*.
+def generate_include_line(
+    target_path: Path, base_dir: Path, directive: str = "incsrc"
+) -> str:
+    """Generate ASM6-compatible incsrc (or incbin) line using a path *relative to base_dir*.
     base_dir should be the directory of the main ASM file being written (i.e., out.parent).
     """
     try:
@@ -518,7 +1340,7 @@ def generate_include_line(target_path: Path, base_dir: Path) -> str:
         except Exception:
             rel = Path(target_path)
     path_str = rel.as_posix()
-    return f'incsrc "{path_str}"'
+    return f'{directive} "{path_str}"'
 
 
 def backup_file(filepath):
@@ -546,7 +1368,244 @@ def route_relpath(base_dir: pathlib.Path, base_name: str) -> pathlib.Path:
     return base_dir / base_name
 
 
-def coalesce_small_blocks(lines, blocks, max_total=40, gap_limit=3):
+# Manifest of extracted blocks, kept in --data-dir for incremental re-splits
+MANIFEST_NAME = "split_manifest.json"
+MANIFEST_VERSION = 1
+
+
+def text_digest(text):
+    """Full SHA1 of block text (hash_block() is its 8-digit prefix) or binary data."""
+    if isinstance(text, bytes):
+        return hashlib.sha1(text).hexdigest()
+    return hashlib.sha1(text.encode("utf-8", errors="ignore")).hexdigest()
+
+
+def read_text_or_none(path):
+    """Read a text file, or return None if it does not exist / cannot be read."""
+    try:
+        return pathlib.Path(path).read_text(encoding="utf-8", errors="ignore")
+    except OSError:
+        return None
+
+
+def read_block_file(path):
+    """Read an extracted block file: bytes for .bin blobs, text otherwise (None if missing)."""
+    path = pathlib.Path(path)
+    if path.suffix.lower() != ".bin":
+        return read_text_or_none(path)
+    try:
+        return path.read_bytes()
+    except OSError:
+        return None
+
+
+def load_manifest(data_dir):
+    """Load the split manifest from data_dir (an empty one if missing or invalid)."""
+    text = read_text_or_none(pathlib.Path(data_dir) / MANIFEST_NAME)
+    try:
+        manifest = json.loads(text) if text else {}
+    except ValueError:
+        manifest = {}
+    if not isinstance(manifest, dict) or manifest.get("version") != MANIFEST_VERSION:
+        manifest = {}
+    manifest.setdefault("version", MANIFEST_VERSION)
+    manifest.setdefault("sources", {})
+    return manifest
+
+
+def save_manifest(data_dir, manifest):
+    """Write the split manifest into data_dir (only if its content changed)."""
+    path = pathlib.Path(data_dir) / MANIFEST_NAME
+    text = json.dumps(manifest, indent=2, sort_keys=True) + "\n"
+    if read_text_or_none(path) != text:
+        path.write_text(text, encoding="utf-8")
+    return path
+
+
+def referenced_includes(index, base_dir, edits=()):
+    """
+    Resolved paths of every incsrc/include/incbin target in a classified file,
+    as it will read once the (start, end, include_line) edits are applied.
+    """
+    base_dir = pathlib.Path(base_dir)
+    referenced = set()
+
+    def add(line):
+        m = INCLUDE_RE.match(line)
+        if m:
+            referenced.add((base_dir / (m.group(2) or m.group(3))).resolve())
+
+    replaced = bytearray(len(index))
+    for start, end, inc_line in edits:
+        replaced[start:end] = b"\x01" * (end - start)
+        add(inc_line)
+
+    for i, kind in enumerate(index.kinds):
+        if (kind == KIND_DIRECTIVE or kind == KIND_DATA) and not replaced[i]:
+            add(index.lines[i])
+    return referenced
+
+
+def plan_block_updates(data_dir, blocks, previous, referenced, force=False):
+    """
+    Diff the blocks about to be extracted against the previous manifest entries
+    for the same source, so only changed files are touched.
+
+    blocks     - [(relpath, content, entry)] for this run; content is text,
+                 or bytes for .bin blobs
+    previous   - manifest entries recorded by the last run
+    referenced - resolved paths still included by the new main file; recorded
+                 files that are still included (e.g. after an in-place split)
+                 are kept as they are
+
+    Returns a dict of lists:
+      unchanged - relpaths whose file already has the right content
+      write     - (relpath, text) to (re)write
+      rename    - (old_path, relpath) for moved blocks with unchanged content
+      delete    - recorded files no longer produced or included
+      kept      - previous entries that stay valid
+      conflicts - existing files with different content that were not written
+                  by the last run (need --force)
+      modified  - stale recorded files that were edited by hand (not deleted
+                  unless force)
+    """
+    data_dir = pathlib.Path(data_dir)
+    plan = {
+        key: []
+        for key in ("unchanged", "write", "rename", "delete", "kept", "conflicts", "modified")
+    }
+    new_paths = {relpath.resolve() for relpath, _, _ in blocks}
+    recorded = {(data_dir / entry["path"]).resolve(): entry.get("hash") for entry in previous}
+
+    # Recorded files that are no longer produced under the same name: candidates
+    # for a rename (same content, new name) or deletion
+    movable = {}
+    for entry in previous:
+        path = data_dir / entry["path"]
+        resolved = path.resolve()
+        if resolved in new_paths:
+            continue
+        if resolved in referenced:
+            plan["kept"].append(entry)
+            continue
+        current = read_block_file(path)
+        if current is None:
+            continue
+        if text_digest(current) == entry.get("hash"):
+            movable.setdefault(entry["hash"], []).append(path)
+        elif force:
+            plan["delete"].append(path)
+        else:
+            plan["modified"].append(path)
+
+    for relpath, text, entry in blocks:
+        current = read_block_file(relpath)
+        if current == text:
+            plan["unchanged"].append(relpath)
+        elif current is not None:
+            # Safe to replace if the last run wrote it and nobody edited it since
+            if force or recorded.get(relpath.resolve()) == text_digest(current):
+                plan["write"].append((relpath, text))
+            else:
+                plan["conflicts"].append(relpath)
+        elif movable.get(entry["hash"]):
+            plan["rename"].append((movable[entry["hash"]].pop(), relpath))
+        else:
+            plan["write"].append((relpath, text))
+
+    for paths in movable.values():
+        plan["delete"].extend(paths)
+
+    return plan
+
+
+def apply_block_updates(plan, verbose=False):
+    """Carry out a plan from plan_block_updates(). Renames keep file mtimes."""
+    for old_path, relpath in plan["rename"]:
+        relpath.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(str(old_path), str(relpath))
+        if verbose:
+            print("Renamed: {} -> {}".format(old_path, relpath))
+
+    for relpath, content in plan["write"]:
+        relpath.parent.mkdir(parents=True, exist_ok=True)
+        if isinstance(content, bytes):
+            relpath.write_bytes(content)
+        else:
+            relpath.write_text(content, encoding="utf-8")
+        if verbose:
+            print("Wrote: {}".format(relpath))
+
+    for path in plan["delete"]:
+        path.unlink()
+        if verbose:
+            print("Deleted: {}".format(path))
+
+
+def describe_block_updates(plan):
+    return "Data files: {} written, {} renamed, {} unchanged, {} deleted".format(
+        len(plan["write"]), len(plan["rename"]), len(plan["unchanged"]), len(plan["delete"])
+    )
+
+
+def collect_block_constants(src, source):
+    """
+    Constants visible to data blocks: the unconditional assignments of the main
+    file (source) and of every text file in its include closure (Defines.asm...).
+    """
+    import asm6_eval
+
+    src = pathlib.Path(src)
+
+    def all_lines():
+        for rel in include_closure(src):
+            if rel == pathlib.Path(src.name) or rel.suffix.lower() != ".asm":
+                continue
+            text = read_text_or_none(src.parent / rel)
+            if text:
+                yield from text.splitlines()
+        yield from source
+
+    return asm6_eval.collect_constants(all_lines())
+
+
+def build_binary_block(relpath, lines, constants, out_dir, description):
+    """
+    Evaluate a data block to bytes and build the .asm stub that replaces it:
+    its labels and assignments at their original offsets, with incbin ranges of
+    the .bin blob in between. Raises asm6_eval.EvalError if the block cannot be
+    evaluated on its own (e.g. it references code labels).
+    Returns (bin_path, stub_text, data).
+    """
+    import asm6_eval
+
+    data, items = asm6_eval.evaluate_block(lines, constants)
+    if not data:
+        raise asm6_eval.EvalError("block emits no bytes")
+
+    bin_path = relpath.with_suffix(".bin")
+    incbin = generate_include_line(bin_path, out_dir, directive="incbin")
+    stub = [";{} (binary data in {})".format(description, bin_path.name)]
+
+    def emit_range(start, end):
+        if start == 0 and end == len(data):
+            stub.append(incbin)
+        else:
+            stub.append("{}, ${:X}, ${:X}".format(incbin, start, end - start))
+
+    pos = 0
+    for offset, kind, text in items:
+        if offset > pos:
+            emit_range(pos, offset)
+            pos = offset
+        stub.append(text + ":" if kind == "label" else text)
+    if pos < len(data):
+        emit_range(pos, len(data))
+
+    return bin_path, "\n".join(stub) + "\n", data
+
+
+def coalesce_small_blocks(index, blocks, max_total=40, gap_limit=3):
     """Merge adjacent small blocks when separated only by <= gap_limit lines
     of comments/blank lines, and total merged size <= max_total.
     Reduces tiny-file spam without changing assembled output.
@@ -554,12 +1613,14 @@ def coalesce_small_blocks(lines, blocks, max_total=40, gap_limit=3):
     if not blocks:
         return blocks
 
+    kinds = classify_lines(index).kinds
     merged = []
     cur_s, cur_e = blocks[0]
 
     def gap_ok(a_end, b_start):
-        gap = lines[a_end:b_start]
-        return all(is_comment_or_blank(x) for x in gap) and len(gap) <= gap_limit
+        if b_start - a_end > gap_limit:
+            return False
+        return all(kinds[k] == KIND_BLANK for k in range(a_end, b_start))
 
     for s, e in blocks[1:]:
         if gap_ok(cur_e, s) and (e - cur_s) <= max_total:
@@ -572,12 +1633,374 @@ def coalesce_small_blocks(lines, blocks, max_total=40, gap_limit=3):
     return merged
 
 
+def changed_line_ranges(old, new):
+    """
+    [(old start, old end, new start, new end)] of the line ranges that differ
+    between two lists of lines. Common leading and trailing lines are skipped
+    before difflib compares the rest, so a local edit to a long file is cheap.
+    """
+    import difflib
+
+    head = 0
+    limit = min(len(old), len(new))
+    while head < limit and old[head] == new[head]:
+        head += 1
+    tail = 0
+    while tail < limit - head and old[-1 - tail] == new[-1 - tail]:
+        tail += 1
+    matcher = difflib.SequenceMatcher(
+        None, old[head : len(old) - tail], new[head : len(new) - tail], autojunk=False
+    )
+    return [
+        (head + i1, head + i2, head + j1, head + j2)
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes()
+        if tag != "equal"
+    ]
+
+
+class WatchedBuild:
+    """
+    What --watch keeps in memory between rebuilds: the text and LineIndex of
+    every source file, and each version's flattened stream
+    (misc/version_pp.py), which tells which files the version includes and
+    which of their lines sit in conditional branches it skips. A change only
+    re-assembles the versions it can affect.
+    """
+
+    def __init__(self, input_file, versions):
+        import version_pp
+
+        self.pp = version_pp
+        self.input_file = pathlib.Path(input_file).resolve()
+        self.base = self.input_file.parent
+        self.versions = versions
+        self.sources = {}  # rel -> (text, LineIndex) of a source file
+        self.digests = {}  # rel -> SHA256 of a binary include
+        self.flats = {}  # version name -> Flattened; absent if it could not be built
+        self.deps = {}  # version name -> set of rel it includes
+        self.refresh()
+
+    def _read(self, rel):
+        if rel not in self.sources:
+            try:
+                text = (self.base / rel).read_text(encoding="utf-8", errors="replace")
+            except OSError:
+                return None
+            self.sources[rel] = (text, LineIndex(text.splitlines()))
+        return self.sources[rel][0]
+
+    def refresh(self):
+        """Re-flatten every version from the cached sources (after update())."""
+        for name, value in self.versions:
+            try:
+                flat = self.pp.flatten(self.input_file, value, read=self._read)
+            except ValueError:  # PreprocessError: every file may matter to it
+                self.flats.pop(name, None)
+                self.deps[name] = {rel.as_posix() for rel in include_closure(self.input_file)}
+                continue
+            deps = flat.files()
+            for line in flat.lines:
+                m = INCLUDE_RE.match(line.text)
+                if m and m.group(1).lower() in ("incbin", "bin"):
+                    deps.add(pathlib.PurePath(m.group(2) or m.group(3)).as_posix())
+            self.flats[name] = flat
+            self.deps[name] = deps
+        for rel in set().union(*self.deps.values()):
+            if rel not in self.sources and rel not in self.digests:
+                self.digests[rel] = get_file_hash(self.base / rel)
+
+    def paths(self):
+        """Every file some version depends on."""
+        return {self.base / rel for rel in set().union(*self.deps.values())}
+
+    def _affects(self, name, rel, ranges, index):
+        if rel not in self.deps.get(name, ()):
+            return False
+        flat = self.flats.get(name)
+        if flat is None or ranges is None:
+            return True
+        skipped = flat.skipped(rel)
+        for i1, i2, j1, j2 in ranges:
+            if i1 == i2:  # insertion: harmless only next to a skipped line (in its branch)
+                if i1 - 1 not in skipped and i1 not in skipped:
+                    return True
+            elif any(i not in skipped for i in range(i1, i2)):
+                return True
+            # A new if/else/endif changes which lines are skipped
+            if any(index.kinds[j] == KIND_CONDITIONAL for j in range(j1, j2)):
+                return True
+        return False
+
+    def update(self, paths):
+        """
+        Take in the new contents of paths. Returns (files whose content
+        changed, names of the versions those changes can affect).
+        """
+        changed = []
+        affected = set()
+        for path in sorted(paths):
+            rel = pathlib.Path(os.path.relpath(str(path), str(self.base))).as_posix()
+            if rel in self.sources:
+                old_text, old_index = self.sources.pop(rel)
+                if self._read(rel) == old_text:
+                    continue
+                ranges = None
+                index = None
+                if rel in self.sources:
+                    index = self.sources[rel][1]
+                    ranges = changed_line_ranges(old_index.lines, index.lines)
+            else:
+                digest = get_file_hash(self.base / rel)
+                if digest == self.digests.get(rel):
+                    continue
+                self.digests[rel] = digest
+                ranges = index = None
+            changed.append(rel)
+            affected.update(
+                name for name, _ in self.versions if self._affects(name, rel, ranges, index)
+            )
+        return changed, affected
+
+
+def _watch_version_job(job):
+    """
+    Process-pool worker for --watch: assemble one version of input_file.
+    job is (asm_path, input_file, name, value); asm_path None evaluates it
+    with asm6_eval instead. Returns (name, image or None, error text, seconds).
+    """
+    asm_path, input_file, name, value = job
+    started = time.perf_counter()
+    if asm_path is None:
+        import asm6_eval
+
+        overrides = {"Version": value} if value is not None else None
+        try:
+            image = asm6_eval.assemble(input_file, overrides, allow_missing=True).image
+            return name, image, "", time.perf_counter() - started
+        except asm6_eval.EvalError as e:
+            return name, None, str(e), time.perf_counter() - started
+    with tempfile.TemporaryDirectory(prefix="split_asm_{}_".format(name)) as tmp:
+        main_copy = prepare_version_workspace(input_file, value, tmp)
+        output = pathlib.Path(tmp) / "output.nes"
+        success, stdout, stderr = run_assembler(asm_path, main_copy, output)
+        seconds = time.perf_counter() - started
+        if not success or not output.exists():
+            return name, None, (stderr or stdout).strip(), seconds
+        return name, output.read_bytes(), "", seconds
+
+
+def watch_sources(
+    input_file, versions, expected, asm_path=None, source_index=None, poll=False
+):
+    """
+    Rebuild input_file whenever one of its sources changes, until Ctrl+C:
+    only the versions the change can affect are assembled again (in a pool
+    of worker processes kept for the whole session), and their hashes are
+    checked against expected {name: hash}. asm_path None evaluates with
+    misc/asm6_eval.py. Differences are traced back to source lines with
+    source_index (a DeferredSourceIndex of the sources at startup) if given.
+    """
+    import file_watch
+
+    input_file = pathlib.Path(input_file).resolve()
+    if asm_path is None:
+        import asm6_eval  # loaded once, before the workers fork
+    elif pathlib.Path(asm_path).exists():
+        asm_path = str(pathlib.Path(asm_path).resolve())
+
+    build = WatchedBuild(input_file, versions)
+    if source_index is not None:
+        source_index.keep(build.paths())  # edits overwrite them
+    watcher = file_watch.open_watcher(build.paths(), poll=poll)
+    print(
+        "Watching {} file(s) with {} (Ctrl+C to stop)...".format(
+            len(build.paths()), watcher.method
+        )
+    )
+    for name in build.deps:
+        if name not in build.flats:
+            print("  Note: {} conditionals not resolved, every change rebuilds it".format(name))
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=len(versions)) as pool:
+        try:
+            while True:
+                paths = watcher.wait()
+                started = time.perf_counter()
+                changed, affected = build.update(paths)
+                if not changed:
+                    continue
+                jobs = [
+                    (asm_path, str(input_file), name, value)
+                    for name, value in versions
+                    if name in affected
+                ]
+                futures = [pool.submit(_watch_version_job, job) for job in jobs]
+
+                print(
+                    "[{}] {} changed".format(time.strftime("%H:%M:%S"), ", ".join(changed))
+                )
+                results = {}
+                for future in futures:
+                    name, image, error, seconds = future.result()
+                    results[name] = (image, error)
+                    record_assembler_run(
+                        asm_path or "asm6_eval", input_file, seconds, image is not None, name
+                    )
+                for name, value in versions:
+                    if name not in results:
+                        print("  {:<10} {:<18} unaffected".format(name, "-"))
+                        continue
+                    image, error = results[name]
+                    if image is None:
+                        print("  {:<10} {:<18} {} {}".format(name, "-", _FAIL, error))
+                        continue
+                    digest = hashlib.sha256(image).hexdigest()
+                    match = digest == expected.get(name)
+                    print("  {:<10} {:<18} {}".format(name, digest[:16], _OK if match else _FAIL))
+                    if match or source_index is None:
+                        continue
+                    index = source_index.get(name, value)
+                    for line in describe_differences(index, value, image) if index else ():
+                        print("  " + line)
+                print("  {:.2f}s".format(time.perf_counter() - started))
+                # The dependency graph is brought up to date after the report, so
+                # it does not delay it; inotify queues the events meanwhile
+                build.refresh()
+                watcher.watch(build.paths())
+        except KeyboardInterrupt:
+            print("Stopped watching.")
+        finally:
+            watcher.close()
+    return 0
+
+
+# Phases run under cProfile with --cprofile: the line classifier and the
+# block heuristics that read its output
+CPROFILE_PHASES = ("classify", "find_blocks")
+PROFILE_FORMAT = 1
+
+
+class Profiler:
+    """
+    Phase timings of one run for --profile. phase(name) ends the current
+    phase and starts the next; each records its wall time, CPU time (of this
+    process, and of the child processes it waited for where the platform
+    reports that) and tracemalloc peak. Phases in cprofile_phases also run
+    under cProfile and are dumped to <cprofile_prefix>.<phase>.prof. Disabled,
+    every method is a no-op.
+    """
+
+    def __init__(self, enabled=False, cprofile_phases=(), cprofile_prefix=None):
+        self.enabled = enabled
+        self.cprofile_phases = set(cprofile_phases)
+        self.cprofile_prefix = cprofile_prefix
+        self.phases = []
+        self.counters = {}
+        self.dumps = []
+        self.current = None
+        if enabled:
+            tracemalloc.start()
+            self.started = self._clock()
+
+    @staticmethod
+    def _clock():
+        try:
+            import resource  # POSIX only
+
+            children = resource.getrusage(resource.RUSAGE_CHILDREN)
+            child_cpu = children.ru_utime + children.ru_stime
+        except ImportError:
+            child_cpu = None
+        return time.perf_counter(), time.process_time(), child_cpu
+
+    @staticmethod
+    def _elapsed(start, end):
+        wall = end[0] - start[0]
+        cpu = end[1] - start[1]
+        child = None if start[2] is None else end[2] - start[2]
+        return {
+            "wall_seconds": round(wall, 6),
+            "cpu_seconds": round(cpu, 6),
+            "child_cpu_seconds": None if child is None else round(child, 6),
+        }
+
+    def phase(self, name):
+        if not self.enabled:
+            return
+        self._end()
+        if hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+        else:  # Python < 3.9: restarting is the only way to reset the peak
+            tracemalloc.stop()
+            tracemalloc.start()
+        profile = None
+        if name in self.cprofile_phases and self.cprofile_prefix:
+            import cProfile
+
+            profile = cProfile.Profile()
+        self.current = (name, self._clock(), tracemalloc.get_traced_memory()[0], profile)
+        if profile:
+            profile.enable()
+
+    def _end(self):
+        if self.current is None:
+            return
+        name, start, base, profile = self.current
+        if profile:
+            profile.disable()
+        entry = {"name": name}
+        entry.update(self._elapsed(start, self._clock()))
+        size, peak = tracemalloc.get_traced_memory()
+        entry["peak_bytes"] = peak
+        entry["peak_increase_bytes"] = peak - base
+        entry["retained_bytes"] = size - base
+        self.phases.append(entry)
+        if profile:
+            path = "{}.{}.prof".format(self.cprofile_prefix, name)
+            profile.dump_stats(path)
+            self.dumps.append(path)
+        self.current = None
+
+    def count(self, name, value):
+        """Record a counter (lines, blocks, files written, ...) for the report."""
+        if self.enabled:
+            self.counters[name] = value
+
+    def report(self, status):
+        """The JSON-ready report; ends the current phase."""
+        self._end()
+        total = self._elapsed(self.started, self._clock())
+        total["peak_bytes"] = max((p["peak_bytes"] for p in self.phases), default=0)
+        return {
+            "format": PROFILE_FORMAT,
+            "command": sys.argv,
+            "python": "{}.{}.{}".format(*sys.version_info[:3]),
+            "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "exit_status": status,
+            "total": total,
+            "phases": self.phases,
+            "assembler_runs": ASSEMBLER_RUNS,
+            "counters": self.counters,
+            "cprofile_dumps": self.dumps,
+        }
+
+    def write(self, path, status):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.report(status), f, indent=2)
+            f.write("\n")
+        tracemalloc.stop()
+
+
 def main():
     ap = argparse.ArgumentParser(
         description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
     )
     ap.add_argument("infile", help="Input ASM file to process")
-    ap.add_argument("outfile", help="Output ASM file (use same as infile to overwrite)")
+    ap.add_argument(
+        "outfile",
+        nargs="?",
+        help="Output ASM file (use same as infile to overwrite; not used with --watch)",
+    )
     ap.add_argument(
         "--data-dir", default="src/data", help="Directory for extracted data files"
     )
@@ -595,21 +2018,110 @@ def main():
         help="Create backup of original file before overwriting",
     )
     ap.add_argument(
-        "--force", action="store_true", help="Overwrite existing data files"
+        "--force",
+        action="store_true",
+        help="Overwrite data files that exist with different content and delete "
+        "hand-edited stale ones",
+    )
+    ap.add_argument(
+        "--emit",
+        choices=("text", "binary"),
+        default="text",
+        help="Write blocks as text (default) or as .bin blobs with incbin stubs; "
+        "blocks that cannot be evaluated on their own stay text",
     )
     ap.add_argument(
         "--verify",
         action="store_true",
         help="Verify assembly before and after splitting",
     )
+    ap.add_argument(
+        "--eval-verify",
+        action="store_true",
+        help="Verify with the built-in ASM6 evaluator instead of the assembler: "
+        "every block must emit the same bytes at the same address after the split "
+        "(implies --verify; used automatically when no assembler is found)",
+    )
     ap.add_argument(
         "--assembler",
         help="Path to asm6f/asm6 assembler (auto-detected if not specified)",
     )
+    ap.add_argument(
+        "--versions",
+        help="Comma-separated versions to verify in parallel, e.g. JP,US,Gamecube "
+        "(implies --verify; the source's Version define is not modified)",
+    )
+    ap.add_argument(
+        "--cache-dir",
+        help="Directory for cached assembler results "
+        "(default: {} next to the input file)".format(CACHE_DIR_NAME),
+    )
+    ap.add_argument(
+        "--cache-size",
+        type=int,
+        default=CACHE_DEFAULT_MAX_MB,
+        help="Maximum assembler cache size in MB (least recently used entries are evicted)",
+    )
+    ap.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Always run the assembler instead of reusing cached results",
+    )
+    ap.add_argument(
+        "--versioned-blocks",
+        action="store_true",
+        help="Let blocks span If Version ... endif regions that hold only data, "
+        "resolving the conditions per version with misc/version_pp.py "
+        "(best verified with --versions JP,US,Gamecube)",
+    )
+    ap.add_argument(
+        "--watch",
+        action="store_true",
+        help="Do not split: keep watching the input file and its includes, and re-verify "
+        "the versions a change affects against the hashes at startup (implies "
+        "--versions JP,US,Gamecube unless given)",
+    )
+    ap.add_argument(
+        "--poll",
+        action="store_true",
+        help="With --watch, poll file timestamps instead of using inotify",
+    )
+    ap.add_argument(
+        "--profile",
+        metavar="FILE",
+        help="Write a JSON report to FILE: wall/CPU time and tracemalloc peak of each "
+        "phase, every assembler run and the files written (tracemalloc slows the run)",
+    )
+    ap.add_argument(
+        "--cprofile",
+        metavar="PREFIX",
+        help="With --profile, also run the {} phases under cProfile and dump their "
+        "stats to PREFIX.<phase>.prof".format(" and ".join(CPROFILE_PHASES)),
+    )
     ap.add_argument("--verbose", "-v", action="store_true", help="Verbose output")
 
     args = ap.parse_args()
+    if args.outfile is None and not args.watch:
+        ap.error("the following arguments are required: outfile")
+    if args.cprofile and not args.profile:
+        ap.error("--cprofile needs --profile")
+
+    profiler = Profiler(args.profile is not None, CPROFILE_PHASES, args.cprofile)
+    status = 1
+    try:
+        status = run_split(args, profiler)
+    finally:
+        if args.profile:
+            try:
+                profiler.write(args.profile, status)
+                print("Profile written to {}".format(args.profile))
+            except OSError as e:
+                print("Error writing profile: {}".format(e), file=sys.stderr)
+    return status
+
 
+def run_split(args, profiler):
+    """Everything main() does once the arguments are parsed; returns the exit status."""
     # Show Python version info if verbose
     if args.verbose:
         print(
@@ -619,93 +2131,235 @@ def main():
         )
 
     src = pathlib.Path(args.infile)
-    out = pathlib.Path(args.outfile)
+    out = pathlib.Path(args.outfile or args.infile)
     data_dir = pathlib.Path(args.data_dir)
 
     if not src.exists():
         print("Error: Input file '{}' not found".format(src), file=sys.stderr)
         return 1
 
+    versions = None
+    if args.versions:
+        try:
+            versions = parse_versions(args.versions)
+        except ValueError as e:
+            print("Error: {}".format(e), file=sys.stderr)
+            return 1
+        if not versions:
+            print("Error: --versions needs at least one version", file=sys.stderr)
+            return 1
+        args.verify = True
+    if args.watch:
+        versions = versions or [(name, value) for value, name in enumerate(VERSION_NAMES)]
+        args.verify = True
+    if args.eval_verify:
+        args.verify = True
+
     # Find assembler if verification is requested
     assembler = None
-    if args.verify:
+    if args.verify and not args.eval_verify:
         assembler = args.assembler or find_assembler()
         if not assembler:
             print(
-                "Error: Could not find asm6f/asm6 assembler for verification.",
-                file=sys.stderr,
+                "No asm6f/asm6 assembler found (install asm6f or use --assembler); "
+                "verifying with the built-in evaluator instead."
             )
-            print("Install asm6f or specify path with --assembler", file=sys.stderr)
-            return 1
-
-        if args.verbose:
+            args.eval_verify = True
+        elif args.verbose:
             print("Using assembler: {}".format(assembler))
 
-    # Read source file
+    cache = None
+    if assembler and not args.no_cache:
+        cache = AssemblyCache(
+            args.cache_dir or src.parent / CACHE_DIR_NAME,
+            max_bytes=args.cache_size * 1024 * 1024,
+        )
+        if cache.root.exists():
+            cache.evict()  # honour a lowered --cache-size straight away
+
+    # Map source file (lines are decoded on demand, never copied as a whole)
+    profiler.phase("read")
     try:
-        lines = src.read_text(encoding="utf-8", errors="ignore").splitlines()
+        source = SourceBuffer(src)
     except Exception as e:
         print("Error reading '{}': {}".format(src, e), file=sys.stderr)
         return 1
 
     # Verify original assembly works (if verification enabled)
+    profiler.phase("verify_original")
     original_hash = None
+    original_hashes = {}
+    original_programs = {}
+    source_index = None
     if args.verify:
-        success, original_hash = verify_assembly(
-            assembler, src, "original file", args.verbose
-        )
+        if args.eval_verify:
+            success, original_programs = evaluate_versions(
+                src, versions, "original file", args.verbose
+            )
+            original_hashes = program_hashes(original_programs)
+            original_hash = original_hashes.get(None)
+        elif versions:
+            success, original_hashes = verify_versions(
+                assembler, src, versions, "original file", args.verbose, cache
+            )
+        else:
+            success, original_hash = verify_assembly(
+                assembler, src, "original file", args.verbose, cache
+            )
         if not success:
             print(
                 "Error: Original file does not assemble successfully. Fix errors before splitting."
             )
             return 1
+        # Lets a mismatch after the split be traced back to a source line
+        source_index = DeferredSourceIndex(
+            src, assembler, original_programs, cache, args.verbose
+        )
 
-    blocks_info = find_data_blocks(lines, args.min_lines)
-    blocks_info = coalesce_small_blocks(lines, blocks_info, max_total=40, gap_limit=3)
+    if args.watch:
+        return watch_sources(
+            src, versions, original_hashes, assembler, source_index, args.poll
+        )
+
+    profiler.phase("classify")
+    index = classify_lines(source)
+    profiler.count("lines", len(index))
+    flats = {}
+    if args.versioned_blocks:
+        profiler.phase("versioned")
+        try:
+            flats = mark_versioned_regions(index, src)
+        except (OSError, ValueError) as e:  # PreprocessError, EvalError
+            print("Warning: conditionals stay block boundaries ({})".format(e), file=sys.stderr)
+        if args.verbose and flats:
+            print(
+                "Versioned conditionals: {} line(s) in {} region(s)".format(
+                    len(index.regions), len(set(index.regions.values()))
+                )
+            )
+    profiler.phase("find_blocks")
+    blocks_info = find_data_blocks(index, args.min_lines)
+    profiler.phase("coalesce")
+    blocks_info = coalesce_small_blocks(index, blocks_info, max_total=40, gap_limit=3)
+    profiler.count("blocks", len(blocks_info))
     if not blocks_info:
         print("No suitable data blocks found.")
         if args.verbose:
             print(
-                "Searched {} lines with min_lines={}".format(len(lines), args.min_lines)
+                "Searched {} lines with min_lines={}".format(len(source), args.min_lines)
             )
+        if cache:
+            print(cache.stats_line())
         return 0
 
     # Process blocks
+    profiler.phase("build_blocks")
     edits = []
     blocks = []
+    extracted = []  # (start, end, data file) for --eval-verify
+
+    constants = None
+    if args.emit == "binary":
+        import asm6_eval
+
+        constants = collect_block_constants(src, source)
 
     for start, end in blocks_info:
-        block_text = "\n".join(lines[start:end]) + "\n"
+        block_text = "\n".join(source[start:end]) + "\n"
 
         # Generate filename
-        label = detect_first_label(lines, start, end)
+        label = detect_first_label(index, start, end)
         base = sanitize_name(label or "block_{}".format(start + 1))
         hash_suffix = hash_block(block_text)
         fname = "{}_{}_{}.asm".format(base, str(start + 1).zfill(5), hash_suffix)
         relpath = route_relpath(data_dir, fname)
         inc_line = generate_include_line(relpath, base_dir=out.parent)
+        entry = {
+            "path": relpath.relative_to(data_dir).as_posix(),
+            "label": label,
+            "start": start + 1,
+            "end": end,
+            "hash": text_digest(block_text),
+        }
 
         edits.append((start, end, inc_line))
-        blocks.append((relpath, block_text))
+        extracted.append((start, end, relpath))
 
         if args.verbose:
-            actual_lines = count_actual_data_lines(lines, start, end)
+            actual_lines = count_actual_data_lines(index, start, end)
             print(
                 "Block {}: lines {}-{}, {} total/{} data -> {}".format(
-                    len(blocks), start + 1, end, end - start, actual_lines, fname
+                    len(edits), start + 1, end, end - start, actual_lines, fname
                 )
             )
 
+        if constants is not None:
+            try:
+                bin_path, stub, data = build_binary_block(
+                    relpath,
+                    source[start:end],
+                    constants,
+                    out.parent,
+                    "lines {}-{} of {}".format(start + 1, end, src.name),
+                )
+            except asm6_eval.EvalError as e:
+                if args.verbose:
+                    print("Keeping {} as text: {}".format(fname, e))
+            else:
+                bin_entry = dict(entry)
+                bin_entry["path"] = bin_path.relative_to(data_dir).as_posix()
+                bin_entry["hash"] = text_digest(data)
+                entry["binary"] = bin_entry["path"]
+                entry["hash"] = text_digest(stub)
+                blocks.append((relpath, stub, entry))
+                blocks.append((bin_path, data, bin_entry))
+                continue
+
+        blocks.append((relpath, block_text, entry))
+
     # Show summary
-    print("Found {} data block(s) to extract:".format(len(blocks)))
-    for i, (path, _) in enumerate(blocks):
-        start, end, _ = edits[i]
-        print("  {} (lines {}-{})".format(path.name, start + 1, end))
+    print("Found {} data block(s) to extract:".format(len(edits)))
+    versioned = False
+    for path, _, entry in blocks:
+        line = "  {} (lines {}-{})".format(path.name, entry["start"], entry["end"])
+        if any(k in index.regions for k in range(entry["start"] - 1, entry["end"])):
+            # Line counts differ per version once the conditionals are resolved
+            line += " [{} lines]".format(
+                ", ".join(
+                    "{} {}".format(name, count)
+                    for name, count in version_line_counts(
+                        flats, src.name, entry["start"] - 1, entry["end"]
+                    ).items()
+                )
+            )
+            versioned = True
+        print(line)
+    if versioned and versions is None:
+        print(
+            "Note: blocks span version conditionals; verify with --versions {}".format(
+                ",".join(VERSION_NAMES)
+            )
+        )
+
+    # Diff against the manifest of the previous run
+    profiler.phase("plan")
+    manifest = load_manifest(data_dir)
+    source_key = pathlib.Path(
+        os.path.relpath(str(src.resolve()), str(data_dir.resolve()))
+    ).as_posix()
+    previous = manifest["sources"].get(source_key, {}).get("blocks", [])
+    referenced = referenced_includes(index, out.parent, edits)
+    plan = plan_block_updates(data_dir, blocks, previous, referenced, args.force)
+    print(describe_block_updates(plan))
+    for key in ("write", "rename", "unchanged", "delete"):
+        profiler.count("data_files_" + key, len(plan[key]))
 
     if args.dry_run:
         print("\n[DRY RUN] No files would be written.")
         if args.verify:
             print("Verification would be performed if not in dry-run mode.")
+        if cache:
+            print(cache.stats_line())
         return 0
 
     # Create backup if requested and overwriting
@@ -713,60 +2367,129 @@ def main():
         backup_path = backup_file(src)
         print("Created backup: {}".format(backup_path))
 
-    # Check for existing files
-    if not args.force:
-        existing = [p for p, _ in blocks if p.exists()]
-        if existing:
-            print(
-                "Error: {} data files already exist. Use --force to overwrite:".format(
-                    len(existing)
-                )
-            )
-            for p in existing[:5]:  # Show first 5
-                print("  {}".format(p))
-            if len(existing) > 5:
-                print("  ... and {} more".format(len(existing) - 5))
-            return 1
+    # Files with the same name but different content are only replaced with --force
+    existing = plan["conflicts"]
+    if existing:
+        print(
+            "Error: {} data files already exist with different content. "
+            "Use --force to overwrite:".format(len(existing))
+        )
+        for p in existing[:5]:  # Show first 5
+            print("  {}".format(p))
+        if len(existing) > 5:
+            print("  ... and {} more".format(len(existing) - 5))
+        return 1
+    for p in plan["modified"]:
+        print("Warning: keeping hand-edited stale data file {} (use --force to delete)".format(p))
 
     # Create data directory
+    profiler.phase("write_data")
     data_dir.mkdir(parents=True, exist_ok=True)
+    if source_index is not None:
+        source_index.keep(
+            [out]
+            + [path for path, _ in plan["write"]]
+            + [path for path, _ in plan["rename"]]
+            + plan["delete"]
+        )
 
-    # Apply edits (back-to-front to avoid index issues)
-    new_lines = lines[:]
-    for start, end, inc_line in reversed(edits):
-        new_lines[start:end] = [inc_line]
-
-    # Write data files
+    # Write, rename and delete only the data files that changed
     try:
-        for relpath, text in blocks:
-            relpath.parent.mkdir(parents=True, exist_ok=True)
-            relpath.write_text(text, encoding="utf-8")
-            if args.verbose:
-                print("Wrote: {}".format(relpath))
+        apply_block_updates(plan, args.verbose)
+        manifest["sources"][source_key] = {
+            "output": pathlib.Path(
+                os.path.relpath(str(out.resolve()), str(data_dir.resolve()))
+            ).as_posix(),
+            "blocks": plan["kept"] + [entry for _, _, entry in blocks],
+        }
+        save_manifest(data_dir, manifest)
     except Exception as e:
         print("Error writing data files: {}".format(e), file=sys.stderr)
         return 1
 
-    # Write main file
+    profiler.phase("write_main")
+    # Write main file: streamed as unchanged byte ranges plus incsrc lines, and
+    # left untouched (mtime included) if nothing changed
     try:
-        out.write_text("\n".join(new_lines) + "\n", encoding="utf-8")
-        print("Wrote main file: {}".format(out))
+        tmp_out, main_hash = write_spliced_source(source, edits, out)
+        source.close()  # release the mapping before out may replace src
+        if out.exists() and get_file_hash(out) == main_hash:
+            tmp_out.unlink()
+            print("Main file unchanged: {}".format(out))
+            profiler.count("main_file_written", False)
+        else:
+            os.replace(str(tmp_out), str(out))
+            print("Wrote main file: {}".format(out))
+            profiler.count("main_file_written", True)
     except Exception as e:
         print("Error writing main file: {}".format(e), file=sys.stderr)
         return 1
 
     # Verify split result assembles correctly
+    profiler.phase("verify_split")
     if args.verify:
-        success, split_hash = verify_assembly(
-            assembler, out, "split result", args.verbose
-        )
+        if args.eval_verify:
+            success, split_programs = evaluate_versions(
+                out, versions, "split result", args.verbose
+            )
+            split_hashes = program_hashes(split_programs)
+            split_hash = split_hashes.get(None)
+        elif versions:
+            success, split_hashes = verify_versions(
+                assembler, out, versions, "split result", args.verbose, cache
+            )
+        else:
+            success, split_hash = verify_assembly(
+                assembler, out, "split result", args.verbose, cache
+            )
+        if cache:
+            print(cache.stats_line())
         if not success:
             print("ERROR: Split result does not assemble!")
             print("This indicates the splitting process introduced errors.")
             return 1
 
+        profiler.phase("compare")
+        if args.eval_verify and not compare_evaluated_blocks(
+            original_programs, split_programs, src, extracted
+        ):
+            print("WARNING: Extracted blocks do not evaluate to the same bytes and addresses")
+            print("This may indicate a problem with the splitting logic.")
+            return 1
+
+        def report_difference(name, value):
+            index = source_index.get(name, value)
+            if index is None:
+                return
+            if args.eval_verify:
+                image = split_programs[name].image
+            else:
+                image = cache.rom(assembly_cache_key(assembler, out, value)) if cache else None
+                if image is None:
+                    image = assemble_image(assembler, out, value)
+            lines = describe_differences(index, value, image)
+            if lines and name:
+                lines[0] = "{}: {}".format(name, lines[0])
+            for line in lines:
+                print(line)
+
         # Compare output hashes
-        if original_hash and split_hash:
+        if versions:
+            if print_version_table(versions, original_hashes, split_hashes):
+                print(
+                    " Verification passed: Split result assembles to identical binary"
+                    " for {} version(s)".format(len(versions))
+                )
+            else:
+                print(
+                    "WARNING: Split result assembles successfully but produces different binary"
+                )
+                for name, value in versions:
+                    if original_hashes.get(name) != split_hashes.get(name):
+                        report_difference(name, value)
+                print("This may indicate a problem with the splitting logic.")
+                return 1
+        elif original_hash and split_hash:
             if original_hash == split_hash:
                 print(
                     " Verification passed: Split result assembles to identical binary"
@@ -777,10 +2500,11 @@ def main():
                 )
                 print("Original hash: {}...".format(original_hash[:16]))
                 print("Split hash:    {}...".format(split_hash[:16]))
+                report_difference(None, None)
                 print("This may indicate a problem with the splitting logic.")
                 return 1
 
-    print("Successfully split {} data blocks.".format(len(blocks)))
+    print("Successfully split {} data blocks.".format(len(edits)))
     if assembler:
         print("Manual verification: {} {} output.nes".format(assembler, out))
 
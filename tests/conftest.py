@@ -0,0 +1,35 @@
+"""
+Shared setup for the tests: the repository root and misc/ go on sys.path, so
+split_asm_data.py and the misc/ tools import the way they do when run.
+"""
+
+import pathlib
+import shutil
+import sys
+
+import pytest
+
+REPO = pathlib.Path(__file__).resolve().parent.parent
+MAIN_FILE = REPO / "DonkeyKongDisassembly.asm"
+
+for path in (REPO, REPO / "misc"):
+    if str(path) not in sys.path:
+        sys.path.insert(0, str(path))
+
+from asm_build import include_closure  # noqa: E402
+
+
+def run_main(monkeypatch, main, *args):
+    """Run a tool's main() with args on its command line; returns its exit status."""
+    monkeypatch.setattr(sys, "argv", ["main"] + [str(arg) for arg in args])
+    return main()
+
+
+@pytest.fixture
+def source_tree(tmp_path):
+    """A copy of the main file and everything it includes; returns the copied main file."""
+    for rel in include_closure(MAIN_FILE):
+        target = tmp_path / rel
+        target.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(str(REPO / rel), str(target))
+    return tmp_path / MAIN_FILE.name
@@ -0,0 +1,32 @@
+import numpy as np
+
+import chr_index
+
+
+def test_class_flips_are_relative_to_first_tile():
+    tile = np.random.default_rng(1).integers(0, 256, chr_index.TILE_BYTES, dtype=np.uint8)
+    forms = chr_index.tile_forms(tile)[0]  # as stored, h, v, hv
+    canonical = int(chr_index.canonical_keys(tile)[1][0])
+    index = chr_index.TileIndex()
+    # Neither tile is the canonical form the class is keyed on
+    index.add("chr", np.concatenate([f for i, f in enumerate(forms) if i != canonical][:2]))
+    index.build()
+
+    (klass,) = index.report()["classes"]
+    first = index.find(klass["tiles"][0]["tile"])
+    expected = {index.name(i): flip for i, flip in index.lookup(index.tile_bytes(first))}
+    assert expected[index.name(first)] == ""
+    assert {t["tile"]: t["flip"] for t in klass["tiles"]} == expected
+
+
+def test_high_plane_of_ff_keeps_its_flips():
+    # drawn in colours 2/3 only: every form has the low word $FFFFFFFFFFFFFFFF
+    tile = np.array([0x80] + [0x00] * 7 + [0xFF] * 8, dtype=np.uint8)
+    forms = chr_index.tile_forms(tile)[0]  # as stored, h, v, hv
+    assert list(chr_index.canonical_keys(forms.reshape(-1))[1]) == [3, 2, 1, 0]
+
+    index = chr_index.TileIndex()
+    index.add("chr", forms.reshape(-1))
+    index.build()
+    found = dict(index.lookup(index.tile_bytes(0)))
+    assert [found[i] for i in range(4)] == list(chr_index.FLIPS)
@@ -0,0 +1,131 @@
+import pytest
+
+from cpu6502 import CPU, INTERRUPT_CYCLES, NMI_VECTOR, RESET_VECTOR
+from mos6502 import CYCLES, OPCODES, PAGE_CROSS
+from nes_machine import Machine
+
+START = 0x8000
+
+
+def cpu_with(code, at=START, **registers):
+    """A CPU reset to code at address at, with registers (a=..., x=..., c=...) set."""
+    memory = bytearray(0x10000)
+    memory[at : at + len(code)] = bytes(code)
+    memory[RESET_VECTOR : RESET_VECTOR + 2] = at.to_bytes(2, "little")
+    cpu = CPU(memory)
+    cpu.reset()
+    for name, value in registers.items():
+        setattr(cpu, name, value)
+    return cpu
+
+
+def flags(cpu):
+    bits = (("n", 0x80), ("v", 0x40), ("z", 0x02), ("c", 0x01))
+    return {flag: bool(cpu.p & bit) for flag, bit in bits}
+
+
+@pytest.mark.parametrize(
+    "a, operand, carry, result, expected",
+    [
+        (0x50, 0x50, 0, 0xA0, dict(n=True, v=True, z=False, c=False)),
+        (0xFF, 0x01, 0, 0x00, dict(n=False, v=False, z=True, c=True)),
+        (0x80, 0x80, 1, 0x01, dict(n=False, v=True, z=False, c=True)),
+        (0x09, 0x01, 0, 0x0A, dict(n=False, v=False, z=False, c=False)),
+    ],
+)
+def test_adc(a, operand, carry, result, expected):
+    cpu = cpu_with([0x69, operand], a=a, c=carry)  # ADC #operand
+    assert cpu.step() == 2
+    assert cpu.a == result and flags(cpu) == expected
+
+
+@pytest.mark.parametrize(
+    "a, operand, carry, result, expected",
+    [
+        (0x50, 0xF0, 1, 0x60, dict(n=False, v=False, z=False, c=False)),
+        (0xD0, 0x70, 1, 0x60, dict(n=False, v=True, z=False, c=True)),
+        (0x50, 0x50, 0, 0xFF, dict(n=True, v=False, z=False, c=False)),
+        (0x50, 0x50, 1, 0x00, dict(n=False, v=False, z=True, c=True)),
+    ],
+)
+def test_sbc(a, operand, carry, result, expected):
+    cpu = cpu_with([0xE9, operand], a=a, c=carry)  # SBC #operand
+    cpu.step()
+    assert cpu.a == result and flags(cpu) == expected
+
+
+def test_decimal_flag_does_not_change_arithmetic():
+    cpu = cpu_with([0xF8, 0x18, 0x69, 0x01, 0x38, 0xE9, 0x01], a=0x09)  # SED CLC ADC SEC SBC
+    cpu.step(), cpu.step(), cpu.step()
+    assert cpu.d == 1 and cpu.a == 0x0A  # binary, not BCD $10
+    cpu.step(), cpu.step()
+    assert cpu.a == 0x09
+
+
+@pytest.mark.parametrize(
+    "at, zero, cycles, target",
+    [
+        (START, 0, 2, START + 2),  # BEQ not taken
+        (START, 1, 3, START + 4),  # taken, same page
+        (0x80FD, 1, 4, 0x8101),  # taken onto the next page
+    ],
+)
+def test_branch_cycles(at, zero, cycles, target):
+    cpu = cpu_with([0xF0, 0x02], at=at)  # BEQ +2
+    cpu.p = 0x02 if zero else 0
+    assert cpu.step() == cycles
+    assert cpu.pc == target
+
+
+@pytest.mark.parametrize(
+    "code, x, y, cycles",
+    [
+        ([0xBD, 0xFF, 0x02], 0, 0, 4),  # LDA $02FF,X
+        ([0xBD, 0xFF, 0x02], 1, 0, 5),  # crosses into $0300
+        ([0x9D, 0xFF, 0x02], 0, 0, 5),  # STA $02FF,X always 5
+        ([0x9D, 0xFF, 0x02], 1, 0, 5),
+        ([0xB1, 0x10], 0, 0x01, 5),  # LDA ($10),Y, pointer $02F0
+        ([0xB1, 0x10], 0, 0x10, 6),
+    ],
+)
+def test_indexed_page_cross_cycles(code, x, y, cycles):
+    cpu = cpu_with(code, x=x, y=y)
+    cpu.mem[0x10:0x12] = b"\xF0\x02"
+    assert cpu.step() == cycles
+
+
+def test_cycle_table():
+    assert CYCLES[OPCODES["jsr"]["abs"]] == 6 and CYCLES[OPCODES["rts"]["imp"]] == 6
+    assert CYCLES[OPCODES["inc"]["absx"]] == 7 and CYCLES[OPCODES["lda"]["indx"]] == 6
+    assert OPCODES["lda"]["absy"] in PAGE_CROSS and OPCODES["lda"]["indy"] in PAGE_CROSS
+    assert not PAGE_CROSS & {OPCODES["sta"]["absx"], OPCODES["inc"]["absx"]}
+
+
+def test_nmi_and_rti_round_trip():
+    cpu = cpu_with([0xEA], a=0x12, s=0xFD)
+    cpu.mem[NMI_VECTOR : NMI_VECTOR + 2] = b"\x00\x90"
+    cpu.mem[0x9000] = 0x40  # RTI
+    cpu.p = 0xC3  # N V Z C, I clear
+    cpu.i = 0
+    before = cpu.cycles
+
+    cpu.nmi()
+    assert cpu.cycles - before == INTERRUPT_CYCLES
+    assert cpu.pc == 0x9000 and cpu.i == 1 and cpu.s == 0xFA
+    assert cpu.mem[0x1FB] == 0xE3  # pushed status: bit 5 set, B clear
+    assert cpu.mem[0x1FC : 0x1FE] == bytes([START & 0xFF, START >> 8])
+
+    assert cpu.step() == 6
+    assert cpu.pc == START and cpu.s == 0xFD and cpu.p == 0xE3 and cpu.a == 0x12
+
+
+def test_machine_runs_nmi_every_frame():
+    prg = bytearray(0x4000)
+    code = [0xA9, 0x80, 0x8D, 0x00, 0x20, 0x4C, 0x05, 0xC0]  # LDA #$80 : STA $2000 : JMP *
+    prg[: len(code)] = bytes(code)
+    prg[0x100:0x103] = b"\xE6\x10\x40"  # $C100: INC $10 : RTI
+    prg[0x3FFA:] = b"\x00\xC1\x00\xC0\x00\xC0"  # NMI, reset, IRQ
+    machine = Machine(bytes(prg))
+    machine.run_frames(3)
+    assert machine.peek(0x10) == 3
+    assert machine.peek(0x810) == 3  # RAM mirror
@@ -0,0 +1,71 @@
+import cycle_estimate as ce
+
+
+def memory(code):
+    """64 KB of CPU memory with code {address: bytes} in it."""
+    mem = bytearray(0x10000)
+    for address, data in code.items():
+        mem[address : address + len(data)] = bytes(data)
+    return mem
+
+
+# LDY/LDX from RAM, so neither loop has a known bound
+NESTED = {
+    0x8000: [
+        0xA6, 0x11,  # outer: LDX $11
+        0xCA,  # inner: DEX
+        0xD0, 0xFD,  # BNE inner
+        0x88,  # DEY
+        0xD0, 0xF8,  # BNE outer
+        0x60,  # RTS
+    ],
+}  # fmt: skip
+
+# CODE_F082 into SpriteDrawingEngine_F096 in miniature: $9000 passes mode 1
+# through $0F past a counted loop, so only $9010 itself can reach the JSR
+DISPATCH = {
+    0x9000: [
+        0xA9, 0x01,  # LDA #$01
+        0xD0, 0x0C,  # BNE $9010
+    ],
+    0x9010: [
+        0x85, 0x0F,  # STA $0F
+        0xA2, 0x08,  # LDX #$08
+        0xCA,  # loop: DEX
+        0xD0, 0xFD,  # BNE loop
+        0xA5, 0x0F,  # LDA $0F
+        0xC9, 0x01,  # CMP #$01
+        0xF0, 0x03,  # BEQ done
+        0x20, 0x00, 0xA0,  # JSR $A000
+        0x60,  # done: RTS
+    ],
+    0xA000: [
+        0xA2, 0x00,  # LDX #$00
+        0xCA,  # loop: DEX
+        0xD0, 0xFD,  # BNE loop
+        0x60,  # RTS
+    ],
+}  # fmt: skip
+
+
+def test_guessed_loop_bounds_do_not_multiply():
+    analysis = ce.Analysis(memory(NESTED), [0x8000])
+    assert len(analysis.assumed(0x8000, {})) == 2
+    known, guessed = analysis.totals(False, default_bound=16)[0x8000]
+    assert known < guessed
+    inner = 2 + 3  # DEX : BNE taken
+    assert guessed < 16 * 16 * inner
+
+    bounds = {0x8000: 4, 0x8002: 8}
+    known, guessed = analysis.totals(False, bounds)[0x8000]
+    assert known == guessed > 4 * 8 * inner
+    assert not analysis.assumed(0x8000, bounds)
+
+
+def test_constant_carried_into_dispatch():
+    analysis = ce.Analysis(memory(DISPATCH), [0x9000, 0x9010])
+    assert analysis.callees(0x9000) == []
+    assert analysis.callees(0x9010) == [0xA000]
+    totals = analysis.totals(False)
+    assert totals[0xA000][0] > 256 * 4
+    assert totals[0x9000][0] < totals[0x9010][0] - totals[0xA000][0]
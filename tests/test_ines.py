@@ -0,0 +1,47 @@
+import pytest
+
+from ines import CHR_BANK_SIZE, PRG_BANK_SIZE, Ines, InesError
+
+
+def image(prg_banks=1, chr_banks=1, flags6=0, reserved=b"\x00" * 5):
+    header = b"NES\x1a" + bytes([prg_banks, chr_banks, flags6, 0, 0, 0, 0]) + reserved
+    prg = bytes(i & 0xFF for i in range(prg_banks * PRG_BANK_SIZE))
+    chr_data = bytes((i * 3) & 0xFF for i in range(chr_banks * CHR_BANK_SIZE))
+    return header + prg + chr_data
+
+
+def test_fields_and_slices():
+    rom = Ines.from_bytes(image(flags6=0x11))
+    assert rom.header.mapper == 1
+    assert rom.header.f6.mirroring == Ines.Header.F6.Mirroring.vertical
+    assert rom.trainer is None and rom.playchoice10 is None and rom.title is None
+    assert (rom.prg_offset, rom.chr_offset) == (16, 16 + PRG_BANK_SIZE)
+    assert bytes(rom.chr_rom[:4]) == bytes([0, 3, 6, 9])
+
+
+def test_bad_images_raise():
+    with pytest.raises(InesError):
+        Ines.from_bytes(b"NES")
+    with pytest.raises(InesError):
+        Ines.from_bytes(image()[:-1])
+    with pytest.raises(InesError):
+        Ines.from_bytes(image(reserved=b"Dude!"))
+    assert Ines.from_bytes(image(reserved=b"Dude!"), strict=False).header.len_prg_rom == 1
+
+
+def test_slice_outlives_with_block(tmp_path):
+    path = tmp_path / "rom.nes"
+    path.write_bytes(image())
+    with Ines.from_file(path) as rom:
+        tiles = rom.chr_rom[:16]
+    assert bytes(tiles) == bytes((i * 3) & 0xFF for i in range(16))
+    tiles.release()
+
+
+def test_close_without_slices_closes_mmap(tmp_path):
+    path = tmp_path / "rom.nes"
+    path.write_bytes(image())
+    with Ines.from_file(path) as rom:
+        mapped = rom._mmap
+        data = bytes(rom.prg_rom[:2])
+    assert data == b"\x00\x01" and mapped.closed
@@ -0,0 +1,12 @@
+import listing_index
+from conftest import MAIN_FILE, run_main
+
+
+def test_queries_around_options_and_failures(tmp_path, monkeypatch, capsys):
+    args = [MAIN_FILE, "--index", tmp_path / "index.db", "--eval"]
+    assert run_main(monkeypatch, listing_index.main, *args, "--offset", "0x0413") == 0
+    assert "offset $0413 ($C403)" in capsys.readouterr().out
+
+    assert run_main(monkeypatch, listing_index.main, *args, "NMI_C85F", "NOPE") == 1
+    out = capsys.readouterr().out
+    assert "NMI_C85F = $C85F" in out and "NOPE: no such label" in out
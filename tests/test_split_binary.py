@@ -0,0 +1,60 @@
+import pytest
+
+import asm6_eval
+import split_asm_data as split
+from conftest import run_main
+
+BLOCK = [
+    "Table_C000:",
+    "db $01,Two,$03",
+    "Table_C003:",
+    "dw $1234",
+    "Entries = 2",
+    "hex 0506",
+]
+
+
+def images(main_file):
+    """Assembled image of main_file for every Version."""
+    return {
+        name: bytes(asm6_eval.assemble(main_file, {"Version": value}, allow_missing=True).image)
+        for name, value in split.VERSION_VALUES.items()
+    }
+
+
+def test_binary_block_keeps_labels_between_incbin_ranges(tmp_path):
+    relpath = tmp_path / "data" / "Table_C000_00010_aaaaaaaa.asm"
+    bin_path, stub, data = split.build_binary_block(
+        relpath, BLOCK, {"Two": 2}, tmp_path, "lines 10-15 of main.asm"
+    )
+    assert bin_path == relpath.with_suffix(".bin")
+    assert data == bytes([1, 2, 3, 0x34, 0x12, 5, 6])
+    assert stub.splitlines()[1:] == [
+        "Table_C000:",
+        'incbin "data/Table_C000_00010_aaaaaaaa.bin", $0, $3',
+        "Table_C003:",
+        'incbin "data/Table_C000_00010_aaaaaaaa.bin", $3, $2',
+        "Entries = 2",
+        'incbin "data/Table_C000_00010_aaaaaaaa.bin", $5, $2',
+    ]
+
+
+def test_block_with_code_label_stays_text(tmp_path):
+    with pytest.raises(asm6_eval.EvalError):
+        split.build_binary_block(
+            tmp_path / "Table.asm", ["dw CODE_C123"], {}, tmp_path, "lines 1-1 of main.asm"
+        )
+
+
+def test_binary_split_is_byte_identical_in_every_version(source_tree, monkeypatch):
+    out = source_tree.parent / "out.asm"
+    data_dir = source_tree.parent / "gen"
+    original = images(source_tree)
+    versions = ",".join(split.VERSION_VALUES)
+    args = [source_tree, out, "--data-dir", data_dir, "--emit", "binary"]
+    args += ["--versions", versions, "--eval-verify", "--no-cache"]
+    assert run_main(monkeypatch, split.main, *args) == 0
+
+    assert list(data_dir.rglob("*.bin"))
+    assert "incbin" in "".join(p.read_text(encoding="utf-8") for p in data_dir.rglob("*.asm"))
+    assert images(out) == original
@@ -0,0 +1,77 @@
+import split_asm_data as split
+from conftest import run_main
+
+TEXT = "DATA_C000:\ndb $01,$02,$03,$04\ndb $05,$06,$07,$08\n"
+
+
+def recorded(data_dir, name, text):
+    """Write a block file as the last run did; returns its manifest entry."""
+    (data_dir / name).write_text(text, encoding="utf-8")
+    return {"path": name, "hash": split.text_digest(text)}
+
+
+def block(data_dir, name, text):
+    return data_dir / name, text, {"path": name, "hash": split.text_digest(text)}
+
+
+def test_unchanged_block_is_left_alone(tmp_path):
+    previous = [recorded(tmp_path, "DATA_C000_00010_aaaaaaaa.asm", TEXT)]
+    blocks = [block(tmp_path, "DATA_C000_00010_aaaaaaaa.asm", TEXT)]
+    plan = split.plan_block_updates(tmp_path, blocks, previous, set())
+    assert plan["unchanged"] == [tmp_path / "DATA_C000_00010_aaaaaaaa.asm"]
+    assert not plan["write"] and not plan["rename"] and not plan["delete"]
+
+
+def test_shifted_block_is_renamed(tmp_path):
+    previous = [recorded(tmp_path, "DATA_C000_00010_aaaaaaaa.asm", TEXT)]
+    blocks = [block(tmp_path, "DATA_C000_00012_aaaaaaaa.asm", TEXT)]
+    plan = split.plan_block_updates(tmp_path, blocks, previous, set())
+    assert plan["rename"] == [
+        (tmp_path / "DATA_C000_00010_aaaaaaaa.asm", tmp_path / "DATA_C000_00012_aaaaaaaa.asm")
+    ]
+    assert not plan["write"] and not plan["delete"]
+
+
+def test_changed_block_replaces_its_old_file(tmp_path):
+    previous = [recorded(tmp_path, "DATA_C000_00010_aaaaaaaa.asm", TEXT)]
+    changed = TEXT.replace("$08", "$09")
+    blocks = [block(tmp_path, "DATA_C000_00010_bbbbbbbb.asm", changed)]
+    plan = split.plan_block_updates(tmp_path, blocks, previous, set())
+    assert plan["write"] == [(tmp_path / "DATA_C000_00010_bbbbbbbb.asm", changed)]
+    assert plan["delete"] == [tmp_path / "DATA_C000_00010_aaaaaaaa.asm"]
+
+
+def test_hand_edited_file_needs_force(tmp_path):
+    previous = [recorded(tmp_path, "DATA_C000_00010_aaaaaaaa.asm", TEXT)]
+    (tmp_path / "DATA_C000_00010_aaaaaaaa.asm").write_text(TEXT + "; edited\n", encoding="utf-8")
+    blocks = [block(tmp_path, "DATA_C000_00010_aaaaaaaa.asm", TEXT)]
+    plan = split.plan_block_updates(tmp_path, blocks, previous, set())
+    assert plan["conflicts"] == [tmp_path / "DATA_C000_00010_aaaaaaaa.asm"]
+    plan = split.plan_block_updates(tmp_path, blocks, previous, set(), force=True)
+    assert plan["write"] == [(tmp_path / "DATA_C000_00010_aaaaaaaa.asm", TEXT)]
+
+
+def test_resplit_keeps_unchanged_and_renames_shifted_files(source_tree, monkeypatch, capsys):
+    data_dir = source_tree.parent / "gen"
+    args = [source_tree, source_tree.parent / "out.asm", "--data-dir", data_dir]
+    args += ["--eval-verify", "--no-cache"]
+
+    def split_files():
+        assert run_main(monkeypatch, split.main, *args) == 0
+        files = {p.name: p.read_bytes() for p in data_dir.rglob("*") if p.is_file()}
+        files.pop(split.MANIFEST_NAME)
+        return capsys.readouterr().out, files
+
+    _, first = split_files()
+    assert first
+
+    report, again = split_files()
+    assert "0 written, 0 renamed, {} unchanged, 0 deleted".format(len(first)) in report
+    assert again == first
+
+    text = source_tree.read_text(encoding="utf-8")
+    source_tree.write_text("; shifts every block down a line\n" + text, encoding="utf-8")
+    report, shifted = split_files()
+    assert "0 written, {} renamed, 0 unchanged, 0 deleted".format(len(first)) in report
+    assert sorted(shifted.values()) == sorted(first.values())
+    assert not set(shifted) & set(first)
@@ -0,0 +1,37 @@
+import pytest
+
+import asm6_eval
+import version_pp
+from conftest import MAIN_FILE, run_main
+from nes_machine import VERSION_VALUES
+
+# The JP branch of the title screen palette's "If Version = JP".
+TITLE_PALETTE_LINE = 11143
+
+
+@pytest.mark.parametrize("name", sorted(VERSION_VALUES))
+def test_flattened_version_assembles_to_the_original_image(source_tree, name):
+    version = VERSION_VALUES[name]
+    flat = version_pp.flatten(source_tree, version)
+    # Next to the main file, so the incbins left in the stream still resolve.
+    flat_file = source_tree.parent / "flat_{}.asm".format(name)
+    flat_file.write_text(flat.text(), encoding="utf-8")
+    original = asm6_eval.assemble(source_tree, {"Version": version}, allow_missing=True)
+    assert asm6_eval.assemble(flat_file, allow_missing=True).image == original.image
+
+
+def test_line_inside_version_conditional_maps_to_jp_only(monkeypatch, capsys):
+    lines = MAIN_FILE.read_text(encoding="utf-8").splitlines()
+    assert lines[TITLE_PALETTE_LINE - 2].split() == ["If", "Version", "=", "JP"]
+    jp = version_pp.flatten(MAIN_FILE, VERSION_VALUES["jp"])
+    index = jp.position(MAIN_FILE.name, TITLE_PALETTE_LINE - 1)
+    assert jp.origin(index) == (MAIN_FILE.name, TITLE_PALETTE_LINE - 1)
+    assert jp.lines[index].text == lines[TITLE_PALETTE_LINE - 1]
+
+    spec = "{}:{}".format(MAIN_FILE.name, TITLE_PALETTE_LINE)
+    assert run_main(monkeypatch, version_pp.main, MAIN_FILE, "--line", spec) == 0
+    assert capsys.readouterr().out.splitlines() == [
+        "jp: {} is flat line {}".format(spec, index + 1),
+        "us: {} is not assembled".format(spec),
+        "gamecube: {} is not assembled".format(spec),
+    ]
@@ -0,0 +1,101 @@
+import pytest
+
+import asm6_eval
+import vram_pack
+from conftest import MAIN_FILE, run_main
+from vram_stream import LAYOUTS, VERSION_VALUES, LayoutSource, decode_stream, encode_stream
+
+# A layout table whose title stream takes a byte from a Version conditional
+SYNTHETIC = """\
+JP = 0
+US = 1
+Version = US
+VRAMWriteCommand_Repeat = $40
+VRAMWriteCommand_DrawVert = $80
+VRAMWriteCommand_Stop = $00
+
+If Version = JP
+Shade = $02
+else
+Shade = $12
+endif
+
+.org $C000
+ScreenLayoutData_C4A7:
+dw Layout_Plain, Layout_Plain, Layout_Plain, Layout_Plain, Layout_Title, Layout_Plain
+
+Layout_Plain:
+db $20,$40
+db $04
+db $24,$24,$24,$24
+db $20,$44
+db $04
+db $24,$24,$24,$24
+db VRAMWriteCommand_Stop
+
+Layout_Title:
+db $20,$80
+db $04
+db $01,$01,$01,Shade
+db $20,$84
+db $04
+db $01,$01,$01,$01
+db VRAMWriteCommand_Stop
+"""
+
+
+def images(main_file):
+    """Assembled image of main_file for every Version."""
+    return {
+        name: bytes(asm6_eval.assemble(main_file, {"Version": value}, allow_missing=True).image)
+        for name, value in VERSION_VALUES.items()
+    }
+
+
+@pytest.fixture(scope="module")
+def source():
+    return LayoutSource(MAIN_FILE)
+
+
+@pytest.mark.parametrize("name", [name for name in LAYOUTS if name != "50m"])
+@pytest.mark.parametrize("base", vram_pack.BASES)
+def test_packed_stream_decodes_to_same_memory(source, name, base):
+    base = "none" if name == "hud" else base
+    original = source.layout(name)
+    cells, required = vram_pack.screen_target(original, base)
+    packed = vram_pack.pack(cells, required, hints=original)
+    data = encode_stream(packed)
+    assert len(data) <= sum(w.size for w in original) + 1
+    assert vram_pack.equivalent(original, decode_stream(data)[0], base)
+
+
+def test_stream_lines_refuses_conditional_range(source):
+    size = sum(w.size for w in source.layout("title")) + 1
+    assert vram_pack.stream_lines(source, "title", size) is None
+
+
+def test_write_title_keeps_every_version(source_tree, monkeypatch):
+    before = source_tree.read_bytes()
+    built = images(source_tree)
+    args = ["--layout", "title", "--base", "clear", "--write"]
+    assert run_main(monkeypatch, vram_pack.main, source_tree, *args) == 0
+    assert source_tree.read_bytes() == before
+    assert images(source_tree) == built
+
+
+def test_write_plain_layout_and_undo_version_dependent_one(tmp_path, monkeypatch):
+    main_file = tmp_path / "main.asm"
+    main_file.write_text(SYNTHETIC, encoding="utf-8")
+    originals = {
+        value: {name: LayoutSource(main_file, value).layout(name) for name in ("25m", "title")}
+        for value in VERSION_VALUES.values()
+    }
+    assert run_main(monkeypatch, vram_pack.main, main_file, "--write") == 0
+
+    text = main_file.read_text(encoding="utf-8")
+    assert "db $08|VRAMWriteCommand_Repeat" in text
+    assert "db $01,$01,$01,Shade" in text  # packing bakes in the US $12, so it is undone
+    for value, layouts in originals.items():
+        written = LayoutSource(main_file, value)
+        for name, original in layouts.items():
+            assert vram_pack.equivalent(original, written.layout(name))